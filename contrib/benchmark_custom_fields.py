@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Compare the ticket query times with and without the
+`[ticket] custom_fields_table` option, on generated tickets.
+"""
+
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from trac.test import EnvironmentStub, MockRequest
+from trac.ticket.api import TicketSystem
+from trac.ticket.query import Query
+from trac.util.text import printout
+
+
+def generate_tickets(env, num_tickets, num_fields):
+    fields = ['field%d' % idx for idx in xrange(num_fields)]
+    for name in fields:
+        env.config.set('ticket-custom', name, 'text')
+    values = ['value%d' % idx for idx in xrange(20)]
+    with env.db_transaction as db:
+        db.executemany("""
+            INSERT INTO ticket (id, summary, status, time, changetime)
+            VALUES (%s, %s, 'new', 0, 0)
+            """, [(id_, 'Ticket %d' % id_)
+                  for id_ in xrange(1, num_tickets + 1)])
+        for name in fields:
+            db.executemany("""
+                INSERT INTO ticket_custom (ticket, name, value)
+                VALUES (%s, %s, %s)
+                """, [(id_, name, random.choice(values))
+                      for id_ in xrange(1, num_tickets + 1)])
+    return fields
+
+
+def run_queries(env, queries, repeat):
+    req = MockRequest(env)
+    results = []
+    for string in queries:
+        start = time.time()
+        for idx in xrange(repeat):
+            query = Query.from_string(env, string)
+            query.execute(req)
+        results.append((time.time() - start) / repeat)
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-t', '--tickets', type=int, default=100000,
+                        help="number of tickets (default: %(default)s)")
+    parser.add_argument('-f', '--fields', type=int, default=5,
+                        help="number of custom fields (default: "
+                             "%(default)s)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="number of runs of each query (default: "
+                             "%(default)s)")
+    args = parser.parse_args(args)
+
+    path = tempfile.mkdtemp(prefix='trac-')
+    env = EnvironmentStub(path=path, default_data=True)
+    try:
+        fields = generate_tickets(env, args.tickets, args.fields)
+        cols = ''.join('&col=' + name for name in fields)
+        queries = ['%s=value1&max=100%s' % (fields[0], cols),
+                   '%s=value1&%s=value2&order=%s%s'
+                   % (fields[0], fields[-1], fields[-1], cols),
+                   'group=%s&order=id&max=100%s' % (fields[0], cols)]
+        without_table = run_queries(env, queries, args.repeat)
+        env.config.set('ticket', 'custom_fields_table', True)
+        start = time.time()
+        TicketSystem(env).rebuild_custom_fields_table()
+        printout("Table built in %.3fs" % (time.time() - start))
+        with_table = run_queries(env, queries, args.repeat)
+        for string, before, after in zip(queries, without_table,
+                                         with_table):
+            printout("%.3fs -> %.3fs  %s" % (before, after, string))
+    finally:
+        env.reset_db()
+        env.shutdown()
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
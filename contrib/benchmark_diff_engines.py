@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Compare the diff engines of `trac.versioncontrol.diff` on the largest
+files modified in the recent history of a git repository.
+
+For each file, the time taken by each engine and the number of lines
+reported as changed are printed. A smaller number of changed lines means
+a more compact diff.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+from trac.util.text import printout
+from trac.versioncontrol.diff import diff_engines, get_filtered_hunks
+
+
+def git(repos, *args):
+    return subprocess.check_output(('git', '--git-dir', repos) + args)
+
+
+def build_corpus(repos, rev, max_commits, max_files):
+    """Return the `(name, old lines, new lines)` of the largest files
+    modified by the first parent commits reachable from `rev`.
+    """
+    changes = []
+    commits = git(repos, 'rev-list', '--first-parent', '--no-merges',
+                  '--max-count=%d' % max_commits, rev).split()
+    for commit in commits:
+        output = git(repos, 'diff-tree', '-r', '--no-renames', commit)
+        for line in output.splitlines()[1:]:
+            info, path = line.split('\t', 1)
+            old_mode, new_mode, old_sha, new_sha, status = info[1:].split()
+            if status == 'M' and old_mode == new_mode == '100644':
+                size = int(git(repos, 'cat-file', '-s', new_sha))
+                changes.append((size, commit, path, old_sha, new_sha))
+    changes.sort(reverse=True)
+    corpus = []
+    for size, commit, path, old_sha, new_sha in changes[:max_files]:
+        old = git(repos, 'cat-file', 'blob', old_sha)
+        new = git(repos, 'cat-file', 'blob', new_sha)
+        if '\0' in old or '\0' in new:
+            continue
+        corpus.append(('%s@%s' % (path, commit[:7]), old.splitlines(),
+                       new.splitlines()))
+    return corpus
+
+
+def run_engine(engine, old, new, context):
+    start = time.time()
+    changed = 0
+    for group in get_filtered_hunks(old, new, context, engine=engine):
+        for tag, i1, i2, j1, j2 in group:
+            if tag != 'equal':
+                changed += i2 - i1 + j2 - j1
+    return time.time() - start, changed
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('repos', help="path to the .git directory")
+    parser.add_argument('--rev', default='HEAD',
+                        help="revision to start from (default: %(default)s)")
+    parser.add_argument('-c', '--commits', type=int, default=500,
+                        help="number of commits looked at (default: "
+                             "%(default)s)")
+    parser.add_argument('-f', '--files', type=int, default=20,
+                        help="number of files compared (default: "
+                             "%(default)s)")
+    parser.add_argument('--context', type=int, default=3,
+                        help="number of context lines (default: "
+                             "%(default)s)")
+    args = parser.parse_args(args)
+
+    corpus = build_corpus(args.repos, args.rev, args.commits, args.files)
+    names = sorted(diff_engines)
+    totals = dict((name, 0.0) for name in names)
+    printout('  '.join('%-20s' % name for name in names) + '  file')
+    for label, old, new in corpus:
+        columns = []
+        for name in names:
+            elapsed, changed = run_engine(diff_engines[name], old, new,
+                                          args.context)
+            totals[name] += elapsed
+            columns.append('%8.3fs %7d +-  ' % (elapsed, changed))
+        printout(''.join(columns) + '%s (%d lines)' % (label, len(new)))
+    printout(''.join('%8.3fs total    ' % totals[name] for name in names))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
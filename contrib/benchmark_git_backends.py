@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Compare the times of browsing a git repository and of retrieving
+its changesets with the `git` and `python` values of the `[git] backend`
+option.
+"""
+
+import argparse
+import os.path
+import sys
+import time
+
+from trac.test import EnvironmentStub
+from trac.util.text import printout
+from trac.versioncontrol.api import DbRepositoryProvider, Node, \
+                                    RepositoryManager
+from tracopt.versioncontrol.git.PyGIT import StorageFactory
+from tracopt.versioncontrol.git.git_fs import GitConnector
+
+
+def browse(repos, rev, max_nodes):
+    """Visit the directories breadth-first and read the file contents,
+    up to `max_nodes` nodes.
+    """
+    count = 0
+    nodes = [repos.get_node('/', rev)]
+    while nodes and count < max_nodes:
+        node = nodes.pop(0)
+        for entry in node.get_entries():
+            count += 1
+            if entry.kind == Node.DIRECTORY:
+                nodes.append(entry)
+            else:
+                entry.get_content_length()
+                entry.get_content().read()
+            if count >= max_nodes:
+                break
+    return count
+
+
+def changesets(repos, revs):
+    for rev in revs:
+        cset = repos.get_changeset(rev)
+        for path, kind, change, base_path, base_rev in cset.get_changes():
+            if kind == Node.FILE and change != 'delete':
+                repos.get_node(path, rev).get_content().read()
+
+
+def run(env, backend, args):
+    env.config.set('git', 'backend', backend)
+    StorageFactory._clean()
+    RepositoryManager(env).reload_repositories()
+    repos = RepositoryManager(env).get_repository('repos')
+    repos.sync()
+    revs = []
+    rev = repos.youngest_rev
+    while rev and len(revs) < args.changesets:
+        revs.append(rev)
+        rev = repos.previous_rev(rev)
+
+    start = time.time()
+    for idx in xrange(args.repeat):
+        count = browse(repos, repos.youngest_rev, args.nodes)
+    browse_time = (time.time() - start) / args.repeat
+    start = time.time()
+    for idx in xrange(args.repeat):
+        changesets(repos, revs)
+    changesets_time = (time.time() - start) / args.repeat
+    return count, len(revs), browse_time, changesets_time
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', help="path of the git repository")
+    parser.add_argument('-n', '--nodes', type=int, default=500,
+                        help="number of nodes browsed (default: "
+                             "%(default)s)")
+    parser.add_argument('-c', '--changesets', type=int, default=50,
+                        help="number of changesets retrieved (default: "
+                             "%(default)s)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="number of runs of each test (default: "
+                             "%(default)s)")
+    args = parser.parse_args(args)
+
+    env = EnvironmentStub(enable=['trac.*', GitConnector])
+    try:
+        DbRepositoryProvider(env).add_repository(
+            'repos', os.path.abspath(args.path), 'git')
+        results = [(backend,) + run(env, backend, args)
+                   for backend in ('git', 'python')]
+        for backend, nodes, csets, browse_time, changesets_time in results:
+            printout("%-6s  browse %d nodes: %.3fs  %d changesets: %.3fs"
+                     % (backend, nodes, browse_time, csets,
+                        changesets_time))
+    finally:
+        RepositoryManager(env).reload_repositories()
+        StorageFactory._clean()
+        env.reset_db()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -131,6 +131,7 @@ setup(
         trac.notification.prefs = trac.notification.prefs
         trac.prefs = trac.prefs.web_ui
         trac.search = trac.search.web_ui
+        trac.search.admin = trac.search.admin
         trac.ticket.admin = trac.ticket.admin
         trac.ticket.batch = trac.ticket.batch
         trac.ticket.query = trac.ticket.query
@@ -148,6 +149,7 @@ setup(
         trac.wiki.admin = trac.wiki.admin
         trac.wiki.interwiki = trac.wiki.interwiki
         trac.wiki.macros = trac.wiki.macros
+        trac.wiki.rendercache = trac.wiki.rendercache
         trac.wiki.web_ui = trac.wiki.web_ui
         trac.wiki.web_api = trac.wiki.web_api
         tracopt.perm.authz_policy = tracopt.perm.authz_policy
@@ -21,6 +21,7 @@ import unittest
 import trac.admin.api
 import trac.attachment
 import trac.perm
+import trac.search.admin
 import trac.ticket.admin
 import trac.versioncontrol.admin
 import trac.versioncontrol.api
@@ -32,7 +32,7 @@ from trac.core import *
 from trac.mimeview import *
 from trac.perm import IPermissionPolicy
 from trac.resource import *
-from trac.search import search_to_sql, shorten_result
+from trac.search import SearchDocument, search_to_sql, shorten_result
 from trac.util import content_disposition, create_zipinfo, file_or_std, \
                       get_reporter_id, normalize_filename
 from trac.util.datefmt import datetime_now, format_datetime, \
@@ -285,31 +285,47 @@ class AttachmentModule(Component):
                 'attachments': attachments,
                 'parent': context.resource}
 
-    def get_history(self, start, stop, realm):
+    def get_history(self, start, stop, realm, limit=None):
         """Return an iterable of tuples describing changes to attachments on
         a particular object realm.
 
         The tuples are in the form (change, realm, id, filename, time,
         description, author). `change` can currently only be `created`.
+        The changes are generated newest first and, if `limit` is
+        specified, they are retrieved `limit` at a time.
 
         FIXME: no iterator
         """
-        for realm, id_, filename, ts, description, author in \
-                self.env.db_query("""
-                SELECT type, id, filename, time, description, author
-                FROM attachment WHERE time > %s AND time < %s AND type = %s
-                """, (to_utimestamp(start), to_utimestamp(stop), realm)):
-            time = from_utimestamp(ts or 0)
-            yield 'created', realm, id_, filename, time, description, author
-
-    def get_timeline_events(self, req, resource_realm, start, stop):
+        sql = """
+            SELECT type, id, filename, time, description, author
+            FROM attachment WHERE time > %s AND time < %s AND type = %s
+            ORDER BY time DESC, type, id, filename
+            """
+        args = (to_utimestamp(start), to_utimestamp(stop), realm)
+        if limit:
+            sql += " LIMIT %s OFFSET %s"
+        offset = 0
+        while True:
+            rows = self.env.db_query(sql, args + (limit, offset)
+                                          if limit else args)
+            for realm, id_, filename, ts, description, author in rows:
+                time = from_utimestamp(ts or 0)
+                yield ('created', realm, id_, filename, time, description,
+                       author)
+            if not limit or len(rows) < limit:
+                break
+            offset += limit
+
+    def get_timeline_events(self, req, resource_realm, start, stop,
+                            limit=None):
         """Return an event generator suitable for ITimelineEventProvider.
 
         Events are changes to attachments on resources of the given
-        `resource_realm.realm`.
+        `resource_realm.realm`, newest first. The `limit` argument is
+        passed to `get_history`.
         """
         for change, realm, id_, filename, time, descr, author in \
-                self.get_history(start, stop, resource_realm.realm):
+                self.get_history(start, stop, resource_realm.realm, limit):
             attachment = resource_realm(id=id_).child(self.realm, filename)
             if 'ATTACHMENT_VIEW' in req.perm(attachment):
                 yield 'attachment', time, author, (attachment, descr), self
@@ -350,6 +366,43 @@ class AttachmentModule(Component):
                            from_utimestamp(time), author,
                            shorten_result(desc, terms))
 
+    def get_search_index_documents(self, resource_realm, filter):
+        """Return the `SearchDocument`s of the attachments on resources
+        of the given `resource_realm.realm`, suitable for
+        `ISearchIndexSource`.
+
+        :since: 1.3.4
+        """
+        for id, time, filename, desc, author in self.env.db_query("""
+                SELECT id, time, filename, description, author
+                FROM attachment WHERE type=%s
+                """, (resource_realm.realm,)):
+            attachment = resource_realm(id=id).child(self.realm, filename)
+            yield self._search_index_document(attachment, filter, time,
+                                              author, desc)
+
+    def get_search_index_document(self, resource, filter):
+        """Return the `SearchDocument` of the attachment `resource`, or
+        `None` if the attachment doesn't exist.
+
+        :since: 1.3.4
+        """
+        for time, desc, author in self.env.db_query("""
+                SELECT time, description, author FROM attachment
+                WHERE type=%s AND id=%s AND filename=%s
+                """, (resource.parent.realm, unicode(resource.parent.id),
+                      resource.id)):
+            return self._search_index_document(resource, filter, time,
+                                               author, desc)
+
+    def _search_index_document(self, attachment, filter, time, author,
+                               desc):
+        text = '\n'.join(t for t in (desc, attachment.id) if t)
+        return SearchDocument(filter, attachment, from_utimestamp(time),
+                              author,
+                              get_resource_shortname(self.env, attachment),
+                              text)
+
     # IResourceManager methods
 
     def get_resource_realms(self):
@@ -610,6 +663,7 @@ class AttachmentModule(Component):
             return data
 
     def _format_link(self, formatter, ns, target, label):
+        formatter.depends_on(self.realm)
         link, params, fragment = formatter.split_link(target)
         ids = link.split(':', 2)
         attachment = None
@@ -12,11 +12,25 @@
 # history and logs, available at http://trac.edgewall.org/.
 
 import functools
-
-from trac.core import Component
+import itertools
+import mmap
+import os
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from trac.config import ExtensionOption, IntOption
+from trac.core import Component, Interface, implements
+from trac.db.api import DatabaseManager
 from trac.util.concurrency import ThreadLocal, threading
+from trac.util.text import exception_to_unicode
 
-__all__ = ['CacheManager', 'cached']
+__all__ = ['CacheManager', 'ICacheInvalidationTransport', 'cached',
+           'cached_mapping']
 
 _id_to_key = {}
 
@@ -73,11 +87,23 @@ class CachedSingletonProperty(CachedPropertyBase):
         return CacheManager(instance.env).get(id, self.retriever, instance)
 
     def __delete__(self, instance):
+        self.update(instance, None)
+
+    def update(self, instance, update):
+        """Invalidate the cached data in the other processes and
+        replace it by `update(data)` in this process.
+
+        The `update` function must return the new data without
+        modifying the given one. The data is retrieved again when this
+        process doesn't have the latest version of the data.
+
+        :since: 1.3.4
+        """
         try:
             id = self.id
         except AttributeError:
             id = self.id = key_to_id(self.make_key(instance.__class__))
-        CacheManager(instance.env).invalidate(id)
+        CacheManager(instance.env).invalidate(id, update)
 
 
 class CachedProperty(CachedPropertyBase):
@@ -114,6 +140,66 @@ class CachedProperty(CachedPropertyBase):
         CacheManager(instance.env).invalidate(id)
 
 
+class CachedMapping(object):
+    """Mapping-like view of a `CachedMappingProperty` for a given
+    instance.
+
+    Each key is cached separately: ``mapping[key]`` only calls the
+    retriever for that key when it is not cached yet or has been
+    invalidated, and ``del mapping[key]`` only invalidates that key.
+
+    The key is cached along with the data, as different keys may get
+    the same id. The data is retrieved without being cached when the
+    id is used by another key.
+    """
+
+    def __init__(self, prop, instance):
+        self.prop = prop
+        self.instance = instance
+
+    def __getitem__(self, key):
+        retriever = self.prop.retriever
+        entry = CacheManager(self.instance.env).get(
+            self.prop.make_id(self.instance.__class__, key),
+            lambda instance: (key, retriever(instance, key)), self.instance)
+        if isinstance(entry, tuple) and len(entry) == 2 and \
+                entry[0] == key:
+            return entry[1]
+        return retriever(self.instance, key)
+
+    def __delitem__(self, key):
+        CacheManager(self.instance.env).invalidate(
+            self.prop.make_id(self.instance.__class__, key))
+
+
+class CachedMappingProperty(CachedPropertyBase):
+    """Cached property descriptor giving access to a `CachedMapping`,
+    for classes behaving as singletons in the scope of one
+    `~trac.env.Environment` instance.
+
+    The key of each entry is appended to the key constructed from the
+    names of the containing module, class and retriever method, so
+    each entry gets its own generation in the `cache` table.
+    """
+
+    def __init__(self, retriever):
+        super(CachedMappingProperty, self).__init__(retriever)
+        self.ids = {}
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return CachedMapping(self, instance)
+
+    def make_id(self, cls, key):
+        try:
+            return self.ids[key]
+        except KeyError:
+            id = self.ids[key] = \
+                key_to_id(self.make_key(cls) + ':' + unicode(key))
+            return id
+
+
 def cached(fn_or_attr=None):
     """Method decorator creating a cached attribute from a data
     retrieval method.
@@ -180,15 +266,205 @@ def cached(fn_or_attr=None):
     return decorator
 
 
+def cached_mapping(fn):
+    """Method decorator creating a cached mapping from a data
+    retrieval method taking a key as argument.
+
+    Contrary to the `cached` attribute, each key is retrieved, cached
+    and invalidated on its own, so that changing the data for one key
+    doesn't require retrieving the data for all the other keys again.
+    The retrieval method is called on first access of a key, and the
+    cached value for a key is invalidated by ``del``\ eting it::
+
+        class MilestoneCache(Component):
+            @cached_mapping
+            def milestone_data(self, name):
+                for row in self.env.db_query(
+                        "SELECT * FROM milestone WHERE name=%s", (name,)):
+                    return row
+
+        data = MilestoneCache(env).milestone_data['milestone1']
+        del MilestoneCache(env).milestone_data['milestone1']
+
+    The keys are converted to strings for identifying the entries in
+    the database. The decorator can only be used in classes for which
+    instances behave as singletons within the scope of a given
+    `~trac.env.Environment`, typically `~trac.core.Component` classes.
+
+    :since: 1.3.4
+    """
+    return CachedMappingProperty(fn)
+
+
+class ICacheInvalidationTransport(Interface):
+    """Extension point interface for components propagating cache
+    invalidations between the processes serving an environment.
+
+    The `cache` table stays the source of truth. A transport only tells
+    the `CacheManager` which entries must be checked again against the
+    database, so that the cache metadata doesn't have to be retrieved
+    from the database on every request.
+
+    :since: 1.3.4
+    """
+
+    def notify(id):
+        """Called once the transaction invalidating the cached data
+        for the given id has been committed.
+        """
+
+    def get_changes():
+        """Return the set of ids invalidated since the previous call,
+        or `None` if the changes are unknown. In the latter case, the
+        cache metadata is retrieved from the database.
+        """
+
+
+class DatabaseInvalidationTransport(Component):
+    """Cache invalidation transport relying on the `cache` table only.
+
+    The cache metadata is retrieved from the database on the first
+    cache access of each request.
+    """
+
+    implements(ICacheInvalidationTransport)
+
+    required = True
+
+    # ICacheInvalidationTransport methods
+
+    def notify(self, id):
+        pass
+
+    def get_changes(self):
+        return None
+
+
+class SharedMemoryInvalidationTransport(Component):
+    """Cache invalidation transport pushing the invalidations through
+    a table of counters in a memory-mapped file.
+
+    Each cache id is hashed to one of the counters, which is incremented
+    when the cached data is invalidated. The cache metadata is then only
+    checked against the database for the ids whose counter has changed.
+
+    The file is stored in the `files` directory of the environment, so
+    this transport must only be used when all the processes serving the
+    environment run on the same host.
+    """
+
+    implements(ICacheInvalidationTransport)
+
+    filename = 'cache-generations'
+    slots = 4096
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = self._mmap = self._counters = None
+        self._format = '<%dQ' % self.slots
+
+    # ICacheInvalidationTransport methods
+
+    def notify(self, id):
+        with self._lock:
+            if not self._open():
+                return
+            offset = (id % self.slots) * 8
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+            try:
+                counter, = struct.unpack_from('<Q', self._mmap, offset)
+                struct.pack_into('<Q', self._mmap, offset,
+                                 (counter + 1) & 0xffffffffffffffff)
+            finally:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+    def get_changes(self):
+        with self._lock:
+            if not self._open():
+                return None
+            counters = struct.unpack_from(self._format, self._mmap)
+            previous, self._counters = self._counters, counters
+        if previous is None:
+            return None
+        if counters == previous:
+            return set()
+        slots = {slot for slot, (old, new)
+                      in enumerate(zip(previous, counters)) if old != new}
+        return {id for id in _id_to_key if id % self.slots in slots}
+
+    # Internal methods
+
+    def _open(self):
+        if self._mmap is not None:
+            return True
+        if fcntl is None:
+            return False
+        path = os.path.join(self.env.files_dir, self.filename)
+        size = self.slots * 8
+        try:
+            if not os.path.isdir(self.env.files_dir):
+                os.makedirs(self.env.files_dir)
+            f = open(path, 'a+b')
+            try:
+                fcntl.lockf(f, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(f.fileno()).st_size < size:
+                        f.truncate(size)
+                finally:
+                    fcntl.lockf(f, fcntl.LOCK_UN)
+                self._mmap = mmap.mmap(f.fileno(), size)
+            except:
+                f.close()
+                raise
+        except EnvironmentError as e:
+            self.log.error("Unable to map cache invalidation file %s: %s",
+                           path, exception_to_unicode(e))
+            return False
+        self._file = f
+        return True
+
+
 class CacheManager(Component):
     """Cache manager."""
 
     required = True
 
+    invalidation_transport = ExtensionOption('trac',
+        'cache_invalidation_transport', ICacheInvalidationTransport,
+        'DatabaseInvalidationTransport',
+        """Name of the component propagating cache invalidations
+        between the processes serving the environment. With the
+        default `DatabaseInvalidationTransport`, the cache metadata is
+        retrieved from the database on every request. Use
+        `SharedMemoryInvalidationTransport` when all the processes run
+        on the same host, to only query the database once the cached
+        data has been invalidated. (''since 1.3.4'')
+        """)
+
+    max_entries = IntOption('trac', 'cache_max_entries', 10000,
+        """Maximum number of entries kept in the cache of each process.
+        The least recently used entries are evicted when the limit is
+        exceeded. Use `0` for no limit. (''since 1.3.4'')
+        """)
+
+    max_size = IntOption('trac', 'cache_max_size', 0,
+        """Approximate maximum size in bytes of the data kept in the
+        cache of each process. The least recently used entries are
+        evicted when the limit is exceeded. Use `0` for no limit, which
+        also avoids the cost of estimating the size of the cached data.
+        (''since 1.3.4'')
+        """)
+
     def __init__(self):
         self._cache = {}
+        self._meta = None
         self._local = ThreadLocal(meta=None, cache=None)
         self._lock = threading.RLock()
+        self._clock = itertools.count()
+        self._used = {}
+        self._sizes = {}
+        self._size = 0
+        self._stats = {}
 
     # Public interface
 
@@ -196,6 +472,20 @@ class CacheManager(Component):
         """Reset per-request cache metadata."""
         self._local.meta = self._local.cache = None
 
+    def get_statistics(self):
+        """Return the usage statistics of the cache in this process, as
+        a list of `(key, hits, misses, size)` tuples sorted by key.
+
+        The `size` is `None` for entries no longer cached, and for all
+        entries when `[trac] cache_max_size` is `0`.
+
+        :since: 1.3.4
+        """
+        with self._lock:
+            return sorted((_id_to_key.get(id, str(id)), hits, misses,
+                           self._sizes.get(id))
+                          for id, (hits, misses) in self._stats.iteritems())
+
     def get(self, id, retriever, instance):
         """Get cached or fresh data for the given id."""
         # Get cache metadata
@@ -203,9 +493,8 @@ class CacheManager(Component):
         local_cache = self._local.cache
         if local_meta is None:
             # First cache usage in this request, retrieve cache metadata
-            # from the database and make a thread-local copy of the cache
-            meta = self.env.db_query("SELECT id, generation FROM cache")
-            self._local.meta = local_meta = dict(meta)
+            # and make a thread-local copy of the cache
+            self._local.meta = local_meta = self._get_metadata()
             self._local.cache = local_cache = self._cache.copy()
 
         db_generation = local_meta.get(id, -1)
@@ -214,6 +503,7 @@ class CacheManager(Component):
         try:
             data, generation = local_cache[id]
             if generation == db_generation:
+                self._hit(id)
                 return data
         except KeyError:
             pass
@@ -224,6 +514,7 @@ class CacheManager(Component):
                 try:
                     data, generation = local_cache[id] = self._cache[id]
                     if generation == db_generation:
+                        self._hit(id)
                         return data
                 except KeyError:
                     generation = None   # Force retrieval from the database
@@ -236,16 +527,27 @@ class CacheManager(Component):
                 else:
                     db_generation = -1
                 if db_generation == generation:
+                    self._hit(id)
                     return data
 
                 # Retrieve data from the database
                 data = retriever(instance)
                 local_cache[id] = self._cache[id] = data, db_generation
                 local_meta[id] = db_generation
+                if self._meta is not None:
+                    self._meta[id] = db_generation
+                self._miss(id, data)
                 return data
 
-    def invalidate(self, id):
-        """Invalidate cached data for the given id."""
+    def invalidate(self, id, update=None):
+        """Invalidate cached data for the given id.
+
+        When an `update` function is given and the process cache has
+        the latest version of the data, the data is replaced by
+        `update(data)` instead of being retrieved again on next use.
+
+        :since 1.3.4: the `update` parameter was added.
+        """
         with self.env.db_transaction as db:
             with self._lock:
                 # Invalidate in other processes
@@ -259,15 +561,131 @@ class CacheManager(Component):
                 #    and we can safely INSERT a new row.
                 db("UPDATE cache SET generation=generation+1 WHERE id=%s",
                    (id,))
-                if not db("SELECT generation FROM cache WHERE id=%s", (id,)):
+                for generation, in db("SELECT generation FROM cache "
+                                      "WHERE id=%s", (id,)):
+                    break
+                else:
+                    generation = 0
                     db("INSERT INTO cache VALUES (%s, %s, %s)",
-                       (id, 0, _id_to_key.get(id, '<unknown>')))
-
-                # Invalidate in this process
-                self._cache.pop(id, None)
+                       (id, generation, _id_to_key.get(id, '<unknown>')))
+
+                DatabaseManager(self.env).call_after_commit(
+                    functools.partial(self.invalidation_transport.notify, id))
+
+                # Invalidate or update in this process. The generation
+                # is checked again on next use, as the transaction may
+                # still be rolled back.
+                data, cached_generation = self._cache.get(id, (None, None))
+                if update is not None and cached_generation is not None \
+                        and cached_generation == generation - 1:
+                    data = update(data)
+                    self._cache[id] = data, generation
+                    if self.max_size > 0:
+                        size = _sizeof(data)
+                        self._size += size - self._sizes.get(id, 0)
+                        self._sizes[id] = size
+                else:
+                    self._discard(id)
+                if self._meta is not None:
+                    self._meta[id] = None
 
                 # Invalidate in this thread
                 try:
                     del self._local.cache[id]
                 except (KeyError, TypeError):
                     pass
+
+    # Internal methods
+
+    def _get_metadata(self):
+        """Return a copy of the cache metadata, as a `dict` mapping ids
+        to generations.
+
+        The metadata is kept for the process and only the entries
+        reported as changed by the invalidation transport are marked as
+        unknown, so that they are checked against the database on
+        access. The metadata is retrieved from the database when the
+        transport can't tell what changed.
+        """
+        with self._lock:
+            changes = self.invalidation_transport.get_changes()
+            if changes is not None:
+                if self._meta is None:
+                    self._meta = self._fetch_metadata()
+                else:
+                    for id in changes:
+                        self._meta[id] = None
+                return self._meta.copy()
+            self._meta = None
+        return self._fetch_metadata()
+
+    def _fetch_metadata(self):
+        return dict(self.env.db_query("SELECT id, generation FROM cache"))
+
+    def _hit(self, id):
+        # Counters are updated without locking, as they don't need to be
+        # accurate
+        self._used[id] = next(self._clock)
+        try:
+            self._stats[id][0] += 1
+        except KeyError:
+            self._stats.setdefault(id, [0, 0])[0] += 1
+
+    def _miss(self, id, data):
+        # Called with the lock held
+        self._used[id] = next(self._clock)
+        self._stats.setdefault(id, [0, 0])[1] += 1
+        if self.max_size > 0:
+            size = _sizeof(data)
+            self._size += size - self._sizes.get(id, 0)
+            self._sizes[id] = size
+        self._evict()
+
+    def _discard(self, id):
+        # Called with the lock held
+        self._cache.pop(id, None)
+        self._used.pop(id, None)
+        self._size -= self._sizes.pop(id, 0)
+
+    def _evict(self):
+        """Evict the least recently used entries when the cache exceeds
+        its limits.
+
+        The cache is shrunk to 90% of the limits, so that the entries
+        don't need to be sorted on every retrieval.
+        """
+        max_entries = self.max_entries
+        max_size = self.max_size
+        if not (0 < max_entries < len(self._cache) or
+                0 < max_size < self._size):
+            return
+        max_entries = max_entries * 9 // 10
+        max_size = max_size * 9 // 10
+        used = self._used
+        for id in sorted(self._cache, key=lambda id: used.get(id, -1)):
+            if not (0 < max_entries < len(self._cache) or
+                    0 < max_size < self._size):
+                break
+            self._discard(id)
+            self.log.debug("Evicted %s from the cache",
+                           _id_to_key.get(id, id))
+
+
+def _sizeof(obj, seen=None):
+    """Return an estimate of the memory used by `obj` and the objects
+    it contains, in bytes.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(_sizeof(k, seen) + _sizeof(v, seen)
+                    for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _sizeof(obj.__dict__, seen)
+    return size
@@ -15,20 +15,23 @@
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
 import os
+import random
 import time
 import urllib
 from abc import ABCMeta, abstractmethod
 
 from trac import db_default
 from trac.api import IEnvironmentSetupParticipant, ISystemInfoProvider
-from trac.config import BoolOption, ConfigurationError, IntOption, Option
+from trac.config import BoolOption, ConfigurationError, IntOption, \
+                        ListOption, Option
 from trac.core import *
 from trac.db.pool import ConnectionPool
 from trac.db.schema import Table
 from trac.db.util import ConnectionWrapper
 from trac.util.concurrency import ThreadLocal
+from trac.util.datefmt import time_now
 from trac.util.html import tag
-from trac.util.text import unicode_passwd
+from trac.util.text import exception_to_unicode, unicode_passwd
 from trac.util.translation import _, tag_
 
 
@@ -68,7 +71,7 @@ class TransactionContextManager(DbContextManager):
         db = self.dbmgr._transaction_local.wdb  # outermost writable db
         if not db:
             db = self.dbmgr._transaction_local.rdb  # reuse wrapped connection
-            if db:
+            if db and not self.dbmgr._transaction_local.replica:
                 db = ConnectionWrapper(db.cnx, db.log)
             else:
                 db = self.dbmgr.get_connection()
@@ -78,12 +81,20 @@ class TransactionContextManager(DbContextManager):
     def __exit__(self, et, ev, tb):
         if self.db:
             self.dbmgr._transaction_local.wdb = None
+            callbacks = self.dbmgr._transaction_local.commit_callbacks
+            self.dbmgr._transaction_local.commit_callbacks = None
             if et is None:
                 self.db.commit()
             else:
                 self.db.rollback()
-            if not self.dbmgr._transaction_local.rdb:
+            if not self.dbmgr._transaction_local.rdb or \
+                    self.dbmgr._transaction_local.replica:
                 self.db.close()
+            if et is None:
+                self.dbmgr._committed()
+                if callbacks:
+                    for callback in callbacks:
+                        callback()
 
 
 class QueryContextManager(DbContextManager):
@@ -91,22 +102,48 @@ class QueryContextManager(DbContextManager):
     `~trac.db.util.ConnectionWrapper`.
     """
 
+    use_replica = False
+
     def __enter__(self):
         db = self.dbmgr._transaction_local.rdb  # outermost readonly db
+        wdb = self.dbmgr._transaction_local.wdb
+        if db and wdb and self.dbmgr._transaction_local.replica:
+            # Don't read from a replica within a transaction
+            return ConnectionWrapper(wdb.cnx, wdb.log, readonly=True)
         if not db:
-            db = self.dbmgr._transaction_local.wdb  # reuse wrapped connection
+            db = wdb  # reuse wrapped connection
             if db:
                 db = ConnectionWrapper(db.cnx, db.log, readonly=True)
             else:
-                db = self.dbmgr.get_connection(readonly=True)
+                if self.use_replica:
+                    db = self.dbmgr.get_replica_connection()
+                self.dbmgr._transaction_local.replica = bool(db)
+                if not db:
+                    db = self.dbmgr.get_connection(readonly=True)
             self.dbmgr._transaction_local.rdb = self.db = db
         return db
 
     def __exit__(self, et, ev, tb):
         if self.db:
             self.dbmgr._transaction_local.rdb = None
-            if not self.dbmgr._transaction_local.wdb:
+            if not self.dbmgr._transaction_local.wdb or \
+                    self.dbmgr._transaction_local.replica:
                 self.db.close()
+            self.dbmgr._transaction_local.replica = False
+
+
+class ReplicaQueryContextManager(QueryContextManager):
+    """Database Context Manager for retrieving a read-only
+    `~trac.db.util.ConnectionWrapper` to one of the replicas of the
+    database, if `[trac] database_replicas` is set.
+
+    The queries nested in the context also read from the replica,
+    except when they are within a transaction.
+
+    :since: 1.3.4
+    """
+
+    use_replica = True
 
 
 class ConnectionBase(object):
@@ -201,6 +238,14 @@ class ConnectionBase(object):
         to `id`."""
         pass
 
+    def supports_window_functions(self):
+        """Returns whether window functions such as `COUNT(*) OVER ()`
+        are supported.
+
+        :since: 1.3.4
+        """
+        return False
+
 
 class IDatabaseConnector(Interface):
     """Extension point interface for components that support the
@@ -274,9 +319,34 @@ class DatabaseManager(Component):
         """Show the SQL queries in the Trac log, at DEBUG level.
         """)
 
+    replica_uris = ListOption('trac', 'database_replicas', '',
+        doc="""List of database connection strings of read-only
+        replicas of the database. When set, the queries of the reports,
+        ticket queries, timeline and search are sent to one of the
+        replicas, or to the primary database if no replica can be
+        connected to. This is not done during
+        `[trac] database_replica_stickiness` seconds after a write to
+        the database in the same thread or by the same web browser.
+        Only supported for the PostgreSQL and MySQL databases.
+        (''since 1.3.4'')
+        """)
+
+    replica_stickiness = IntOption('trac', 'database_replica_stickiness',
+                                   10,
+        """Number of seconds during which the read-only queries are
+        still sent to the primary database after a write, so that data
+        not yet copied to the replicas can be read back. See
+        `[trac] database_replicas`. (''since 1.3.4'')
+        """)
+
     def __init__(self):
         self._cnx_pool = None
-        self._transaction_local = ThreadLocal(wdb=None, rdb=None)
+        self._replica_pools = None
+        self._transaction_local = ThreadLocal(wdb=None, rdb=None,
+                                              commit_callbacks=None,
+                                              replica=False,
+                                              primary_until=0,
+                                              write_listener=None)
 
     def init_db(self):
         connector, args = self.get_connector()
@@ -403,6 +473,22 @@ class DatabaseManager(Component):
                                                col.name)
                     self.drop_tables((temp_table_name,))
 
+    def call_after_commit(self, callback):
+        """Call `callback` without arguments once the outermost
+        transaction of the current thread has been committed.
+
+        The callback is discarded if the transaction is rolled back,
+        and called immediately if no transaction is in progress.
+
+        :since: 1.3.4
+        """
+        if self._transaction_local.wdb:
+            if self._transaction_local.commit_callbacks is None:
+                self._transaction_local.commit_callbacks = []
+            self._transaction_local.commit_callbacks.append(callback)
+        else:
+            callback()
+
     def get_connection(self, readonly=False):
         """Get a database connection from the pool.
 
@@ -417,6 +503,71 @@ class DatabaseManager(Component):
             db = ConnectionWrapper(db, readonly=True)
         return db
 
+    def get_replica_connection(self):
+        """Get a read-only database connection to one of the replicas,
+        or `None` if no replica is configured, if the primary database
+        must be used (see `stick_to_primary`) or if none of the replicas
+        can be connected to.
+
+        :since: 1.3.4
+        """
+        if not self.replica_uris or \
+                time_now() < self._transaction_local.primary_until:
+            return None
+        if self._replica_pools is None:
+            scheme = parse_connection_uri(self.connection_uri)[0]
+            pools = []
+            for uri in self.replica_uris:
+                if scheme not in ('mysql', 'postgres') or \
+                        parse_connection_uri(uri)[0] != scheme:
+                    raise ConfigurationError(
+                        _("Database replicas are only supported for "
+                          "PostgreSQL and MySQL databases, and must use "
+                          "the same database type as the primary "
+                          "database."))
+                connector, args = self.get_connector(uri)
+                pools.append(ConnectionPool(5, connector, **args))
+            self._replica_pools = pools
+        pools = random.sample(self._replica_pools, len(self._replica_pools))
+        for pool in pools:
+            try:
+                cnx = pool.get_cnx(self.timeout or None)
+            except Exception as e:
+                self.log.warning("Can't connect to database replica: %s",
+                                 exception_to_unicode(e))
+            else:
+                return ConnectionWrapper(cnx, readonly=True)
+        return None
+
+    def stick_to_primary(self, until, listener=None):
+        """Send the read-only queries of the current thread to the
+        primary database until the `until` timestamp.
+
+        The timestamp is extended by `[trac] database_replica_stickiness`
+        seconds each time a transaction is committed by the thread, and
+        the optional `listener` is then called with the new timestamp.
+        This allows the web front-end to keep sending the requests of a
+        user who wrote to the database to the primary database.
+
+        :since: 1.3.4
+        """
+        self._transaction_local.primary_until = until
+        self._transaction_local.write_listener = listener
+
+    def get_pool_statistics(self):
+        """Return a `dict` of statistics describing the use of the
+        process-wide connection pool, or an empty `dict` if no
+        connection has been requested yet.
+
+        See `~trac.db.pool.ConnectionPoolBackend.get_statistics` for
+        the meaning of the counters.
+
+        :since: 1.3.4
+        """
+        if not self._cnx_pool:
+            return {}
+        return self._cnx_pool.get_statistics()
+
     def get_database_version(self, name='database_version'):
         """Returns the database version from the SYSTEM table as an int,
         or `False` if the entry is not found.
@@ -546,10 +697,12 @@ class DatabaseManager(Component):
                 self.set_database_version(i, name)
 
     def shutdown(self, tid=None):
+        self.stick_to_primary(0)
         if self._cnx_pool:
             self._cnx_pool.shutdown(tid)
             if not tid:
                 self._cnx_pool = None
+                self._replica_pools = None
 
     def backup(self, dest=None):
         """Save a backup of the database.
@@ -574,8 +727,14 @@ class DatabaseManager(Component):
             os.makedirs(backup_dir)
         return connector.backup(dest)
 
-    def get_connector(self):
-        scheme, args = parse_connection_uri(self.connection_uri)
+    def get_connector(self, uri=None):
+        """Return the connector for the connection string `uri` and its
+        arguments. The `[trac] database` connection string is used if
+        `uri` is not specified.
+
+        :since 1.3.4: added the `uri` parameter.
+        """
+        scheme, args = parse_connection_uri(uri or self.connection_uri)
         candidates = [
             (priority, connector)
             for connector in self.connectors
@@ -604,6 +763,17 @@ class DatabaseManager(Component):
             args['log'] = self.log
         return connector, args
 
+    def _committed(self):
+        """Called once the outermost transaction of the current thread
+        has been committed.
+        """
+        if self.replica_uris:
+            until = time_now() + self.replica_stickiness
+            self._transaction_local.primary_until = until
+            listener = self._transaction_local.write_listener
+            if listener:
+                listener(until)
+
     # IEnvironmentSetupParticipant methods
 
     def environment_created(self):
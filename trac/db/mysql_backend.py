@@ -543,6 +543,15 @@ class MySQLConnection(ConnectionBase, ConnectionWrapper):
         """Return the quoted identifier."""
         return _quote(identifier)
 
+    def supports_window_functions(self):
+        # Window functions are available since MySQL 8.0 and MariaDB 10.2
+        info = self.cnx.get_server_info()
+        match = re.match(r'(\d+)\.(\d+)', info)
+        if not match:
+            return False
+        version = tuple(int(v) for v in match.groups())
+        return version >= ((10, 2) if 'MariaDB' in info else (8, 0))
+
     def update_sequence(self, cursor, table, column='id'):
         # MySQL handles sequence updates automagically
         pass
@@ -16,6 +16,8 @@
 
 import os
 import sys
+import time
+from collections import deque
 
 from trac.core import TracError
 from trac.db.util import ConnectionWrapper
@@ -55,15 +57,27 @@ class PooledConnection(ConnectionWrapper):
 
 class ConnectionPoolBackend(object):
     """A process-wide LRU-based connection pool.
+
+    Idle connections are kept in a deque per connection key, so that
+    taking and returning a connection doesn't need to scan the pool.
+    Connections idle for more than `idle_timeout` seconds are closed by
+    a background thread, every `reap_interval` seconds.
     """
+
+    idle_timeout = 120
+    reap_interval = 30
+
     def __init__(self, maxsize):
         self._available = threading.Condition(threading.RLock())
         self._maxsize = maxsize
         self._active = {}
-        self._pool = []
-        self._pool_key = []
-        self._pool_time = []
+        self._idle = {}
+        self._idle_count = 0
         self._waiters = 0
+        self._reaper_pid = None
+        self._stats = dict.fromkeys(('checkouts', 'waits', 'wait_time',
+                                     'timeouts', 'creations', 'pings',
+                                     'ping_failures', 'evictions'), 0)
 
     def get_cnx(self, connector, kwargs, timeout=None):
         cnx = None
@@ -71,25 +85,32 @@ class ConnectionPoolBackend(object):
         key = unicode(kwargs)
         start = time_now()
         tid = get_thread_id()
+        # First choice: Return the same cnx already used by the thread.
+        # That slot is only modified by the current thread, so there's
+        # no need to hold the lock.
+        active = self._active.get((tid, key))
+        if active:
+            cnx, num = active
+            self._active[(tid, key)] = (cnx, num + 1)
+            return PooledConnection(self, cnx, key, tid, log)
+
+        self._start_reaper()
         # Get a Connection, either directly or a deferred one
         with self._available:
-            # First choice: Return the same cnx already used by the thread
-            if (tid, key) in self._active:
-                cnx, num = self._active[(tid, key)]
-                num += 1
-            else:
-                if self._waiters == 0:
-                    cnx = self._take_cnx(connector, kwargs, key, tid)
-                if not cnx:
-                    self._waiters += 1
-                    self._available.wait()
-                    self._waiters -= 1
-                    cnx = self._take_cnx(connector, kwargs, key, tid)
-                num = 1
+            self._stats['checkouts'] += 1
+            if self._waiters == 0:
+                cnx = self._take_cnx(key)
+            if not cnx:
+                self._stats['waits'] += 1
+                self._waiters += 1
+                self._available.wait(timeout)
+                self._waiters -= 1
+                cnx = self._take_cnx(key)
+                self._stats['wait_time'] += time_now() - start
             if cnx:
-                self._active[(tid, key)] = (cnx, num)
+                self._active[(tid, key)] = (cnx, 1)
 
-        deferred = num == 1 and isinstance(cnx, tuple)
+        deferred = isinstance(cnx, tuple)
         exc_info = (None, None, None)
         if deferred:
             # Potentially lengthy operations must be done without lock held
@@ -114,19 +135,24 @@ class ConnectionPoolBackend(object):
             if deferred:
                 # replace placeholder with real Connection
                 with self._available:
-                    self._active[(tid, key)] = (cnx, num)
+                    self._active[(tid, key)] = (cnx, 1)
             return PooledConnection(self, cnx, key, tid, log)
 
         if deferred:
             # cnx couldn't be reused, clear placeholder
             with self._available:
                 del self._active[(tid, key)]
+                if op == 'ping':
+                    self._stats['ping_failures'] += 1
+                self._available.notify()
             if op == 'ping': # retry
                 return self.get_cnx(connector, kwargs)
 
         # if we didn't get a cnx after wait(), something's fishy...
         if isinstance(exc_info[1], TracError):
             raise exc_info[0], exc_info[1], exc_info[2]
+        with self._available:
+            self._stats['timeouts'] += 1
         timeout = time_now() - start
         errmsg = _("Unable to get database connection within %(time)d seconds.",
                    time=timeout)
@@ -134,70 +160,131 @@ class ConnectionPoolBackend(object):
             errmsg += " (%s)" % exception_to_unicode(exc_info[1])
         raise TimeoutError(errmsg)
 
-    def _take_cnx(self, connector, kwargs, key, tid):
+    def get_statistics(self):
+        """Return a `dict` of counters describing the use of the pool.
+
+        The counters are the number of connections taken from the pool
+        (`checkouts`), the number of times and the total number of
+        seconds threads had to wait for a connection (`waits` and
+        `wait_time`), the number of failures to get a connection
+        (`timeouts`), the number of connections created (`creations`),
+        the number of times pooled connections have been verified and
+        found broken (`pings` and `ping_failures`) and the number of
+        idle connections closed to make room or after being idle for
+        too long (`evictions`). The current number of `active` and
+        `idle` connections and the `maxsize` of the pool are also
+        given.
+        """
+        with self._available:
+            stats = dict(self._stats)
+            stats.update(active=len(self._active), idle=self._idle_count,
+                         maxsize=self._maxsize)
+        return stats
+
+    def _take_cnx(self, key):
         """Note: _available lock must be held when calling this method."""
-        # Second best option: Reuse a live pooled connection
-        if key in self._pool_key:
-            idx = self._pool_key.index(key)
-            self._pool_key.pop(idx)
-            self._pool_time.pop(idx)
-            cnx = self._pool.pop(idx)
+        # Second best option: Reuse the most recently used live pooled
+        # connection
+        idle = self._idle.get(key)
+        if idle:
+            cnx = idle.pop()[1]
+            self._idle_count -= 1
             # If possible, verify that the pooled connection is
             # still available and working.
             if hasattr(cnx, 'ping'):
+                self._stats['pings'] += 1
                 return 'ping', cnx
             return cnx
         # Third best option: Create a new connection
-        elif len(self._active) + len(self._pool) < self._maxsize:
+        elif len(self._active) + self._idle_count < self._maxsize:
+            self._stats['creations'] += 1
             return 'create', None
         # Forth best option: Replace a pooled connection with a new one
         elif len(self._active) < self._maxsize:
             # Remove the LRU connection in the pool
-            cnx = self._pool.pop(0)
-            self._pool_key.pop(0)
-            self._pool_time.pop(0)
+            idle = min((idle for idle in self._idle.itervalues() if idle),
+                       key=lambda idle: idle[0][0])
+            cnx = idle.popleft()[1]
+            self._idle_count -= 1
+            self._stats['creations'] += 1
+            self._stats['evictions'] += 1
             return 'close', cnx
 
     def _return_cnx(self, cnx, key, tid):
         # Decrement active refcount, clear slot if 1
+        assert (tid, key) in self._active
+        cnx, num = self._active[(tid, key)]
+        if num > 1:
+            # Only modified by the current thread, see get_cnx
+            self._active[(tid, key)] = (cnx, num - 1)
+            return
         with self._available:
-            assert (tid, key) in self._active
-            cnx, num = self._active[(tid, key)]
-            if num == 1:
-                del self._active[(tid, key)]
-            else:
-                self._active[(tid, key)] = (cnx, num - 1)
-        if num == 1:
-            # Reset connection outside of critical section
-            try:
-                cnx.rollback() # resets the connection
-            except Exception:
-                cnx.close()
-                cnx = None
-            # Connection available, from reuse or from creation of a new one
-            with self._available:
-                if cnx and cnx.poolable:
-                    self._pool.append(cnx)
-                    self._pool_key.append(key)
-                    self._pool_time.append(time_now())
-                self._available.notify()
+            del self._active[(tid, key)]
+        # Reset connection outside of critical section
+        try:
+            cnx.rollback() # resets the connection
+        except Exception:
+            cnx.close()
+            cnx = None
+        # Connection available, from reuse or from creation of a new one
+        with self._available:
+            if cnx and cnx.poolable:
+                self._idle.setdefault(key, deque()).append((time_now(), cnx))
+                self._idle_count += 1
+            self._available.notify()
 
-    def shutdown(self, tid=None):
-        """Close pooled connections not used in a while"""
-        delay = 120
-        if tid is None:
-            delay = 0
+    def _start_reaper(self):
+        """Start the thread closing the connections idle for too long,
+        unless it is already running in this process.
+        """
+        pid = os.getpid()
+        if self._reaper_pid == pid:
+            return
+        with self._available:
+            if self._reaper_pid == pid:
+                return
+            self._reaper_pid = pid
+        thread = threading.Thread(target=self._run_reaper,
+                                  name='trac.db.pool reaper')
+        thread.daemon = True
+        thread.start()
+
+    def _run_reaper(self):
+        pid = self._reaper_pid
+        while self._reaper_pid == pid:
+            time.sleep(self.reap_interval)
+            self._reap(self.idle_timeout)
+
+    def _reap(self, delay):
+        """Close pooled connections not used in the last `delay`
+        seconds.
+        """
         when = time_now() - delay
+        expired = []
         with self._available:
-            if tid is None: # global shutdown, also close active connections
+            for idle in self._idle.itervalues():
+                while idle and idle[0][0] <= when:
+                    expired.append(idle.popleft()[1])
+            self._idle_count -= len(expired)
+            self._stats['evictions'] += len(expired)
+        for db in expired:
+            db.close()
+
+    def shutdown(self, tid=None):
+        """Close pooled connections not used in a while.
+
+        When `tid` is `None`, all the connections are closed, including
+        the active ones. Otherwise, this is a no-op unless the thread
+        closing the idle connections isn't running.
+        """
+        if tid is None: # global shutdown, also close active connections
+            with self._available:
                 for db, num in self._active.values():
                     db.close()
                 self._active = {}
-            while self._pool_time and self._pool_time[0] <= when:
-                db = self._pool.pop(0)
-                db.close()
-                self._pool_key.pop(0)
-                self._pool_time.pop(0)
+            self._reap(0)
+        elif self._reaper_pid != os.getpid():
+            self._reap(self.idle_timeout)
 
 
 _pool_size = int(os.environ.get('TRAC_DB_POOL_SIZE', 10))
@@ -213,5 +300,12 @@ class ConnectionPool(object):
     def get_cnx(self, timeout=None):
         return _backend.get_cnx(self._connector, self._kwargs, timeout)
 
+    def get_statistics(self):
+        """Return the statistics of the process-wide connection pool.
+
+        :since: 1.3.4
+        """
+        return _backend.get_statistics()
+
     def shutdown(self, tid=None):
         _backend.shutdown(tid)
@@ -414,6 +414,9 @@ class PostgreSQLConnection(ConnectionBase, ConnectionWrapper):
     def quote(self, identifier):
         return _quote(identifier)
 
+    def supports_window_functions(self):
+        return True
+
     def reset_tables(self):
         # reset sequences
         cursor = self.cursor()
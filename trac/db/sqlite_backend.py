@@ -428,6 +428,9 @@ class SQLiteConnection(ConnectionBase, ConnectionWrapper):
     def quote(self, identifier):
         return _quote(identifier)
 
+    def supports_window_functions(self):
+        return sqlite_version >= (3, 25, 0)
+
     def reset_tables(self):
         cursor = self.cursor()
         table_names = self.get_table_names()
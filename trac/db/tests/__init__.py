@@ -13,7 +13,7 @@
 
 import unittest
 
-from trac.db.tests import api, mysql_test, postgres_test, schema, \
+from trac.db.tests import api, mysql_test, pool, postgres_test, schema, \
                           sqlite_test, util
 from trac.db.tests.functional import functionalSuite
 
@@ -22,6 +22,7 @@ def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(api.test_suite())
     suite.addTest(mysql_test.test_suite())
+    suite.addTest(pool.test_suite())
     suite.addTest(postgres_test.test_suite())
     suite.addTest(sqlite_test.test_suite())
     suite.addTest(schema.test_suite())
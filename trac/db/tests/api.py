@@ -22,6 +22,8 @@ from trac.db_default import (schema as default_schema,
                              db_version as default_db_version)
 from trac.db.schema import Column, Table
 from trac.test import EnvironmentStub, get_dburi
+from trac.util.concurrency import get_thread_id
+from trac.util.datefmt import time_now
 
 
 class ParseConnectionStringTestCase(unittest.TestCase):
@@ -394,8 +396,32 @@ class DatabaseManagerTestCase(unittest.TestCase):
         self.dbm = DatabaseManager(self.env)
 
     def tearDown(self):
+        self.env.config.remove('trac', 'database_replicas')
+        self.dbm._replica_pools = None
+        self.dbm.stick_to_primary(0)
         self.env.reset_db()
 
+    def _setup_replica(self, fail=False):
+        """Make the replica connections come from the primary
+        database, and return the list of replica connections made.
+        """
+        dbm = self.dbm
+        connections = []
+
+        class ReplicaPool(object):
+            def get_cnx(self, timeout=None):
+                if fail:
+                    raise dbm.get_exceptions().OperationalError('down')
+                cnx = dbm.get_connection()
+                connections.append(cnx)
+                return cnx
+
+        self.env.config.set('trac', 'database_replicas',
+                            'postgres://trac@replica/trac')
+        dbm.stick_to_primary(0)
+        dbm._replica_pools = [ReplicaPool()]
+        return connections
+
     def test_destroy_db(self):
         """Database doesn't exist after calling destroy_db."""
         with self.env.db_query as db:
@@ -468,6 +494,109 @@ class DatabaseManagerTestCase(unittest.TestCase):
 
         self.assertEqual(sequence_names, self.dbm.get_sequence_names())
 
+    def test_call_after_commit(self):
+        """Callbacks are called once the outermost transaction has been
+        committed.
+        """
+        called = []
+        with self.env.db_transaction:
+            with self.env.db_transaction:
+                self.dbm.call_after_commit(lambda: called.append(1))
+            self.assertEqual([], called)
+        self.assertEqual([1], called)
+        self.dbm.call_after_commit(lambda: called.append(2))
+        self.assertEqual([1, 2], called)
+
+    def test_replica_connection_without_replicas(self):
+        self.assertIsNone(self.dbm.get_replica_connection())
+
+    def test_replica_connection_unsupported_database(self):
+        scheme = parse_connection_uri(get_dburi())[0]
+        if scheme in ('mysql', 'postgres'):
+            self.skipTest("Database replicas supported by %s" % scheme)
+        self.env.config.set('trac', 'database_replicas',
+                            'postgres://trac@replica/trac')
+        self.assertRaises(ConfigurationError,
+                          self.dbm.get_replica_connection)
+
+    def test_stick_to_primary_after_commit(self):
+        """No replica connection is used after a commit."""
+        self.env.config.set('trac', 'database_replicas',
+                            'postgres://trac@replica/trac')
+        self.env.config.set('trac', 'database_replica_stickiness', 60)
+        timestamps = []
+        self.dbm.stick_to_primary(0, timestamps.append)
+        with self.env.db_transaction:
+            pass
+        self.assertEqual(1, len(timestamps))
+        self.assertAlmostEqual(time_now() + 60, timestamps[0], delta=5)
+        self.assertIsNone(self.dbm.get_replica_connection())
+        self.dbm.shutdown(get_thread_id())
+        self.assertEqual(0, self.dbm._transaction_local.primary_until)
+
+    def test_query_does_not_use_replica(self):
+        """Replicas are only used by `db_replica_query`."""
+        connections = self._setup_replica()
+        with self.env.db_query as db:
+            db("SELECT name FROM " + db.quote('system'))
+            self.assertFalse(self.dbm._transaction_local.replica)
+        self.assertEqual([], connections)
+
+    def test_replica_query_uses_replica(self):
+        """Queries nested in `db_replica_query` use the replica."""
+        connections = self._setup_replica()
+        with self.env.db_replica_query as db:
+            self.assertTrue(self.dbm._transaction_local.replica)
+            self.assertEqual(1, len(connections))
+            self.assertIs(connections[0], db.cnx)
+            with self.env.db_query as db2:
+                self.assertIs(connections[0], db2.cnx)
+        self.assertFalse(self.dbm._transaction_local.replica)
+        self.assertEqual(1, len(connections))
+
+    def test_replica_query_transaction_uses_primary(self):
+        """Transactions and their nested queries don't use the replica
+        of an outer `db_replica_query`."""
+        connections = self._setup_replica()
+        with self.env.db_replica_query:
+            with self.env.db_transaction as db:
+                self.assertIsNot(connections[0], db.cnx)
+                with self.env.db_query as db2:
+                    self.assertIs(db.cnx, db2.cnx)
+        self.assertEqual(1, len(connections))
+
+    def test_replica_query_falls_back_to_primary(self):
+        """The primary database is used if the replica can't be
+        connected to."""
+        self._setup_replica(fail=True)
+        with self.env.db_replica_query as db:
+            self.assertFalse(self.dbm._transaction_local.replica)
+            self.assertEqual(1, db("SELECT COUNT(*) FROM " +
+                                   db.quote('system') +
+                                   " WHERE name='database_version'")[0][0])
+
+    def test_replica_query_sticks_to_primary(self):
+        """The primary database is used after a commit."""
+        connections = self._setup_replica()
+        with self.env.db_transaction:
+            pass
+        with self.env.db_replica_query:
+            self.assertFalse(self.dbm._transaction_local.replica)
+        self.assertEqual([], connections)
+
+    def test_call_after_commit_rollback(self):
+        """Callbacks are discarded when the transaction is rolled back."""
+        called = []
+        try:
+            with self.env.db_transaction:
+                self.dbm.call_after_commit(lambda: called.append(1))
+                raise ValueError()
+        except ValueError:
+            pass
+        with self.env.db_transaction:
+            pass
+        self.assertEqual([], called)
+
 
 class ModifyTableTestCase(unittest.TestCase):
 
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.db.pool import ConnectionPoolBackend, TimeoutError
+
+
+class Connection(object):
+
+    poolable = True
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class Connector(object):
+
+    def __init__(self):
+        self.connections = []
+
+    def get_connection(self, name):
+        cnx = Connection(name)
+        self.connections.append(cnx)
+        return cnx
+
+
+class ConnectionPoolBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = ConnectionPoolBackend(2)
+        self.backend._reaper_pid = -1  # Don't start the reaper thread
+        self.connector = Connector()
+
+    def tearDown(self):
+        self.backend.shutdown()
+
+    def _get_cnx(self, name='db'):
+        return self.backend.get_cnx(self.connector, {'name': name}, 0)
+
+    def test_reuse_thread_connection(self):
+        db1 = self._get_cnx()
+        db2 = self._get_cnx()
+        self.assertIs(db1.cnx, db2.cnx)
+        db2.close()
+        db1.close()
+        stats = self.backend.get_statistics()
+        self.assertEqual(1, stats['checkouts'])
+        self.assertEqual(1, stats['creations'])
+        self.assertEqual(0, stats['active'])
+        self.assertEqual(1, stats['idle'])
+
+    def test_reuse_idle_connection(self):
+        db = self._get_cnx()
+        cnx = db.cnx
+        db.close()
+        db = self._get_cnx()
+        self.assertIs(cnx, db.cnx)
+        db.close()
+        self.assertEqual(1, len(self.connector.connections))
+
+    def test_replace_lru_idle_connection(self):
+        db = self._get_cnx('db1')
+        db.close()
+        db = self._get_cnx('db2')
+        db.close()
+        db = self._get_cnx('db3')
+        db.close()
+        cnx1, cnx2, cnx3 = self.connector.connections
+        self.assertTrue(cnx1.closed)
+        self.assertFalse(cnx2.closed)
+        self.assertFalse(cnx3.closed)
+        stats = self.backend.get_statistics()
+        self.assertEqual(3, stats['creations'])
+        self.assertEqual(1, stats['evictions'])
+        self.assertEqual(2, stats['idle'])
+
+    def test_timeout(self):
+        self.backend._maxsize = 1
+        db = self._get_cnx('db1')
+        self.assertRaises(TimeoutError, self._get_cnx, 'db2')
+        db.close()
+        stats = self.backend.get_statistics()
+        self.assertEqual(1, stats['waits'])
+        self.assertEqual(1, stats['timeouts'])
+
+    def test_reap_idle_connections(self):
+        db = self._get_cnx()
+        db.close()
+        self.backend._reap(60)
+        self.assertFalse(self.connector.connections[0].closed)
+        self.backend._reap(0)
+        self.assertTrue(self.connector.connections[0].closed)
+        stats = self.backend.get_statistics()
+        self.assertEqual(0, stats['idle'])
+        self.assertEqual(1, stats['evictions'])
+
+    def test_shutdown(self):
+        db1 = self._get_cnx('db1')
+        db2 = self._get_cnx('db2')
+        db2.close()
+        self.backend.shutdown()
+        db1.cnx = None  # Already closed by the shutdown
+        self.assertTrue(all(cnx.closed for cnx in self.connector.connections))
+        stats = self.backend.get_statistics()
+        self.assertEqual(0, stats['active'])
+        self.assertEqual(0, stats['idle'])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ConnectionPoolBackendTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
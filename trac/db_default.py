@@ -17,7 +17,7 @@
 from trac.db.schema import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 45
+db_version = 48
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -106,6 +106,18 @@ schema = [
         Column('base_rev'),
         Index(['repos', 'rev', 'path']),
         Index(['repos', 'path', 'rev'])],
+    Table('node_change_path', key=('repos', 'path', 'rev'))[
+        Column('repos', type='int'),
+        Column('path', key_size=255),
+        Column('rev', key_size=40),
+        Column('time', type='int64'),
+        Index(['repos', 'rev']),
+        Index(['repos', 'path', 'time'])],
+    Table('node_annotation', key=('repos', 'path', 'rev'))[
+        Column('repos', type='int'),
+        Column('path', key_size=255),
+        Column('rev', key_size=40),
+        Column('annotations')],
 
     # Ticket system
     Table('ticket', key='id')[
@@ -191,6 +203,26 @@ schema = [
         Column('target'),
         Index(['sid', 'authenticated', 'class']),
         Index(['class', 'realm', 'target'])],
+
+    # Search system
+    Table('search_document', key='id')[
+        Column('id', auto_increment=True),
+        Column('filter'),
+        Column('realm'),
+        Column('resource'),
+        Column('parent_realm'),
+        Column('parent_resource'),
+        Column('time', type='int64'),
+        Column('author'),
+        Column('title'),
+        Column('text'),
+        Index(['realm', 'resource']),
+        Index(['parent_realm', 'parent_resource'])],
+    Table('search_term', key=('term', 'document'))[
+        Column('term'),
+        Column('document', type='int'),
+        Column('weight', type='int'),
+        Index(['document'])],
 ]
 
 
@@ -38,6 +38,7 @@ from trac.config import BoolOption, ChoiceOption, ConfigSection, \
 from trac.core import Component, ComponentManager, ExtensionPoint, \
                       TracBaseError, TracError, implements
 from trac.db.api import (DatabaseManager, QueryContextManager,
+                         ReplicaQueryContextManager,
                          TransactionContextManager, parse_connection_uri)
 from trac.db.convert import copy_tables
 from trac.loader import load_components
@@ -463,6 +464,22 @@ class Environment(Component, ComponentManager):
         """
         return QueryContextManager(self)
 
+    @property
+    def db_replica_query(self):
+        """Return a context manager
+        (`~trac.db.api.ReplicaQueryContextManager`) which can be used
+        like `db_query` to obtain a read-only connection to one of the
+        replicas of the database, see `[trac] database_replicas`.
+
+        It is meant for the expensive read-only queries that can cope
+        with slightly outdated data. A connection to the primary
+        database is returned if no replica is configured or can be
+        connected to.
+
+        :since: 1.3.4
+        """
+        return ReplicaQueryContextManager(self)
+
     @property
     def db_transaction(self):
         """Return a context manager
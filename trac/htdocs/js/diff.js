@@ -107,27 +107,68 @@
         }
   }
 
-  $.documentReady(function($) {
-    $("div.diff h2").each(function() {
-      var switcher = $("<span class='switch'></span>").prependTo(this);
-      var name = $.trim($(this).text());
-      var table = $(this).siblings("table").get(0);
-      if (! table) return;
-      var pre = $('<pre class="diff">').hide().insertAfter(table);
-      $("<span>" + _("Tabular") + "</span>").click(function() {
-        $(pre).hide();
-        $(table).show();
-        $(this).addClass("active").siblings("span").removeClass("active");
-        return false;
-      }).addClass("active").appendTo(switcher);
-      $("<span>" + _("Unified") + "</span>").click(function() {
-        $(table).hide();
-        if (!pre.get(0).firstChild) convertDiff(name, table, pre);
-        $(pre).fadeIn("fast")
-        $(this).addClass("active").siblings("span").removeClass("active");
-        return false;
-      }).appendTo(switcher);
+  function addSwitcher() {
+    var switcher = $("<span class='switch'></span>").prependTo(this);
+    var name = $.trim($(this).text());
+    var table = $(this).siblings("table").get(0);
+    if (! table) return;
+    var pre = $('<pre class="diff">').hide().insertAfter(table);
+    $("<span>" + _("Tabular") + "</span>").click(function() {
+      $(pre).hide();
+      $(table).show();
+      $(this).addClass("active").siblings("span").removeClass("active");
+      return false;
+    }).addClass("active").appendTo(switcher);
+    $("<span>" + _("Unified") + "</span>").click(function() {
+      $(table).hide();
+      if (!pre.get(0).firstChild) convertDiff(name, table, pre);
+      $(pre).fadeIn("fast")
+      $(this).addClass("active").siblings("span").removeClass("active");
+      return false;
+    }).appendTo(switcher);
+  }
+
+  // Load the diffs of a file which were not shown inline, e.g. in a large
+  // changeset, and insert them at the position of the file in the list
+  function loadDiff() {
+    var link = $(this);
+    if (link.hasClass("loading"))
+      return false;
+    link.addClass("loading");
+    $.ajax({
+      url: this.href, data: {annotate: link.data("path")}, dataType: "html",
+      success: function(html) {
+        var index = link.data("index");
+        var entries = $("<div>").html(html).find("div.diff li.entry");
+        var diff = $("#content > div.diff > div.diff");
+        var list = diff.children("ul.entries");
+        if (!list.length)
+          list = $("<ul class='entries'></ul>").prependTo(diff);
+        var next = list.children("li.entry").filter(function() {
+          var id = $(this).children("h2").attr("id");
+          return id && parseInt(id.slice(4)) > index;
+        }).first();
+        entries.each(function() {
+          var h2 = $(this).children("h2").attr("id", "file" + index);
+          if (next.length)
+            $(this).insertBefore(next);
+          else
+            $(this).appendTo(list);
+          h2.each(addSwitcher);
+        });
+        link.attr("href", "#file" + index).off("click", loadDiff)
+            .removeClass("loading");
+      },
+      error: function() {
+        link.removeClass("loading");
+      }
     });
+    return false;
+  }
+
+  $.documentReady(function($) {
+    $("div.diff h2").each(addSwitcher);
+    $("a.trac-load-diff").click(loadDiff);
   });
 
 })(jQuery);
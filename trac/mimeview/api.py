@@ -528,6 +528,18 @@ class IHTMLPreviewRenderer(Interface):
 
         """
 
+    def prerender(mimetype, content):
+        """Prepare the rendering of the `content` unicode string ahead
+        of time, for renderers caching their output.
+
+        This is an optional method. It is called in a background thread
+        for the files changed by the changesets added to the
+        repositories, when `[browser] prerender` is enabled, so that
+        they are already rendered when first viewed.
+
+        :since: 1.3.4
+        """
+
 
 class IHTMLPreviewAnnotator(Interface):
     """Extension point interface for components that can annotate an XHTML
@@ -12,9 +12,11 @@
 
 from __future__ import absolute_import
 
+import hashlib
 import io
 import os
 import re
+import zlib
 from datetime import datetime
 from pkg_resources import resource_filename
 
@@ -25,25 +27,32 @@ from pygments.styles import get_all_styles, get_style_by_name
 
 from trac.api import ISystemInfoProvider
 from trac.core import *
-from trac.config import ConfigSection, ListOption, Option
+from trac.config import ConfigSection, IntOption, ListOption, Option
 from trac.mimeview.api import IHTMLPreviewRenderer, Mimeview
 from trac.prefs import IPreferencePanelProvider
-from trac.util import get_pkginfo, lazy
-from trac.util.datefmt import http_date, localtz
+from trac.util import AtomicFile, get_pkginfo, lazy
+from trac.util.concurrency import threading
+from trac.util.datefmt import http_date, localtz, time_now
 from trac.util.html import Markup
+from trac.util.text import exception_to_unicode, to_utf8
 from trac.util.translation import _
 from trac.web.api import IRequestHandler, HTTPNotFound
 from trac.web.chrome import ITemplateProvider, add_notice, add_stylesheet
 
 __all__ = ['PygmentsRenderer']
 
+# Minimum length of the content for its highlighting to be cached
+_CACHE_MIN_LENGTH = 8192
+_CACHE_SUFFIX = '.html.z'
+# Maximum number of seconds between two scans of the cache directory
+_CACHE_PRUNE_INTERVAL = 300
+
 
 class PygmentsRenderer(Component):
     """HTML renderer for syntax highlighting based on Pygments."""
 
     implements(ISystemInfoProvider, IHTMLPreviewRenderer,
-               IPreferencePanelProvider, IRequestHandler,
-               ITemplateProvider)
+               IPreferencePanelProvider, IRequestHandler, ITemplateProvider)
 
     is_valid_default_handler = False
 
@@ -79,6 +88,17 @@ class PygmentsRenderer(Component):
         to override the default quality ratio used by the
         Pygments render.""")
 
+    pygments_cache_size = IntOption('mimeviewer', 'pygments_cache_size',
+                                    52428800,
+        """Maximum total size in bytes of the highlighted files kept
+        in the `files/pygments` directory of the environment. The
+        highlighting of a file is cached by its content, lexer and
+        lexer options, so that the file doesn't need to be highlighted
+        again when viewed again. The least recently used files are
+        removed when the limit is exceeded. Use `0` to disable the
+        cache. (''since 1.3.4'')
+        """)
+
     expand_tabs = True
     returns_source = True
 
@@ -99,6 +119,11 @@ class PygmentsRenderer(Component):
   </body>
 </html>"""
 
+    def __init__(self):
+        self._cache_lock = threading.Lock()
+        self._cache_usage = None
+        self._cache_pruned = 0
+
     # ISystemInfoProvider methods
 
     def get_system_info(self):
@@ -131,6 +156,14 @@ class PygmentsRenderer(Component):
             raise Exception("No Pygments lexer found for mime-type '%s'."
                             % mimetype)
 
+    def prerender(self, mimetype, content):
+        """Highlight `content` if its highlighting would be cached, so
+        that it is already cached when the content is first viewed.
+        """
+        if self.pygments_cache_size > 0 and \
+                len(content) >= _CACHE_MIN_LENGTH and mimetype in self._types:
+            self._generate(self._types[mimetype][0], content)
+
     # IPreferencePanelProvider methods
 
     def get_preference_panels(self, req):
@@ -247,13 +280,97 @@ class PygmentsRenderer(Component):
         lexer_options.update(self._lexer_options.get(lexer_name, {}))
         if context:
             lexer_options.update(context.get_hint('lexer_options', {}))
+        path = self._get_cache_path(lexer_name, lexer_options, content)
+        if path:
+            html = self._read_cache(path)
+            if html is not None:
+                return Markup(html)
         lexer = get_lexer_by_name(lexer_name, **lexer_options)
         out = io.StringIO()
         # Specify `lineseparator` to workaround exception with Pygments 2.2.0:
         # "TypeError: unicode argument expected, got 'str'" with newline input
         formatter = HtmlFormatter(nowrap=True, lineseparator=u'\n')
         formatter.format(lexer.get_tokens(content), out)
-        return Markup(out.getvalue())
+        html = out.getvalue()
+        if path:
+            self._write_cache(path, html)
+        return Markup(html)
 
     def _lexer_alias_to_name(self, alias):
         return self._lexer_alias_name_map.get(alias, alias)
+
+    @lazy
+    def _cache_dir(self):
+        return os.path.join(self.env.files_dir, 'pygments')
+
+    def _get_cache_path(self, lexer_name, lexer_options, content):
+        if self.pygments_cache_size <= 0 or \
+                len(content) < _CACHE_MIN_LENGTH or \
+                not os.path.isdir(self.env.files_dir):
+            return None
+        key = hashlib.sha1(repr((pygments.__version__, lexer_name,
+                                 sorted(lexer_options.iteritems()))))
+        key.update(to_utf8(content))
+        return os.path.join(self._cache_dir, key.hexdigest() + _CACHE_SUFFIX)
+
+    def _read_cache(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+            return zlib.decompress(data).decode('utf-8')
+        except (IOError, OSError, UnicodeDecodeError, zlib.error):
+            return None
+
+    def _write_cache(self, path, html):
+        data = zlib.compress(html.encode('utf-8'))
+        try:
+            if not os.path.isdir(self._cache_dir):
+                os.mkdir(self._cache_dir)
+            with AtomicFile(path, 'wb') as f:
+                f.write(data)
+        except (IOError, OSError) as e:
+            self.log.warning("Unable to cache the highlighted file %s: %s",
+                             path, exception_to_unicode(e))
+            return
+        # The size of the cache is estimated from the files written by
+        # this process since the last scan of the cache directory. The
+        # directory is scanned again when the estimate exceeds the limit
+        # or, to account for the files written by the other processes,
+        # when the last scan is too old.
+        with self._cache_lock:
+            now = time_now()
+            if self._cache_usage is not None:
+                self._cache_usage += len(data)
+            if self._cache_usage is None or \
+                    self._cache_usage > self.pygments_cache_size or \
+                    now - self._cache_pruned > _CACHE_PRUNE_INTERVAL:
+                self._cache_usage = self._prune_cache()
+                self._cache_pruned = now
+
+    def _prune_cache(self):
+        """Remove the least recently used files until the total size of
+        the cache is within the limit, and return that size.
+        """
+        entries = []
+        try:
+            names = os.listdir(self._cache_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if name.endswith(_CACHE_SUFFIX):
+                try:
+                    st = os.stat(os.path.join(self._cache_dir, name))
+                except OSError:
+                    continue  # removed by another process
+                entries.append((st.st_mtime, st.st_size, name))
+        total_size = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total_size <= self.pygments_cache_size:
+                break
+            try:
+                os.unlink(os.path.join(self._cache_dir, name))
+            except OSError:
+                pass
+            total_size -= size
+        return total_size
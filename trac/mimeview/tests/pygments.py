@@ -18,10 +18,11 @@ import re
 import sys
 import textwrap
 import unittest
+import zlib
 from pkg_resources import parse_version
 
 from trac.mimeview.api import LineNumberAnnotator, Mimeview
-from trac.test import EnvironmentStub, MockRequest
+from trac.test import EnvironmentStub, MockRequest, mkdtemp
 from trac.util import get_pkginfo
 from trac.web.chrome import Chrome, web_context
 from trac.wiki.formatter import format_to_html
@@ -260,10 +261,83 @@ class PygmentsRendererTestCase(unittest.TestCase):
                          mimeview.get_mimetype('file.text/x-ini'))
 
 
+class PygmentsCacheTestCase(unittest.TestCase):
+
+    content = u'def f(x):\n    return x * 2\n' * 400
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[Chrome, PygmentsRenderer],
+                                   path=mkdtemp())
+        os.mkdir(self.env.files_dir)
+        self.renderer = PygmentsRenderer(self.env)
+        self.context = web_context(MockRequest(self.env))
+        self.cache_dir = os.path.join(self.env.files_dir, 'pygments')
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _render(self, content):
+        return self.renderer.render(self.context, 'text/x-python', content)
+
+    def test_cached(self):
+        result = self._render(self.content)
+        self.assertIn('<span class="k">def</span>', result)
+        names = os.listdir(self.cache_dir)
+        self.assertEqual(1, len(names))
+        path = os.path.join(self.cache_dir, names[0])
+        with open(path, 'rb') as f:
+            self.assertEqual(result, zlib.decompress(f.read()))
+
+        with open(path, 'wb') as f:
+            f.write(zlib.compress('<cached/>'))
+        self.assertEqual('<cached/>', self._render(self.content))
+
+    def test_small_content_not_cached(self):
+        self.assertTrue(self._render(u'def f(x):\n    return x * 2\n'))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_cache_disabled(self):
+        self.env.config.set('mimeviewer', 'pygments_cache_size', 0)
+        self.assertTrue(self._render(self.content))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_cache_pruned(self):
+        self.assertTrue(self._render(self.content))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        self.env.config.set('mimeviewer', 'pygments_cache_size', 1)
+        self.assertTrue(self._render(self.content + u'\n'))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_cache_scanned_when_size_exceeded(self):
+        scans = []
+        prune_cache = self.renderer._prune_cache
+
+        def _prune_cache():
+            scans.append(len(os.listdir(self.cache_dir)))
+            return prune_cache()
+
+        self.renderer._prune_cache = _prune_cache
+        self.assertTrue(self._render(self.content))
+        self.assertTrue(self._render(self.content + u'\n'))
+        self.assertEqual([1], scans)
+        self.env.config.set('mimeviewer', 'pygments_cache_size', 1)
+        self.assertTrue(self._render(self.content + u'\n\n'))
+        self.assertEqual([1, 3], scans)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_prerender(self):
+        self.renderer.prerender('text/x-python', self.content)
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        self.renderer.prerender('text/x-python', u'def f(x):\n')
+        self.renderer.prerender('image/png', self.content + u'\n')
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+
 def test_suite():
     suite = unittest.TestSuite()
     if pygments:
         suite.addTest(unittest.makeSuite(PygmentsRendererTestCase))
+        suite.addTest(unittest.makeSuite(PygmentsCacheTestCase))
     else:
         print('SKIP: mimeview/tests/pygments (no pygments installed)')
     return suite
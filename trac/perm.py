@@ -163,6 +163,23 @@ class IPermissionPolicy(Interface):
         this will probably change in the future (e.g. `'VIEW' in ...`).
         """
 
+    def check_permissions(action, username, resources, perm):
+        """Check that the action can be performed by username on each
+        of the resources.
+
+        This method is optional. Policies can implement it when they
+        can decide for many resources at once more efficiently than by
+        calling `check_permission` for each resource, which is what
+        happens when it isn't implemented.
+
+        :param perm: the permission cache for that username.
+
+        :return: a list with one decision per resource, with the same
+                 meaning as the return value of `check_permission`.
+
+        :since: 1.3.4
+        """
+
 
 class DefaultPermissionStore(Component):
     """Default implementation of permission storage and group management.
@@ -289,39 +306,67 @@ class DefaultPermissionGroupProvider(Component):
 
 
 class DefaultPermissionPolicy(Component):
-    """Default permission policy using the IPermissionStore system."""
+    """Default permission policy using the IPermissionStore system.
+
+    The permissions of each user are cached and shared by the threads
+    of the process. The cache is cleared in all the processes when a
+    permission is granted or revoked through the `PermissionSystem`.
+    """
 
     implements(IPermissionPolicy)
 
-    # Number of seconds a cached user permission set is valid for.
-    CACHE_EXPIRY = 5
-    # How frequently to clear the entire permission cache
-    CACHE_REAP_TIME = 60
+    # Number of seconds a cached user permission set is valid for. This
+    # only matters for permission stores and group providers which
+    # don't use the `PermissionSystem` to grant and revoke permissions.
+    CACHE_EXPIRY = 300
 
     def __init__(self):
-        self.permission_cache = {}
-        self.last_reap = time_now()
+        self._last_reap = time_now()
 
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
-        now = time_now()
+        return action in self._get_user_permissions(username) or None
 
-        if now - self.last_reap > self.CACHE_REAP_TIME:
-            self.permission_cache = {}
-            self.last_reap = time_now()
+    def check_permissions(self, action, username, resources, perm):
+        # The decision doesn't depend on the resource
+        decision = action in self._get_user_permissions(username) or None
+        return [decision] * len(resources)
 
-        timestamp, permissions = \
-            self.permission_cache.get(username, (0, None))
+    def invalidate_cache(self):
+        """Clear the cached user permissions in all the processes.
+
+        :since: 1.3.4
+        """
+        del self.permission_cache
+
+    @cached
+    def permission_cache(self):
+        # Filled lazily by `_get_user_permissions`, a new dict is
+        # created when the cache is invalidated.
+        return {}
+
+    def _get_user_permissions(self, username):
+        now = time_now()
+        permission_cache = self.permission_cache
+
+        timestamp, permissions = permission_cache.get(username, (0, None))
 
         # Cache hit?
         if now - timestamp > self.CACHE_EXPIRY:
             # No, pull permissions from database.
             permissions = PermissionSystem(self.env). \
                           get_user_permissions(username)
-            self.permission_cache[username] = (now, permissions)
+            if now - self._last_reap > self.CACHE_EXPIRY:
+                # Remove the expired entries, as the cache is only
+                # cleared when the permissions are changed
+                self._last_reap = now
+                for name, (timestamp, perms) in permission_cache.items():
+                    if now - timestamp > self.CACHE_EXPIRY:
+                        permission_cache.pop(name, None)
+            permission_cache[username] = (now, permissions)
 
-        return action in permissions or None
+        return permissions
 
 
 class PermissionSystem(Component):
@@ -386,11 +431,13 @@ class PermissionSystem(Component):
                 raise PermissionExistsError(
                     _("The user %(user)s is already in the group %(group)s.",
                       user=username, group=action))
+        DefaultPermissionPolicy(self.env).invalidate_cache()
 
     def revoke_permission(self, username, action):
         """Revokes the permission of the specified user to perform an
         action."""
         self.store.revoke_permission(username, action)
+        DefaultPermissionPolicy(self.env).invalidate_cache()
 
     def get_actions_dict(self, skip=None):
         """Get all actions from permission requestors as a `dict`.
@@ -569,6 +616,51 @@ class PermissionSystem(Component):
                        username, action, resource)
         return False
 
+    def check_permissions(self, action, username=None, resources=(),
+                          perm=None):
+        """Return a list telling for each of the `resources` whether
+        permission to perform action is allowed.
+
+        Policies implementing `check_permissions` decide for all the
+        pending resources at once, the other ones are called for each
+        resource.
+
+        :since: 1.3.4
+        """
+        if username is None:
+            username = 'anonymous'
+        if perm is None:
+            perm = PermissionCache(self.env, username)
+        resources = [None if resource and resource.realm is None
+                     else resource for resource in resources]
+        decisions = [None] * len(resources)
+        pending = range(len(resources))
+        for policy in self.policies:
+            if not pending:
+                break
+            if hasattr(policy, 'check_permissions'):
+                results = policy.check_permissions(
+                    action, username, [resources[idx] for idx in pending],
+                    perm)
+            else:
+                results = [policy.check_permission(action, username,
+                                                   resources[idx],
+                                                   perm(resources[idx]))
+                           for idx in pending]
+            undecided = []
+            for idx, decision in zip(pending, results):
+                if decision is None:
+                    undecided.append(idx)
+                else:
+                    decisions[idx] = decision
+            if len(undecided) != len(pending):
+                self.log.debug("%s decided %s performing %s on %d of %d "
+                               "resources", policy.__class__.__name__,
+                               username, action,
+                               len(pending) - len(undecided), len(pending))
+            pending = undecided
+        return [bool(decision) for decision in decisions]
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
@@ -670,6 +762,47 @@ class PermissionCache(object):
 
     __contains__ = has_permission
 
+    def filter(self, action, resources):
+        """Return the resources of the `resources` sequence on which
+        `action` is allowed, in the same order.
+
+        The decisions are shared with the other checks made through
+        this permission cache, like `'TICKET_VIEW' in perm(resource)`,
+        and the policies can check all the resources at once.
+
+        :since: 1.3.4
+        """
+        resources = list(resources)
+        decisions = [None] * len(resources)
+        # Each distinct uncached resource is checked once, in order of
+        # first occurrence, and its decision applies to all occurrences.
+        unchecked = []
+        indices = {}
+        for idx, resource in enumerate(resources):
+            key = (self.username, hash(resource), action)
+            cached = self._cache.get(key)
+            if cached and resource == cached[1]:
+                decisions[idx] = cached[0]
+            elif (key, resource) in indices:
+                indices[(key, resource)].append(idx)
+            else:
+                unchecked.append((key, resource))
+                indices[(key, resource)] = [idx]
+        if unchecked:
+            # Avoid recursion in policies that call has_permission.
+            for key, resource in unchecked:
+                self._cache[key] = (False, resource)
+            perm = PermissionCache(self.env, self.username, None, self._cache)
+            results = PermissionSystem(self.env).check_permissions(
+                action, self.username,
+                [resource for key, resource in unchecked], perm)
+            for (key, resource), decision in zip(unchecked, results):
+                self._cache[key] = (decision, resource)
+                for idx in indices[(key, resource)]:
+                    decisions[idx] = decision
+        return [resource for resource, decision in zip(resources, decisions)
+                if decision]
+
     def require(self, action, realm_or_resource=None, id=False, version=False,
                 message=None):
         resource = self._normalize_resource(realm_or_resource, id, version)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+
+from trac.admin import IAdminCommandProvider
+from trac.core import *
+from trac.search.index import SearchIndex
+from trac.util.text import printout
+from trac.util.translation import _, ngettext
+
+
+class SearchAdmin(Component):
+    """trac-admin command provider for the search index.
+
+    :since: 1.3.4
+    """
+
+    implements(IAdminCommandProvider)
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('search reindex', '',
+               """Rebuild the search index
+
+               The index is used for searching when the `[search] use_index`
+               option is enabled.""",
+               None, self._do_reindex)
+
+    def _do_reindex(self):
+        printout(_("Rebuilding the search index..."))
+        count = SearchIndex(self.env).reindex()
+        printout(ngettext("%(num)s document indexed.",
+                          "%(num)s documents indexed.", num=count))
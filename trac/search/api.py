@@ -12,6 +12,7 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import re
+from collections import namedtuple
 
 from trac.core import *
 
@@ -41,6 +42,53 @@ class ISearchSource(Interface):
         """
 
 
+class SearchDocument(namedtuple('SearchDocument', 'filter resource time '
+                                                  'author title text')):
+    """A resource as stored in the search index.
+
+    `filter` is the name of the search filter the document belongs to,
+    `resource` the `Resource` it describes, `time` a `datetime` (or
+    `None`) and `author`, `title` and `text` the searchable strings.
+    The `text` is also used for building the excerpt of a search
+    result.
+
+    :since: 1.3.4
+    """
+    __slots__ = ()
+
+
+class ISearchIndexSource(Interface):
+    """Extension point interface for search sources whose resources can
+    be stored in the search index.
+
+    An `ISearchSource` implementing this interface is no longer asked
+    for results when the search index is enabled: its filters are
+    answered directly from the index.
+
+    :since: 1.3.4
+    """
+
+    def get_search_index_documents():
+        """Return an iterable of `SearchDocument`s for all the resources
+        of this source, used when rebuilding the index.
+        """
+
+    def get_search_index_document(resource):
+        """Return the `SearchDocument` for `resource`.
+
+        `None` must be returned if the resource is not handled by this
+        source or doesn't exist anymore.
+        """
+
+    def get_search_index_action(resource):
+        """Return the permission action required for viewing `resource`
+        in the search results.
+
+        `resource` is the resource of one of the documents provided by
+        this source.
+        """
+
+
 def search_to_sql(db, columns, terms):
     """Convert a search query into an SQL WHERE clause and corresponding
     parameters.
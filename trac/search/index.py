@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import re
+from collections import Counter
+
+from trac.attachment import IAttachmentChangeListener
+from trac.config import BoolOption
+from trac.core import *
+from trac.resource import Resource
+from trac.search.api import ISearchIndexSource, SearchDocument
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util.datefmt import from_utimestamp, to_utimestamp
+from trac.versioncontrol.api import IRepositoryChangeListener
+from trac.wiki.api import IWikiChangeListener
+
+__all__ = ['SearchIndex']
+
+
+class SearchIndex(Component):
+    """Full-text index of the resources provided by the
+    `ISearchIndexSource`s.
+
+    The index is a plain inverted index stored in the `search_document`
+    and `search_term` tables, so it works the same way on all the
+    supported database backends. Each word of a query term is matched
+    as a prefix of the indexed words, and the matching documents are
+    ranked by the number of occurrences of the words.
+
+    :since: 1.3.4
+    """
+
+    implements(IAttachmentChangeListener, IMilestoneChangeListener,
+               IRepositoryChangeListener, ITicketChangeListener,
+               IWikiChangeListener)
+
+    sources = ExtensionPoint(ISearchIndexSource)
+
+    use_index = BoolOption('search', 'use_index', 'false',
+        """Answer the searches from the search index instead of
+        scanning the tickets, wiki pages, milestones, changesets and
+        attachments. The index is kept up to date as resources change,
+        but it must be built with `trac-admin $ENV search reindex`
+        after enabling this option.
+        (''since 1.3.4'')
+        """)
+
+    max_term_length = 64
+
+    _words_re = re.compile(r'\w+', re.UNICODE)
+
+    def is_indexed(self, source):
+        """Return whether the results of the `ISearchSource` `source`
+        are provided by the index.
+        """
+        return self.use_index and source in self.sources
+
+    def reindex(self):
+        """Rebuild the index from scratch.
+
+        Returns the number of documents indexed.
+        """
+        count = 0
+        with self.env.db_transaction as db:
+            db("DELETE FROM search_term")
+            db("DELETE FROM search_document")
+            for source in self.sources:
+                for doc in source.get_search_index_documents():
+                    self._insert(db, doc)
+                    count += 1
+        return count
+
+    def update(self, resource):
+        """Update the document of `resource`, removing it from the index
+        if it doesn't exist anymore.
+        """
+        doc = None
+        for source in self.sources:
+            doc = source.get_search_index_document(resource)
+            if doc is not None:
+                break
+        with self.env.db_transaction as db:
+            self._delete(db, resource)
+            if doc is not None:
+                self._insert(db, doc)
+
+    def remove(self, resource):
+        """Remove the document of `resource` and of its children (e.g.
+        its attachments) from the index.
+        """
+        with self.env.db_transaction as db:
+            self._delete(db, resource)
+            self._delete_children(db, resource)
+
+    def search(self, terms, filters, offset=0, limit=None):
+        """Return the `SearchDocument`s matching all the `terms`, ranked
+        by relevance and restricted to the given `filters`.
+
+        The result is a `(documents, total)` tuple, where `documents`
+        contains at most `limit` documents starting at `offset` and
+        `total` is the number of matching documents.
+        """
+        words = []
+        for term in terms:
+            for word in self._tokenize(term):
+                if word not in words:
+                    words.append(word)
+        if not words or not filters:
+            return [], 0
+
+        with self.env.db_query as db:
+            matches = ' UNION ALL '.join(["""
+                SELECT document, SUM(weight) AS score FROM search_term
+                WHERE term %s GROUP BY document
+                """ % db.prefix_match()] * len(words))
+            join = """
+                FROM search_document AS d
+                INNER JOIN (SELECT document, SUM(score) AS score
+                            FROM (%s) AS w
+                            GROUP BY document HAVING COUNT(*)=%%s) AS m
+                 ON m.document=d.id
+                WHERE d.filter IN (%s)
+                """ % (matches, ','.join(['%s'] * len(filters)))
+            args = [db.prefix_match_value(word) for word in words]
+            args.append(len(words))
+            args.extend(filters)
+            sql = """
+                SELECT d.filter, d.realm, d.resource, d.parent_realm,
+                       d.parent_resource, d.time, d.author, d.title, d.text
+                """ + join + " ORDER BY m.score DESC, d.time DESC, d.id"
+            if limit is not None:
+                sql += " LIMIT %s OFFSET %s"
+                total = db("SELECT COUNT(*) " + join, args)[0][0]
+                rows = db(sql, args + [limit, offset])
+            else:
+                rows = db(sql, args)
+                total = len(rows)
+
+        docs = []
+        for filter_, realm, id, parent_realm, parent_id, time, author, \
+                title, text in rows:
+            parent = Resource(parent_realm, parent_id) if parent_realm \
+                     else None
+            resource = Resource(realm, id, parent=parent)
+            if time is not None:
+                time = from_utimestamp(time)
+            docs.append(SearchDocument(filter_, resource, time, author,
+                                       title, text))
+        return docs, total
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        if self.use_index:
+            self.update(attachment.resource)
+
+    def attachment_deleted(self, attachment):
+        if self.use_index:
+            self.remove(attachment.resource)
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        if self.use_index:
+            self.remove(Resource(old_parent_realm, old_parent_id)
+                        .child(attachment.realm, old_filename))
+            self.update(attachment.resource)
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        if self.use_index:
+            self.update(milestone.resource)
+
+    def milestone_changed(self, milestone, old_values):
+        if self.use_index:
+            if 'name' in old_values:
+                self.remove(Resource(milestone.realm, old_values['name']))
+            self.update(milestone.resource)
+
+    def milestone_deleted(self, milestone):
+        if self.use_index:
+            self.remove(milestone.resource)
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        if self.use_index:
+            self.update(changeset.resource)
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        if self.use_index:
+            self.update(changeset.resource)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        if self.use_index:
+            self.update(ticket.resource)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        if self.use_index:
+            self.update(ticket.resource)
+
+    def ticket_deleted(self, ticket):
+        if self.use_index:
+            self.remove(ticket.resource)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        if self.use_index:
+            self.update(ticket.resource)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        if self.use_index:
+            self.update(ticket.resource)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        if self.use_index:
+            self.update(page.resource)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        if self.use_index:
+            self.update(page.resource)
+
+    def wiki_page_deleted(self, page):
+        if self.use_index:
+            self.remove(page.resource)
+
+    def wiki_page_version_deleted(self, page):
+        if self.use_index:
+            self.update(page.resource)
+
+    def wiki_page_renamed(self, page, old_name):
+        if self.use_index:
+            self.remove(Resource(page.realm, old_name))
+            self.update(page.resource)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    def _tokenize(self, text):
+        return [word[:self.max_term_length]
+                for word in self._words_re.findall(text.lower())]
+
+    def _insert(self, db, doc):
+        resource = doc.resource
+        parent = resource.parent
+        cursor = db.cursor()
+        cursor.execute("""
+            INSERT INTO search_document (filter, realm, resource,
+                                         parent_realm, parent_resource,
+                                         time, author, title, text)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            """, (doc.filter, resource.realm, unicode(resource.id),
+                  parent.realm if parent else '',
+                  unicode(parent.id) if parent else '',
+                  to_utimestamp(doc.time) if doc.time else None,
+                  doc.author, unicode(doc.title), doc.text))
+        id = db.get_last_id(cursor, 'search_document')
+        weights = Counter(self._tokenize(doc.text or ''))
+        weights.update(self._tokenize(doc.author or ''))
+        cursor.executemany("""
+            INSERT INTO search_term (term, document, weight)
+            VALUES (%s,%s,%s)
+            """, [(term, id, weight) for term, weight in weights.iteritems()])
+
+    def _delete(self, db, resource):
+        parent = resource.parent
+        self._delete_where(db, 'realm=%s AND resource=%s AND '
+                               'parent_realm=%s AND parent_resource=%s',
+                           (resource.realm, unicode(resource.id),
+                            parent.realm if parent else '',
+                            unicode(parent.id) if parent else ''))
+
+    def _delete_children(self, db, resource):
+        self._delete_where(db, 'parent_realm=%s AND parent_resource=%s',
+                           (resource.realm, unicode(resource.id)))
+
+    def _delete_where(self, db, where, args):
+        db("""DELETE FROM search_term WHERE document IN (
+                SELECT id FROM search_document WHERE %s)
+           """ % where, args)
+        db("DELETE FROM search_document WHERE " + where, args)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+
+import io
+import unittest
+
+from trac.attachment import Attachment
+from trac.search.index import SearchIndex
+from trac.test import EnvironmentStub, mkdtemp
+from trac.ticket.model import Milestone
+from trac.ticket.test import insert_ticket
+from trac.wiki.model import WikiPage
+
+
+class SearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(path=mkdtemp())
+        self.env.config.set('search', 'use_index', 'enabled')
+        self.index = SearchIndex(self.env)
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def _search(self, terms, filters=('ticket', 'wiki', 'milestone'),
+                **kwargs):
+        docs, total = self.index.search(terms, list(filters), **kwargs)
+        return [(doc.resource.realm, doc.resource.id) for doc in docs], total
+
+    def test_reindex(self):
+        self.env.config.set('search', 'use_index', 'disabled')
+        insert_ticket(self.env, summary='Crash on startup', reporter='joe')
+        self._insert_page('WikiStart', 'Welcome to the startup page')
+        self.assertEqual(([], 0), self._search(['startup']))
+
+        self.assertEqual(2, self.index.reindex())
+        self.assertEqual(2, self._search(['startup'])[1])
+        self.assertEqual(([('ticket', '1')], 1),
+                         self._search(['startup'], filters=['ticket']))
+
+    def test_prefix_match(self):
+        insert_ticket(self.env, summary='Crash on startup')
+        self.assertEqual(([('ticket', '1')], 1), self._search(['start']))
+        self.assertEqual(([], 0), self._search(['tart']))
+
+    def test_all_words_required(self):
+        insert_ticket(self.env, summary='Crash on startup')
+        insert_ticket(self.env, summary='Crash on shutdown')
+        self.assertEqual(2, self._search(['crash'])[1])
+        self.assertEqual(([('ticket', '2')], 1),
+                         self._search(['crash', 'shutdown']))
+        self.assertEqual(([('ticket', '2')], 1),
+                         self._search(['"crash on shutdown"']))
+
+    def test_ranking(self):
+        insert_ticket(self.env, summary='Crash', description='Other')
+        insert_ticket(self.env, summary='Crash', description='Crash crash')
+        self.assertEqual([('ticket', '2'), ('ticket', '1')],
+                         self._search(['crash'])[0])
+
+    def test_limit_and_offset(self):
+        for i in xrange(5):
+            insert_ticket(self.env, summary='Crash ' * (i + 1))
+        self.assertEqual(([('ticket', '3'), ('ticket', '2')], 5),
+                         self._search(['crash'], offset=2, limit=2))
+
+    def test_ticket_comment_and_delete(self):
+        ticket = insert_ticket(self.env, summary='Crash')
+        ticket.save_changes('joe', 'Happens with the xyzzy plugin')
+        self.assertEqual(([('ticket', '1')], 1), self._search(['xyzzy']))
+
+        ticket.delete()
+        self.assertEqual(([], 0), self._search(['xyzzy']))
+
+    def test_wiki_page_renamed(self):
+        page = self._insert_page('SandBox', 'Some xyzzy text')
+        page.rename('PlayGround')
+        self.assertEqual(([('wiki', 'PlayGround')], 1),
+                         self._search(['xyzzy']))
+
+    def test_milestone_renamed(self):
+        milestone = Milestone(self.env)
+        milestone.name = 'milestone1'
+        milestone.description = 'Some xyzzy text'
+        milestone.insert()
+        milestone.name = 'milestone5'
+        milestone.update()
+        self.assertEqual(([('milestone', 'milestone5')], 1),
+                         self._search(['xyzzy']))
+
+    def test_attachment(self):
+        self._insert_page('WikiStart', 'Welcome')
+        attachment = Attachment(self.env, 'wiki', 'WikiStart')
+        attachment.description = 'The xyzzy logs'
+        attachment.insert('crash.log', io.BytesIO(), 0)
+        docs, total = self.index.search(['xyzzy'], ['wiki'])
+        self.assertEqual(1, total)
+        self.assertEqual(('attachment', 'crash.log', 'wiki', 'WikiStart'),
+                         (docs[0].resource.realm, docs[0].resource.id,
+                          docs[0].resource.parent.realm,
+                          docs[0].resource.parent.id))
+
+        attachment.delete()
+        self.assertEqual(([], 0), self._search(['xyzzy']))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SearchIndexTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -15,6 +15,12 @@ import os
 import pkg_resources
 import unittest
 
+from trac.core import Component, ComponentMeta, implements
+from trac.perm import IPermissionPolicy, PermissionSystem
+from trac.resource import Resource
+from trac.search.api import ISearchIndexSource, ISearchSource, \
+                            SearchDocument
+from trac.search.index import SearchIndex
 from trac.search.web_ui import SearchModule
 from trac.test import EnvironmentStub, MockRequest
 from trac.ticket.model import Ticket
@@ -66,6 +72,118 @@ class SearchModuleTestCase(unittest.TestCase):
         self.assertIn("Page 3 is out of range.", req.chrome['warnings'])
         self.assertEqual(0, data['results'].page)
 
+    def test_process_request_page_in_range_with_index(self):
+        self.env.config.set('search', 'use_index', 'enabled')
+        for _ in xrange(21):
+            self._insert_ticket(summary="Trac")
+        req = MockRequest(self.env,
+                          args={'page': '3', 'q': 'Trac', 'ticket': 'on'})
+
+        data = self.search_module.process_request(req)[1]
+
+        self.assertEqual([], req.chrome['warnings'])
+        self.assertEqual(2, data['results'].page)
+        self.assertEqual(21, data['results'].num_items)
+        self.assertEqual(['/trac.cgi/ticket/1'],
+                         [r['href'] for r in data['results']])
+
+    def test_process_request_page_out_of_range_with_index(self):
+        """Out of range value for page defaults to page 1."""
+        self.env.config.set('search', 'use_index', 'enabled')
+        for _ in xrange(20):
+            self._insert_ticket(summary="Trac")
+        req = MockRequest(self.env,
+                          args={'page': '3', 'q': 'Trac', 'ticket': 'on'})
+
+        data = self.search_module.process_request(req)[1]
+
+        self.assertIn("Page 3 is out of range.", req.chrome['warnings'])
+        self.assertEqual(0, data['results'].page)
+        self.assertEqual(10, len(data['results']))
+
+    def test_process_request_with_index_source_action(self):
+        """The indexed sources tell which action is required for viewing
+        their documents."""
+        class ArticleModule(Component):
+            implements(ISearchIndexSource, ISearchSource)
+
+            def get_search_filters(self, req):
+                yield ('article', "Articles")
+
+            def get_search_results(self, req, terms, filters):
+                return []
+
+            def get_search_index_documents(self):
+                yield SearchDocument('article', Resource('article', 'Trac'),
+                                     None, 'joe', "Trac", "About Trac")
+
+            def get_search_index_document(self, resource):
+                return None
+
+            def get_search_index_action(self, resource):
+                return 'WIKI_VIEW'
+
+        try:
+            self.env.config.set('search', 'use_index', 'enabled')
+            SearchIndex(self.env).reindex()
+            PermissionSystem(self.env).grant_permission('joe', 'SEARCH_VIEW')
+            PermissionSystem(self.env).grant_permission('joe', 'WIKI_VIEW')
+            req = MockRequest(self.env, authname='joe',
+                              args={'q': 'Trac', 'article': 'on'})
+
+            data = self.search_module.process_request(req)[1]
+
+            self.assertEqual(1, data['results'].num_items)
+            self.assertEqual(['/trac.cgi/article/Trac'],
+                             [r['href'] for r in data['results']])
+        finally:
+            ComponentMeta.deregister(ArticleModule)
+
+    def test_process_request_with_index_and_restricted_tickets(self):
+        """The results the user can't view are skipped before paging."""
+        class HiddenTicketPolicy(Component):
+            implements(IPermissionPolicy)
+
+            def check_permission(self, action, username, resource, perm):
+                if action == 'TICKET_VIEW' and resource and \
+                        resource.realm == 'ticket' and \
+                        resource.id is not None and int(resource.id) % 2 == 0:
+                    return False
+
+        try:
+            self.env.config.set('trac', 'permission_policies',
+                                'HiddenTicketPolicy, DefaultPermissionPolicy')
+            self.env.config.set('search', 'use_index', 'enabled')
+            for _ in xrange(30):
+                self._insert_ticket(summary="Trac")
+            PermissionSystem(self.env).grant_permission('joe', 'SEARCH_VIEW')
+            PermissionSystem(self.env).grant_permission('joe', 'TICKET_VIEW')
+
+            def search(page):
+                req = MockRequest(self.env, authname='joe',
+                                  args={'page': str(page), 'q': 'Trac',
+                                        'ticket': 'on'})
+                return req, self.search_module.process_request(req)[1]
+
+            req, data = search(1)
+            hrefs = [r['href'] for r in data['results']]
+            self.assertEqual(10, len(hrefs))
+            self.assertTrue(data['results'].has_next_page)
+            req, data = search(2)
+            hrefs.extend(r['href'] for r in data['results'])
+            self.assertEqual([], req.chrome['warnings'])
+            self.assertEqual(5, len(data['results']))
+            self.assertEqual(15, data['results'].num_items)
+            self.assertFalse(data['results'].has_next_page)
+            self.assertEqual(sorted('/trac.cgi/ticket/%d' % id
+                                    for id in xrange(1, 31, 2)),
+                             sorted(hrefs))
+            req, data = search(3)
+            self.assertIn("Page 3 is out of range.", req.chrome['warnings'])
+            self.assertEqual(10, len(data['results']))
+        finally:
+            ComponentMeta.deregister(HiddenTicketPolicy)
+
     def test_camelcase_quickjump(self):
         """CamelCase word does quick-jump."""
         req = MockRequest(self.env, args={'q': 'WikiStart'})
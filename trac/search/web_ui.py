@@ -20,8 +20,10 @@ import re
 from trac.config import IntOption, ListOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
-from trac.search.api import ISearchSource
-from trac.util.datefmt import format_datetime, user_time
+from trac.resource import get_resource_url
+from trac.search.api import ISearchSource, shorten_result
+from trac.search.index import SearchIndex
+from trac.util.datefmt import datetime_now, format_datetime, user_time, utc
 from trac.util.html import Markup, escape, find_element, tag
 from trac.util.presentation import Paginator
 from trac.util.text import quote_query_string
@@ -106,9 +108,12 @@ class SearchModule(Component):
 
             terms = self._parse_query(req, query)
             if terms:
-                results = self._do_search(req, terms, filters)
-                if results:
-                    data.update(self._prepare_results(req, filters, results))
+                with self.env.db_replica_query:
+                    results, num_items = self._do_search(req, terms,
+                                                         filters)
+                if results or num_items:
+                    data.update(self._prepare_results(req, filters, results,
+                                                      num_items))
             if noquickjump and filters:
                 req.session['search.filters'] = ','.join(filters)
 
@@ -132,6 +137,7 @@ class SearchModule(Component):
         yield ('search', self._format_link)
 
     def _format_link(self, formatter, ns, target, label):
+        formatter.depends_on()
         path, query, fragment = formatter.split_link(target)
         if path:
             href = formatter.href.search(q=path)
@@ -230,16 +236,115 @@ class SearchModule(Component):
                            num=self.min_query_length))
 
     def _do_search(self, req, terms, filters):
+        """Return a `(results, num_items)` tuple.
+
+        When all the selected filters are answered by the search index,
+        only the results of the requested page are returned and
+        `num_items` is the number of results, as computed by
+        `_get_index_page`. Otherwise, all the results are returned,
+        sorted by date, and `num_items` is `None`.
+        """
+        index = SearchIndex(self.env)
         results = []
+        index_sources = {}
         for source in self.search_sources:
-            results.extend(source.get_search_results(req, terms, filters)
-                           or [])
-        return sorted(results, key=lambda x: x[2], reverse=True)
+            if index.is_indexed(source):
+                for f in source.get_search_filters(req) or []:
+                    if f[0] in filters:
+                        index_sources[f[0]] = source
+            else:
+                results.extend(source.get_search_results(req, terms, filters)
+                               or [])
+        if not index_sources:
+            return sorted(results, key=lambda x: x[2], reverse=True), None
+        index_filters = list(index_sources)
+        if results:
+            docs, num_items = index.search(terms, index_filters)
+            docs = self._filter_index_documents(req, index_sources, docs)
+            results.extend(self._get_index_results(req, terms, docs))
+            return sorted(results, key=lambda x: x[2], reverse=True), None
 
-    def _prepare_results(self, req, filters, results):
+        page = req.args.getint('page', 1, min=1)
+        results, num_items = self._get_index_page(req, index, terms,
+                                                  index_sources, page)
+        if num_items and not results:
+            add_warning(req, _("Page %(page)s is out of range.", page=page))
+            req.args['page'] = '1'
+            results, num_items = self._get_index_page(req, index, terms,
+                                                      index_sources, 1)
+        return results, num_items
+
+    def _get_index_page(self, req, index, terms, index_sources, page):
+        """Return the results of `page` that the user is allowed to view
+        and the number of results, as a `(results, num_items)` tuple.
+
+        The documents are read from the index in batches until enough
+        viewable results are collected, as the user may not be allowed
+        to view all the matching documents. The total number of results
+        is only known when all the matching documents were read and
+        none was skipped. Otherwise, `num_items` only tells whether
+        there's a next page, so that the number of documents the user
+        can't view is not disclosed.
+        """
+        per_page = self.RESULTS_PER_PAGE
+        skip = (page - 1) * per_page
+        page_docs = []
+        offset = 0
+        limit = skip + per_page + 1
+        filtered = False
+        while True:
+            docs, total = index.search(terms, list(index_sources), offset,
+                                       limit)
+            viewable = self._filter_index_documents(req, index_sources,
+                                                    docs)
+            if len(viewable) < len(docs):
+                filtered = True
+            page_docs.extend(viewable[skip:])
+            skip = max(0, skip - len(viewable))
+            offset += len(docs)
+            if len(page_docs) > per_page or len(docs) < limit or \
+                    offset >= total:
+                break
+            limit = max(skip + per_page + 1 - len(page_docs), per_page)
+        if offset >= total and not filtered:
+            num_items = total
+        else:
+            num_items = (page - 1) * per_page + len(page_docs)
+        results = self._get_index_results(req, terms, page_docs[:per_page])
+        return list(results), num_items
+
+    def _get_index_results(self, req, terms, docs):
+        """Convert the `SearchDocument`s returned by the search index
+        to search results.
+        """
+        for doc in docs:
+            yield (get_resource_url(self.env, doc.resource, req.href),
+                   doc.title, doc.time or datetime_now(utc), doc.author,
+                   shorten_result(doc.text, terms))
+
+    def _filter_index_documents(self, req, index_sources, docs):
+        """Return the `SearchDocument`s of `docs` the user is allowed to
+        view, in the same order.
+
+        `index_sources` maps the filter names to the
+        `ISearchIndexSource`s providing the documents, which tell the
+        permission action required for viewing each resource.
+        """
+        resources_by_action = {}
+        for doc in docs:
+            source = index_sources[doc.filter]
+            action = source.get_search_index_action(doc.resource)
+            resources_by_action.setdefault(action, []).append(doc.resource)
+        viewable = set()
+        for action, resources in resources_by_action.iteritems():
+            viewable.update(req.perm.filter(action, resources))
+        return [doc for doc in docs if doc.resource in viewable]
+
+    def _prepare_results(self, req, filters, results, num_items=None):
         page = req.args.getint('page', 1, min=1)
         try:
-            results = Paginator(results, page - 1, self.RESULTS_PER_PAGE)
+            results = Paginator(results, page - 1, self.RESULTS_PER_PAGE,
+                                num_items)
         except TracError:
             add_warning(req, _("Page %(page)s is out of range.", page=page))
             page = 1
@@ -142,6 +142,9 @@ class MockPerm(object):
     def __call__(self, realm_or_resource, id=False, version=False):
         return self
 
+    def filter(self, action, resources):
+        return list(resources)
+
     def require(self, action, realm_or_resource=None, id=False, version=False,
                 message=None):
         pass
@@ -381,6 +384,7 @@ class EnvironmentStub(Environment):
         # -- database
         self.dburi = get_dburi()
         self.config.set('components', 'trac.db.*', 'enabled')
+        self.config.set('components', 'trac.cache.*', 'enabled')
         self.config.set('trac', 'database', self.dburi)
 
         if not destroying:
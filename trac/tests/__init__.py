@@ -13,8 +13,8 @@
 
 import unittest
 
-from trac.tests import attachment, config, core, env, loader, notification, \
-                       perm, resource, wikisyntax, functional
+from trac.tests import attachment, cache, config, core, env, loader, \
+                       notification, perm, resource, wikisyntax, functional
 
 
 def test_suite():
@@ -27,6 +27,7 @@ def test_suite():
 def basicSuite():
     suite = unittest.TestSuite()
     suite.addTest(attachment.test_suite())
+    suite.addTest(cache.test_suite())
     suite.addTest(config.test_suite())
     suite.addTest(core.test_suite())
     suite.addTest(env.test_suite())
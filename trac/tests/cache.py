@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009-2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.cache import CacheManager, SharedMemoryInvalidationTransport, \
+                       cached, cached_mapping, fcntl, key_to_id
+from trac.core import Component
+from trac.test import EnvironmentStub, mkdtemp, rmtree
+
+
+class Cacheable(Component):
+
+    def __init__(self):
+        self.retrieved = 0
+
+    @cached
+    def value(self):
+        self.retrieved += 1
+        return self.retrieved
+
+
+class CacheableMapping(Component):
+
+    def __init__(self):
+        self.retrieved = []
+
+    @cached_mapping
+    def value(self, key):
+        self.retrieved.append(key)
+        return key * len(self.retrieved)
+
+
+def _key(cls, attr):
+    return key_to_id('%s.%s.%s' % (cls.__module__, cls.__name__, attr))
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.id = _key(Cacheable, 'value')
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _bump_generation(self):
+        """Invalidate the cached data as another process would do."""
+        with self.env.db_transaction as db:
+            db("UPDATE cache SET generation=generation+1 WHERE id=%s",
+               (self.id,))
+            if not db("SELECT generation FROM cache WHERE id=%s",
+                      (self.id,)):
+                db("INSERT INTO cache VALUES (%s, %s, %s)",
+                   (self.id, 0, 'Cacheable.value'))
+
+    def test_retrieve_once(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        self.assertEqual(1, obj.value)
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(1, obj.value)
+
+    def test_invalidate(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        del obj.value
+        self.assertEqual(2, obj.value)
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(2, obj.value)
+
+    def test_invalidate_in_other_process(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        self._bump_generation()
+        self.assertEqual(1, obj.value)
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(2, obj.value)
+
+    def test_update(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        Cacheable.value.update(obj, lambda value: value + 10)
+        self.assertEqual(11, obj.value)
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(11, obj.value)
+        self.assertEqual(1, obj.retrieved)
+
+    def test_update_outdated(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        self._bump_generation()
+        Cacheable.value.update(obj, lambda value: value + 10)
+        self.assertEqual(2, obj.value)
+
+    def test_update_rolled_back(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        try:
+            with self.env.db_transaction:
+                Cacheable.value.update(obj, lambda value: value + 10)
+                raise ValueError
+        except ValueError:
+            pass
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(2, obj.value)
+
+
+class CachedMappingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.obj = CacheableMapping(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_retrieve_per_key(self):
+        self.assertEqual('a', self.obj.value['a'])
+        self.assertEqual('bb', self.obj.value['b'])
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual('a', self.obj.value['a'])
+        self.assertEqual('bb', self.obj.value['b'])
+        self.assertEqual(['a', 'b'], self.obj.retrieved)
+
+    def test_invalidate_one_key(self):
+        self.assertEqual('a', self.obj.value['a'])
+        self.assertEqual('bb', self.obj.value['b'])
+        del self.obj.value['a']
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual('aaa', self.obj.value['a'])
+        self.assertEqual('bb', self.obj.value['b'])
+        self.assertEqual(['a', 'b', 'a'], self.obj.retrieved)
+
+    def test_colliding_keys(self):
+        """Keys having the same id don't get each other's data."""
+        ids = CacheableMapping.value.ids
+        ids['b'] = CacheableMapping.value.make_id(CacheableMapping, 'a')
+        try:
+            self.assertEqual('a', self.obj.value['a'])
+            self.assertEqual('bb', self.obj.value['b'])
+            self.assertEqual('a', self.obj.value['a'])
+            self.assertEqual('bbb', self.obj.value['b'])
+            self.assertEqual(['a', 'b', 'b'], self.obj.retrieved)
+        finally:
+            del ids['b']
+
+    def test_statistics(self):
+        self.obj.value['a']
+        self.obj.value['a']
+        self.obj.value['b']
+        key = '%s.CacheableMapping.value:' % __name__
+        self.assertEqual([(key + 'a', 1, 1, None), (key + 'b', 0, 1, None)],
+                         CacheManager(self.env).get_statistics())
+
+
+class CacheEvictionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.obj = CacheableMapping(self.env)
+        self.cache = CacheManager(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_max_entries(self):
+        self.env.config.set('trac', 'cache_max_entries', 10)
+        for key in 'abcdefghijk':
+            self.obj.value[key]
+        self.assertEqual(9, len(self.cache._cache))
+        self.cache.reset_metadata()
+        self.obj.value['c']
+        self.obj.value['a']
+        self.obj.value['b']
+        self.assertEqual(9, len(self.cache._cache))
+        self.cache.reset_metadata()
+        self.obj.value['c']
+        self.obj.value['d']
+        self.assertEqual(list('abcdefghijk') + ['a', 'b', 'd'],
+                         self.obj.retrieved)
+
+    def test_max_size(self):
+        self.env.config.set('trac', 'cache_max_size', 10000)
+        for key in 'abcdefghij':
+            self.obj.value[key * 200]
+        self.assertGreater(10000, self.cache._size)
+        self.assertGreater(10, len(self.cache._cache))
+        self.assertEqual(self.cache._size, sum(self.cache._sizes.values()))
+        self.obj.value['j' * 200]
+        self.assertEqual(10, len(self.obj.retrieved))
+
+
+class SharedMemoryInvalidationTransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.env = EnvironmentStub(path=self.path, config=[
+            ('trac', 'cache_invalidation_transport',
+             'SharedMemoryInvalidationTransport')])
+        self.transport = SharedMemoryInvalidationTransport(self.env)
+        self.id = _key(Cacheable, 'value')
+
+    def tearDown(self):
+        self.env.reset_db()
+        rmtree(self.path)
+
+    def _bump_generation(self):
+        with self.env.db_transaction as db:
+            db("UPDATE cache SET generation=generation+1 WHERE id=%s",
+               (self.id,))
+
+    def test_get_changes(self):
+        self.assertIsNone(self.transport.get_changes())
+        self.assertEqual(set(), self.transport.get_changes())
+        self.transport.notify(self.id)
+        self.assertIn(self.id, self.transport.get_changes())
+        self.assertEqual(set(), self.transport.get_changes())
+
+    def test_metadata_checked_on_notification_only(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        del obj.value
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(2, obj.value)
+
+        # Changes not pushed through the transport aren't seen
+        self._bump_generation()
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(2, obj.value)
+
+        self.transport.notify(self.id)
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(3, obj.value)
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(3, obj.value)
+
+    def test_notify_after_commit(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        self.transport.get_changes()
+        with self.env.db_transaction:
+            del obj.value
+            self.assertEqual(set(), self.transport.get_changes())
+        self.assertIn(self.id, self.transport.get_changes())
+
+    def test_no_notification_after_rollback(self):
+        obj = Cacheable(self.env)
+        self.assertEqual(1, obj.value)
+        self.transport.get_changes()
+        try:
+            with self.env.db_transaction:
+                del obj.value
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(set(), self.transport.get_changes())
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CacheTestCase))
+    suite.addTest(unittest.makeSuite(CachedMappingTestCase))
+    suite.addTest(unittest.makeSuite(CacheEvictionTestCase))
+    if fcntl:
+        suite.addTest(unittest.makeSuite(
+            SharedMemoryInvalidationTransportTestCase))
+    else:
+        print("SKIP: trac/tests/cache.py (no fcntl module)")
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
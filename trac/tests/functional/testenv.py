@@ -184,12 +184,6 @@ class FunctionalTestEnvironment(object):
             self._tracadmin('permission', 'add', user, *perm)
         else:
             self._tracadmin('permission', 'add', user, perm)
-        # We need to force an environment reset, as this is necessary
-        # for the permission change to take effect: grant only
-        # invalidates the `DefaultPermissionStore._all_permissions`
-        # cache, but the `DefaultPermissionPolicy.permission_cache` is
-        # unaffected.
-        self.get_trac_environment().config.touch()
 
     def revoke_perm(self, user, perm):
         """Revoke permission(s) from specified user. A single permission
@@ -199,8 +193,6 @@ class FunctionalTestEnvironment(object):
             self._tracadmin('permission', 'remove', user, *perm)
         else:
             self._tracadmin('permission', 'remove', user, perm)
-        # Force an environment reset (see grant_perm above)
-        self.get_trac_environment().config.touch()
 
     def set_config(self, *args):
         """Calls trac-admin to get the value for the given option
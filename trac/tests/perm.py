@@ -447,6 +447,93 @@ class PermissionCacheTestCase(BaseTestCase):
         'TEST_ADMIN' in self.perm(None)
         self.assertEqual(1, len(self.perm._cache))
 
+    def test_filter(self):
+        resources = [Resource('ticket', id_) for id_ in (3, 1, 2)]
+        self.assertEqual(resources, self.perm.filter('TEST_MODIFY',
+                                                     resources))
+        self.assertEqual([], self.perm.filter('TRAC_ADMIN', resources))
+        self.assertEqual(6, len(self.perm._cache))
+
+    def test_filter_duplicate_resources(self):
+        resources = [Resource('ticket', 1), Resource('ticket', 1),
+                     Resource('ticket', 2), Resource('ticket', 1)]
+        self.assertEqual(resources, self.perm.filter('TEST_MODIFY',
+                                                     resources))
+        self.assertEqual([], self.perm.filter('TRAC_ADMIN', resources))
+        self.assertEqual(4, len(self.perm._cache))
+
+    def test_filter_shares_cache(self):
+        resource = Resource('ticket', 1)
+        self.perm.filter('TEST_ADMIN', [resource])
+        self.perm_system.revoke_permission('testuser', 'TEST_ADMIN')
+        # Using cached GRANT here
+        self.assertIn('TEST_ADMIN', self.perm(resource))
+        self.assertIn('TEST_ADMIN', self.perm('ticket', 1))
+
+
+class DefaultPermissionPolicyTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[perm.DefaultPermissionStore,
+                                           perm.DefaultPermissionPolicy] +
+                                          self.permission_requestors)
+        self.env.config.set('trac', 'permission_policies',
+                            'DefaultPermissionPolicy')
+        self.perm_system = perm.PermissionSystem(self.env)
+        self.policy = perm.DefaultPermissionPolicy(self.env)
+        self.policy.CACHE_EXPIRY = 300
+        self.perm_system.grant_permission('testuser', 'TEST_MODIFY')
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def check_permission(self, action):
+        return self.policy.check_permission(action, 'testuser', None, None)
+
+    def test_cache(self):
+        self.assertTrue(self.check_permission('TEST_MODIFY'))
+        self.env.db_transaction("""
+            INSERT INTO permission VALUES ('testuser', 'TEST_ADMIN')
+            """)
+        # Using cached permissions here
+        self.assertIsNone(self.check_permission('TEST_ADMIN'))
+
+    def test_grant_permission_invalidates_cache(self):
+        self.assertIsNone(self.check_permission('TEST_ADMIN'))
+        self.perm_system.grant_permission('testuser', 'TEST_ADMIN')
+        self.assertTrue(self.check_permission('TEST_ADMIN'))
+
+    def test_revoke_permission_invalidates_cache(self):
+        self.assertTrue(self.check_permission('TEST_MODIFY'))
+        self.perm_system.revoke_permission('testuser', 'TEST_MODIFY')
+        self.assertIsNone(self.check_permission('TEST_MODIFY'))
+
+    def test_group_change_invalidates_cache(self):
+        self.perm_system.grant_permission('group1', 'TEST_ADMIN')
+        self.assertIsNone(self.check_permission('TEST_ADMIN'))
+        self.perm_system.grant_permission('testuser', 'group1')
+        self.assertTrue(self.check_permission('TEST_ADMIN'))
+        self.perm_system.revoke_permission('group1', 'TEST_ADMIN')
+        self.assertIsNone(self.check_permission('TEST_ADMIN'))
+
+    def test_cache_expiry(self):
+        self.assertTrue(self.check_permission('TEST_MODIFY'))
+        self.env.db_transaction("""
+            DELETE FROM permission WHERE username='testuser'
+            """)
+        del perm.DefaultPermissionStore(self.env)._all_permissions
+        self.policy.CACHE_EXPIRY = -1
+        self.assertIsNone(self.check_permission('TEST_MODIFY'))
+
+    def test_cache_expired_entries_removed(self):
+        for username in ('user1', 'user2', 'user3'):
+            self.policy.check_permission('TEST_MODIFY', username, None, None)
+        self.assertEqual({'user1', 'user2', 'user3'},
+                         set(self.policy.permission_cache))
+        self.policy.CACHE_EXPIRY = -1
+        self.check_permission('TEST_MODIFY')
+        self.assertEqual(['testuser'], list(self.policy.permission_cache))
+
 
 class TestPermissionPolicy(Component):
     implements(perm.IPermissionPolicy)
@@ -515,6 +602,47 @@ class PermissionPolicyTestCase(BaseTestCase):
                          {('testuser', 'TEST_MODIFY'): True,
                           ('testuser', 'TEST_ADMIN'): None})
 
+    def test_filter(self):
+        self.policy.grant('testuser', ['TEST_MODIFY'])
+        resources = [Resource('ticket', 1), Resource('wiki', 'WikiStart')]
+        self.assertEqual(resources, self.perm.filter('TEST_MODIFY',
+                                                     resources))
+        self.assertEqual([], self.perm.filter('TEST_ADMIN', resources))
+        self.assertIn('TEST_MODIFY', self.perm(resources[1]))
+        self.assertEqual({('testuser', 'TEST_MODIFY'): True,
+                          ('testuser', 'TEST_ADMIN'): None},
+                         self.policy.results)
+
+    def test_filter_bulk_policy(self):
+        class BulkPermissionPolicy(Component):
+            implements(perm.IPermissionPolicy)
+
+            calls = []
+
+            def check_permission(self, action, username, resource, perm):
+                raise AssertionError("check_permission called")
+
+            def check_permissions(self, action, username, resources, perm):
+                self.calls.append(len(resources))
+                return [True if resource.id % 2 else None
+                        for resource in resources]
+
+        self.addCleanup(ComponentMeta.deregister, BulkPermissionPolicy)
+        self.env.enable_component(BulkPermissionPolicy)
+        self.env.config.set('trac', 'permission_policies',
+                            'BulkPermissionPolicy,TestPermissionPolicy')
+        self.policy.grant('testuser', ['TEST_MODIFY'])
+        resources = [Resource('ticket', id_) for id_ in xrange(1, 6)]
+
+        self.assertEqual(resources, self.perm.filter('TEST_MODIFY',
+                                                     resources))
+        self.assertEqual([resources[0], resources[2], resources[4]],
+                         self.perm.filter('TEST_ADMIN', resources))
+        self.assertEqual([5, 5], BulkPermissionPolicy.calls)
+        self.assertIn('TEST_MODIFY', self.perm('ticket', 2))
+        self.assertNotIn('TEST_ADMIN', self.perm('ticket', 2))
+        self.assertEqual([5, 5], BulkPermissionPolicy.calls)
+
 
 class RecursivePolicyTestCase(unittest.TestCase):
     """Test case for policies that perform recursive permission checks."""
@@ -862,6 +990,7 @@ def test_suite():
     suite.addTest(unittest.makeSuite(PermissionErrorTestCase))
     suite.addTest(unittest.makeSuite(PermissionSystemTestCase))
     suite.addTest(unittest.makeSuite(PermissionCacheTestCase))
+    suite.addTest(unittest.makeSuite(DefaultPermissionPolicyTestCase))
     suite.addTest(unittest.makeSuite(PermissionPolicyTestCase))
     suite.addTest(unittest.makeSuite(RecursivePolicyTestCase))
     suite.addTest(unittest.makeSuite(TracAdminTestCase))
@@ -822,11 +822,29 @@ class TicketAdmin(Component):
     # IAdminCommandProvider methods
 
     def get_admin_commands(self):
+        yield ('ticket rebuild_custom', '',
+               """Rebuild the custom fields table
+
+               Fill the `ticket_custom_columns` table from the custom
+               field values of all tickets. The table is only used when
+               `[ticket] custom_fields_table` is enabled, and must be
+               rebuilt after enabling it and after changing the custom
+               fields.
+               """,
+               None, self._do_rebuild_custom)
         yield ('ticket remove', '<ticket#>',
                'Remove ticket', None, self._do_remove)
         yield ('ticket remove_comment', '<ticket#> <comment#>',
                'Remove ticket comment', None, self._do_remove_comment)
 
+    def _do_rebuild_custom(self):
+        ticket_system = TicketSystem(self.env)
+        if not ticket_system.custom_fields_table:
+            raise AdminCommandError(_("The custom fields table is not "
+                                      "enabled."))
+        ticket_system.rebuild_custom_fields_table()
+        printout(_("Custom fields table rebuilt."))
+
     def _do_remove(self, number):
         number = as_int(number, None)
         if number is None:
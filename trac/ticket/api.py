@@ -18,12 +18,15 @@ import contextlib
 import copy
 import re
 from datetime import datetime
+from itertools import groupby
 
 from trac.cache import cached
 from trac.config import (
     BoolOption, ConfigSection, IntOption, ListOption, Option,
     OrderedExtensionsOption)
 from trac.core import *
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
 from trac.perm import IPermissionRequestor, PermissionCache, PermissionSystem
 from trac.resource import IResourceManager
 from trac.util import Ranges, as_bool, as_int
@@ -31,7 +34,7 @@ from trac.util.datefmt import parse_date, user_time
 from trac.util.html import tag
 from trac.util.text import shorten_line, to_unicode
 from trac.util.translation import _, N_, deactivate, gettext, reactivate
-from trac.wiki import IWikiSyntaxProvider, WikiParser
+from trac.wiki import IWikiLinkPrefetcher, IWikiSyntaxProvider, WikiParser
 
 
 class TicketFieldList(list):
@@ -202,8 +205,8 @@ class IMilestoneChangeListener(Interface):
 
 
 class TicketSystem(Component):
-    implements(IPermissionRequestor, IWikiSyntaxProvider, IResourceManager,
-               ITicketManipulator)
+    implements(IPermissionRequestor, IWikiLinkPrefetcher,
+               IWikiSyntaxProvider, IResourceManager, ITicketManipulator)
 
     change_listeners = ExtensionPoint(ITicketChangeListener)
     milestone_change_listeners = ExtensionPoint(IMilestoneChangeListener)
@@ -283,6 +286,17 @@ class TicketSystem(Component):
     max_summary_size = IntOption('ticket', 'max_summary_size', 262144,
         """Maximum allowed summary size in characters. (//since 1.0.2//)""")
 
+    custom_fields_table = BoolOption('ticket', 'custom_fields_table',
+                                     'false',
+        """Keep a copy of the custom field values in the
+        `ticket_custom_columns` table, which has one indexed column per
+        custom field, and use it in ticket queries instead of joining
+        the `ticket_custom` table for each custom field. The table must
+        be built with `trac-admin $ENV ticket rebuild_custom` after
+        enabling this option and after changing the custom fields. Until
+        then, ticket queries use the `ticket_custom` table.
+        (//since 1.3.4//)""")
+
     def __init__(self):
         self.log.debug('action controllers for ticket workflow: %r',
                        [c.__class__.__name__ for c in self.action_controllers])
@@ -463,6 +477,105 @@ class TicketSystem(Component):
         fields.sort(key=lambda f: (f['order'], f['name']))
         return fields
 
+    def has_custom_fields_table(self):
+        """Return whether the `ticket_custom_columns` table is enabled
+        and up to date with the custom fields.
+
+        The table is never rebuilt here, as this can take a long time
+        and would happen while processing a request. It must be rebuilt
+        with `rebuild_custom_fields_table`.
+
+        :since: 1.3.4
+        """
+        if not self.custom_fields_table:
+            return False
+        layout = ','.join(f['name'] for f in self.custom_fields)
+        return layout == self._custom_fields_table_layout
+
+    @cached
+    def _custom_fields_table_layout(self):
+        """Comma-separated names of the custom fields stored in the
+        `ticket_custom_columns` table, or `None` if the table is out of
+        date.
+        """
+        for value, in self.env.db_query("""
+                SELECT value FROM system WHERE name=%s
+                """, ('custom_fields_table',)):
+            return value
+
+    def rebuild_custom_fields_table(self):
+        """Create the `ticket_custom_columns` table for the current
+        custom fields and fill it from the `ticket_custom` table.
+
+        Each custom field is stored in an indexed `c_<name>` column with
+        the same string representation as in `ticket_custom`, so that
+        values compare and sort the same way in both tables.
+
+        :since: 1.3.4
+        """
+        names = [f['name'] for f in self.custom_fields]
+        columns = ['c_' + name for name in names]
+        table = Table('ticket_custom_columns', key='id')[
+            [Column('id', type='int')] +
+            [Column(column) for column in columns] +
+            [Index([column]) for column in columns]]
+        with self.env.db_transaction as db:
+            if db.has_table(table.name):
+                db.drop_table(table.name)
+            DatabaseManager(self.env).create_tables([table])
+            if names:
+                sql = "INSERT INTO ticket_custom_columns (id,%s) " \
+                      "VALUES (%s)" % (','.join(columns),
+                                       ','.join(['%s'] * (len(names) + 1)))
+                cursor = db.cursor()
+                cursor.execute("""
+                    SELECT ticket, name, value FROM ticket_custom
+                    WHERE name IN (%s) ORDER BY ticket
+                    """ % ','.join(['%s'] * len(names)), names)
+                rows = []
+                for tkt_id, values in groupby(cursor, lambda row: row[0]):
+                    values = {name: value for id_, name, value in values}
+                    rows.append([tkt_id] + [values.get(name)
+                                            for name in names])
+                    if len(rows) >= 1000:
+                        db.executemany(sql, rows)
+                        rows = []
+                if rows:
+                    db.executemany(sql, rows)
+            db("DELETE FROM system WHERE name=%s", ('custom_fields_table',))
+            db("INSERT INTO system (name, value) VALUES (%s, %s)",
+               ('custom_fields_table', ','.join(names)))
+            del self._custom_fields_table_layout
+
+    def update_custom_fields_table(self, tkt_id):
+        """Copy the custom field values of ticket `tkt_id` to the
+        `ticket_custom_columns` table, if it is enabled.
+
+        If the table is disabled or out of date, it is marked as needing
+        a rebuild instead, as it won't be kept up to date anymore.
+
+        :since: 1.3.4
+        """
+        if self._custom_fields_table_layout is None:
+            return
+        names = [f['name'] for f in self.custom_fields]
+        with self.env.db_transaction as db:
+            if not self.has_custom_fields_table():
+                db("DELETE FROM system WHERE name=%s",
+                   ('custom_fields_table',))
+                del self._custom_fields_table_layout
+                return
+            db("DELETE FROM ticket_custom_columns WHERE id=%s", (tkt_id,))
+            values = dict(db("""
+                SELECT name, value FROM ticket_custom WHERE ticket=%s
+                """, (tkt_id,)))
+            names = [name for name in names if name in values]
+            if names:
+                db("INSERT INTO ticket_custom_columns (id,%s) VALUES (%s)"
+                   % (','.join('c_' + name for name in names),
+                      ','.join(['%s'] * (len(names) + 1))),
+                   [tkt_id] + [values[name] for name in names])
+
     def get_field_synonyms(self):
         """Return a mapping from field name synonyms to field names.
         The synonyms are supposed to be more intuitive for custom queries."""
@@ -579,6 +692,30 @@ class TicketSystem(Component):
                                   'TICKET_EDIT_DESCRIPTION',
                                   'TICKET_EDIT_COMMENT'])]
 
+    # IWikiLinkPrefetcher methods
+
+    _link_id_re = re.compile(r"(?:(?<!&)#|\b(?:bug|issue|ticket):)([0-9]+)")
+
+    def prefetch_links(self, formatter, lines):
+        from trac.ticket.model import Ticket
+        ids = set()
+        for line in lines:
+            if '#' in line or ':' in line:
+                ids.update(int(id_) for id_ in self._link_id_re.findall(line))
+        ids = sorted(id_ for id_ in ids if Ticket.id_is_valid(id_))
+        if not ids:
+            return
+        tickets = formatter.prefetched.setdefault(self.realm, {})
+        with self.env.db_query as db:
+            for idx in xrange(0, len(ids), 100):
+                chunk = ids[idx:idx + 100]
+                tickets.update(dict.fromkeys(chunk))
+                for id_, type, summary, status, resolution in db("""
+                        SELECT id, type, summary, status, resolution
+                        FROM ticket WHERE id IN (%s)
+                        """ % ','.join(['%s'] * len(chunk)), chunk):
+                    tickets[id_] = (type, summary, status, resolution)
+
     # IWikiSyntaxProvider methods
 
     def get_link_resolvers(self):
@@ -597,6 +734,7 @@ class TicketSystem(Component):
             lambda x, y, z: self._format_link(x, 'ticket', y[1:], y, z))
 
     def _format_link(self, formatter, ns, target, label, fullmatch=None):
+        formatter.depends_on(self.realm)
         intertrac = formatter.shorthand_intertrac_helper(ns, target, label,
                                                          fullmatch)
         if intertrac:
@@ -610,13 +748,15 @@ class TicketSystem(Component):
                 from trac.ticket.model import Ticket
                 if Ticket.id_is_valid(num) and \
                         'TICKET_VIEW' in formatter.perm(ticket):
-                    # TODO: attempt to retrieve ticket view directly,
-                    #       something like: t = Ticket.view(num)
-                    for type, summary, status, resolution in \
-                            self.env.db_query("""
+                    prefetched = formatter.prefetched.get(self.realm, {})
+                    if num in prefetched:
+                        rows = [prefetched[num]] if prefetched[num] else []
+                    else:
+                        rows = self.env.db_query("""
                             SELECT type, summary, status, resolution
                             FROM ticket WHERE id=%s
-                            """, (str(num),)):
+                            """, (str(num),))
+                    for type, summary, status, resolution in rows:
                         description = self.format_summary(summary, status,
                                                           resolution, type)
                         title = '#%s: %s' % (num, description)
@@ -637,6 +777,7 @@ class TicketSystem(Component):
         return tag.a(label, class_='missing ticket')
 
     def _format_comment_link(self, formatter, ns, target, label):
+        formatter.depends_on(self.realm)
         resource = None
         if ':' in target:
             elts = target.split(':')
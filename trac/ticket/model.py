@@ -21,7 +21,7 @@ import re
 
 from trac import core
 from trac.attachment import Attachment
-from trac.cache import cached
+from trac.cache import cached, cached_mapping
 from trac.core import TracError
 from trac.resource import Resource, ResourceExistsError, ResourceNotFound
 from trac.ticket.api import TicketSystem
@@ -315,6 +315,7 @@ class Ticket(object):
                        VALUES (%s, %s, %s)
                     """, [(tkt_id, c, db_values.get(c))
                           for c in custom_fields])
+            TicketSystem(self.env).update_custom_fields_table(tkt_id)
 
         self.id = int(tkt_id)
         self._old = {}
@@ -405,6 +406,8 @@ class Ticket(object):
                       VALUES (%s, %s, %s, %s, %s, %s)
                       """, (self.id, db_values['changetime'], author, name,
                             old_db_values.get(name), db_values.get(name)))
+            if any(name in self.custom_fields for name in self._old):
+                TicketSystem(self.env).update_custom_fields_table(self.id)
 
             # always save comment, even if empty
             # (numbering support for timeline)
@@ -489,6 +492,7 @@ class Ticket(object):
             db("DELETE FROM ticket WHERE id=%s", (self.id,))
             db("DELETE FROM ticket_change WHERE ticket=%s", (self.id,))
             db("DELETE FROM ticket_custom WHERE ticket=%s", (self.id,))
+            TicketSystem(self.env).update_custom_fields_table(self.id)
 
         for listener in TicketSystem(self.env).change_listeners:
             listener.ticket_deleted(self)
@@ -558,6 +562,8 @@ class Ticket(object):
                         db("""UPDATE ticket_custom SET value=%s
                               WHERE ticket=%s AND name=%s
                               """, (oldvalue, self.id, field))
+            if any(field not in self.std_fields for field, old, new in fields):
+                TicketSystem(self.env).update_custom_fields_table(self.id)
 
             # Delete the change
             db("DELETE FROM ticket_change WHERE ticket=%s AND time=%s",
@@ -1058,6 +1064,22 @@ class MilestoneCache(core.Component):
                 description or '')
         return milestones
 
+    @cached_mapping
+    def milestone_data(self, name):
+        """Milestone data for the milestone having the given `name`, or
+        `None` if no such milestone exists.
+
+        Contrary to `milestones`, the data is cached for each milestone,
+        so changing a milestone doesn't require retrieving the data for
+        all the other milestones again.
+        """
+        for name, due, completed, description in self.env.db_query("""
+                SELECT name, due, completed, description FROM milestone
+                WHERE name=%s
+                """, (name,)):
+            return (name, _from_timestamp(due), _from_timestamp(completed),
+                    description or '')
+
     def fetchone(self, name, milestone=None):
         """Retrieve an existing milestone having the given `name`.
 
@@ -1066,10 +1088,32 @@ class MilestoneCache(core.Component):
 
         :return: `None` if no such milestone exists
         """
-        data = self.milestones.get(name)
+        data = self.milestone_data[name]
         if data:
             return self.factory(data, milestone)
 
+    def invalidate(self, *names):
+        """Invalidate the cached data for the milestones having the
+        given `names`.
+
+        The `milestones` cached by this process are only updated for
+        these milestones rather than retrieved again.
+        """
+        names = [name for name in names if name is not None]
+        for name in names:
+            del self.milestone_data[name]
+        changes = {name: self.milestone_data[name] for name in names}
+
+        def update(milestones):
+            milestones = milestones.copy()
+            for name, data in changes.iteritems():
+                if data:
+                    milestones[name] = data
+                else:
+                    milestones.pop(name, None)
+            return milestones
+        MilestoneCache.milestones.update(self, update)
+
     def fetchall(self):
         """Iterator on all milestones."""
         for data in self.milestones.itervalues():
@@ -1131,11 +1175,12 @@ class Milestone(object):
                                     self.due < datetime_now(utc))
 
     def checkin(self, invalidate=True):
+        old_name = self._old['name'] if self._old else None
         self._old = {'name': self.name, 'due': self.due,
                      'completed': self.completed,
                      'description': self.description}
         if invalidate:
-            del self.cache.milestones
+            self.cache.invalidate(old_name, self.name)
 
     def delete(self):
         """Delete the milestone."""
@@ -1143,7 +1188,7 @@ class Milestone(object):
         with self.env.db_transaction as db:
             db("DELETE FROM milestone WHERE name=%s", (self.name,))
             Attachment.delete_all(self.env, self.realm, self.name)
-            del self.cache.milestones
+            self.cache.invalidate(self.name)
             TicketSystem(self.env).reset_ticket_fields()
         self._old['name'] = None
 
@@ -30,8 +30,8 @@ from trac.mimeview.api import IContentConverter, Mimeview
 from trac.resource import Resource
 from trac.ticket.api import TicketSystem, translation_deactivated
 from trac.ticket.model import Milestone, _datetime_to_db_str
-from trac.ticket.roadmap import group_milestones
-from trac.util import Ranges, as_bool
+from trac.ticket.roadmap import apply_ticket_permissions, group_milestones
+from trac.util import Ranges, as_bool, as_int
 from trac.util.datefmt import (datetime_now, from_utimestamp,
                                format_date_or_datetime, parse_date,
                                to_timestamp, to_utimestamp, utc, user_time)
@@ -67,7 +67,7 @@ class Query(object):
 
     def __init__(self, env, report=None, constraints=None, cols=None,
                  order=None, desc=0, group=None, groupdesc=0, verbose=0,
-                 rows=None, page=None, max=None, format=None):
+                 rows=None, page=None, max=None, format=None, after=None):
         self.env = env
         self.id = report  # if not None, it's the corresponding saved query
         constraints = constraints or []
@@ -116,6 +116,9 @@ class Query(object):
             self.has_more_pages = True
             self.offset = self.max * (self.page - 1)
 
+        # id of the last ticket of the previous page, for keyset pagination
+        self.after = as_int(after, None, min=1) if self.page > 1 else None
+
         if rows is None:
             rows = []
         if verbose and 'description' not in rows:  # 0.10 compatibility
@@ -147,7 +150,7 @@ class Query(object):
 
     @classmethod
     def from_string(cls, env, string, **kw):
-        kw_strs = ['order', 'group', 'page', 'max', 'format']
+        kw_strs = ['order', 'group', 'page', 'max', 'format', 'after']
         kw_arys = ['rows']
         kw_bools = ['desc', 'groupdesc', 'verbose']
         kw_synonyms = {'row': 'rows'}
@@ -286,36 +289,57 @@ class Query(object):
         return cnt
 
     def execute(self, req=None, cached_ids=None, authname=None, tzinfo=None,
-                href=None, locale=None):
+                href=None, locale=None, count=True):
         """Retrieve the list of matching tickets.
 
+        The total number of matching tickets is stored in `num_items`.
+        When the database supports window functions, it is retrieved
+        along with the tickets of the current page. Callers that don't
+        need it can pass `count=False`, in which case `num_items` is
+        `None` and `has_more_pages` tells whether there are more tickets
+        after the current page.
+
         :since 1.0.17: the `tzinfo` parameter is deprecated and will be
             removed in version 1.5.1
         :since 1.0.17: the `locale` parameter is deprecated and will be
             removed in version 1.5.1
+        :since 1.3.4: the `count` parameter was added
         """
         if req is not None:
             href = req.href
 
         self.num_items = 0
-        sql, args = self.get_sql(req, cached_ids, authname, tzinfo, locale)
-        self.num_items = self._count(sql, args)
-
-        if self.num_items <= self.max:
-            self.has_more_pages = False
+        keyset = self._get_keyset() if self.has_more_pages else None
+        # Rows of the previous pages that are not skipped by the keyset
+        offset = 0 if keyset else self.offset
+        with self.env.db_replica_query as db:
+            total = count and self.has_more_pages and \
+                    db.supports_window_functions()
+            sql, args = self._get_sql(req, cached_ids, authname, tzinfo,
+                                      locale, keyset, total)
+
+            if not self.has_more_pages:
+                pass
+            elif total:
+                max = self.max
+                if self.group:
+                    max += 1
+                sql += " LIMIT %d OFFSET %d" % (max, offset)
+            elif count:
+                self.num_items = self._count(sql, args) + self.offset - offset
+                if self.num_items <= self.max:
+                    self.has_more_pages = False
+                else:
+                    self._check_page()
+                    max = self.max
+                    if self.group:
+                        max += 1
+                    sql += " LIMIT %d OFFSET %d" % (max, offset)
+            else:
+                self.num_items = None
+                sql += " LIMIT %d OFFSET %d" % (self.max + 1, offset)
 
-        if self.has_more_pages:
-            max = self.max
-            if self.group:
-                max += 1
-            sql += " LIMIT %d OFFSET %d" % (max, self.offset)
-            if (self.page > int(ceil(float(self.num_items) / self.max)) and
-                self.num_items != 0):
-                raise TracError(_("Page %(page)s is beyond the number of "
-                                  "pages in the query", page=self.page))
-
-        results = []
-        with self.env.db_query as db:
+            results = []
             cursor = db.cursor()
             cursor.execute(sql, args)
             columns = get_column_names(cursor)
@@ -324,6 +348,9 @@ class Query(object):
             for row in cursor:
                 result = {}
                 for name, field, val in zip(columns, fields, row):
+                    if name == '_total':
+                        self.num_items = val + self.offset - offset
+                        continue
                     if name == 'reporter':
                         val = val or 'anonymous'
                     elif name == 'id':
@@ -338,10 +365,52 @@ class Query(object):
                         val = ''
                     result[name] = val
                 results.append(result)
-            return results
+
+        if not self.has_more_pages:
+            self.num_items = len(results)
+        elif total:
+            if not results and self.offset:
+                # The page is empty, the total is only known by counting
+                self.num_items = self.count(req, cached_ids, authname)
+                if self.num_items <= self.max:
+                    # Show the only page, as when counting first
+                    self.has_more_pages = False
+                    return self.execute(req, cached_ids, authname, tzinfo,
+                                        href, locale)
+            if self.num_items <= self.max:
+                self.has_more_pages = False
+            else:
+                self._check_page()
+        elif not count:
+            self.has_more_pages = len(results) > self.max
+            del results[self.max:]
+        return results
+
+    def _check_page(self):
+        if self.page > int(ceil(float(self.num_items) / self.max)) and \
+                self.num_items != 0:
+            raise TracError(_("Page %(page)s is beyond the number of "
+                              "pages in the query", page=self.page))
+
+    def _get_keyset(self):
+        """Return the sort values of the `after` ticket, if the query can
+        continue after that ticket instead of skipping the rows of the
+        previous pages with `OFFSET`.
+        """
+        if self.after is None or self.group or \
+                self.order not in ('id', 'time', 'changetime'):
+            return None
+        if self.order == 'id':
+            return self.after,
+        for value, in self.env.db_query("""
+                SELECT %s FROM ticket WHERE id=%%s
+                """ % self.order, (self.after,)):
+            if value:
+                return value, self.after
+        return None
 
     def get_href(self, href, id=None, order=None, desc=None, format=None,
-                 max=None, page=None):
+                 max=None, page=None, after=None):
         """Create a link corresponding to this query.
 
         :param href: the `Href` object used to build the URL
@@ -352,6 +421,9 @@ class Query(object):
         :param max: optionally override the max items per page
         :param page: optionally specify which page of results (defaults to
                      the first)
+        :param after: optionally specify the id of the last ticket of the
+                      previous page, which allows the next page to be
+                      retrieved without skipping the previous ones
 
         Note: `get_resource_url` of a 'query' resource?
         """
@@ -399,6 +471,7 @@ class Query(object):
                           row=self.rows,
                           max=max,
                           page=page,
+                          after=after,
                           format=format)
 
     def to_string(self):
@@ -420,6 +493,10 @@ class Query(object):
         :since 1.0.17: the `locale` parameter is deprecated and will be
             removed in version 1.5.1
         """
+        return self._get_sql(req, cached_ids, authname, tzinfo, locale)
+
+    def _get_sql(self, req, cached_ids, authname, tzinfo, locale,
+                 keyset=None, total=False):
         if req is not None:
             authname = req.authname
         self.get_columns()
@@ -443,7 +520,9 @@ class Query(object):
                                  if f['type'] == 'text' and
                                     f.get('format') == 'list'}
         cols_custom = [k for k in cols if k in custom_fields]
-        use_joins = len(cols_custom) <= 1
+        use_table = bool(cols_custom) and \
+                    TicketSystem(self.env).has_custom_fields_table()
+        use_joins = not use_table and len(cols_custom) <= 1
         enum_columns = [col for col in ('resolution', 'priority', 'severity',
                                         'type')
                             if col not in custom_fields and
@@ -455,11 +534,28 @@ class Query(object):
         sql = []
         sql.append("SELECT " + ",".join('t.%s AS %s' % (c, c) for c in cols
                                         if c not in custom_fields))
+        if total:
+            sql.append(",COUNT(*) OVER () AS _total")
         if 'priority' in enum_columns:
             sql.append(",priority.value AS _priority_value")
 
         with self.env.db_query as db:
-            if use_joins:
+            def custom_column(name):
+                if use_table:
+                    return 'c.c_' + name
+                elif use_joins:
+                    return db.quote(name) + '.value'
+                else:
+                    return 'c.' + db.quote(name)
+
+            if use_table:
+                # Use the denormalized ticket_custom_columns table
+                sql.extend(",c.c_%s AS %s" % (k, db.quote(k))
+                           for k in cols_custom)
+                sql.append("\nFROM ticket AS t"
+                           "\n  LEFT OUTER JOIN ticket_custom_columns AS c "
+                           "ON c.id=t.id")
+            elif use_joins:
                 # Use LEFT OUTER JOIN for ticket_custom table
                 sql.extend(",%(qk)s.value AS %(qk)s" % {'qk': db.quote(k)}
                            for k in cols_custom)
@@ -502,12 +598,8 @@ class Query(object):
 
             def get_constraint_sql(name, value, mode, neg):
                 is_custom_field = name in custom_fields
-                if not is_custom_field:
-                    col = 't.' + name
-                elif use_joins:
-                    col = db.quote(name) + '.value'
-                else:
-                    col = 'c.' + db.quote(name)
+                col = custom_column(name) if is_custom_field \
+                      else 't.' + name
                 value = value[len(mode) + neg:]
 
                 if name in self.time_fields:
@@ -624,12 +716,8 @@ class Query(object):
                                               ' OR '.join(id_clauses)))
                     # Special case for exact matches on multiple values
                     elif not mode and len(v) > 1 and k not in self.time_fields:
-                        if k not in custom_fields:
-                            col = 't.' + k
-                        elif use_joins:
-                            col = db.quote(k) + '.value'
-                        else:
-                            col = 'c.' + db.quote(k)
+                        col = custom_column(k) if k in custom_fields \
+                              else 't.' + k
                         clauses.append("COALESCE(%s,'') %sIN (%s)"
                                        % (col, 'NOT ' if neg else '',
                                           ','.join('%s' for val in v)))
@@ -656,11 +744,34 @@ class Query(object):
                              (get_clause_sql(c) for c in self.constraints))
             if clauses:
                 sql.append("\nWHERE ")
+                if keyset:
+                    sql.append("(")
                 sql.append(" OR ".join('(%s)' % c for c in clauses))
                 if cached_ids:
                     sql.append(" OR ")
                     sql.append("t.id in (%s)" %
                                (','.join(str(id) for id in cached_ids)))
+                if keyset:
+                    sql.append(")\n  AND ")
+            elif keyset:
+                sql.append("\nWHERE ")
+            if keyset:
+                # Continue after the last ticket of the previous page,
+                # following the ORDER BY clause below
+                if self.order == 'id':
+                    sql.append("t.id%s%%s" % ('<' if self.desc else '>'))
+                    args.extend(keyset)
+                else:
+                    if self.desc:
+                        sql.append("(t.{0}<>0 AND (t.{0}<%s OR "
+                                   "(t.{0}=%s AND t.id>%s)))"
+                                   .format(self.order))
+                    else:
+                        sql.append("(COALESCE(t.{0},0)=0 OR t.{0}>%s OR "
+                                   "(t.{0}=%s AND t.id>%s))"
+                                   .format(self.order))
+                    value, id_ = keyset
+                    args.extend((value, value, id_))
 
             sql.append("\nORDER BY ")
             order_cols = [(self.order, self.desc)]
@@ -672,10 +783,8 @@ class Query(object):
                     col = name + '.value'
                 elif name not in custom_fields:
                     col = 't.' + name
-                elif use_joins:
-                    col = db.quote(name) + '.value'
                 else:
-                    col = 'c.' + db.quote(name)
+                    col = custom_column(name)
                 desc = ' DESC' if desc else ''
                 # FIXME: This is a somewhat ugly hack.  Can we also have the
                 #        column type for this?  If it's an integer, we do
@@ -797,6 +906,12 @@ class Query(object):
             return ''
         field_names = sorted(fields, key=by_label)
 
+        # Check the permission on all the tickets at once, the checks
+        # made when rendering them are then answered by the cache
+        context.perm.filter('TICKET_VIEW',
+                            [Resource(TicketSystem.realm, ticket['id'])
+                             for ticket in tickets])
+
         groups = {}
         groupsequence = []
         for ticket in tickets:
@@ -834,8 +949,10 @@ class Query(object):
 
         if req:
             if results.has_next_page:
+                after = tickets[-1]['id'] \
+                        if tickets and not self.group else None
                 next_href = self.get_href(req.href, max=self.max,
-                                          page=self.page + 1)
+                                          page=self.page + 1, after=after)
                 add_link(req, 'next', next_href, _("Next Page"))
 
             if results.has_previous_page:
@@ -996,7 +1113,8 @@ class QueryModule(Component):
         query = Query(self.env, report_id,
                       constraints, cols, order, as_bool(args.get('desc')),
                       group, as_bool(args.get('groupdesc')),
-                      as_bool(args.get('verbose')), rows, page, max)
+                      as_bool(args.get('verbose')), rows, page, max,
+                      after=args.get('after'))
 
         if 'update' in req.args:
             # Reset session vars
@@ -1202,10 +1320,12 @@ class QueryModule(Component):
 
             chrome = Chrome(self.env)
             context = web_context(req)
-            results = query.execute(req)
-            for result in results:
-                ticket = Resource(self.realm, result['id'])
-                if 'TICKET_VIEW' in req.perm(ticket):
+            results = query.execute(req, count=False)
+            tickets = [Resource(self.realm, result['id'])
+                       for result in results]
+            viewable = set(req.perm.filter('TICKET_VIEW', tickets))
+            for result, ticket in zip(results, tickets):
+                if ticket in viewable:
                     values = []
                     for col in cols:
                         value = result[col]
@@ -1226,7 +1346,7 @@ class QueryModule(Component):
         query_href = query.get_href(context.href)
         if 'description' not in query.rows:
             query.rows.append('description')
-        results = query.execute(req)
+        results = query.execute(req, count=False)
         data = {
             'context': context,
             'results': results,
@@ -1395,7 +1515,8 @@ class TicketQueryMacro(WikiMacroBase):
                              title=title)
 
         try:
-            tickets = query.execute(req)
+            # Only the table format needs the count, for its pagination
+            tickets = query.execute(req, count=format == 'table')
         except QueryValueError as e:
             raise MacroError(e)
 
@@ -1410,7 +1531,6 @@ class TicketQueryMacro(WikiMacroBase):
 
         if format == 'progress':
             from trac.ticket.roadmap import (RoadmapModule,
-                                             apply_ticket_permissions,
                                              get_ticket_stats,
                                              grouped_stats_data)
 
@@ -1479,8 +1599,7 @@ class TicketQueryMacro(WikiMacroBase):
         # Formats above had their own permission checks, here we need to
         # do it explicitly:
 
-        tickets = [t for t in tickets
-                   if 'TICKET_VIEW' in req.perm(self.realm, t['id'])]
+        tickets = apply_ticket_permissions(self.env, req, tickets)
 
         if not tickets:
             return tag.span(_("No results"), class_='query_no_results')
@@ -537,6 +537,10 @@ class ReportModule(Component):
                 header_groups.append([])
             header_group.append(header)
 
+        # Check the permissions on the resources of all the rows at once,
+        # the checks made below for each row are answered by the cache
+        self._check_rows_permission(req, cols, results)
+
         # Structure the rows and cells:
         #  - group rows according to __group__ value, if defined
         #  - group cells the same way headers are grouped
@@ -671,6 +675,34 @@ class ReportModule(Component):
                     args=", ".join(missing_args)))
             return 'report_view.html', data, None
 
+    def _check_rows_permission(self, req, cols, results):
+        indexes = {}
+        for idx, col in enumerate(cols):
+            if col in ('report', 'ticket', 'id', '_id'):
+                indexes['id'] = idx
+            elif col.strip('_') in ('realm', 'parent_realm', 'parent_id'):
+                indexes[col.strip('_')] = idx
+
+        def get_value(result, name, default=''):
+            idx = indexes.get(name)
+            return cell_value(result[idx]) if idx is not None else default
+
+        resources_by_action = {}
+        for result in results:
+            realm = get_value(result, 'realm', TicketSystem.realm)
+            id = get_value(result, 'id', None)
+            parent_realm = get_value(result, 'parent_realm')
+            if parent_realm:
+                resource = Resource(realm, id, parent=Resource(
+                    parent_realm, get_value(result, 'parent_id')))
+            else:
+                resource = Resource(realm, id)
+            if resource.realm:
+                action = resource.realm.upper() + '_VIEW'
+                resources_by_action.setdefault(action, []).append(resource)
+        for action, resources in resources_by_action.iteritems():
+            req.perm.filter(action, resources)
+
     def execute_paginated_report(self, req, id, sql, args, limit=0, offset=0):
         """
         :param req: `Request` object.
@@ -692,7 +724,7 @@ class ReportModule(Component):
         limit_offset = None
         base_sql = sql.replace(SORT_COLUMN, '1').replace(LIMIT_OFFSET, '')
 
-        with self.env.db_query as db:
+        with self.env.db_replica_query as db:
             cursor = db.cursor()
             if id == self.REPORT_LIST_ID or limit == 0:
                 sql = base_sql
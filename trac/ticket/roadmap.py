@@ -26,7 +26,8 @@ from trac.core import *
 from trac.notification.api import NotificationSystem
 from trac.perm import IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_regexps, shorten_result
+from trac.search import ISearchIndexSource, ISearchSource, SearchDocument, \
+                        search_to_regexps, shorten_result
 from trac.util import as_bool, partition
 from trac.util.datefmt import (datetime_now, format_date, format_datetime,
                                from_utimestamp, get_datetime_format_hint,
@@ -358,8 +359,10 @@ def get_num_tickets_for_milestone(env, milestone, exclude_closed=False):
 def apply_ticket_permissions(env, req, tickets):
     """Apply permissions to a set of milestone tickets as returned by
     `get_tickets_for_milestone()`."""
-    return [t for t in tickets
-            if 'TICKET_VIEW' in req.perm('ticket', t['id'])]
+    resources = [Resource('ticket', t['id']) for t in tickets]
+    viewable = set(req.perm.filter('TICKET_VIEW', resources))
+    return [t for t, resource in zip(tickets, resources)
+            if resource in viewable]
 
 
 def milestone_stats_data(env, req, stat, name, grouped_by='component',
@@ -656,8 +659,8 @@ class MilestoneModule(Component):
     """View and edit individual milestones."""
 
     implements(INavigationContributor, IPermissionRequestor, IRequestHandler,
-               IResourceManager, ISearchSource, ITimelineEventProvider,
-               IWikiSyntaxProvider)
+               IResourceManager, ISearchIndexSource, ISearchSource,
+               ITimelineEventProvider, IWikiSyntaxProvider)
 
     realm = 'milestone'
 
@@ -1181,3 +1184,38 @@ class MilestoneModule(Component):
         for result in AttachmentModule(self.env).get_search_results(
                 req, milestone_realm, terms):
             yield result
+
+    # ISearchIndexSource methods
+
+    def get_search_index_documents(self):
+        milestone_realm = Resource(self.realm)
+        for name, due, completed, description \
+                in MilestoneCache(self.env).milestones.itervalues():
+            yield self._search_index_document(milestone_realm(id=name), due,
+                                              completed, description)
+        for doc in AttachmentModule(self.env).get_search_index_documents(
+                milestone_realm, 'milestone'):
+            yield doc
+
+    def get_search_index_document(self, resource):
+        if resource.realm == 'attachment' and resource.parent and \
+                resource.parent.realm == self.realm:
+            return AttachmentModule(self.env).get_search_index_document(
+                resource, 'milestone')
+        if resource.realm == self.realm:
+            milestone = MilestoneCache(self.env).fetchone(resource.id)
+            if milestone:
+                return self._search_index_document(
+                    Resource(self.realm, milestone.name), milestone.due,
+                    milestone.completed, milestone.description)
+
+    def get_search_index_action(self, resource):
+        if resource.realm == 'attachment':
+            return 'ATTACHMENT_VIEW'
+        return 'MILESTONE_VIEW'
+
+    def _search_index_document(self, milestone, due, completed,
+                               description):
+        return SearchDocument('milestone', milestone, completed or due, '',
+                              get_resource_name(self.env, milestone),
+                              '%s\n%s' % (description or '', milestone.id))
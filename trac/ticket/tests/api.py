@@ -21,6 +21,8 @@ from trac.ticket.api import TicketSystem
 from trac.ticket.model import Milestone, Ticket, Version
 from trac.ticket.test import insert_ticket
 from trac.util.datefmt import datetime_now, utc
+from trac.web.chrome import web_context
+from trac.wiki.formatter import Formatter
 
 import unittest
 
@@ -410,6 +412,26 @@ class TicketSystemTestCase(unittest.TestCase):
         self.assertFalse(self.ticket_system.resource_exists(r3))
         self.assertFalse(self.ticket_system.resource_exists(r4))
 
+    def test_prefetch_links(self):
+        insert_ticket(self.env, summary='Ticket 1', status='new')
+        insert_ticket(self.env, summary='Ticket 2', status='closed')
+        context = web_context(self.req)
+        formatter = Formatter(self.env, context)
+        formatter.prefetch_links(['#1 and ticket:2', '[bug:3 label] &#4;'])
+        self.assertEqual([1, 2, 3], sorted(formatter.prefetched['ticket']))
+        self.assertIsNone(formatter.prefetched['ticket'][3])
+
+        # The ticket links are rendered from the prefetched tickets
+        self.env.db_transaction("DELETE FROM ticket")
+        def link(id_):
+            return unicode(self.ticket_system._format_link(
+                formatter, 'ticket', id_, '#' + id_))
+        self.assertIn('class="new ticket"', link('1'))
+        self.assertIn('class="closed ticket"', link('2'))
+        self.assertIn('class="missing ticket"', link('3'))
+        formatter.prefetched.clear()
+        self.assertIn('class="missing ticket"', link('1'))
+
 
 def test_suite():
     return unittest.makeSuite(TicketSystemTestCase)
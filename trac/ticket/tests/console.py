@@ -216,6 +216,25 @@ class TracAdminTestCase(TracAdminTestCaseBase):
         self.assertEqual(0, rv, output)
         self.assertExpectedResult(output)
 
+    def test_ticket_rebuild_custom_ok(self):
+        """Custom fields table is successfully rebuilt."""
+        self.env.config.set('ticket', 'custom_fields_table', True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        insert_ticket(self.env, foo='bar')
+        rv, output = self.execute('ticket rebuild_custom')
+        self.assertEqual(0, rv, output)
+        self.assertExpectedResult(output)
+        self.assertEqual([(1, 'bar')], self.env.db_query("""
+            SELECT id, c_foo FROM ticket_custom_columns"""))
+        with self.env.db_transaction as db:
+            db.drop_table('ticket_custom_columns')
+
+    def test_ticket_rebuild_custom_error_not_enabled(self):
+        """Error reported when the custom fields table is not enabled."""
+        rv, output = self.execute('ticket rebuild_custom')
+        self.assertEqual(2, rv, output)
+        self.assertExpectedResult(output)
+
     def test_ticket_remove_ok(self):
         """Ticket is successfully deleted."""
         insert_ticket(self.env)
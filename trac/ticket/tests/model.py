@@ -24,7 +24,7 @@ from trac.ticket.api import (
     IMilestoneChangeListener, ITicketChangeListener, TicketSystem
 )
 from trac.ticket.model import (
-    Component, Milestone, Priority, Report, Ticket, Version
+    Component, Milestone, MilestoneCache, Priority, Report, Ticket, Version
 )
 from trac.ticket.roadmap import MilestoneModule
 from trac.ticket.test import insert_ticket
@@ -903,6 +903,101 @@ class TicketCommentDeleteTestCase(TicketCommentTestCase):
                          listener.changes)
 
 
+class CustomFieldsTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('ticket', 'custom_fields_table', True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        self.ticket_system = TicketSystem(self.env)
+        self.ticket_system.rebuild_custom_fields_table()
+
+    def tearDown(self):
+        with self.env.db_transaction as db:
+            if db.has_table('ticket_custom_columns'):
+                db.drop_table('ticket_custom_columns')
+        self.env.reset_db()
+
+    def _get_rows(self):
+        self.assertTrue(self.ticket_system.has_custom_fields_table())
+        return self.env.db_query("""
+            SELECT id, c_foo, c_bar FROM ticket_custom_columns ORDER BY id
+            """)
+
+    def test_insert(self):
+        insert_ticket(self.env, summary='1', foo='f1')
+        insert_ticket(self.env, summary='2', foo='f2', bar='b2')
+
+        self.assertEqual([(1, 'f1', None), (2, 'f2', 'b2')], self._get_rows())
+
+    def test_save_changes(self):
+        ticket = insert_ticket(self.env, summary='1', foo='f1')
+        ticket['bar'] = 'b1'
+        ticket.save_changes('joe')
+
+        self.assertEqual([(1, 'f1', 'b1')], self._get_rows())
+
+    def test_delete(self):
+        insert_ticket(self.env, summary='1', foo='f1')
+        ticket = insert_ticket(self.env, summary='2', foo='f2')
+        ticket.delete()
+
+        self.assertEqual([(1, 'f1', None)], self._get_rows())
+
+    def test_delete_change(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
+        ticket = insert_ticket(self.env, summary='1', foo='f1', when=t1)
+        ticket['foo'] = 'f2'
+        ticket.save_changes('joe', when=t2)
+        self.assertEqual([(1, 'f2', None)], self._get_rows())
+        ticket.delete_change(cdate=t2)
+
+        self.assertEqual([(1, 'f1', None)], self._get_rows())
+
+    def test_not_rebuilt_on_layout_change(self):
+        """The table is only rebuilt on demand, and isn't used nor updated
+        until then."""
+        insert_ticket(self.env, summary='1', foo='f1', bar='b1')
+        self.assertEqual([(1, 'f1', 'b1')], self._get_rows())
+
+        self.env.config.set('ticket-custom', 'baz', 'text')
+        self.ticket_system.reset_ticket_fields()
+        del self.ticket_system.custom_fields
+        self.assertFalse(self.ticket_system.has_custom_fields_table())
+        insert_ticket(self.env, summary='2', foo='f2', baz='z2')
+        with self.env.db_query as db:
+            self.assertEqual([(1, 'f1', 'b1')], db("""
+                SELECT id, c_foo, c_bar FROM ticket_custom_columns"""))
+            self.assertEqual([], db("""
+                SELECT * FROM system WHERE name='custom_fields_table'
+                """))
+
+        self.ticket_system.rebuild_custom_fields_table()
+        self.assertTrue(self.ticket_system.has_custom_fields_table())
+        self.assertEqual([(1, 'f1', 'b1', None), (2, 'f2', None, 'z2')],
+                         self.env.db_query("""
+                            SELECT id, c_foo, c_bar, c_baz
+                            FROM ticket_custom_columns ORDER BY id
+                            """))
+
+    def test_not_used_when_disabled(self):
+        """The table must be rebuilt after being disabled."""
+        insert_ticket(self.env, summary='1', foo='f1')
+        self.assertEqual([(1, 'f1', None)], self._get_rows())
+
+        self.env.config.set('ticket', 'custom_fields_table', False)
+        self.assertFalse(self.ticket_system.has_custom_fields_table())
+        insert_ticket(self.env, summary='2', foo='f2')
+        self.env.config.set('ticket', 'custom_fields_table', True)
+        self.assertFalse(self.ticket_system.has_custom_fields_table())
+
+        self.ticket_system.rebuild_custom_fields_table()
+        self.assertEqual([(1, 'f1', None), (2, 'f2', None)],
+                         self._get_rows())
+
+
 class EnumTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -1253,6 +1348,31 @@ class MilestoneTestCase(unittest.TestCase):
             [('Test', to_utimestamp(t1), to_utimestamp(t2), 'Foo bar')],
             self.env.db_query("SELECT * FROM milestone WHERE name='Test'"))
 
+    def test_update_milestone_updates_cache(self):
+        """The cached milestones are updated rather than retrieved
+        again when a milestone is changed."""
+        cache = MilestoneCache(self.env)
+        retrieved = []
+        retriever = MilestoneCache.milestones.retriever
+        MilestoneCache.milestones.retriever = \
+            lambda self: retrieved.append(1) or retriever(self)
+        try:
+            self.assertIn('milestone1', cache.milestones)
+            milestone = Milestone(self.env, 'milestone1')
+            milestone.name = 'renamed'
+            milestone.description = 'Foo bar'
+            milestone.update()
+            Milestone(self.env, 'milestone2').delete()
+            milestone = Milestone(self.env)
+            milestone.name = 'new'
+            milestone.insert()
+
+            self.assertEqual(retriever(cache), cache.milestones)
+            self.assertEqual('Foo bar', cache.milestones['renamed'][3])
+            self.assertEqual(1, len(retrieved))
+        finally:
+            MilestoneCache.milestones.retriever = retriever
+
     def test_update_milestone_without_name(self):
         self.env.db_transaction("INSERT INTO milestone (name) VALUES ('Test')")
 
@@ -1796,6 +1916,7 @@ def test_suite():
     suite.addTest(unittest.makeSuite(TicketTestCase))
     suite.addTest(unittest.makeSuite(TicketCommentEditTestCase))
     suite.addTest(unittest.makeSuite(TicketCommentDeleteTestCase))
+    suite.addTest(unittest.makeSuite(CustomFieldsTableTestCase))
     suite.addTest(unittest.makeSuite(EnumTestCase))
     suite.addTest(unittest.makeSuite(MilestoneTestCase))
     suite.addTest(unittest.makeSuite(ComponentTestCase))
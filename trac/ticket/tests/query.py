@@ -15,13 +15,15 @@ from datetime import datetime, timedelta
 import difflib
 import unittest
 
+from trac.core import TracError
 from trac.mimeview.api import Mimeview
 from trac.test import Mock, EnvironmentStub, MockPerm, MockRequest
 from trac.ticket.api import TicketSystem
-from trac.ticket.model import Milestone, Severity, Ticket, Version
+from trac.ticket.model import Milestone, MilestoneCache, Severity, Ticket, \
+                               Version
 from trac.ticket.query import Query, QueryModule, TicketQueryMacro
 from trac.ticket.test import insert_ticket
-from trac.util.datefmt import utc
+from trac.util.datefmt import to_utimestamp, utc
 from trac.web.api import arg_list_to_args, parse_arg_list
 from trac.web.chrome import web_context
 from trac.wiki.formatter import LinkFormatter
@@ -88,6 +90,9 @@ class QueryTestCase(unittest.TestCase):
         del tktsys.custom_fields
 
     def tearDown(self):
+        with self.env.db_transaction as db:
+            if db.has_table('ticket_custom_columns'):
+                db.drop_table('ticket_custom_columns')
         self.env.reset_db()
 
     def _insert_tickets(self, owner, type, status, priority, milestone,
@@ -513,6 +518,137 @@ ORDER BY COALESCE(t.id,0)=0,t.id""")
         query = Query.from_string(self.env, 'col_00=notfound')
         self.assertEqual([], query.execute(self.req))
 
+    def test_custom_fields_table(self):
+        self.env.config.set('ticket', 'custom_fields_table', True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        self._update_tickets('foo', [None, '', 'something'])
+        self._update_tickets('bar', ['a', 'b'])
+        TicketSystem(self.env).rebuild_custom_fields_table()
+        query = Query.from_string(self.env, 'foo=something&col=bar',
+                                  group='foo', order='bar')
+        sql, args = query.get_sql()
+        with self.env.db_query as db:
+            foo = db.quote('foo')
+            bar = db.quote('bar')
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.status AS status,t.priority AS priority,t.time AS time,t.changetime AS changetime,priority.value AS _priority_value,c.c_bar AS %(bar)s,c.c_foo AS %(foo)s
+FROM ticket AS t
+  LEFT OUTER JOIN ticket_custom_columns AS c ON c.id=t.id
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=t.priority)
+WHERE ((COALESCE(c.c_foo,'')=%%s))
+ORDER BY COALESCE(c.c_foo,'')='',c.c_foo,COALESCE(c.c_bar,'')='',c.c_bar,t.id"""
+        % {'foo': foo, 'bar': bar})
+        self.assertEqual(['something'], args)
+        tickets = self._execute_query(query)
+        self.assertEqual([(3, 'a'), (9, 'a'), (6, 'b')],
+                         [(t['id'], t['bar']) for t in tickets])
+
+    def test_custom_fields_table_out_of_date(self):
+        """The `ticket_custom` table is used until the table is rebuilt."""
+        self.env.config.set('ticket', 'custom_fields_table', True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self._update_tickets('foo', [None, '', 'something'])
+        TicketSystem(self.env).rebuild_custom_fields_table()
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        del TicketSystem(self.env).custom_fields
+        query = Query.from_string(self.env, 'foo=something&col=bar')
+        sql, args = query.get_sql()
+        self.assertNotIn('ticket_custom_columns', sql)
+        self.assertEqual([3, 6, 9],
+                         [t['id'] for t in self._execute_query(query)])
+        with self.env.db_query as db:
+            self.assertTrue(db.has_table('ticket_custom_columns'))
+
+    def test_custom_fields_table_same_results(self):
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        self._update_tickets('foo', [None, '', 'something', 'other'])
+        self._update_tickets('bar', ['a', 'b', None])
+        queries = ['foo=something|other&col=bar&order=bar',
+                   'foo!=something&bar~=a&order=foo&desc=1',
+                   'bar=&group=foo&col=foo&order=id']
+        results = [self._execute_query(Query.from_string(self.env, string))
+                   for string in queries]
+        self.env.config.set('ticket', 'custom_fields_table', True)
+        TicketSystem(self.env).rebuild_custom_fields_table()
+        self.assertEqual(results,
+                         [self._execute_query(Query.from_string(self.env,
+                                                                string))
+                          for string in queries])
+
+    def test_execute_counts_in_single_query(self):
+        query = Query.from_string(self.env, 'order=id&max=3&page=2')
+        with self.env.db_query as db:
+            if db.supports_window_functions():
+                query._count = lambda sql, args: self.fail("counted")
+        tickets = query.execute(self.req)
+        self.assertEqual(self.tktids[3:6], [t['id'] for t in tickets])
+        self.assertEqual(self.n_tickets, query.num_items)
+        self.assertTrue(query.has_more_pages)
+        self.assertNotIn('_total', tickets[0])
+
+    def test_execute_beyond_last_page(self):
+        query = Query.from_string(self.env, 'order=id&max=3&page=5')
+        self.assertRaises(TracError, query.execute, self.req)
+
+    def test_execute_page_of_single_page_result(self):
+        query = Query.from_string(self.env, 'order=id&max=30&page=2')
+        tickets = query.execute(self.req)
+        self.assertEqual(self.tktids, [t['id'] for t in tickets])
+        self.assertEqual(self.n_tickets, query.num_items)
+        self.assertFalse(query.has_more_pages)
+
+    def test_execute_without_count(self):
+        query = Query.from_string(self.env, 'order=id&max=3&page=3')
+        query._count = lambda sql, args: self.fail("counted")
+        tickets = query.execute(self.req, count=False)
+        self.assertEqual(self.tktids[6:9], [t['id'] for t in tickets])
+        self.assertIsNone(query.num_items)
+        self.assertTrue(query.has_more_pages)
+
+        query = Query.from_string(self.env, 'order=id&max=3&page=4')
+        query._count = lambda sql, args: self.fail("counted")
+        tickets = query.execute(self.req, count=False)
+        self.assertEqual(self.tktids[9:], [t['id'] for t in tickets])
+        self.assertFalse(query.has_more_pages)
+
+    def test_keyset_pagination(self):
+        for string in ('order=id', 'order=id&desc=1', 'order=time',
+                       'order=changetime&desc=1', 'order=priority'):
+            for page in (2, 3):
+                query = Query.from_string(self.env, '%s&max=3&page=%d'
+                                                    % (string, page - 1))
+                after = query.execute(self.req)[-1]['id']
+                query = Query.from_string(self.env, '%s&max=3&page=%d'
+                                                    % (string, page))
+                expected = query.execute(self.req)
+                query = Query.from_string(self.env, '%s&max=3&page=%d&'
+                                                    'after=%d'
+                                                    % (string, page, after))
+                self.assertEqual(expected, query.execute(self.req), string)
+                self.assertEqual(self.n_tickets, query.num_items)
+
+    def test_keyset_pagination_sql(self):
+        query = Query.from_string(self.env,
+                                  'owner=someone&order=time&desc=1&'
+                                  'max=3&page=2&after=%d' % self.tktids[2])
+        sql, args = query._get_sql(self.req, None, None, None, None,
+                                   query._get_keyset())
+        self.assertIn("WHERE (((COALESCE(t.owner,'')=%s)))\n"
+                      "  AND (t.time<>0 AND (t.time<%s OR "
+                      "(t.time=%s AND t.id>%s)))\nORDER BY", sql)
+        ticket = Ticket(self.env, self.tktids[2])
+        time = to_utimestamp(ticket['time'])
+        self.assertEqual(['someone', time, time, self.tktids[2]], args)
+
+    def test_next_page_link_has_keyset(self):
+        query = Query.from_string(self.env, 'order=id&max=3')
+        tickets = query.execute(self.req)
+        query.template_data(web_context(self.req), tickets, req=self.req)
+        self.assertIn('&after=%d&page=2&' % self.tktids[2],
+                      self.req.chrome['links']['next'][0]['href'])
+
     def test_constrained_by_multiple_owners(self):
         query = Query.from_string(self.env, 'owner=someone|someone_else',
                                   order='id')
@@ -885,6 +1021,8 @@ ORDER BY COALESCE(t.id,0)=0,t.id""")
         with self.env.db_transaction as db:
             if name in ('milestone', 'version'):
                 db("DELETE FROM %s" % name)
+                if name == 'milestone':
+                    del MilestoneCache(self.env).milestones
             else:
                 db("DELETE FROM enum WHERE type=%s",
                    (name if name != 'type' else 'ticket_type',))
@@ -1018,10 +1156,11 @@ ORDER BY COALESCE(%(version)s.value,'')='',%(version)s.value,t.id""" % quoted)
         self.env.config.set('ticket-custom', 'custom1.label', 'CustomOne')
         query = Mock(get_columns=lambda: ['id', 'owner', 'milestone',
                                           'custom1'],
-                     execute=lambda r: [{'id': 1,
-                                         'owner': 'joe@example.org',
-                                         'milestone': 'milestone1',
-                                         'custom1': 'val1'}],
+                     execute=lambda r, count=True: [
+                         {'id': 1,
+                          'owner': 'joe@example.org',
+                          'milestone': 'milestone1',
+                          'custom1': 'val1'}],
                      time_fields=['time', 'changetime'])
         req = Mock(href=self.env.href, perm=MockPerm())
         content, mimetype, ext = Mimeview(self.env).convert_content(
@@ -1089,8 +1228,8 @@ ORDER BY COALESCE(c.%(ticket)s,'')='',c.%(ticket)s,t.id""" % quoted)
 
     def test_csv_escape(self):
         query = Mock(get_columns=lambda: ['id', 'col1'],
-                     execute=lambda r: [{'id': 1,
-                                         'col1': 'value, needs escaped'}],
+                     execute=lambda r, count=True: [
+                         {'id': 1, 'col1': 'value, needs escaped'}],
                      time_fields=['time', 'changetime'])
         req = MockRequest(self.env)
         content, mimetype, ext = Mimeview(self.env).convert_content(
@@ -1100,10 +1239,11 @@ ORDER BY COALESCE(c.%(ticket)s,'')='',c.%(ticket)s,t.id""" % quoted)
 
     def test_csv_obfuscation(self):
         query = Mock(get_columns=lambda: ['id', 'owner', 'reporter', 'cc'],
-                     execute=lambda r: [{'id': 1,
-                                         'owner': 'joe@example.org',
-                                         'reporter': 'foo@example.org',
-                                         'cc': 'cc1@example.org, cc2'}],
+                     execute=lambda r, count=True: [
+                         {'id': 1,
+                          'owner': 'joe@example.org',
+                          'reporter': 'foo@example.org',
+                          'cc': 'cc1@example.org, cc2'}],
                      time_fields=['time', 'changetime'])
         req = MockRequest(self.env, authname='anonymous')
         content, mimetype, ext = Mimeview(self.env).convert_content(
@@ -1150,6 +1290,7 @@ ORDER BY COALESCE(c.%(ticket)s,'')='',c.%(ticket)s,t.id""" % quoted)
 
     def test_properties_script_data_with_no_milestones(self):
         self.env.db_transaction("DELETE FROM milestone")
+        del MilestoneCache(self.env).milestones
         self.env.config.set('ticket-custom', 'milestone', 'text')
         req = MockRequest(self.env, path_info='/query')
         template, data = self._process_request(req)
@@ -19,6 +19,7 @@ from datetime import datetime
 import io
 import pkg_resources
 import re
+from itertools import groupby
 
 from trac.attachment import AttachmentModule
 from trac.config import BoolOption, Option
@@ -30,7 +31,8 @@ from trac.resource import (
     Resource, ResourceNotFound, get_resource_url, render_resource_link,
     get_resource_shortname
 )
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchIndexSource, ISearchSource, SearchDocument, \
+                        search_to_sql, shorten_result
 from trac.ticket import model
 from trac.ticket.api import TicketSystem, ITicketManipulator
 from trac.ticket.notification import TicketChangeEvent
@@ -70,7 +72,8 @@ class InvalidTicket(TracError):
 class TicketModule(Component):
 
     implements(IContentConverter, INavigationContributor, IRequestHandler,
-               ISearchSource, ITemplateProvider, ITimelineEventProvider)
+               ISearchIndexSource, ISearchSource, ITemplateProvider,
+               ITimelineEventProvider)
 
     ticket_manipulators = ExtensionPoint(ITicketManipulator)
 
@@ -207,22 +210,26 @@ class TicketModule(Component):
             sql2, args2 = search_to_sql(db, ['newvalue'], terms)
             sql3, args3 = search_to_sql(db, ['value'], terms)
             ticketsystem = TicketSystem(self.env)
-            for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
-                                 time, status, resolution
-                          FROM ticket
-                          WHERE id IN (
-                              SELECT id FROM ticket WHERE %s
-                            UNION
-                              SELECT ticket FROM ticket_change
-                              WHERE field='comment' AND %s
-                            UNION
-                              SELECT ticket FROM ticket_custom WHERE %s
-                          )
-                          """ % (sql, sql2, sql3),
-                          args + args2 + args3):
+            rows = db("""SELECT summary, description, reporter, type, id,
+                                time, status, resolution
+                         FROM ticket
+                         WHERE id IN (
+                             SELECT id FROM ticket WHERE %s
+                           UNION
+                             SELECT ticket FROM ticket_change
+                             WHERE field='comment' AND %s
+                           UNION
+                             SELECT ticket FROM ticket_custom WHERE %s
+                         )
+                         """ % (sql, sql2, sql3),
+                      args + args2 + args3)
+            viewable = set(req.perm.filter('TICKET_VIEW',
+                                           [ticket_realm(id=row[4])
+                                            for row in rows]))
+            for summary, desc, author, type, tid, ts, status, resolution \
+                    in rows:
                 t = ticket_realm(id=tid)
-                if 'TICKET_VIEW' in req.perm(t):
+                if t in viewable:
                     yield (req.href.ticket(tid),
                            tag_("%(title)s: %(message)s",
                                 title=tag.span(
@@ -238,6 +245,81 @@ class TicketModule(Component):
             req, ticket_realm, terms):
             yield result
 
+    # ISearchIndexSource methods
+
+    def get_search_index_documents(self):
+        for doc in self._search_index_documents():
+            yield doc
+        for doc in AttachmentModule(self.env).get_search_index_documents(
+                Resource(self.realm), 'ticket'):
+            yield doc
+
+    def get_search_index_document(self, resource):
+        if resource.realm == 'attachment' and resource.parent and \
+                resource.parent.realm == self.realm:
+            return AttachmentModule(self.env).get_search_index_document(
+                resource, 'ticket')
+        if resource.realm == self.realm:
+            tid = as_int(resource.id, None)
+            if tid is not None:
+                for doc in self._search_index_documents(tid):
+                    return doc
+
+    def get_search_index_action(self, resource):
+        if resource.realm == 'attachment':
+            return 'ATTACHMENT_VIEW'
+        return 'TICKET_VIEW'
+
+    def _search_index_documents(self, tid=None):
+        """Generate the documents of all the tickets, or only of ticket
+        `tid`. The custom field values and the comments are merged with
+        the ticket rows in a single pass, both queries being ordered by
+        ticket id.
+        """
+        ticketsystem = TicketSystem(self.env)
+        ticket_realm = Resource(self.realm)
+        if tid is None:
+            id_where = ticket_where = and_ticket_where = ''
+            args = ()
+        else:
+            id_where = 'WHERE id=%s'
+            ticket_where = 'WHERE ticket=%s'
+            and_ticket_where = 'AND ticket=%s'
+            args = (tid,)
+        with self.env.db_query as db:
+            tickets = db.cursor()
+            tickets.execute("""
+                SELECT id, summary, description, keywords, reporter, cc,
+                       type, time, status, resolution
+                FROM ticket %s ORDER BY id
+                """ % id_where, args)
+            values = db.cursor()
+            values.execute("""
+                SELECT ticket, value FROM (
+                    SELECT ticket, value, 0 AS time FROM ticket_custom %s
+                  UNION ALL
+                    SELECT ticket, newvalue, time FROM ticket_change
+                    WHERE field='comment' %s) AS v
+                ORDER BY ticket, time
+                """ % (ticket_where, and_ticket_where), args * 2)
+            groups = groupby(values, key=lambda row: row[0])
+            group = next(groups, None)
+            for id, summary, desc, keywords, reporter, cc, type, ts, \
+                    status, resolution in tickets:
+                texts = [desc, summary, keywords, reporter, cc, unicode(id)]
+                while group is not None and group[0] < id:
+                    group = next(groups, None)
+                if group is not None and group[0] == id:
+                    texts.extend(value for ticket, value in group[1])
+                    group = next(groups, None)
+                t = ticket_realm(id=id)
+                yield SearchDocument(
+                    'ticket', t, from_utimestamp(ts), reporter,
+                    '%s: %s' % (get_resource_shortname(self.env, t),
+                                ticketsystem.format_summary(
+                                    summary, status, resolution, type)),
+                    '\n'.join(text for text in texts if text))
+
     # ITimelineEventProvider methods
 
     def get_timeline_filters(self, req):
@@ -261,9 +343,9 @@ class TicketModule(Component):
 
         def produce_event(values, status, fields, comment, cid):
             id, ts, author, type, summary, description, component = values
-            ticket = ticket_realm(id=id)
-            if 'TICKET_VIEW' not in req.perm(ticket):
+            if id not in viewable:
                 return None
+            ticket = ticket_realm(id=id)
             resolution = fields.get('resolution')
             info = ''
             if status == 'edit':
@@ -334,6 +416,14 @@ class TicketModule(Component):
         # Ticket changes
         with self.env.db_query as db:
             if 'ticket' in filters or 'ticket_details' in filters:
+                # Check the permission on all the tickets of the period
+                viewable = {resource.id for resource in req.perm.filter(
+                    'TICKET_VIEW', [ticket_realm(id=id) for id, in db("""
+                        SELECT ticket FROM ticket_change
+                        WHERE time>=%s AND time<=%s
+                        UNION
+                        SELECT id FROM ticket WHERE time>=%s AND time<=%s
+                        """, (ts_start, ts_stop, ts_start, ts_stop))])}
                 prev_t = None
                 prev_ev = None
                 batch_ev = None
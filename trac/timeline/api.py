@@ -17,7 +17,10 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+import heapq
+
 from trac.core import *
+from trac.util.datefmt import to_datetime, to_utimestamp
 
 
 class ITimelineEventProvider(Interface):
@@ -54,6 +57,25 @@ class ITimelineEventProvider(Interface):
         of the following form: `(kind, date, author, data, provider)`.
         """
 
+    def get_sorted_timeline_events(req, start, stop, filters, limit):
+        """Return the events in the time range given by the `start` and
+        `stop` parameters, newest first.
+
+        This is an optional method. The events are the same as those
+        returned by `get_timeline_events`, but as they are sorted, the
+        timeline can merge them with the events of the other providers
+        and stop consuming them as soon as enough events have been
+        retrieved. A generator should therefore be returned.
+
+        `limit` is the maximum number of events that will be displayed,
+        or `None` if there's no such maximum. It can be used to bound the
+        queries (e.g. with `ORDER BY time DESC LIMIT`), but events which
+        are later dropped by the provider itself (e.g. for lack of
+        permission) must not be counted.
+
+        :since: 1.3.4
+        """
+
     def render_timeline_event(context, field, event):
         """Display the title of the event in the given context.
 
@@ -64,3 +86,34 @@ class ITimelineEventProvider(Interface):
                       the 'url'
         :param event: the event tuple, as returned by `get_timeline_events`
         """
+
+
+def merge_timeline_events(streams, key=None):
+    """Merge iterables of timeline events sorted newest first into a
+    single generator of events sorted newest first.
+
+    The iterables are consumed lazily. Events having the same date are
+    generated in the order of `streams`. If given, `key` is a function
+    returning the event tuple for each item of the iterables.
+
+    :since: 1.3.4
+    """
+    def order(item):
+        event = key(item) if key else item
+        return -to_utimestamp(to_datetime(event[1]))
+
+    heap = []
+    for idx, stream in enumerate(streams):
+        stream = iter(stream)
+        for item in stream:
+            heap.append((order(item), idx, item, stream))
+            break
+    heapq.heapify(heap)
+    while heap:
+        idx, item, stream = heap[0][1:]
+        yield item
+        for item in stream:
+            heapq.heapreplace(heap, (order(item), idx, item, stream))
+            break
+        else:
+            heapq.heappop(heap)
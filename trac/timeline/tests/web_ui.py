@@ -230,8 +230,33 @@ class TimelineEventProviderTestCase(unittest.TestCase):
             def render_timeline_event(self, context, field, event):
                 return event[3].render(context, field, event)
 
+        class SortedTimelineEventProvider(Component):
+            implements(ITimelineEventProvider)
+
+            def __init__(self):
+                self._events = None
+                self.consumed = 0
+                self.limit = None
+
+            def get_timeline_filters(self, req):
+                yield ('sorted', 'Sorted')
+
+            def get_timeline_events(self, req, start, stop, filters):
+                return iter(self._events or ())
+
+            def get_sorted_timeline_events(self, req, start, stop, filters,
+                                           limit):
+                self.limit = limit
+                for event in self._events or ():
+                    self.consumed += 1
+                    yield event
+
+            def render_timeline_event(self, context, field, event):
+                return event[3].render(context, field, event)
+
         cls.timeline_event_providers = {
             'normal': TimelineEventProvider,
+            'sorted': SortedTimelineEventProvider,
         }
 
     @classmethod
@@ -306,6 +331,49 @@ class TimelineEventProviderTestCase(unittest.TestCase):
         self.assertEqual('<?xml version="1.0"?>', output[:21])
         minidom.parseString(output)  # verify valid xml
 
+    def test_events_merged_newest_first(self):
+        normal = self.timeline_event_providers['normal'](self.env)
+        normal._events = [
+            ('normal', datetime(2018, 3, 1, tzinfo=utc), 'joe', None),
+            ('normal', datetime(2018, 3, 5, tzinfo=utc), 'joe', None),
+            ('normal', datetime(2018, 3, 3, tzinfo=utc), 'joe', None),
+        ]
+        sorted_ = self.timeline_event_providers['sorted'](self.env)
+        sorted_._events = [
+            ('sorted', datetime(2018, 3, 6, tzinfo=utc), 'joe', None),
+            ('sorted', datetime(2018, 3, 4, tzinfo=utc), 'joe', None),
+            ('sorted', datetime(2018, 3, 2, tzinfo=utc), 'joe', None),
+            ('sorted', datetime(2018, 2, 28, tzinfo=utc), 'joe', None),
+            ('sorted', datetime(2018, 2, 26, tzinfo=utc), 'joe', None),
+        ]
+        req = MockRequest(self.env, path_info='/timeline',
+                          args={'format': 'rss', 'max': '4'})
+
+        data = TimelineModule(self.env).process_request(req)[1]
+
+        self.assertEqual([6, 5, 4, 3],
+                         [e['datetime'].day for e in data['events']])
+        self.assertEqual(['sorted', 'normal', 'sorted', 'normal'],
+                         [e['kind'] for e in data['events']])
+        self.assertEqual(4, sorted_.limit)
+        self.assertEqual(3, sorted_.consumed)
+
+    def test_no_limit_with_authors_filter(self):
+        sorted_ = self.timeline_event_providers['sorted'](self.env)
+        sorted_._events = [
+            ('sorted', datetime(2018, 3, 6, tzinfo=utc), 'joe', None),
+            ('sorted', datetime(2018, 3, 4, tzinfo=utc), 'jane', None),
+            ('sorted', datetime(2018, 3, 2, tzinfo=utc), 'jane', None),
+        ]
+        req = MockRequest(self.env, path_info='/timeline',
+                          args={'format': 'rss', 'max': '1',
+                                'authors': 'jane'})
+
+        data = TimelineModule(self.env).process_request(req)[1]
+
+        self.assertEqual([4], [e['datetime'].day for e in data['events']])
+        self.assertIsNone(sorted_.limit)
+
     def _process_request(self, req):
         mod = TimelineModule(self.env)
         req = MockRequest(self.env, path_info='/timeline',
@@ -24,7 +24,7 @@ from datetime import datetime, timedelta
 from trac.config import IntOption, BoolOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
-from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.api import ITimelineEventProvider, merge_timeline_events
 from trac.util.datefmt import (datetime_now, format_date, format_datetime,
                                format_time, localtz, parse_date,
                                pretty_timedelta, to_datetime, to_utimestamp,
@@ -186,22 +186,23 @@ class TimelineModule(Component):
             else:
                 include.add(name)
 
-        # gather all events for the given period of time
+        # merge the events of all the providers for the given period of
+        # time, newest first, and only prepare the displayed events
+        limit = maxrows if maxrows and not include and not exclude else None
+        streams = [self._get_provider_events(req, provider, start, stop,
+                                             filters, limit)
+                   for provider in self.event_providers]
         events = []
-        for provider in self.event_providers:
-            with component_guard(self.env, req, provider):
-                for event in provider.get_timeline_events(req, start, stop,
-                                                          filters) or []:
-                    author = (event[2] or '').lower()
-                    if ((not include or author in include) and
-                        author not in exclude):
-                        events.append(
-                            self._event_data(req, provider, event, lastvisit))
-
-        # prepare sorted global list
-        events = sorted(events, key=lambda e: e['datetime'], reverse=True)
-        if maxrows:
-            events = events[:maxrows]
+        with self.env.db_replica_query:
+            for provider, event in merge_timeline_events(streams,
+                                                         key=lambda e: e[1]):
+                author = (event[2] or '').lower()
+                if (not include or author in include) and \
+                        author not in exclude:
+                    events.append(self._event_data(req, provider, event,
+                                                   lastvisit))
+                    if maxrows and len(events) >= maxrows:
+                        break
 
         data['events'] = events
 
@@ -362,6 +363,26 @@ class TimelineModule(Component):
 
     # Internal methods
 
+    def _get_provider_events(self, req, provider, start, stop, filters,
+                             limit):
+        """Generate `(provider, event)` tuples for the events of
+        `provider`, newest first.
+
+        The events of providers not implementing the optional
+        `get_sorted_timeline_events` method are retrieved and sorted
+        at once.
+        """
+        with component_guard(self.env, req, provider):
+            if hasattr(provider, 'get_sorted_timeline_events'):
+                events = provider.get_sorted_timeline_events(
+                    req, start, stop, filters, limit)
+            else:
+                events = sorted(provider.get_timeline_events(
+                                    req, start, stop, filters) or [],
+                                key=lambda e: e[1], reverse=True)
+            for event in events or []:
+                yield provider, event
+
     def _event_data(self, req, provider, event, lastvisit):
         """Compose the timeline event date from the event tuple and prepared
         provider methods"""
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `search_document` and `search_term` tables used by the
+    search index.
+    """
+    new_schema = [
+        Table('search_document', key='id')[
+            Column('id', auto_increment=True),
+            Column('filter'),
+            Column('realm'),
+            Column('resource'),
+            Column('parent_realm'),
+            Column('parent_resource'),
+            Column('time', type='int64'),
+            Column('author'),
+            Column('title'),
+            Column('text'),
+            Index(['realm', 'resource']),
+            Index(['parent_realm', 'parent_resource'])],
+        Table('search_term', key=('term', 'document'))[
+            Column('term'),
+            Column('document', type='int'),
+            Column('weight', type='int'),
+            Index(['document'])],
+    ]
+
+    DatabaseManager(env).create_tables(new_schema)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `node_change_path` table used for looking up the last
+    change of the nodes in the repository caches, and fill it from the
+    `node_change` table.
+
+    The repositories are processed one at a time, by batches of
+    `[versioncontrol] sync_batch_size` revisions, so that only the rows
+    of a batch are held in memory.
+    """
+    table = Table('node_change_path', key=('repos', 'path', 'rev'))[
+        Column('repos', type='int'),
+        Column('path', key_size=255),
+        Column('rev', key_size=40),
+        Column('time', type='int64'),
+        Index(['repos', 'rev']),
+        Index(['repos', 'path', 'time'])]
+
+    DatabaseManager(env).create_tables([table])
+
+    batch_size = max(1, env.config.getint('versioncontrol',
+                                          'sync_batch_size', 100))
+    with env.db_transaction as db:
+        for repos, in db("SELECT DISTINCT repos FROM revision ORDER BY repos"):
+            last_rev = ''
+            while True:
+                revs = db("""
+                    SELECT rev, time FROM revision
+                    WHERE repos=%s AND rev>%s ORDER BY rev LIMIT %s
+                    """, (repos, last_rev, batch_size))
+                if not revs:
+                    break
+                times = dict(revs)
+                first_rev, last_rev = revs[0][0], revs[-1][0]
+                rows = set()
+                for rev, path in db("""
+                        SELECT rev, path FROM node_change
+                        WHERE repos=%s AND rev>=%s AND rev<=%s
+                        """, (repos, first_rev, last_rev)):
+                    if rev not in times:
+                        continue
+                    # the path and its parent directories have changed
+                    while path:
+                        rows.add((repos, path, rev, times[rev]))
+                        path = path.rpartition('/')[0]
+                if rows:
+                    db.executemany("""
+                        INSERT INTO node_change_path (repos, path, rev, time)
+                        VALUES (%s,%s,%s,%s)
+                        """, sorted(rows))
+                if len(revs) < batch_size:
+                    break
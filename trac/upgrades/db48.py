@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `node_annotation` table caching the annotations of the
+    files.
+    """
+    table = Table('node_annotation', key=('repos', 'path', 'rev'))[
+        Column('repos', type='int'),
+        Column('path', key_size=255),
+        Column('rev', key_size=40),
+        Column('annotations')]
+
+    DatabaseManager(env).create_tables([table])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub, mkdtemp
+from trac.upgrades import db47
+
+VERSION = 47
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(path=mkdtemp())
+        self.dbm = DatabaseManager(self.env)
+        with self.env.db_transaction as db:
+            db.drop_table('node_change_path')
+            self.dbm.set_database_version(VERSION - 1)
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _insert_changes(self):
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO revision (repos, rev, time, author, message)
+                VALUES (%s,%s,%s,'joe','')
+                """, [(1, '0000000001', 42), (1, '0000000002', 43),
+                      (2, 'a' * 40, 44)])
+            db.executemany("""
+                INSERT INTO node_change (repos, rev, path, node_type,
+                                         change_type, base_path, base_rev)
+                VALUES (%s,%s,%s,%s,%s,NULL,NULL)
+                """, [(1, '0000000001', 'trunk', 'D', 'A'),
+                      (1, '0000000001', 'trunk/dir/file', 'F', 'A'),
+                      (1, '0000000002', 'trunk/dir/file', 'F', 'E'),
+                      (1, '0000000002', 'trunk/dir/file2', 'F', 'A'),
+                      (2, 'a' * 40, 'README', 'F', 'A')])
+
+    def _assert_node_change_paths(self):
+        self.assertEqual([
+            (1, 'trunk', '0000000001', 42),
+            (1, 'trunk', '0000000002', 43),
+            (1, 'trunk/dir', '0000000001', 42),
+            (1, 'trunk/dir', '0000000002', 43),
+            (1, 'trunk/dir/file', '0000000001', 42),
+            (1, 'trunk/dir/file', '0000000002', 43),
+            (1, 'trunk/dir/file2', '0000000002', 43),
+            (2, 'README', 'a' * 40, 44)],
+            self.env.db_query("""
+                SELECT repos, path, rev, time FROM node_change_path
+                ORDER BY repos, path, rev"""))
+
+    def test_node_change_path_table_created(self):
+        """The node_change_path table is created and filled from the
+        node_change table."""
+        self._insert_changes()
+
+        db47.do_upgrade(self.env, VERSION, None)
+
+        self.assertIn('node_change_path', self.dbm.get_table_names())
+        self._assert_node_change_paths()
+
+    def test_node_change_path_table_filled_by_batches(self):
+        """The node_change_path table is filled by batches of revisions
+        of each repository."""
+        self.env.config.set('versioncontrol', 'sync_batch_size', 1)
+        self._insert_changes()
+
+        db47.do_upgrade(self.env, VERSION, None)
+
+        self._assert_node_change_paths()
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub, mkdtemp
+from trac.upgrades import db48
+
+VERSION = 48
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(path=mkdtemp())
+        self.dbm = DatabaseManager(self.env)
+        with self.env.db_transaction as db:
+            db.drop_table('node_annotation')
+            self.dbm.set_database_version(VERSION - 1)
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def test_node_annotation_table_created(self):
+        """The node_annotation table is created."""
+        db48.do_upgrade(self.env, VERSION, None)
+
+        self.assertIn('node_annotation', self.dbm.get_table_names())
+        self.assertEqual(['repos', 'path', 'rev', 'annotations'],
+                         self.dbm.get_column_names('node_annotation'))
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -20,6 +20,7 @@ from trac.config import ListOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
 from trac.util import as_bool, is_path_below
+from trac.util.datefmt import time_now
 from trac.util.html import tag
 from trac.util.text import breakable_path, normalize_whitespace, print_table, \
                            printerr, printout
@@ -151,7 +152,7 @@ class VersionControlAdmin(Component):
             else:
                 printout(_('Resyncing repository history for %(reponame)s... ',
                            reponame=pretty_name))
-                repos.sync(self._sync_feedback, clean=clean)
+                repos.sync(self._sync_feedback(), clean=clean)
                 for cnt, in self.env.db_query(
                         "SELECT count(rev) FROM revision WHERE repos=%s",
                         (repos.id,)):
@@ -159,9 +160,21 @@ class VersionControlAdmin(Component):
                                       '%(num)s revisions cached.', num=cnt))
         printout(_('Done.'))
 
-    def _sync_feedback(self, rev):
-        sys.stdout.write(' [%s]\r' % rev)
-        sys.stdout.flush()
+    def _sync_feedback(self):
+        """Return a `feedback` callback for `CachedRepository.sync`,
+        showing the last cached revision and the number of revisions
+        cached per second.
+        """
+        start = time_now()
+        count = [0]
+
+        def feedback(rev):
+            count[0] += 1
+            elapsed = time_now() - start
+            rate = count[0] / elapsed if elapsed > 0 else 0
+            sys.stdout.write(' [%s] %.1f revs/s\r' % (rev, rate))
+            sys.stdout.flush()
+        return feedback
 
     def _do_resync(self, reponame, rev=None):
         self._sync(reponame, rev, clean=True)
@@ -177,7 +190,7 @@ class VersionControlAdmin(Component):
             pretty_name = repos.reponame or '(default)'
             printout(_(" Indexing '%(name)s' repository", name=pretty_name))
             try:
-                repos.sync(self._sync_feedback)
+                repos.sync(self._sync_feedback())
             except TracError:
                 printerr(_("""
  ---------------------------------------------------------------------
@@ -19,7 +19,7 @@ from abc import ABCMeta, abstractmethod
 from datetime import datetime
 
 from trac.admin import AdminCommandError, IAdminCommandProvider, get_dir_list
-from trac.config import ConfigSection, Option
+from trac.config import ConfigSection, IntOption, Option
 from trac.core import *
 from trac.resource import IResourceManager, Resource, ResourceNotFound
 from trac.util import as_bool, native_path
@@ -271,6 +271,8 @@ class DbRepositoryProvider(Component):
             db("DELETE FROM repository WHERE id=%s", (id,))
             db("DELETE FROM revision WHERE repos=%s", (id,))
             db("DELETE FROM node_change WHERE repos=%s", (id,))
+            db("DELETE FROM node_change_path WHERE repos=%s", (id,))
+            db("DELETE FROM node_annotation WHERE repos=%s", (id,))
         rm.reload_repositories()
 
     def modify_repository(self, reponame, changes):
@@ -353,6 +355,26 @@ class RepositoryManager(Component):
         or using the "Repositories" admin panel.
         """)
 
+    sync_batch_size = IntOption('versioncontrol', 'sync_batch_size', 100,
+        """Number of revisions written to the cache in each database
+        transaction when synchronizing a cached repository. The
+        synchronization progress is saved after each batch, so an
+        interrupted `trac-admin $ENV repository resync` can be resumed
+        with `trac-admin $ENV repository sync`. Use `1` to make each new
+        revision visible as soon as it is cached.
+        (''since 1.3.4'')
+        """)
+
+    sync_workers = IntOption('versioncontrol', 'sync_workers', 1,
+        """Number of threads retrieving the changesets from the
+        repository when synchronizing a cached repository. With more
+        than one thread, the changesets of the next batch of revisions
+        (see `sync_batch_size`) are retrieved while the current batch
+        is written to the database. This is only used for the
+        repository types supporting it, like Git.
+        (''since 1.3.4'')
+        """)
+
     def __init__(self):
         self._cache = {}
         self._lock = threading.Lock()
@@ -843,6 +865,10 @@ class Repository(object):
 
     has_linear_changesets = False
 
+    # Whether the changesets can be retrieved concurrently by several
+    # threads. (since 1.3.4)
+    has_thread_safe_changesets = False
+
     scope = '/'
 
     realm = RepositoryManager.repository_realm
@@ -982,6 +1008,18 @@ class Repository(object):
         """
         pass
 
+    def get_created_revs(self, nodes):
+        """Return a `dict` mapping the paths of `nodes` to the revision
+        in which they were last changed, i.e. their `created_rev`.
+
+        The nodes are usually the entries of a directory, and
+        repositories which can look up these revisions for several nodes
+        at once override this method.
+
+        :since: 1.3.4
+        """
+        return {node.path: node.created_rev for node in nodes}
+
     @abstractmethod
     def get_oldest_rev(self):
         """Return the oldest revision stored in the repository."""
@@ -15,12 +15,15 @@
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
 import os
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 
 from trac.cache import cached
 from trac.core import TracError
 from trac.util.datefmt import from_utimestamp, to_utimestamp
 from trac.util.translation import _
-from trac.versioncontrol import Changeset, Node, Repository, NoSuchChangeset
+from trac.versioncontrol import Changeset, Node, NoSuchChangeset, Repository, \
+                                RepositoryManager
 
 
 _kindmap = {'D': Node.DIRECTORY, 'F': Node.FILE}
@@ -176,49 +179,109 @@ class CachedRepository(Repository):
 
             # prepare for resyncing (there might still be a race
             # condition at this point)
-            while next_youngest is not None:
-                srev = self.db_rev(next_youngest)
-
-                with self.env.db_transaction as db:
-                    self.log.info("Trying to sync revision [%s] in '%s'",
-                                  next_youngest, _norm_reponame(self))
-                    cset = self.repos.get_changeset(next_youngest)
-                    try:
-                        # steps 1. and 2.
-                        self.insert_changeset(next_youngest, cset)
-                    except Exception as e: # *another* 1.1. resync attempt won
-                        if isinstance(e, self.env.db_exc.IntegrityError):
-                            self.log.warning("Revision %s in '%s' already "
-                                             "cached: %r", next_youngest,
-                                             _norm_reponame(self), e)
-                        else:
-                            self.log.error("Unable to create cache records "
-                                           "for revision %s in '%s': %r",
-                                           next_youngest, _norm_reponame(self),
-                                           e)
-                        # the other resync attempts is also
-                        # potentially still in progress, so for our
-                        # process/thread, keep ''previous'' notion of
-                        # 'youngest'
-                        self.repos.clear(youngest_rev=youngest)
-                        # FIXME: This aborts a containing transaction
-                        db.rollback()
+            batch_size = max(1, RepositoryManager(self.env).sync_batch_size)
+
+            def batches(next_youngest):
+                while next_youngest is not None:
+                    revs = []
+                    while next_youngest is not None and \
+                            len(revs) < batch_size:
+                        revs.append(next_youngest)
+                        next_youngest = self.repos.next_rev(next_youngest)
+                    yield revs
+
+            with closing(self._fetch_changesets(batches(next_youngest))) \
+                    as fetched:
+                for changesets in fetched:
+                    if not self._sync_changesets(changesets, youngest):
                         return
+                    youngest = changesets[-1][0]
 
-                    # 3. update 'youngest_rev' metadata (minimize
-                    # possibility of failures at point 0.)
-                    db("""
-                        UPDATE repository SET value=%s WHERE id=%s AND name=%s
-                        """, (str(next_youngest), self.id, CACHE_YOUNGEST_REV))
-                    del self.metadata
+                    # 5. provide some feedback
+                    if feedback:
+                        for rev, revision, changes in changesets:
+                            feedback(rev)
 
-                # 4. iterate (1. should always succeed now)
-                youngest = next_youngest
-                next_youngest = self.repos.next_rev(next_youngest)
+    def _sync_changesets(self, changesets, youngest):
+        """Insert a batch of changesets retrieved by `_fetch_changesets`
+        and update the 'youngest_rev' metadata.
 
-                # 5. provide some feedback
-                if feedback:
-                    feedback(youngest)
+        Return `False` if the changesets couldn't be inserted.
+        """
+        first_rev = changesets[0][0]
+        last_rev = changesets[-1][0]
+
+        with self.env.db_transaction as db:
+            if first_rev == last_rev:
+                self.log.info("Trying to sync revision [%s] in '%s'",
+                              first_rev, _norm_reponame(self))
+            else:
+                self.log.info("Trying to sync revisions [%s:%s] in '%s'",
+                              first_rev, last_rev, _norm_reponame(self))
+            try:
+                # steps 1. and 2.
+                self._insert_changeset_rows(changesets)
+            except Exception as e: # *another* 1.1. resync attempt won
+                if isinstance(e, self.env.db_exc.IntegrityError):
+                    self.log.warning("Revisions [%s:%s] in '%s' already "
+                                     "cached: %r", first_rev, last_rev,
+                                     _norm_reponame(self), e)
+                else:
+                    self.log.error("Unable to create cache records for "
+                                   "revisions [%s:%s] in '%s': %r",
+                                   first_rev, last_rev, _norm_reponame(self),
+                                   e)
+                # the other resync attempts is also potentially still in
+                # progress, so for our process/thread, keep ''previous''
+                # notion of 'youngest'
+                self.repos.clear(youngest_rev=youngest)
+                # FIXME: This aborts a containing transaction
+                db.rollback()
+                return False
+
+            # 3. update 'youngest_rev' metadata (minimize possibility of
+            # failures at point 0.), which is also where an interrupted
+            # sync resumes
+            db("""
+                UPDATE repository SET value=%s WHERE id=%s AND name=%s
+                """, (str(last_rev), self.id, CACHE_YOUNGEST_REV))
+            del self.metadata
+        return True
+
+    def _fetch_changesets(self, batches):
+        """Retrieve the changesets for each list of revisions of the
+        `batches` iterable.
+
+        Yield a list of `(rev, revision, node_changes)` tuples for each
+        batch, containing the rows to insert in the `revision` and
+        `node_change` tables.
+
+        When `[versioncontrol] sync_workers` is greater than 1 and the
+        repository supports it, the changesets of a batch are retrieved
+        by a pool of threads, while the previous batch is written to
+        the database.
+        """
+        def fetch(rev):
+            return self._get_changeset_rows(rev, self.repos.get_changeset(rev))
+
+        workers = RepositoryManager(self.env).sync_workers
+        if workers <= 1 or not self.repos.has_thread_safe_changesets:
+            for revs in batches:
+                yield [fetch(rev) for rev in revs]
+            return
+
+        pool = ThreadPool(workers)
+        try:
+            pending = None
+            for revs in batches:
+                result = pool.map_async(fetch, revs)
+                if pending is not None:
+                    yield pending.get()
+                pending = result
+            if pending is not None:
+                yield pending.get()
+        finally:
+            pool.terminate()
 
     def remove_cache(self):
         """Remove the repository cache."""
@@ -228,6 +291,10 @@ class CachedRepository(Repository):
                (self.id,))
             db("DELETE FROM node_change WHERE repos=%s",
                (self.id,))
+            db("DELETE FROM node_change_path WHERE repos=%s",
+               (self.id,))
+            db("DELETE FROM node_annotation WHERE repos=%s",
+               (self.id,))
             db.executemany("DELETE FROM repository WHERE id=%s AND name=%s",
                            [(self.id, k) for k in CACHE_METADATA_KEYS])
             db.executemany("""
@@ -282,34 +349,154 @@ class CachedRepository(Repository):
     def insert_changeset(self, rev, cset):
         """Create revision and node_change records for the given changeset
         instance."""
+        self.insert_changesets([(rev, cset)])
+
+    def insert_changesets(self, changesets):
+        """Create revision and node_change records for the given
+        sequence of `(rev, changeset)` pairs, in a single transaction.
+
+        :since: 1.3.4
+        """
+        self._insert_changeset_rows([self._get_changeset_rows(rev, cset)
+                                     for rev, cset in changesets])
+
+    def _get_changeset_rows(self, rev, cset):
         srev = self.db_rev(rev)
+        revision = (self.id, srev, to_utimestamp(cset.date), cset.author,
+                    cset.message)
+        node_changes = []
+        for path, kind, action, bpath, brev in cset.get_changes():
+            self.log.debug("Caching node change in [%s] in '%s': %r",
+                           rev, _norm_reponame(self.repos),
+                           (path, kind, action, bpath, brev))
+            kind = _inverted_kindmap[kind]
+            action = _inverted_actionmap[action]
+            node_changes.append((self.id, srev, path, kind, action, bpath,
+                                 brev))
+        return rev, revision, node_changes
+
+    def _insert_changeset_rows(self, changesets):
         with self.env.db_transaction as db:
             # 1. Attempt to resync the 'revision' table.  In case of
             # concurrent syncs, only such insert into the `revision` table
             # will succeed, the others will fail and raise an exception.
-            db("""
+            db.executemany("""
                 INSERT INTO revision (repos,rev,time,author,message)
                 VALUES (%s,%s,%s,%s,%s)
-                """, (self.id, srev, to_utimestamp(cset.date),
-                      cset.author, cset.message))
+                """, [revision for rev, revision, changes in changesets])
             # 2. now *only* one process was able to get there (i.e. there
             # *shouldn't* be any race condition here)
-            for path, kind, action, bpath, brev in cset.get_changes():
-                self.log.debug("Caching node change in [%s] in '%s': %r",
-                               rev, _norm_reponame(self.repos),
-                               (path, kind, action, bpath, brev))
-                kind = _inverted_kindmap[kind]
-                action = _inverted_actionmap[action]
-                db("""
+            node_changes = [row for rev, revision, changes in changesets
+                                for row in changes]
+            if node_changes:
+                db.executemany("""
                     INSERT INTO node_change
                         (repos,rev,path,node_type,change_type,base_path,
                          base_rev)
                     VALUES (%s,%s,%s,%s,%s,%s,%s)
-                    """, (self.id, srev, path, kind, action, bpath, brev))
+                    """, node_changes)
+            # 3. index the changed paths and their parent directories,
+            # for looking up the last change of the nodes
+            paths = set()
+            for rev, revision, changes in changesets:
+                srev, time = revision[1], revision[2]
+                for row in changes:
+                    path = row[2]
+                    while path:
+                        paths.add((self.id, path, srev, time))
+                        path = path.rpartition('/')[0]
+            if paths:
+                db.executemany("""
+                    INSERT INTO node_change_path (repos,path,rev,time)
+                    VALUES (%s,%s,%s,%s)
+                    """, sorted(paths))
 
     def get_node(self, path, rev=None):
         return self.repos.get_node(path, self.normalize_rev(rev))
 
+    def get_created_revs(self, nodes):
+        """Look up the revisions in the `node_change_path` index, which
+        contains the changed paths and their parent directories for each
+        revision. The other nodes are looked up in the repository.
+
+        :since: 1.3.4
+        """
+        nodes = list(nodes)
+        revs = {}
+        nodes_by_rev = {}
+        for node in nodes:
+            nodes_by_rev.setdefault(node.rev, []).append(node)
+        with self.env.db_query as db:
+            for rev, rev_nodes in nodes_by_rev.iteritems():
+                revs.update(self._get_indexed_created_revs(db, rev,
+                                                           rev_nodes))
+        missing = [node for node in nodes if node.path not in revs]
+        if missing:
+            revs.update(self.repos.get_created_revs(missing))
+        return revs
+
+    # Maximum number of candidate revisions checked for each node, when
+    # the changesets are not linear
+    _max_created_rev_candidates = 20
+
+    def _get_indexed_created_revs(self, db, rev, nodes):
+        srev = self.db_rev(rev)
+        for time, in db("SELECT time FROM revision WHERE repos=%s AND rev=%s",
+                        (self.id, srev)):
+            break
+        else:
+            return {}  # not synchronized yet
+
+        paths = [node.path.strip('/') for node in nodes]
+        revs = {}
+        if self.has_linear_changesets:
+            # A copy of a parent directory is the last change of the
+            # nodes which haven't changed since the copy, but only the
+            # directory itself has a `node_change` row
+            parents = set()
+            for path in paths:
+                while '/' in path:
+                    path = path.rpartition('/')[0]
+                    parents.add(path)
+            copied = None
+            if parents:
+                copied = db("""
+                    SELECT MAX(rev) FROM node_change
+                    WHERE repos=%%s AND rev<=%%s AND path IN (%s)
+                      AND change_type IN ('C', 'M')
+                    """ % ','.join(['%s'] * len(parents)),
+                    [self.id, srev] + list(parents))[0][0]
+            for idx in xrange(0, len(paths), 900):
+                chunk = paths[idx:idx + 900]
+                for path, last in db("""
+                        SELECT path, MAX(rev) FROM node_change_path
+                        WHERE repos=%%s AND rev<=%%s AND path IN (%s)
+                        GROUP BY path
+                        """ % ','.join(['%s'] * len(chunk)),
+                        [self.id, srev] + chunk):
+                    if copied is None or last >= copied:
+                        revs[path] = self.rev_db(last)
+        else:
+            # The most recent change which is an ancestor of `rev`,
+            # skipping the merges as their changes come from the merged
+            # branches
+            for path in paths:
+                for last, in db("""
+                        SELECT rev FROM node_change_path
+                        WHERE repos=%s AND path=%s AND time<=%s
+                        ORDER BY time DESC LIMIT %s
+                        """, (self.id, path, time,
+                               self._max_created_rev_candidates)):
+                    same = last == srev
+                    last = self.rev_db(last)
+                    if not same and not self.rev_older_than(last, rev):
+                        continue
+                    if len(self.parent_revs(last)) <= 1:
+                        revs[path] = last
+                        break
+        return {node.path: revs[path]
+                for node, path in zip(nodes, paths) if path in revs}
+
     def _get_node_revs(self, path, last=None, first=None):
         """Return the revisions affecting `path` between `first` and `last`
         revisions.
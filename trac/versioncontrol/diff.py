@@ -14,14 +14,16 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+from bisect import bisect_left
 import difflib
 import re
+import time
 
 from trac.util.html import Markup, escape
 from trac.util.text import expandtabs
 
 __all__ = ['diff_blocks', 'get_change_extent', 'get_diff_options',
-           'unified_diff']
+           'patience_matcher', 'unified_diff']
 
 _whitespace_split = re.compile(r'\s+', re.UNICODE).split
 
@@ -50,9 +52,120 @@ def get_change_extent(str1, str2):
     return start, end + 1
 
 
+def patience_matcher(fromlines, tolines, timeout=None,
+                     max_fallback_size=250000):
+    """Return a `difflib.SequenceMatcher` for the differences found
+    by the patience diff algorithm.
+
+    The lines occurring exactly once in both sequences are matched
+    first, and the ranges between them are processed the same way. This
+    takes `O(n log n)` time and linear space, unlike `SequenceMatcher`
+    which goes quadratic on large inputs with many similar lines.
+
+    The ranges without any unique line are compared using
+    `SequenceMatcher` if the product of their lengths doesn't exceed
+    `max_fallback_size`, and are reported as replaced otherwise. They
+    are also reported as replaced once `timeout` seconds have elapsed,
+    in which case the `timed_out` attribute of the returned matcher is
+    `True`.
+
+    :since: 1.3.4
+    """
+    a, b = fromlines, tolines
+    deadline = time.time() + timeout if timeout is not None else None
+    timed_out = False
+    blocks = []
+    ranges = [(0, len(a), 0, len(b))]
+    while ranges:
+        alo, ahi, blo, bhi = ranges.pop()
+        n = 0
+        while alo + n < ahi and blo + n < bhi and a[alo + n] == b[blo + n]:
+            n += 1
+        if n:
+            blocks.append((alo, blo, n))
+            alo += n
+            blo += n
+        n = 0
+        while alo < ahi - n and blo < bhi - n and \
+                a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        if n:
+            ahi -= n
+            bhi -= n
+            blocks.append((ahi, bhi, n))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = _unique_common_lines(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                ranges.append((alo, i, blo, j))
+                blocks.append((i, j, 1))
+                alo, blo = i + 1, j + 1
+            ranges.append((alo, ahi, blo, bhi))
+        elif (ahi - alo) * (bhi - blo) <= max_fallback_size:
+            if deadline is not None and time.time() >= deadline:
+                timed_out = True
+                continue
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi])
+            blocks.extend((alo + i, blo + j, n)
+                          for i, j, n in matcher.get_matching_blocks() if n)
+
+    matching_blocks = []
+    for i, j, n in sorted(blocks):
+        if matching_blocks:
+            i1, j1, n1 = matching_blocks[-1]
+            if i1 + n1 == i and j1 + n1 == j:
+                matching_blocks[-1] = i1, j1, n1 + n
+                continue
+        matching_blocks.append((i, j, n))
+    matching_blocks.append((len(a), len(b), 0))
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    matcher.matching_blocks = matching_blocks
+    matcher.timed_out = timed_out
+    return matcher
+
+
+def _unique_common_lines(a, alo, ahi, b, blo, bhi):
+    """Return the longest sequence of `(i, j)` pairs, increasing in
+    both `i` and `j`, of lines occurring exactly once in `a[alo:ahi]`
+    and `b[blo:bhi]`.
+    """
+    aindex = {}
+    for i in xrange(alo, ahi):
+        line = a[i]
+        aindex[line] = None if line in aindex else i
+    bindex = {}
+    for j in xrange(blo, bhi):
+        line = b[j]
+        if aindex.get(line) is not None:
+            bindex[line] = None if line in bindex else j
+    pairs = sorted((aindex[line], j) for line, j in bindex.iteritems()
+                   if j is not None)
+    # longest increasing subsequence of the `j`s, by patience sorting
+    tails = []
+    tail_pairs = []
+    backrefs = []
+    for idx, (i, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_pairs.append(idx)
+        else:
+            tails[pos] = j
+            tail_pairs[pos] = idx
+        backrefs.append(tail_pairs[pos - 1] if pos else None)
+    result = []
+    idx = tail_pairs[-1] if tail_pairs else None
+    while idx is not None:
+        result.append(pairs[idx])
+        idx = backrefs[idx]
+    result.reverse()
+    return result
+
+
 def get_filtered_hunks(fromlines, tolines, context=None,
                        ignore_blank_lines=False, ignore_case=False,
-                       ignore_space_changes=False):
+                       ignore_space_changes=False, engine=None):
     """Retrieve differences in the form of `difflib.SequenceMatcher`
     opcodes, grouped according to the ``context`` and ``ignore_*``
     parameters.
@@ -64,6 +177,9 @@ def get_filtered_hunks(fromlines, tolines, context=None,
     :param ignore_space_changes: differences in amount of spaces are ignored
     :param context: the number of "equal" lines kept for representing
                     the context of the change
+    :param engine: callable returning the `difflib.SequenceMatcher` for
+                   the lines, e.g. `patience_matcher` (defaults to
+                   `difflib.SequenceMatcher`) (''since 1.3.4'')
     :return: generator of grouped `difflib.SequenceMatcher` opcodes
 
     If none of the ``ignore_*`` parameters is `True`, there's nothing
@@ -76,19 +192,22 @@ def get_filtered_hunks(fromlines, tolines, context=None,
     if ignore_case:
         fromlines = [l.lower() for l in fromlines]
         tolines = [l.lower() for l in tolines]
-    hunks = get_hunks(fromlines, tolines, context)
+    hunks = get_hunks(fromlines, tolines, context, engine)
     if ignore_blank_lines:
         hunks = filter_ignorable_lines(hunks, fromlines, tolines, context,
                                        ignore_blank_lines, False, False)
     return hunks
 
 
-def get_hunks(fromlines, tolines, context=None):
+def get_hunks(fromlines, tolines, context=None, engine=None):
     """Generator yielding grouped opcodes describing differences .
 
     See `get_filtered_hunks` for the parameter descriptions.
     """
-    matcher = difflib.SequenceMatcher(None, fromlines, tolines)
+    if engine is None:
+        matcher = difflib.SequenceMatcher(None, fromlines, tolines)
+    else:
+        matcher = engine(fromlines, tolines)
     if context is None:
         return (hunk for hunk in [matcher.get_opcodes()])
     else:
@@ -186,7 +305,8 @@ def filter_ignorable_lines(hunks, fromlines, tolines, context,
 
 
 def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
-                ignore_blank_lines=0, ignore_case=0, ignore_space_changes=0):
+                ignore_blank_lines=0, ignore_case=0, ignore_space_changes=0,
+                engine=None):
     """Return an array that is adequate for adding to the data dictionary
 
     See `get_filtered_hunks` for the parameter descriptions.
@@ -222,7 +342,7 @@ def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
     changes = []
     for group in get_filtered_hunks(fromlines, tolines, context,
                                     ignore_blank_lines, ignore_case,
-                                    ignore_space_changes):
+                                    ignore_space_changes, engine):
         blocks = []
         last_tag = None
         for tag, i1, i2, j1, j2 in markup_intraline_changes(group):
@@ -263,14 +383,14 @@ def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
 
 
 def unified_diff(fromlines, tolines, context=None, ignore_blank_lines=0,
-                 ignore_case=0, ignore_space_changes=0):
+                 ignore_case=0, ignore_space_changes=0, engine=None):
     """Generator producing lines corresponding to a textual diff.
 
     See `get_filtered_hunks` for the parameter descriptions.
     """
     for group in get_filtered_hunks(fromlines, tolines, context,
                                     ignore_blank_lines, ignore_case,
-                                    ignore_space_changes):
+                                    ignore_space_changes, engine):
         i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
         if i1 == 0 and i2 == 0:
             i1, i2 = -1, -1 # support for 'A'dd changes
@@ -39,7 +39,7 @@ class CacheTestCase(unittest.TestCase):
 
     # Helpers
 
-    def get_repos(self, get_changeset=None, youngest_rev=1):
+    def get_repos(self, get_changeset=None, youngest_rev=1, **kwargs):
         if get_changeset is None:
             def no_changeset(rev):
                 raise NoSuchChangeset(rev)
@@ -51,7 +51,8 @@ class CacheTestCase(unittest.TestCase):
                     get_youngest_rev=lambda: youngest_rev,
                     normalize_rev=lambda x: get_changeset(x).rev,
                     next_rev=(lambda x: int(x) < youngest_rev and x + 1
-                                        or None))
+                                        or None),
+                    **kwargs)
 
     def preset_cache(self, *args):
         """Each arg is a (rev tuple, changes list of tuples) pair."""
@@ -116,6 +117,11 @@ class CacheTestCase(unittest.TestCase):
             self.assertEqual(('1', 'trunk', 'D', 'A', None, None), rows[0])
             self.assertEqual(('1', 'trunk/README', 'F', 'A', None, None),
                              rows[1])
+            self.assertEqual([('1', 'trunk', to_utimestamp(t2)),
+                              ('1', 'trunk/README', to_utimestamp(t2))],
+                             db("""
+                                SELECT rev, path, time FROM node_change_path
+                                ORDER BY path"""))
 
     def test_update_sync(self):
         t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
@@ -194,6 +200,76 @@ class CacheTestCase(unittest.TestCase):
         self.assertEqual(('2', 'trunk/README', 'F', 'E', 'trunk/README', '1'),
                          rows[2])
 
+    def test_sync_in_batches(self):
+        self.env.config.set('versioncontrol', 'sync_batch_size', 2)
+        t = [datetime(2001 + rev, 1, 1, 1, 1, 1, 0, utc)
+             for rev in xrange(5)]
+        failing = [True]
+
+        def get_changeset(rev):
+            if failing[0] and rev == 3:
+                raise NoSuchChangeset(rev)
+            return changesets[int(rev)]
+
+        repos = self.get_repos(get_changeset=get_changeset, youngest_rev=4)
+        changesets = [
+            Mock(Changeset, repos, rev, 'Revision %d' % rev, 'joe', t[rev],
+                 get_changes=lambda: iter([('trunk/README', Node.FILE,
+                                            Changeset.EDIT, 'trunk/README',
+                                            0)]))
+            for rev in xrange(5)]
+        cache = CachedRepository(self.env, repos, self.log)
+        revs = []
+
+        # The sync is interrupted in the second batch, the first batch
+        # is committed
+        self.assertRaises(NoSuchChangeset, cache.sync, revs.append)
+        self.assertEqual([0, 1], revs)
+        self.assertEqual('1', cache.metadata['youngest_rev'])
+        self.assertEqual([('0',), ('1',)], self.env.db_query(
+            "SELECT rev FROM revision ORDER BY rev"))
+
+        # The sync resumes after the last committed batch
+        failing[0] = False
+        cache.sync(revs.append)
+        self.assertEqual([0, 1, 2, 3, 4], revs)
+        self.assertEqual('4', cache.metadata['youngest_rev'])
+        rows = self.env.db_query("""
+            SELECT r.rev, r.time, r.message, n.path FROM revision AS r
+            INNER JOIN node_change AS n ON n.repos=r.repos AND n.rev=r.rev
+            ORDER BY r.rev""")
+        self.assertEqual([(str(rev), to_utimestamp(t[rev]),
+                           'Revision %d' % rev, 'trunk/README')
+                          for rev in xrange(5)], rows)
+
+    def test_sync_with_workers(self):
+        self.env.config.set('versioncontrol', 'sync_batch_size', 3)
+        self.env.config.set('versioncontrol', 'sync_workers', 4)
+        t = [datetime(2001 + rev, 1, 1, 1, 1, 1, 0, utc)
+             for rev in xrange(10)]
+        repos = self.get_repos(get_changeset=lambda x: changesets[int(x)],
+                               youngest_rev=9)
+        repos.has_thread_safe_changesets = True
+        changesets = [
+            Mock(Changeset, repos, rev, 'Revision %d' % rev, 'joe', t[rev],
+                 get_changes=lambda: iter([('trunk/README', Node.FILE,
+                                            Changeset.EDIT, 'trunk/README',
+                                            0)]))
+            for rev in xrange(10)]
+        cache = CachedRepository(self.env, repos, self.log)
+        revs = []
+        cache.sync(revs.append)
+
+        self.assertEqual(range(10), revs)
+        self.assertEqual('9', cache.metadata['youngest_rev'])
+        rows = self.env.db_query("""
+            SELECT r.rev, r.message, n.path FROM revision AS r
+            INNER JOIN node_change AS n ON n.repos=r.repos AND n.rev=r.rev
+            """)
+        self.assertEqual(sorted((str(rev), 'Revision %d' % rev,
+                                 'trunk/README') for rev in xrange(10)),
+                         sorted(rows))
+
     def test_sync_changeset(self):
         t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
         t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
@@ -343,6 +419,57 @@ class CacheTestCase(unittest.TestCase):
                          next(changes))
         self.assertRaises(StopIteration, next, changes)
 
+    def test_get_created_revs(self):
+        t = [to_utimestamp(datetime(2001 + idx, 1, 1, 0, 0, 0, 0, utc))
+             for idx in xrange(4)]
+        self.preset_cache(
+            (('0', t[0], '', ''), []),
+            (('1', t[1], 'joe', 'Import'),
+             [('trunk', 'D', 'A', None, None),
+              ('trunk/README', 'F', 'A', None, None),
+              ('trunk/src', 'D', 'A', None, None),
+              ('trunk/src/main.c', 'F', 'A', None, None)]),
+            (('2', t[2], 'joe', 'Edit'),
+             [('trunk/src/main.c', 'F', 'E', 'trunk/src/main.c', '1')]),
+            (('3', t[3], 'joe', 'Merge'),
+             [('trunk/README', 'F', 'E', 'trunk/README', '1')]))
+        self.env.db_transaction.executemany("""
+            INSERT INTO node_change_path (repos, path, rev, time)
+            VALUES (1, %s, %s, %s)
+            """, [('trunk', '1', t[1]), ('trunk/README', '1', t[1]),
+                  ('trunk/src', '1', t[1]), ('trunk/src/main.c', '1', t[1]),
+                  ('trunk', '2', t[2]), ('trunk/src', '2', t[2]),
+                  ('trunk/src/main.c', '2', t[2]), ('trunk', '3', t[3]),
+                  ('trunk/README', '3', t[3])])
+        repos = self.get_repos(
+            get_changeset=lambda x: Mock(Changeset, repos, int(x), '', '',
+                                         None),
+            youngest_rev=3,
+            get_created_revs=lambda nodes: {n.path: 'backend'
+                                            for n in nodes},
+            parent_revs=lambda rev: [1, 2] if int(rev) == 3 else [],
+            rev_older_than=lambda rev1, rev2: int(rev1) < int(rev2))
+        cache = CachedRepository(self.env, repos, self.log)
+
+        def get_created_revs(rev, *paths):
+            nodes = [Mock(Node, repos, path, rev, Node.FILE, path=path,
+                          rev=rev)
+                     for path in paths]
+            return cache.get_created_revs(nodes)
+
+        # the change of the merge in revision 3 is skipped
+        self.assertEqual({'trunk/README': '1', 'trunk/src': '2',
+                          'trunk/src/main.c': '2'},
+                         get_created_revs(3, 'trunk/README', 'trunk/src',
+                                          'trunk/src/main.c'))
+        self.assertEqual({'trunk/src': '1', 'trunk/src/main.c': '1'},
+                         get_created_revs(1, 'trunk/src',
+                                          'trunk/src/main.c'))
+        self.assertEqual({'trunk/src/main.c': '2',
+                          'trunk/src/other.c': 'backend'},
+                         get_created_revs(2, 'trunk/src/main.c',
+                                          'trunk/src/other.c'))
+
 
 def test_suite():
     return unittest.makeSuite(CacheTestCase)
@@ -10,6 +10,8 @@
 # This software consists of voluntary contributions made by many
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
+import difflib
+import random
 import textwrap
 
 from trac.versioncontrol import diff
@@ -256,8 +258,100 @@ class DiffTestCase(unittest.TestCase):
         self.assertEqual(str(block['changed']['lines'][0]),
                          'aa<ins>x</ins>b')
 
+
+class PatienceDiffTestCase(unittest.TestCase):
+
+    def _apply(self, fromlines, tolines, opcodes):
+        lines = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                self.assertEqual(fromlines[i1:i2], tolines[j1:j2])
+                lines.extend(fromlines[i1:i2])
+            else:
+                lines.extend(tolines[j1:j2])
+        return lines
+
+    def test_same_as_difflib(self):
+        old = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+        new = ['X', 'B', 'C', 'd', 'e', 'f', 'G', 'Y']
+        self.assertEqual(
+            difflib.SequenceMatcher(None, old, new).get_opcodes(),
+            diff.patience_matcher(old, new).get_opcodes())
+
+    def test_unique_lines_matched_first(self):
+        old = ['a();', '}', '', 'b();', '}', '', 'c();', '}']
+        new = ['a();', '}', '', 'd();', '}', '', 'b();', '}', '', 'c();',
+               '}']
+        self.assertEqual([('equal', 0, 1, 0, 1),
+                          ('insert', 1, 1, 1, 4),
+                          ('equal', 1, 8, 4, 11)],
+                         difflib.SequenceMatcher(None, old, new)
+                             .get_opcodes())
+        self.assertEqual([('equal', 0, 3, 0, 3),
+                          ('insert', 3, 3, 3, 6),
+                          ('equal', 3, 8, 6, 11)],
+                         diff.patience_matcher(old, new).get_opcodes())
+
+    def test_lines_without_unique_lines(self):
+        old = ['a', 'x', 'x', 'b']
+        new = ['a', 'y', 'x', 'x', 'y', 'b']
+        self.assertEqual([('equal', 0, 1, 0, 1),
+                          ('insert', 1, 1, 1, 2),
+                          ('equal', 1, 3, 2, 4),
+                          ('insert', 3, 3, 4, 5),
+                          ('equal', 3, 4, 5, 6)],
+                         diff.patience_matcher(old, new).get_opcodes())
+        self.assertEqual([('equal', 0, 1, 0, 1),
+                          ('replace', 1, 3, 1, 5),
+                          ('equal', 3, 4, 5, 6)],
+                         diff.patience_matcher(old, new,
+                                               max_fallback_size=0)
+                             .get_opcodes())
+        matcher = diff.patience_matcher(old, new, timeout=-1)
+        self.assertEqual([('equal', 0, 1, 0, 1),
+                          ('replace', 1, 3, 1, 5),
+                          ('equal', 3, 4, 5, 6)], matcher.get_opcodes())
+        self.assertTrue(matcher.timed_out)
+        self.assertFalse(diff.patience_matcher(old, new).timed_out)
+
+    def test_random_changes(self):
+        rand = random.Random(42)
+        words = ['{', '}', 'return x;', 'x++;', '', 'if (x) {']
+        for idx in xrange(50):
+            old = [rand.choice(words) + rand.choice(['', ' ', 'a', 'b'])
+                   for n in xrange(rand.randint(0, 60))]
+            new = list(old)
+            for n in xrange(rand.randint(0, 10)):
+                pos = rand.randint(0, len(new))
+                if rand.random() < 0.5:
+                    new.insert(pos, rand.choice(words))
+                else:
+                    del new[pos:pos + rand.randint(1, 5)]
+            opcodes = diff.patience_matcher(old, new).get_opcodes()
+            self.assertEqual(new, self._apply(old, new, opcodes))
+
+    def test_filtered_hunks(self):
+        old = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+        new = ['X', 'B', 'C', 'd', 'e', 'f', 'G', 'Y']
+        for context in (None, 1):
+            self.assertEqual(
+                list(diff.get_filtered_hunks(old, new, context,
+                                             ignore_case=1)),
+                list(diff.get_filtered_hunks(old, new, context,
+                                             ignore_case=1,
+                                             engine=diff.patience_matcher)))
+
+    def test_unified_diff(self):
+        self.assertEqual(['@@ -1,1 +1,1 @@', '-a', '+b'],
+                         list(diff.unified_diff(
+                             ['a'], ['b'], engine=diff.patience_matcher)))
+
+
 def test_suite():
-    return unittest.makeSuite(DiffTestCase)
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DiffTestCase))
+    suite.addTest(unittest.makeSuite(PatienceDiffTestCase))
+    return suite
 
 if __name__ == '__main__':
     unittest.main(defaultTest='test_suite')
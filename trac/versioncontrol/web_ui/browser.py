@@ -15,21 +15,29 @@
 #
 # Author: Jonas Borgström <jonas@edgewall.com>
 
+import collections
+import json
 import re
 from datetime import datetime, timedelta
 from fnmatch import fnmatchcase
 
-from trac.config import BoolOption, ListOption, Option
+from trac.config import BoolOption, IntOption, ListOption, Option, \
+                        PathOption
 from trac.core import *
-from trac.mimeview.api import IHTMLPreviewAnnotator, Mimeview, is_binary
+from trac.mimeview.api import IHTMLPreviewAnnotator, Mimeview, \
+                              content_to_unicode, ct_mimetype, is_binary
 from trac.perm import IPermissionRequestor, PermissionError
 from trac.resource import Resource, ResourceNotFound
 from trac.util import as_bool, embedded_numbers
+from trac.util.concurrency import get_thread_id, threading
 from trac.util.datefmt import datetime_now, http_date, to_datetime, utc
 from trac.util.html import Markup, escape, tag
 from trac.util.text import exception_to_unicode, shorten_line
 from trac.util.translation import _, cleandoc_
-from trac.versioncontrol.api import NoSuchChangeset, RepositoryManager
+from trac.versioncontrol.api import Changeset, IRepositoryChangeListener, \
+                                    Node, NoSuchChangeset, NoSuchNode, \
+                                    RepositoryManager
+from trac.versioncontrol.diff import patience_matcher
 from trac.versioncontrol.web_ui.util import *
 from trac.web.api import IRequestHandler, RequestDone
 from trac.web.chrome import (Chrome, INavigationContributor, add_ctxtnav,
@@ -191,6 +199,26 @@ class BrowserModule(Component):
         performed on the paths, so aliases won't get automatically resolved.
         """)
 
+    max_zip_size = IntOption('browser', 'max_zip_size', 0,
+        """Maximum total size (in bytes) of the files of a repository
+        path for it to be downloadable as a `.zip`. Set this to 0 for
+        no limit. (''since 1.3.4'')
+        """)
+
+    zip_cache_dir = PathOption('browser', 'zip_cache_dir', '',
+        """Directory where the `.zip` archives of the repository paths
+        are kept, so that downloading the same path at the same revision
+        again doesn't build the archive anew. Relative paths are resolved
+        relative to the `conf` directory of the environment. Leave empty
+        to disable the cache. (''since 1.3.4'')
+        """)
+
+    zip_cache_size = IntOption('browser', 'zip_cache_size', 104857600,
+        """Maximum total size (in bytes) of the archives kept in the
+        `zip_cache_dir` directory. The least recently downloaded archives
+        are removed first. (''since 1.3.4'')
+        """)
+
     color_scale = BoolOption('browser', 'color_scale', True,
         doc="""Enable colorization of the ''age'' column.
 
@@ -568,17 +596,18 @@ class BrowserModule(Component):
 
         # Entries metadata
         class entry(object):
-            _copy = 'name rev created_rev kind isdir path content_length' \
-                    .split()
-            __slots__ = _copy + ['raw_href']
+            _copy = 'name rev kind isdir path content_length'.split()
+            __slots__ = _copy + ['created_rev', 'raw_href']
 
-            def __init__(self, node):
+            def __init__(self, node, created_rev):
                 for f in entry._copy:
                     setattr(self, f, getattr(node, f))
+                self.created_rev = created_rev
                 self.raw_href = download_href(req.href, repos, node, rev)
 
-        entries = [entry(n) for n in node.get_entries()
-                   if n.is_viewable(req.perm)]
+        nodes = [n for n in node.get_entries() if n.is_viewable(req.perm)]
+        created_revs = repos.get_created_revs(nodes)
+        entries = [entry(n, created_revs[n.path]) for n in nodes]
         changes = get_changes(repos, [i.created_rev for i in entries],
                               self.log)
 
@@ -657,7 +686,10 @@ class BrowserModule(Component):
         else:
             archive_name = repos.reponame or 'repository'
         filename = '%s-%s.zip' % (archive_name, root_node.rev)
-        render_zip(req, filename, repos, root_node, self._iter_nodes)
+        render_zip(req, filename, repos, root_node, self._iter_nodes,
+                   max_size=self.max_zip_size,
+                   cache_dir=self.zip_cache_dir,
+                   cache_size=self.zip_cache_size)
 
     def _render_file(self, req, context, repos, node, rev=None):
         req.perm(node.resource).require('FILE_VIEW')
@@ -959,6 +991,97 @@ class BrowserModule(Component):
                                      for reponame, repos in all_repos)
 
 
+class FilePrerenderer(Component):
+    """Render in the background the files changed by the changesets
+    added to the repositories, for the renderers caching their output.
+
+    :since: 1.3.4
+    """
+
+    implements(IRepositoryChangeListener)
+
+    prerender = BoolOption('browser', 'prerender', 'false',
+        """Render in a background thread the files changed by the
+        changesets added to the repositories, when the renderer of
+        their content caches its output (like the Pygments renderer,
+        see `[mimeviewer] pygments_cache_size`), so that the files
+        are already rendered when they are first viewed.
+        (''since 1.3.4'')
+        """)
+
+    def __init__(self):
+        self._jobs = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        if self.prerender:
+            with self._lock:
+                self._jobs.append((repos.reponame, changeset.rev))
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run_jobs, name='File pre-rendering')
+                    self._thread.start()
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        pass
+
+    # Internal methods
+
+    def _run_jobs(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._jobs:
+                        self._thread = None
+                        break
+                    reponame, rev = self._jobs.popleft()
+                try:
+                    self._prerender_changeset(reponame, rev)
+                except Exception as e:
+                    self.log.warning("Unable to pre-render changeset %s in "
+                                     "repository '%s': %s", rev,
+                                     reponame or '(default)',
+                                     exception_to_unicode(e, traceback=True))
+        finally:
+            RepositoryManager(self.env).shutdown(get_thread_id())
+
+    def _prerender_changeset(self, reponame, rev):
+        repos = RepositoryManager(self.env).get_repository(reponame)
+        if repos is None:
+            return
+        changeset = repos.get_changeset(rev)
+        for path, kind, change, base_path, base_rev \
+                in changeset.get_changes():
+            if kind == Node.FILE and change != Changeset.DELETE:
+                self._prerender_node(repos.get_node(path, changeset.rev))
+
+    def _prerender_node(self, node):
+        """Pass the content of `node` to the renderer the repository
+        browser would use, if that renderer supports pre-rendering.
+        """
+        mimeview = Mimeview(self.env)
+        if node.content_length >= mimeview.max_preview_size:
+            return
+        with content_closing(node.get_processed_content()) as content:
+            data = content.read()
+        mime_type = node.content_type
+        if not mime_type or mime_type == 'application/octet-stream':
+            mime_type = mimeview.get_mimetype(node.name, data[:CHUNK_SIZE]) \
+                        or mime_type or 'text/plain'
+        mimetype = ct_mimetype(mime_type)
+        qr, renderer = max(((r.get_quality_ratio(mimetype), r)
+                            for r in mimeview.renderers),
+                           key=lambda candidate: candidate[0])
+        if qr <= 0 or not hasattr(renderer, 'prerender'):
+            return
+        content = content_to_unicode(self.env, data, mime_type)
+        if renderer.expand_tabs:
+            content = content.expandtabs(mimeview.tab_width)
+        renderer.prerender(mimetype, content)
+
 
 class BlameAnnotator(object):
 
@@ -982,7 +1105,7 @@ class BlameAnnotator(object):
         node = self.repos.get_node(self.path, rev)
         # FIXME: get_annotations() should be in the Resource API
         # -- get revision numbers for each line
-        self.annotations = node.get_annotations()
+        self.annotations = self._get_annotations(node)
         # -- from the annotations, retrieve changesets and
         # determine the span of dates covered, for the color code.
         # Note: changesets[i].rev can differ from annotations[i]
@@ -1009,6 +1132,82 @@ class BlameAnnotator(object):
         browser = BrowserModule(self.env)
         self.colorize_age = browser.get_custom_colorizer()
 
+    def _get_annotations(self, node):
+        """Return the annotations of `node` from the `node_annotation`
+        table, or derive them from the annotations of the file at the
+        parent revision, or else retrieve them from the repository.
+        """
+        annotations = self._load_annotations(node)
+        if annotations is None:
+            annotations = self._diff_annotations(node)
+            if annotations is None:
+                annotations = node.get_annotations()
+            self._save_annotations(node, annotations)
+        return annotations
+
+    def _diff_annotations(self, node):
+        """Compute the annotations of `node` from the cached
+        annotations of the file at the parent revision of the changeset
+        in which it was last modified: the unchanged lines keep their
+        revision and the other lines get the revision of the changeset.
+        """
+        rev = node.created_rev
+        parents = self.repos.parent_revs(rev)
+        if len(parents) != 1:
+            return None  # added or merged changes
+        try:
+            old_node = self.repos.get_node(node.created_path, parents[0])
+        except NoSuchNode:
+            return None
+        if not old_node.isfile:
+            return None
+        old_annotations = self._load_annotations(old_node)
+        if old_annotations is None:
+            return None
+        old_lines = _read_lines(old_node)
+        if len(old_lines) != len(old_annotations):
+            return None
+        new_lines = _read_lines(node)
+        annotations = []
+        matcher = patience_matcher(old_lines, new_lines)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                annotations.extend(old_annotations[i1:i2])
+            else:
+                annotations.extend([rev] * (j2 - j1))
+        return annotations
+
+    def _load_annotations(self, node):
+        for value, in self.env.db_query("""
+                SELECT annotations FROM node_annotation
+                WHERE repos=%s AND path=%s AND rev=%s
+                """, (self.repos.id, node.created_path,
+                      unicode(node.created_rev))):
+            annotations = []
+            for rev, count in json.loads(value):
+                annotations.extend([self.repos.normalize_rev(rev)] * count)
+            return annotations
+
+    def _save_annotations(self, node, annotations):
+        # store the runs of lines with the same revision
+        runs = []
+        for rev in annotations:
+            rev = unicode(rev)
+            if runs and runs[-1][0] == rev:
+                runs[-1][1] += 1
+            else:
+                runs.append([rev, 1])
+        try:
+            with self.env.db_transaction as db:
+                db("""INSERT INTO node_annotation (repos, path, rev,
+                                                 annotations)
+                      VALUES (%s,%s,%s,%s)
+                      """, (self.repos.id, node.created_path,
+                            unicode(node.created_rev),
+                            json.dumps(runs, separators=(',', ':'))))
+        except self.env.db_exc.IntegrityError:
+            pass  # saved concurrently
+
     def annotate(self, row, lineno):
         if lineno > len(self.annotations):
             row.append(tag.th())
@@ -1048,3 +1247,11 @@ class BlameAnnotator(object):
             blame_col.append(anchor)
             self.prev_chgset = chgset
         row.append(blame_col)
+
+
+def _read_lines(node):
+    with content_closing(node.get_content()) as content:
+        lines = content.read().split('\n')
+    if lines and not lines[-1]:
+        lines.pop()
+    return lines
@@ -18,19 +18,25 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 #         Christian Boos <cboos@edgewall.org>
 
+from collections import OrderedDict
 from functools import partial
 from itertools import groupby
+import difflib
+import hashlib
 import os
 import posixpath
 import re
+import threading
 
-from trac.config import BoolOption, IntOption, Option
+from trac.config import BoolOption, ExtensionOption, FloatOption, \
+                        IntOption, Option
 from trac.core import *
 from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import ResourceNotFound
-from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.timeline.api import ITimelineEventProvider
+from trac.search import ISearchIndexSource, ISearchSource, SearchDocument, \
+                        search_to_sql, shorten_result
+from trac.timeline.api import ITimelineEventProvider, merge_timeline_events
 from trac.util import as_bool, content_disposition, embedded_numbers, pathjoin
 from trac.util.datefmt import from_utimestamp, pretty_timedelta
 from trac.util.html import tag
@@ -41,7 +47,7 @@ from trac.util.translation import _, ngettext, tag_
 from trac.versioncontrol.api import Changeset, NoSuchChangeset, Node, \
                                     RepositoryManager
 from trac.versioncontrol.diff import diff_blocks, get_diff_options, \
-                                     unified_diff
+                                     patience_matcher, unified_diff
 from trac.versioncontrol.web_ui.browser import BrowserModule
 from trac.versioncontrol.web_ui.util import content_closing, render_zip
 from trac.web import IRequestHandler, RequestDone
@@ -81,6 +87,53 @@ class IPropertyDiffRenderer(Interface):
         """
 
 
+class IDiffEngine(Interface):
+    """Compute the differences between two versions of a file.
+
+    :since: 1.3.4
+    """
+
+    def get_matcher(fromlines, tolines):
+        """Return a `difflib.SequenceMatcher` for the differences
+        between the `fromlines` and `tolines` lists of lines.
+
+        The matcher may have a `timed_out` attribute, which is `True`
+        when the differences weren't all computed exactly. Such
+        differences are not cached.
+        """
+
+
+class DifflibDiffEngine(Component):
+    """Diff engine using `difflib.SequenceMatcher`, which can be very
+    slow on large files with many similar lines.
+    """
+
+    implements(IDiffEngine)
+
+    def get_matcher(self, fromlines, tolines):
+        return difflib.SequenceMatcher(None, fromlines, tolines)
+
+
+class PatienceDiffEngine(Component):
+    """Diff engine using the patience diff algorithm, which matches the
+    lines occurring once in both files first and takes a time roughly
+    proportional to the size of the files.
+    """
+
+    implements(IDiffEngine)
+
+    diff_timeout = FloatOption('changeset', 'diff_timeout', 2.0,
+        """Time in seconds after which the `PatienceDiffEngine` stops
+        looking for the exact differences of the remaining parts of a
+        file, and shows them as replaced.
+        (''since 1.3.4'')
+        """)
+
+    def get_matcher(self, fromlines, tolines):
+        return patience_matcher(fromlines, tolines,
+                                timeout=self.diff_timeout)
+
+
 class DefaultPropertyDiffRenderer(Component):
     """Default version control property difference renderer."""
 
@@ -120,7 +173,8 @@ class ChangesetModule(Component):
     """
 
     implements(INavigationContributor, IPermissionRequestor, IRequestHandler,
-               ITimelineEventProvider, IWikiSyntaxProvider, ISearchSource)
+               ITimelineEventProvider, IWikiSyntaxProvider, ISearchIndexSource,
+               ISearchSource)
 
     property_diff_renderers = ExtensionPoint(IPropertyDiffRenderer)
 
@@ -158,6 +212,35 @@ class ChangesetModule(Component):
         plus their new size) for which the changeset view will attempt to show
         the diffs inlined.""")
 
+    diff_cache_size = IntOption('changeset', 'diff_cache_size', 100,
+        """Maximum number of file differences kept in memory. The
+        differences are looked up by the hash of the old and new
+        contents of the files, hence they are reused by all the
+        changesets and diffs involving the same contents. Set to `0`
+        to disable the cache.
+        (''since 1.3.4'')
+        """)
+
+    diff_cache_max_bytes = IntOption('changeset', 'diff_cache_max_bytes',
+                                     10000000,
+        """Approximate maximum size in bytes of the file differences
+        kept in memory, estimated from the size of the old and new
+        contents of the files. The differences of files larger than
+        this are not cached. Set to `0` for no limit.
+        (''since 1.3.4'')
+        """)
+
+    diff_engine = ExtensionOption('changeset', 'diff_engine', IDiffEngine,
+                                  'DifflibDiffEngine',
+        """Name of the component implementing `IDiffEngine`, which is
+        used for computing the differences of the files.
+        `DifflibDiffEngine` is the historical algorithm, which can be
+        very slow on large files with many similar lines.
+        `PatienceDiffEngine` takes a time roughly proportional to the
+        size of the files, bounded by `[changeset] diff_timeout`.
+        (''since 1.3.4'')
+        """)
+
     wiki_format_messages = BoolOption('changeset', 'wiki_format_messages',
                                       'true',
         """Whether wiki formatting should be applied to changeset messages.
@@ -165,6 +248,11 @@ class ChangesetModule(Component):
         If this option is disabled, changeset messages will be rendered as
         pre-formatted text.""")
 
+    def __init__(self):
+        self._diff_cache = OrderedDict()
+        self._diff_cache_bytes = 0
+        self._diff_cache_lock = threading.Lock()
+
     # INavigationContributor methods
 
     def get_active_navigation_item(self, req):
@@ -563,12 +651,17 @@ class ChangesetModule(Component):
                 ignore_blank_lines = options.get('ignoreblanklines')
                 ignore_case = options.get('ignorecase')
                 ignore_space = options.get('ignorewhitespace')
-                return diff_blocks(old_content.splitlines(),
-                                   new_content.splitlines(),
-                                   context, tabwidth,
-                                   ignore_blank_lines=ignore_blank_lines,
-                                   ignore_case=ignore_case,
-                                   ignore_space_changes=ignore_space)
+                key = (_content_hash(old_content),
+                       _content_hash(new_content), context, tabwidth,
+                       bool(ignore_blank_lines), bool(ignore_case),
+                       bool(ignore_space),
+                       self.diff_engine.__class__.__name__)
+                nbytes = len(old_content) + len(new_content)
+                return self._get_diff_blocks(key, lambda engine: diff_blocks(
+                    old_content.splitlines(), new_content.splitlines(),
+                    context, tabwidth, ignore_blank_lines=ignore_blank_lines,
+                    ignore_case=ignore_case,
+                    ignore_space_changes=ignore_space, engine=engine), nbytes)
             else:
                 return []
 
@@ -578,6 +671,7 @@ class ChangesetModule(Component):
         diff_bytes = diff_files = 0
         annotated = None
         if req.is_xhr:
+            # also used for loading on demand the diffs not shown inline
             show_diffs = None
             annotated = repos.normalize_path(req.args.get('annotate'))
         else:
@@ -678,6 +772,43 @@ class ChangesetModule(Component):
 
         return data
 
+    def _get_diff_blocks(self, key, diff, nbytes=0):
+        """Return the differences computed by `diff(engine)`, or the
+        cached ones for `key`.
+
+        `nbytes` is the estimated size of the differences. They are not
+        cached when they exceed `[changeset] diff_cache_max_bytes` or
+        when the `engine` timed out.
+        """
+        size = self.diff_cache_size
+        max_bytes = self.diff_cache_max_bytes
+        if size <= 0 or 0 < max_bytes < nbytes:
+            return diff(self.diff_engine.get_matcher)
+        with self._diff_cache_lock:
+            entry = self._diff_cache.pop(key, None)
+            if entry is not None:
+                self._diff_cache[key] = entry
+                return entry[0]
+        matchers = []
+        def engine(fromlines, tolines):
+            matcher = self.diff_engine.get_matcher(fromlines, tolines)
+            matchers.append(matcher)
+            return matcher
+        blocks = diff(engine)
+        if any(getattr(matcher, 'timed_out', False) for matcher in matchers):
+            return blocks
+        with self._diff_cache_lock:
+            entry = self._diff_cache.pop(key, None)
+            if entry is not None:
+                self._diff_cache_bytes -= entry[1]
+            self._diff_cache[key] = blocks, nbytes
+            self._diff_cache_bytes += nbytes
+            while len(self._diff_cache) > size or \
+                    0 < max_bytes < self._diff_cache_bytes:
+                self._diff_cache_bytes -= \
+                    self._diff_cache.popitem(last=False)[1][1]
+        return blocks
+
     def _render_diff(self, req, filename, repos, data):
         """Raw Unified Diff version"""
 
@@ -751,6 +882,7 @@ class ChangesetModule(Component):
                 ignore_blank_lines = options.get('ignoreblanklines')
                 ignore_case = options.get('ignorecase')
                 ignore_space = options.get('ignorewhitespace')
+                engine = self.diff_engine.get_matcher
                 if not old_node_info[0]:
                     old_node_info = new_node_info  # support for 'A'dd changes
                 yield 'Index: ' + new_path + CRLF
@@ -761,7 +893,8 @@ class ChangesetModule(Component):
                                          new_content.splitlines(), context,
                                          ignore_blank_lines=ignore_blank_lines,
                                          ignore_case=ignore_case,
-                                         ignore_space_changes=ignore_space):
+                                         ignore_space_changes=ignore_space,
+                                         engine=engine):
                     yield line + CRLF
 
     def _zip_iter_nodes(self, req, repos, data, root_node):
@@ -867,6 +1000,10 @@ class ChangesetModule(Component):
             return []
 
     def get_timeline_events(self, req, start, stop, filters):
+        return self.get_sorted_timeline_events(req, start, stop, filters,
+                                               None)
+
+    def get_sorted_timeline_events(self, req, start, stop, filters, limit):
         all_repos = 'changeset' in filters
         repo_filters = {f for f in filters if f.startswith('repo-')}
         if all_repos or repo_filters:
@@ -907,17 +1044,25 @@ class ChangesetModule(Component):
                                (viewable_changesets,
                                 show_location, show_files))
 
+            def generate_events(repos):
+                try:
+                    for event in generate_changesets(repos):
+                        yield event
+                except TracError as e:
+                    self.log.error("Timeline event provider for repository"
+                                   " '%s' failed: %r",
+                                   repos.reponame, exception_to_unicode(e))
+
+            # The changesets of each repository are retrieved lazily, as
+            # `get_changesets` generates them newest first
             rm = RepositoryManager(self.env)
-            for repos in sorted(rm.get_real_repositories(),
-                                key=lambda repos: repos.reponame):
-                if all_repos or ('repo-' + repos.reponame) in repo_filters:
-                    try:
-                        for event in generate_changesets(repos):
-                            yield event
-                    except TracError as e:
-                        self.log.error("Timeline event provider for repository"
-                                       " '%s' failed: %r",
-                                       repos.reponame, exception_to_unicode(e))
+            for event in merge_timeline_events(
+                    generate_events(repos)
+                    for repos in sorted(rm.get_real_repositories(),
+                                        key=lambda repos: repos.reponame)
+                    if all_repos or ('repo-' + repos.reponame) in
+                                    repo_filters):
+                yield event
 
     def render_timeline_event(self, context, field, event):
         changesets, show_location, show_files = event[3]
@@ -1159,6 +1304,50 @@ class ChangesetModule(Component):
                            from_utimestamp(ts), author,
                            shorten_result(log, terms))
 
+    # ISearchIndexSource methods
+
+    def get_search_index_documents(self):
+        rm = RepositoryManager(self.env)
+        repositories = {repos.params['id']: repos
+                        for repos in rm.get_real_repositories()}
+        for id, rev, ts, author, log in self.env.db_query("""
+                SELECT repos, rev, time, author, message FROM revision
+                """):
+            repos = repositories.get(id)
+            if not repos:
+                continue  # revisions for a no longer active repository
+            try:
+                rev = repos.normalize_rev(rev)
+            except NoSuchChangeset:
+                continue
+            yield self._search_index_document(repos, rev,
+                                              from_utimestamp(ts), author,
+                                              log)
+
+    def get_search_index_document(self, resource):
+        if resource.realm != self.realm or not resource.parent:
+            return None
+        repos = RepositoryManager(self.env).get_repository(resource.parent.id)
+        if not repos:
+            return None
+        try:
+            changeset = repos.get_changeset(resource.id)
+        except NoSuchChangeset:
+            return None
+        return self._search_index_document(repos, changeset.rev,
+                                           changeset.date, changeset.author,
+                                           changeset.message)
+
+    def get_search_index_action(self, resource):
+        return 'CHANGESET_VIEW'
+
+    def _search_index_document(self, repos, rev, time, author, log):
+        drev = repos.display_rev(rev)
+        return SearchDocument('changeset',
+                              repos.resource.child(self.realm, rev), time,
+                              author, '[%s]: %s' % (drev, shorten_line(log)),
+                              '%s\n%s' % (log or '', drev))
+
 
 class AnyDiffModule(Component):
 
@@ -1228,6 +1417,10 @@ class AnyDiffModule(Component):
         return 'diff_form.html', data
 
 
+def _content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).digest()
+
+
 def _read_content(node):
     with content_closing(node.get_content()) as content:
         return content.read()
@@ -12,21 +12,23 @@
 # history and logs, available at http://trac.edgewall.org/.
 
 import io
+import os
 import posixpath
 import unittest
 import zipfile
 from datetime import datetime
 
-from trac.core import Component, TracError, implements
+from trac.core import Component, ComponentMeta, TracError, implements
+from trac.mimeview.api import IHTMLPreviewRenderer
 from trac.perm import PermissionError
 from trac.resource import ResourceNotFound
-from trac.test import Mock, MockRequest
+from trac.test import EnvironmentStub, Mock, MockRequest
 from trac.util.datefmt import utc
 from trac.util.text import to_utf8
 from trac.versioncontrol.api import (
     Changeset, DbRepositoryProvider, IRepositoryConnector, Node, NoSuchNode,
     Repository, RepositoryManager)
-from trac.versioncontrol.web_ui.browser import BrowserModule
+from trac.versioncontrol.web_ui.browser import BrowserModule, FilePrerenderer
 from trac.web.api import RequestDone
 from trac.web.tests.api import RequestHandlerPermissionsTestCaseBase
 
@@ -423,10 +425,128 @@ anonymous = !BROWSER_VIEW, !FILE_VIEW
                          z.read('trunk/dir2/file.txt'))
         self.assertEqual((2017, 3, 31, 12, 34, 56), zi.date_time)
 
+    def test_zip_archive_max_size(self):
+        self.env.config.set('browser', 'max_zip_size', 64)
+        req = MockRequest(self.env, path_info='/browser/trunk',
+                          args={'format': 'zip'})
+        self.assertRaises(RequestDone, self.process_request, req)
+        self.assertEqual('Contents for trunk/dir1/file.txt',
+                         zipfile.ZipFile(req.response_sent)
+                         .read('trunk/dir1/file.txt'))
+
+        self.env.config.set('browser', 'max_zip_size', 63)
+        req = MockRequest(self.env, path_info='/browser/trunk',
+                          args={'format': 'zip'})
+        with self.assertRaises(TracError) as cm:
+            self.process_request(req)
+        self.assertEqual('Maximum total size for a zip archive: 63 bytes',
+                         unicode(cm.exception))
+        self.assertEqual([], req.status_sent)
+
+    def test_zip_archive_cache(self):
+        cache_dir = os.path.join(self.env.path, 'zip-cache')
+        self.env.config.set('browser', 'zip_cache_dir', cache_dir)
+        self.env.config.set('browser', 'downloadable_paths',
+                            '/trunk, /trunk/*')
+        req1 = MockRequest(self.env, path_info='/browser/trunk',
+                           args={'format': 'zip'})
+        self.assertRaises(RequestDone, self.process_request, req1)
+        self.assertNotIn('Content-Length', req1.headers_sent)
+        archives = os.listdir(cache_dir)
+        self.assertEqual(1, len(archives))
+
+        req2 = MockRequest(self.env, path_info='/browser/trunk',
+                           args={'format': 'zip'})
+        self.assertRaises(RequestDone, self.process_request, req2)
+        content = req2.response_sent.getvalue()
+        self.assertEqual(req1.response_sent.getvalue(), content)
+        self.assertEqual(str(len(content)),
+                         str(req2.headers_sent['Content-Length']))
+
+        req3 = MockRequest(self.env, path_info='/browser/trunk/dir1',
+                           args={'format': 'zip'})
+        self.assertRaises(RequestDone, self.process_request, req3)
+        self.assertEqual(2, len(os.listdir(cache_dir)))
+
+        os.utime(os.path.join(cache_dir, archives[0]), (0, 0))
+        self.env.config.set('browser', 'zip_cache_size', len(content) + 1)
+        req4 = MockRequest(self.env, path_info='/browser/trunk/dir2',
+                           args={'format': 'zip'})
+        self.assertRaises(RequestDone, self.process_request, req4)
+        self.assertEqual(2, len(os.listdir(cache_dir)))
+        self.assertNotIn(archives[0], os.listdir(cache_dir))
+
+
+class FilePrerendererTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class PrerenderingRenderer(Component):
+            implements(IHTMLPreviewRenderer)
+
+            expand_tabs = True
+
+            def get_quality_ratio(self, mimetype):
+                return 9 if mimetype == 'text/x-python' else 0
+
+            def render(self, context, mimetype, content, filename=None,
+                       url=None):
+                return content
+
+            def prerender(self, mimetype, content):
+                self.prerendered.append((mimetype, content))
+
+        cls.renderer_cls = PrerenderingRenderer
+
+    @classmethod
+    def tearDownClass(cls):
+        ComponentMeta.deregister(cls.renderer_cls)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', self.renderer_cls])
+        self.prerenderer = FilePrerenderer(self.env)
+        self.renderer = self.renderer_cls(self.env)
+        self.renderer.prerendered = []
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_prerender_node(self):
+        data = 'def f(x):\n\treturn x\n'
+        node = Mock(name='file.py', content_type='text/x-python',
+                    content_length=len(data),
+                    get_processed_content=lambda: io.BytesIO(data))
+        self.prerenderer._prerender_node(node)
+        self.assertEqual([('text/x-python',
+                           u'def f(x):\n        return x\n')],
+                         self.renderer.prerendered)
+
+        node.content_type = 'image/png'
+        self.prerenderer._prerender_node(node)
+        self.assertEqual(1, len(self.renderer.prerendered))
+
+    def test_prerender_changesets(self):
+        jobs = []
+        self.prerenderer._prerender_changeset = \
+            lambda reponame, rev: jobs.append((reponame, rev))
+        repos = Mock(reponame='repos')
+        self.prerenderer.changeset_added(repos, Mock(rev=1))
+        self.assertIsNone(self.prerenderer._thread)
+
+        self.env.config.set('browser', 'prerender', True)
+        self.prerenderer.changeset_added(repos, Mock(rev=2))
+        self.prerenderer.changeset_added(repos, Mock(rev=3))
+        thread = self.prerenderer._thread
+        if thread:
+            thread.join()
+        self.assertEqual([('repos', 2), ('repos', 3)], jobs)
+        self.assertIsNone(self.prerenderer._thread)
+
 
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BrowserModulePermissionsTestCase))
+    suite.addTest(unittest.makeSuite(FilePrerendererTestCase))
     return suite
 
 
@@ -15,7 +15,9 @@ import unittest
 
 from trac.core import TracError
 from trac.test import EnvironmentStub, MockRequest
-from trac.versioncontrol.web_ui.changeset import ChangesetModule
+from trac.versioncontrol.web_ui.changeset import ChangesetModule, \
+                                                DifflibDiffEngine, \
+                                                PatienceDiffEngine
 
 
 class ChangesetModuleTestCase(unittest.TestCase):
@@ -29,6 +31,71 @@ class ChangesetModuleTestCase(unittest.TestCase):
         req = MockRequest(self.env, args={'new_path': '/'})
         self.assertRaises(TracError, self.cm.process_request, req)
 
+    def test_diff_cache(self):
+        self.env.config.set('changeset', 'diff_cache_size', 2)
+        calls = []
+        def diff(blocks):
+            def diff(engine):
+                calls.append(blocks)
+                return blocks
+            return diff
+
+        self.assertEqual(['a'], self.cm._get_diff_blocks('a', diff(['a'])))
+        self.assertEqual(['b'], self.cm._get_diff_blocks('b', diff(['b'])))
+        self.assertEqual(['a'], self.cm._get_diff_blocks('a', diff(['x'])))
+        self.assertEqual(['c'], self.cm._get_diff_blocks('c', diff(['c'])))
+        self.assertEqual(['y'], self.cm._get_diff_blocks('b', diff(['y'])))
+        self.assertEqual([['a'], ['b'], ['c'], ['y']], calls)
+
+    def test_diff_cache_max_bytes(self):
+        self.env.config.set('changeset', 'diff_cache_max_bytes', 100)
+        calls = []
+        def diff(blocks):
+            def diff(engine):
+                calls.append(blocks)
+                return blocks
+            return diff
+
+        self.cm._get_diff_blocks('a', diff(['a']), 101)
+        self.cm._get_diff_blocks('a', diff(['a']), 101)
+        self.cm._get_diff_blocks('b', diff(['b']), 60)
+        self.cm._get_diff_blocks('c', diff(['c']), 30)
+        self.cm._get_diff_blocks('b', diff(['b']), 60)
+        self.cm._get_diff_blocks('d', diff(['d']), 50)
+        self.cm._get_diff_blocks('d', diff(['d']), 50)
+        self.cm._get_diff_blocks('b', diff(['b']), 60)
+        self.assertEqual([['a'], ['a'], ['b'], ['c'], ['d'], ['b']], calls)
+        self.assertEqual(60, self.cm._diff_cache_bytes)
+
+    def test_diff_cache_disabled(self):
+        self.env.config.set('changeset', 'diff_cache_size', 0)
+        self.assertEqual(['a'], self.cm._get_diff_blocks('a',
+                                                         lambda e: ['a']))
+        self.assertEqual(['b'], self.cm._get_diff_blocks('a',
+                                                         lambda e: ['b']))
+
+    def test_diff_engine(self):
+        self.assertIsInstance(self.cm.diff_engine, DifflibDiffEngine)
+        self.env.config.set('changeset', 'diff_engine', 'PatienceDiffEngine')
+        self.assertIsInstance(self.cm.diff_engine, PatienceDiffEngine)
+
+    def test_diff_cache_timed_out(self):
+        """Differences are not cached when the diff engine timed out."""
+        self.env.config.set('changeset', 'diff_engine', 'PatienceDiffEngine')
+        self.env.config.set('changeset', 'diff_timeout', -1)
+        calls = []
+        def diff(engine):
+            calls.append(engine)
+            return engine(['a', 'x', 'x'], ['b', 'x']).get_opcodes()
+        self.cm._get_diff_blocks('a', diff)
+        self.cm._get_diff_blocks('a', diff)
+        self.assertEqual(2, len(calls))
+
+        self.env.config.set('changeset', 'diff_timeout', 2)
+        self.cm._get_diff_blocks('b', diff)
+        self.cm._get_diff_blocks('b', diff)
+        self.assertEqual(3, len(calls))
+
 
 def test_suite():
     suite = unittest.TestSuite()
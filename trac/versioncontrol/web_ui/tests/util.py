@@ -11,9 +11,14 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/.
 
+import io
 import unittest
+import zipfile
+from datetime import datetime
 
 from trac.test import Mock
+from trac.util import create_zipinfo
+from trac.util.datefmt import utc
 from trac.versioncontrol.api import EmptyChangeset, NoSuchChangeset
 from trac.versioncontrol.web_ui import util
 
@@ -33,6 +38,35 @@ class UtilTestCase(unittest.TestCase):
         self.assertEqual(rev, changes[rev].rev)
         self.assertEqual(repos, changes[rev].repos)
 
+    def test_zip_stream_writer(self):
+        t = datetime(2017, 3, 31, 12, 34, 56, tzinfo=utc)
+        content = ''.join('line %d\n' % idx for idx in xrange(10000))
+        chunks = [content[idx:idx + 4096]
+                  for idx in xrange(0, len(content), 4096)]
+        out = io.BytesIO()
+        zipstream = util.ZipStreamWriter(out.write)
+        zipstream.write(create_zipinfo(u'dir/', mtime=t, dir=True), ())
+        zipstream.write(create_zipinfo(u'dir/f\xefle.txt', mtime=t), chunks)
+        zipstream.write(create_zipinfo(u'dir/link', mtime=t, symlink=True),
+                        ['f\xc3\xafle.txt'])
+        zipstream.write(create_zipinfo(u'dir/empty.txt', mtime=t), ())
+        zipstream.close()
+
+        out.seek(0)
+        z = zipfile.ZipFile(out)
+        self.assertIsNone(z.testzip())
+        self.assertEqual([u'dir/', u'dir/f\xefle.txt', u'dir/link',
+                          u'dir/empty.txt'], z.namelist())
+        self.assertEqual(content, z.read(u'dir/f\xefle.txt'))
+        self.assertEqual('f\xc3\xafle.txt', z.read(u'dir/link'))
+        self.assertEqual('', z.read(u'dir/empty.txt'))
+        zi = z.getinfo(u'dir/f\xefle.txt')
+        self.assertEqual(zipfile.ZIP_DEFLATED, zi.compress_type)
+        self.assertLess(zi.compress_size, zi.file_size)
+        self.assertEqual((2017, 3, 31, 12, 34, 56), zi.date_time)
+        self.assertEqual(zipfile.ZIP_STORED,
+                         z.getinfo(u'dir/link').compress_type)
+
 
 def test_suite():
     suite = unittest.TestSuite()
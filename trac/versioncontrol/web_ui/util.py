@@ -16,14 +16,21 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christian Boos <cboos@edgewall.org>
 
+import hashlib
+import os
+import struct
+import zlib
 from itertools import izip
-from tempfile import TemporaryFile
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import (LargeZipFile, ZIP64_LIMIT, ZIP_FILECOUNT_LIMIT,
+                     ZIP_STORED, structCentralDir, structEndArchive,
+                     stringCentralDir, stringEndArchive)
 
+from trac.core import TracError
 from trac.resource import ResourceNotFound
-from trac.util import content_disposition, create_zipinfo
+from trac.util import AtomicFile, content_disposition, create_zipinfo
 from trac.util.datefmt import http_date
 from trac.util.html import tag
+from trac.util.text import pretty_size
 from trac.util.translation import tag_, _
 from trac.versioncontrol.api import EmptyChangeset, NoSuchChangeset, \
                                     NoSuchNode
@@ -31,7 +38,9 @@ from trac.web.api import RequestDone
 
 __all__ = ['content_closing', 'get_changes', 'get_path_links',
            'get_existing_node', 'get_allowed_node', 'make_log_graph',
-           'render_zip']
+           'render_zip', 'ZipStreamWriter']
+
+_CHUNK_SIZE = 4096
 
 
 class content_closing(object):
@@ -186,23 +195,154 @@ def make_log_graph(repos, revs):
     return threads, vertices, columns
 
 
-def render_zip(req, filename, repos, root_node, iter_nodes):
+class ZipStreamWriter(object):
+    """Write a ZIP archive as a stream, without ever seeking back.
+
+    The content of the deflated entries is compressed chunk by chunk,
+    their CRC and sizes being written in a data descriptor following
+    the compressed data. The stored entries (directories and symbolic
+    links) are small and written at once.
+
+    :since: 1.3.4
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._offset = 0
+        self._entries = []
+
+    def write(self, zinfo, chunks):
+        """Add an entry to the archive.
+
+        :param zinfo: the `ZipInfo` of the entry, as returned by
+                      `~trac.util.create_zipinfo`
+        :param chunks: iterable of the `str` chunks of the content
+        """
+        zinfo.header_offset = self._offset
+        if zinfo.compress_type == ZIP_STORED:
+            data = ''.join(chunks)
+            zinfo.CRC = zlib.crc32(data) & 0xffffffff
+            zinfo.file_size = zinfo.compress_size = len(data)
+            self._check_size(zinfo)
+            self._output(zinfo.FileHeader(False))
+            self._output(data)
+        else:
+            zinfo.flag_bits |= 0x08
+            self._output(zinfo.FileHeader(False))
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, -15)
+            crc = file_size = compress_size = 0
+            for chunk in chunks:
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                data = compressor.compress(chunk)
+                compress_size += len(data)
+                self._output(data)
+            data = compressor.flush()
+            compress_size += len(data)
+            self._output(data)
+            zinfo.CRC = crc & 0xffffffff
+            zinfo.file_size = file_size
+            zinfo.compress_size = compress_size
+            self._check_size(zinfo)
+            self._output(struct.pack('<4sLLL', 'PK\x07\x08', zinfo.CRC,
+                                     compress_size, file_size))
+        self._entries.append(zinfo)
+
+    def close(self):
+        """Write the central directory and the end of archive record."""
+        start = self._offset
+        for zinfo in self._entries:
+            dt = zinfo.date_time
+            dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+            dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+            self._output(struct.pack(structCentralDir, stringCentralDir,
+                                     zinfo.create_version,
+                                     zinfo.create_system,
+                                     zinfo.extract_version, zinfo.reserved,
+                                     zinfo.flag_bits, zinfo.compress_type,
+                                     dostime, dosdate, zinfo.CRC,
+                                     zinfo.compress_size, zinfo.file_size,
+                                     len(zinfo.filename), len(zinfo.extra),
+                                     len(zinfo.comment), 0,
+                                     zinfo.internal_attr,
+                                     zinfo.external_attr,
+                                     zinfo.header_offset))
+            self._output(zinfo.filename)
+            self._output(zinfo.extra)
+            self._output(zinfo.comment)
+        count = len(self._entries)
+        if count > ZIP_FILECOUNT_LIMIT or self._offset > ZIP64_LIMIT:
+            raise LargeZipFile("Archive would require ZIP64 extensions")
+        self._output(struct.pack(structEndArchive, stringEndArchive, 0, 0,
+                                 count, count, self._offset - start, start,
+                                 0))
+
+    def _check_size(self, zinfo):
+        if zinfo.file_size > ZIP64_LIMIT or \
+                zinfo.compress_size > ZIP64_LIMIT or \
+                self._offset > ZIP64_LIMIT:
+            raise LargeZipFile("Filesize would require ZIP64 extensions")
+
+    def _output(self, data):
+        self._write(data)
+        self._offset += len(data)
+
+
+def render_zip(req, filename, repos, root_node, iter_nodes, max_size=0,
+               cache_dir=None, cache_size=0):
     """Send a ZIP file containing the data corresponding to the `nodes`
     iterable.
 
+    The archive is streamed while it is built, reading the content of
+    the files by chunks.
+
     :type root_node: `~trac.versioncontrol.api.Node`
     :param root_node: optional ancestor for all the *nodes*
 
     :param iter_nodes: callable taking the optional *root_node* as input
                        and generating the `~trac.versioncontrol.api.Node`
                        for which the content should be added into the zip.
+
+    :param max_size: if positive, the maximum total size (in bytes) of
+                     the files; a `TracError` is raised if it is exceeded.
+
+    :param cache_dir: optional directory where the archive is kept, for
+                      the following requests of the same *root_node*.
+
+    :param cache_size: maximum total size (in bytes) of the archives in
+                       *cache_dir*, the least recently used being removed
+                       first.
     """
-    req.send_response(200)
-    req.send_header('Content-Type', 'application/zip')
-    req.send_header('Content-Disposition',
-                    content_disposition('inline', filename))
+    cache_path = None
+    if cache_dir and root_node:
+        key = repr((repos.reponame, root_node.path, root_node.rev))
+        cache_path = os.path.join(cache_dir,
+                                  hashlib.sha1(key).hexdigest() + '.zip')
+        try:
+            fileobj = open(cache_path, 'rb')
+        except IOError:
+            pass
+        else:
+            with fileobj:
+                os.utime(cache_path, None)
+                _send_zip_headers(req, filename, root_node,
+                                  os.fstat(fileobj.fileno()).st_size)
+                for chunk in _iter_chunks(fileobj):
+                    req.write(chunk)
+            raise RequestDone
+
+    if max_size > 0:
+        nodes = list(iter_nodes(root_node))
+        total_size = sum(node.content_length or 0 for node in nodes
+                         if node.isfile)
+        if total_size > max_size:
+            raise TracError(_("Maximum total size for a zip archive: "
+                              "%(num)s", num=pretty_size(max_size)),
+                            _("Download failed"))
+        iter_nodes = lambda root_node: nodes
+
     if root_node:
-        req.send_header('Last-Modified', http_date(root_node.last_modified))
         root_path = root_node.path.rstrip('/')
     else:
         root_path = ''
@@ -212,47 +352,97 @@ def render_zip(req, filename, repos, root_node, iter_nodes):
     else:
         root_name = ''
     root_len = len(root_path)
-    req.end_headers()
 
-    def write_partial(fileobj, start):
-        end = fileobj.tell()
-        fileobj.seek(start, 0)
-        remaining = end - start
-        while remaining > 0:
-            chunk = fileobj.read(min(remaining, 4096))
-            req.write(chunk)
-            remaining -= len(chunk)
-        fileobj.seek(end, 0)
-        return end
-
-    pos = 0
-    with TemporaryFile(prefix='trac-', suffix='.zip') as fileobj:
-        with ZipFile(fileobj, 'w', ZIP_DEFLATED) as zipfile:
-            for node in iter_nodes(root_node):
-                if node is root_node:
-                    continue
-                path = node.path.strip('/')
-                assert path.startswith(root_path)
-                path = root_name + path[root_len:]
-                kwargs = {'mtime': node.last_modified}
-                data = None
-                if node.isfile:
-                    with content_closing(
-                            node.get_processed_content(eol_hint='CRLF')) \
-                            as content:
-                        data = content.read()
-                    props = node.get_properties()
+    cache_file = None
+    if cache_path:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            cache_file = AtomicFile(cache_path, 'wb')
+        except (IOError, OSError):
+            pass
+
+    def write(data):
+        req.write(data)
+        if cache_file:
+            cache_file.write(data)
+
+    _send_zip_headers(req, filename, root_node)
+    try:
+        zipstream = ZipStreamWriter(write)
+        for node in iter_nodes(root_node):
+            if node is root_node:
+                continue
+            path = node.path.strip('/')
+            assert path.startswith(root_path)
+            path = root_name + path[root_len:]
+            kwargs = {'mtime': node.last_modified}
+            if node.isfile:
+                props = node.get_properties()
+                # Subversion specific
+                if 'svn:executable' in props:
+                    kwargs['executable'] = True
+                with content_closing(
+                        node.get_processed_content(eol_hint='CRLF')) \
+                        as content:
+                    chunk = content.read(_CHUNK_SIZE)
                     # Subversion specific
-                    if 'svn:special' in props and data.startswith('link '):
-                        data = data[5:]
+                    if 'svn:special' in props and chunk.startswith('link '):
+                        chunk = chunk[5:]
                         kwargs['symlink'] = True
-                    if 'svn:executable' in props:
-                        kwargs['executable'] = True
-                elif node.isdir and path:
-                    kwargs['dir'] = True
-                    data = ''
-                if data is not None:
-                    zipfile.writestr(create_zipinfo(path, **kwargs), data)
-                    pos = write_partial(fileobj, pos)
-        write_partial(fileobj, pos)
+                    zipstream.write(create_zipinfo(path, **kwargs),
+                                    _iter_chunks(content, chunk))
+            elif node.isdir and path:
+                kwargs['dir'] = True
+                zipstream.write(create_zipinfo(path, **kwargs), ())
+        zipstream.close()
+    except Exception:
+        if cache_file:
+            cache_file.rollback()
+        raise
+    if cache_file:
+        try:
+            cache_file.commit()
+            _prune_zip_cache(cache_dir, cache_size)
+        except (IOError, OSError):
+            pass
     raise RequestDone
+
+
+def _send_zip_headers(req, filename, root_node, length=None):
+    req.send_response(200)
+    req.send_header('Content-Type', 'application/zip')
+    req.send_header('Content-Disposition',
+                    content_disposition('inline', filename))
+    if root_node:
+        req.send_header('Last-Modified', http_date(root_node.last_modified))
+    if length is not None:
+        req.send_header('Content-Length', length)
+    req.end_headers()
+
+
+def _iter_chunks(fileobj, chunk=''):
+    if chunk:
+        yield chunk
+    while True:
+        chunk = fileobj.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _prune_zip_cache(cache_dir, cache_size):
+    archives = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.zip'):
+            st = os.stat(os.path.join(cache_dir, name))
+            archives.append((st.st_mtime, st.st_size, name))
+    total_size = sum(size for mtime, size, name in archives)
+    for mtime, size, name in sorted(archives):
+        if total_size <= cache_size:
+            break
+        try:
+            os.unlink(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total_size -= size
@@ -803,6 +803,7 @@ class Chrome(Component):
         yield ('htdocs', self._format_link)
 
     def _format_link(self, formatter, ns, file, label):
+        formatter.depends_on()
         file, query, fragment = formatter.split_link(file)
         href = formatter.href.chrome('site', file) + query + fragment
         return tag.a(label, href=href)
@@ -40,6 +40,7 @@ from trac.config import BoolOption, ChoiceOption, ConfigSection, \
                         ConfigurationError, ExtensionOption, Option, \
                         OrderedExtensionsOption
 from trac.core import *
+from trac.db.api import DatabaseManager
 from trac.env import open_environment
 from trac.loader import get_plugin_info, match_plugins_to_frames
 from trac.perm import PermissionCache, PermissionError
@@ -201,6 +202,7 @@ class RequestDispatcher(Component):
         passed to the the template and adds the web site chrome.
         """
         self.log.debug('Dispatching %r', req)
+        self._stick_to_primary_database(req)
         chrome = Chrome(self.env)
 
         try:
@@ -317,6 +319,32 @@ class RequestDispatcher(Component):
 
     # Internal methods
 
+    _primary_cookie = 'trac_db_primary'
+
+    def _stick_to_primary_database(self, req):
+        """Send the read-only queries to the primary database rather than
+        to the replicas if the user recently wrote to the database, as
+        recorded in a cookie.
+        """
+        dbm = DatabaseManager(self.env)
+        if not dbm.replica_uris:
+            return
+        try:
+            until = int(req.incookie[self._primary_cookie].value)
+        except (KeyError, ValueError):
+            until = 0
+
+        def bake_cookie(until):
+            name = self._primary_cookie
+            req.outcookie[name] = int(until) + 1
+            req.outcookie[name]['path'] = req.base_path or '/'
+            req.outcookie[name]['expires'] = dbm.replica_stickiness + 1
+            if self.env.secure_cookies:
+                req.outcookie[name]['secure'] = True
+            req.outcookie[name]['httponly'] = True
+
+        dbm.stick_to_primary(until, bake_cookie)
+
     def set_default_callbacks(self, req):
         """Setup request callbacks for lazily-evaluated properties.
         """
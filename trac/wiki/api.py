@@ -16,6 +16,7 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+import bisect
 import re
 
 from trac.cache import cached
@@ -196,6 +197,25 @@ class IWikiSyntaxProvider(Interface):
         for the link.
         """
 
+
+class IWikiLinkPrefetcher(Interface):
+    """Look up in bulk the resources targeted by the wiki links.
+
+    :since: 1.3.4
+    """
+
+    def prefetch_links(formatter, lines):
+        """Called by the `formatter` before rendering the `lines` of
+        wiki text.
+
+        The resources which may be targeted by the links rendered by
+        the component can be retrieved at once and stored in the
+        `formatter.prefetched` dictionary, usually under the realm of
+        the resources, for use by the link resolvers. The `lines` can
+        contain more links than what is actually rendered, for example
+        in code blocks.
+        """
+
 def parse_args(args, strict=True):
     """Utility for parsing macro "content" and splitting them into arguments.
 
@@ -245,12 +265,77 @@ def validate_page_name(pagename):
            all(part not in ('', '.', '..') for part in pagename.split('/'))
 
 
+class WikiPageNames(frozenset):
+    """Set of wiki page names, also kept in sorted order for listing
+    the names by prefix and by level in the hierarchy of pages.
+
+    :since: 1.3.4
+    """
+
+    def __new__(cls, names=(), _sorted=None):
+        self = super(WikiPageNames, cls).__new__(cls, names)
+        self._sorted = sorted(self) if _sorted is None else _sorted
+        return self
+
+    def iter_names(self, prefix=None, depth=None):
+        """Iterate in order over the names starting with `prefix`.
+
+        If `depth` is given, only the names at most `depth` levels
+        below the level of `prefix` in the hierarchy are included.
+        The deeper names are skipped without being looked at one by
+        one.
+
+        >>> names = WikiPageNames(['A', 'A/B', 'A/B/C', 'A/B-C', 'B'])
+        >>> list(names.iter_names('A'))
+        ['A', 'A/B', 'A/B-C', 'A/B/C']
+        >>> list(names.iter_names('A/', depth=0))
+        ['A/B', 'A/B-C']
+        >>> list(names.iter_names(depth=0))
+        ['A', 'B']
+        """
+        names = self._sorted
+        prefix = prefix or ''
+        if depth is not None:
+            depth += prefix.count('/')
+        idx = bisect.bisect_left(names, prefix)
+        while idx < len(names):
+            name = names[idx]
+            if not name.startswith(prefix):
+                break
+            if depth is None or name.count('/') <= depth:
+                yield name
+                idx += 1
+            else:
+                # Skip the names having the same ancestor at the
+                # maximal depth
+                pos = -1
+                for level in xrange(depth + 1):
+                    pos = name.index('/', pos + 1)
+                idx = bisect.bisect_left(names, name[:pos] + '0', idx + 1)
+
+    def updated(self, added=(), removed=()):
+        """Return a copy of the set with the `added` names and without
+        the `removed` names.
+        """
+        names = list(self._sorted)
+        for name in removed:
+            idx = bisect.bisect_left(names, name)
+            if idx < len(names) and names[idx] == name:
+                del names[idx]
+        for name in added:
+            idx = bisect.bisect_left(names, name)
+            if idx == len(names) or names[idx] != name:
+                names.insert(idx, name)
+        return WikiPageNames(names, names)
+
+
 class WikiSystem(Component):
     """Wiki system manager."""
 
     implements(IResourceManager, IWikiSyntaxProvider)
 
     change_listeners = ExtensionPoint(IWikiChangeListener)
+    link_prefetchers = ExtensionPoint(IWikiLinkPrefetcher)
     macro_providers = ExtensionPoint(IWikiMacroProvider)
     syntax_providers = ExtensionPoint(IWikiSyntaxProvider)
 
@@ -292,21 +377,28 @@ class WikiSystem(Component):
 
     @cached
     def pages(self):
-        """Return the names of all existing wiki pages."""
-        return {name for name,
-                     in self.env.db_query("SELECT DISTINCT name FROM wiki")}
+        """Return the names of all existing wiki pages, as a
+        `WikiPageNames` set.
+        """
+        return WikiPageNames(name for name,
+                             in self.env.db_query("SELECT DISTINCT name "
+                                                  "FROM wiki"))
 
     # Public API
 
-    def get_pages(self, prefix=None):
-        """Iterate over the names of existing Wiki pages.
+    def get_pages(self, prefix=None, depth=None):
+        """Iterate over the names of existing Wiki pages, in sorted
+        order.
 
         :param prefix: if given, only names that start with that
           prefix are included.
+        :param depth: if given, only names at most `depth` levels
+          below the level of `prefix` in the hierarchy are included.
+
+        :since 1.3.4: the names are sorted and the `depth` parameter
+          was added.
         """
-        for page in self.pages:
-            if not prefix or page.startswith(prefix):
-                yield page
+        return self.pages.iter_names(prefix, depth)
 
     def has_page(self, pagename):
         """Whether a page with the specified name exists."""
@@ -410,6 +502,7 @@ class WikiSystem(Component):
 
     def _format_link(self, formatter, ns, pagename, label, ignore_missing,
                      original_label=None):
+        formatter.depends_on(self.realm)
         pagename, query, fragment = formatter.split_link(pagename)
         version = None
         if '@' in pagename:
@@ -447,6 +540,13 @@ class WikiSystem(Component):
             return tag.a(label, class_='forbidden wiki',
                          title=_("no permission to view this wiki page"))
 
+    def _update_pages(self, added=(), removed=()):
+        # Update the page names cached by this process rather than
+        # retrieving all of them again, and invalidate them in the
+        # other processes
+        WikiSystem.pages.update(self, lambda pages: pages.updated(added,
+                                                                  removed))
+
     def _resolve_relative_name(self, pagename, referrer):
         base = referrer.split('/')
         components = pagename.split('/')
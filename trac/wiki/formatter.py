@@ -34,14 +34,16 @@ from trac.util.html import (
     Element, Fragment, Markup, Stream, TracHTMLSanitizer, escape, genshi,
     plaintext, stream_to_unicode, tag, to_fragment
 )
+from trac.util.concurrency import ThreadLocal
 from trac.util.translation import _, tag_
 from trac.wiki.api import WikiSystem, parse_args
 from trac.wiki.parser import WikiParser, parse_processor_args
 
 __all__ = ['Formatter', 'MacroError', 'ProcessorError',
-           'concat_path_query_fragment', 'extract_link', 'format_to',
-           'format_to_html', 'format_to_oneliner',
-           'split_url_into_path_query_fragment', 'wiki_to_outline']
+           'RenderDependencies', 'concat_path_query_fragment',
+           'extract_link', 'format_to', 'format_to_html',
+           'format_to_oneliner', 'split_url_into_path_query_fragment',
+           'wiki_to_outline']
 
 
 def _markup_to_unicode(markup):
@@ -128,6 +130,74 @@ class ProcessorError(TracError):
     pass
 
 
+class RenderDependencies(object):
+    """Collect the dependencies of the output of a wiki text being
+    rendered, as declared by the link resolvers, wiki syntax handlers
+    and macros with `Formatter.depends_on`.
+
+    Used as a context manager around the rendering. The dependencies
+    of nested renderings are added to the dependencies of the
+    enclosing one.
+
+    :since: 1.3.4
+    """
+
+    _local = ThreadLocal(current=None)
+
+    def __init__(self):
+        self.names = set()
+        #: `False` if some output didn't declare its dependencies
+        self.cacheable = True
+        self._declared = True
+        self._parent = None
+
+    def __enter__(self):
+        self._parent = self._local.current
+        self._local.current = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._local.current = parent = self._parent
+        self._parent = None
+        if parent is not None:
+            parent.add(self.names)
+            parent.cacheable = parent.cacheable and self.cacheable
+
+    @classmethod
+    def current(cls):
+        """Return the dependencies of the innermost rendering in
+        progress in this thread, if any.
+        """
+        return cls._local.current
+
+    def add(self, names):
+        self.names.update(names)
+
+    def declare(self, names):
+        self.names.update(names)
+        self._declared = True
+
+    def call(self, fn, *args):
+        """Call an extension producing part of the output, which is
+        not cacheable if the extension doesn't declare its dependencies.
+        """
+        declared = self._declared
+        self._declared = False
+        try:
+            return fn(*args)
+        finally:
+            if not self._declared:
+                self.cacheable = False
+            self._declared = declared
+
+
+def _call_extension(fn, *args):
+    dependencies = RenderDependencies.current()
+    if dependencies is None:
+        return fn(*args)
+    return dependencies.call(fn, *args)
+
+
 class WikiProcessor(object):
 
     _code_block_re = re.compile('^<div(?:\s+class="([^"]+)")?>(.*)</div>$')
@@ -354,11 +424,12 @@ class WikiProcessor(object):
         self.env.log.debug('Executing Wiki macro %s by provider %s',
                            self.name, self.macro_provider)
         if arity(self.macro_provider.expand_macro) == 4:
-            return self.macro_provider.expand_macro(self.formatter, self.name,
-                                                    text, self.args)
+            return _call_extension(self.macro_provider.expand_macro,
+                                   self.formatter, self.name, text,
+                                   self.args)
         else:
-            return self.macro_provider.expand_macro(self.formatter, self.name,
-                                                    text)
+            return _call_extension(self.macro_provider.expand_macro,
+                                   self.formatter, self.name, text)
 
     def _mimeview_processor(self, text):
         annotations = []
@@ -375,9 +446,11 @@ class WikiProcessor(object):
             annotations.append('lineno')
         if args:  # Remaining args are assumed to be lexer options
             context.set_hints(lexer_options=args)
+        # The renderers may add stylesheets or warnings to the request,
+        # which wouldn't be added again if the output was cached
         return tag.div(class_='wiki-code')(
-            Mimeview(self.env).render(context, self.name, text,
-                                      annotations=annotations))
+            _call_extension(Mimeview(self.env).render, context, self.name,
+                            text, None, None, annotations))
     # TODO: use convert('text/html') instead of render
 
     def process(self, text, in_paragraph=False):
@@ -447,6 +520,7 @@ class Formatter(object):
         self._anchors = {}
         self._open_tags = []
         self._safe_schemes = None
+        self.prefetched = {}
         if not self.wiki.render_unsafe_content:
             self._safe_schemes = set(self.wiki.safe_schemes)
 
@@ -454,6 +528,24 @@ class Formatter(object):
     def split_link(self, target):
         return split_url_into_path_query_fragment(target)
 
+    def depends_on(self, *names):
+        """Declare what the output of the link resolver, wiki syntax
+        handler or macro being called depends on, besides the wiki text
+        and the rendering context.
+
+        The names are usually resource realms, like `'wiki'` or
+        `'ticket'`, and the rendered output is cached until a resource
+        of one of the realms changes. Calling this method without
+        arguments declares that the output only depends on the wiki
+        text and the rendering context. The output of the extensions
+        which don't call this method is never cached.
+
+        :since: 1.3.4
+        """
+        dependencies = RenderDependencies.current()
+        if dependencies is not None:
+            dependencies.declare(names)
+
     # -- Pre- IWikiSyntaxProvider rules (Font styles)
 
     _indirect_tags = {
@@ -680,10 +772,11 @@ class Formatter(object):
         if ns in self.wikiparser.link_resolvers:
             resolver = self.wikiparser.link_resolvers[ns]
             if arity(resolver) == 5:
-                return resolver(self, ns, target, escape(label, False),
-                                fullmatch)
+                return _call_extension(resolver, self, ns, target,
+                                       escape(label, False), fullmatch)
             else:
-                return resolver(self, ns, target, escape(label, False))
+                return _call_extension(resolver, self, ns, target,
+                                       escape(label, False))
         elif ns == "mailto":
             from trac.web.chrome import Chrome
             chrome = Chrome(self.env)
@@ -737,6 +830,9 @@ class Formatter(object):
 
     def _make_interwiki_link(self, ns, target, label):
         from trac.wiki.interwiki import InterWikiMap
+        dependencies = RenderDependencies.current()
+        if dependencies is not None:
+            dependencies.add(['wiki'])  # the InterMapTxt page
         interwiki = InterWikiMap(self.env)
         if ns in interwiki:
             url, title = interwiki.url(ns, target)
@@ -1260,17 +1356,28 @@ class Formatter(object):
     # -- Wiki engine
 
     def handle_match(self, fullmatch):
-        for itype, match in fullmatch.groupdict().items():
-            if match and not itype in self.wikiparser.helper_patterns:
-                # Check for preceding escape character '!'
-                if match[0] == '!':
-                    return escape(match[1:])
-                if itype in self.wikiparser.external_handlers:
-                    external_handler = self.wikiparser.external_handlers[itype]
-                    return external_handler(self, match, fullmatch)
-                else:
-                    internal_handler = getattr(self, '_%s_formatter' % itype)
-                    return internal_handler(match, fullmatch)
+        # The group of the matching rule encloses all the groups of
+        # the rule, hence it is the last group matched
+        itype = fullmatch.lastgroup
+        if itype is None or itype in self.wikiparser.helper_patterns:
+            for itype, match in fullmatch.groupdict().iteritems():
+                if match and itype not in self.wikiparser.helper_patterns:
+                    break
+            else:
+                return
+        match = fullmatch.group(itype)
+        if not match:
+            return
+        # Check for preceding escape character '!'
+        if match[0] == '!':
+            return escape(match[1:])
+        if itype in self.wikiparser.external_handlers:
+            external_handler = self.wikiparser.external_handlers[itype]
+            return _call_extension(external_handler, self, match,
+                                   fullmatch)
+        else:
+            internal_handler = getattr(self, '_%s_formatter' % itype)
+            return internal_handler(match, fullmatch)
 
     def replace(self, fullmatch):
         """Replace one match with its corresponding expansion"""
@@ -1278,6 +1385,25 @@ class Formatter(object):
         if replacement:
             return _markup_to_unicode(replacement)
 
+    def replace_all(self, text):
+        """Replace all the matches in `text` with their corresponding
+        expansion.
+
+        :since: 1.3.4
+        """
+        return u''.join(token if isinstance(token, basestring)
+                        else self.replace(token) or u''
+                        for token in self.wikiparser.tokenize(text))
+
+    def prefetch_links(self, lines):
+        """Let the `IWikiLinkPrefetcher`s look up in bulk the resources
+        targeted by the links in the `lines` of wiki text.
+
+        :since: 1.3.4
+        """
+        for prefetcher in self.wiki.link_prefetchers:
+            prefetcher.prefetch_links(self, lines)
+
     _normalize_re = re.compile(r'[\v\f]', re.UNICODE)
 
     def reset(self, source, out=None):
@@ -1288,6 +1414,7 @@ class Formatter(object):
             def write(self, data):
                 pass
         self.out = out or NullOut()
+        self.prefetched = {}
         self._open_tags = []
         self._list_stack = []
         self._quote_stack = []
@@ -1308,6 +1435,9 @@ class Formatter(object):
         text = self.reset(text, out)
         if isinstance(text, basestring):
             text = text.splitlines()
+        else:
+            text = list(text)
+        self.prefetch_links(text)
 
         for line in text:
             if isinstance(line, str):
@@ -1361,7 +1491,7 @@ class Formatter(object):
             self.in_quote = False
             # Throw a bunch of regexps on the problem
             self.line = line
-            result = re.sub(self.wikiparser.rules, self.replace, line)
+            result = self.replace_all(line)
 
             if not self.in_list_item:
                 self.close_list()
@@ -1465,7 +1595,8 @@ class OneLinerFormatter(Formatter):
         if shorten:
             result = shorten_line(result)
 
-        result = re.sub(self.wikiparser.rules, self.replace, result)
+        self.prefetch_links([result])
+        result = self.replace_all(result)
         result = result.replace('[...]', u'[\u2026]')
         if result.endswith('...'):
             result = result[:-3] + u'\u2026'
@@ -1499,6 +1630,9 @@ class OutlineFormatter(Formatter):
         elif line.strip() == WikiParser.ENDBLOCK:
             self.in_code_block -= 1
 
+    def prefetch_links(self, lines):
+        pass
+
     def format(self, text, out, max_depth=6, min_depth=1, shorten=True):
         self.shorten = shorten
         whitespace_indent = '  '
@@ -1554,9 +1688,9 @@ class LinkFormatter(OutlineFormatter):
         """Return the Wiki match found at the beginning of the `wikitext`"""
         wikitext = self.reset(wikitext)
         self.line = wikitext
-        match = re.match(self.wikiparser.rules, wikitext)
-        if match:
-            return self.handle_match(match)
+        tokens = self.wikiparser.tokenize(wikitext)
+        if tokens and not isinstance(tokens[0], basestring):
+            return self.handle_match(tokens[0])
 
 
 # Pure Wiki Formatter
@@ -1626,14 +1760,27 @@ def format_to_html(env, context, wikidom, escape_newlines=None):
         return Markup()
     if escape_newlines is None:
         escape_newlines = context.get_hint('preserve_newlines', False)
-    return HtmlFormatter(env, context, wikidom).generate(escape_newlines)
+    return _render_cached(env, context, HtmlFormatter.flavor, wikidom,
+                          escape_newlines,
+                          lambda: HtmlFormatter(env, context, wikidom)
+                                  .generate(escape_newlines))
 
 def format_to_oneliner(env, context, wikidom, shorten=None):
     if not wikidom:
         return Markup()
     if shorten is None:
         shorten = context.get_hint('shorten_lines', False)
-    return InlineHtmlFormatter(env, context, wikidom).generate(shorten)
+    return _render_cached(env, context, InlineHtmlFormatter.flavor, wikidom,
+                          shorten,
+                          lambda: InlineHtmlFormatter(env, context, wikidom)
+                                  .generate(shorten))
+
+def _render_cached(env, context, flavor, wikidom, option, generate):
+    from trac.wiki.rendercache import WikiRenderCache
+    cache = env[WikiRenderCache]
+    if cache is None or not isinstance(wikidom, basestring):
+        return generate()
+    return cache.render(context, flavor, wikidom, option, generate)
 
 def extract_link(env, context, wikidom):
     if not wikidom:
@@ -95,6 +95,7 @@ class InterTracDispatcher(Component):
         return 'messages', N_("Provide a list of known InterTrac prefixes.")
 
     def expand_macro(self, formatter, name, content):
+        formatter.depends_on()
         intertracs = {}
         for key, value in self.intertrac_section.options():
             idx = key.rfind('.')
@@ -166,6 +166,7 @@ class InterWikiMap(Component):
                   "prefixes.")
 
     def expand_macro(self, formatter, name, content):
+        formatter.depends_on('wiki')
         interwikis = []
         for k in sorted(self.keys()):
             prefix, url, title = self[k]
@@ -126,6 +126,7 @@ class TitleIndexMacro(WikiMacroBase):
     NUM_SPLIT_RE = re.compile(r"([0-9.]+)")
 
     def expand_macro(self, formatter, name, content):
+        formatter.depends_on('wiki')
         args, kw = parse_args(content)
         prefix = args[0].strip() if args else None
         hideprefix = args and len(args) > 1 and args[1].strip() == 'hideprefix'
@@ -146,18 +147,16 @@ class TitleIndexMacro(WikiMacroBase):
         if prefix and resource and resource.realm == 'wiki':
             prefix = wiki.resolve_relative_name(prefix, resource.id)
 
-        start = prefix.count('/') if prefix else 0
-
         if hideprefix:
             omitprefix = lambda page: page[len(prefix):]
         else:
             omitprefix = lambda page: page
 
-        pages = sorted(page for page in wiki.get_pages(prefix)
-                       if (depth < 0 or depth >= page.count('/') - start)
-                       and 'WIKI_VIEW' in formatter.perm('wiki', page)
-                       and any(fnmatchcase(page, inc) for inc in includes)
-                       and not any(fnmatchcase(page, exc) for exc in excludes))
+        pages = [page for page in wiki.get_pages(prefix,
+                                                 depth if depth >= 0 else None)
+                 if 'WIKI_VIEW' in formatter.perm('wiki', page)
+                 and any(fnmatchcase(page, inc) for inc in includes)
+                 and not any(fnmatchcase(page, exc) for exc in excludes)]
 
         if format == 'compact':
             return tag(
@@ -338,6 +337,7 @@ class RecentChangesMacro(WikiMacroBase):
     """)
 
     def expand_macro(self, formatter, name, content):
+        formatter.depends_on('wiki')
         args, kw = parse_args(content)
         prefix = args[0].strip() if args else None
         limit = _arg_as_int(args[1].strip(), min=1) if len(args) > 1 else None
@@ -417,6 +417,7 @@ class PageOutlineMacro(WikiMacroBase):
     """)
 
     def expand_macro(self, formatter, name, content):
+        formatter.depends_on()
         min_depth, max_depth = 1, 6
         title = None
         inline = False
@@ -733,6 +734,7 @@ class MacroListMacro(WikiMacroBase):
     def expand_macro(self, formatter, name, content):
         from trac.wiki.formatter import system_message
 
+        formatter.depends_on()
         content = content.strip() if content else ''
         name_filter = content.strip('*')
 
@@ -800,6 +802,7 @@ class TracIniMacro(WikiMacroBase):
     def expand_macro(self, formatter, name, content):
         from trac.config import ConfigSection, Option
 
+        formatter.depends_on()
         args, kw = parse_args(content)
         filters = {}
         for name, index in (('section', 0), ('option', 1)):
@@ -876,6 +879,7 @@ class KnownMimeTypesMacro(WikiMacroBase):
 
     def expand_macro(self, formatter, name, content):
         from trac.mimeview.api import Mimeview
+        formatter.depends_on()
         mime_map = Mimeview(self.env).mime_map
         mime_type_filter = ''
         args, kw = parse_args(content)
@@ -942,6 +946,7 @@ class TracGuideTocMacro(WikiMacroBase):
           ]
 
     def expand_macro(self, formatter, name, content):
+        formatter.depends_on('wiki')
         curpage = formatter.resource.id
 
         # scoped TOC (e.g. TranslateRu/TracGuide or 0.11/TracGuide ...)
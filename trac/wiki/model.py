@@ -129,8 +129,8 @@ class WikiPage(object):
                 self._fetch(self.name, None)
 
             if not self.exists:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
+                # Update page name cache
+                WikiSystem(self.env)._update_pages(removed=[self.name])
                 # Delete orphaned attachments
                 from trac.attachment import Attachment
                 Attachment.delete_all(self.env, self.realm, self.name)
@@ -167,8 +167,8 @@ class WikiPage(object):
                 db("UPDATE wiki SET readonly=%s WHERE name=%s",
                    (self.readonly, self.name))
             if self.version == 1:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
+                # Update page name cache
+                WikiSystem(self.env)._update_pages(added=[self.name])
 
         self.author = author
         self.comment = comment
@@ -205,8 +205,9 @@ class WikiPage(object):
                                   name=new_name))
 
             db("UPDATE wiki SET name=%s WHERE name=%s", (new_name, old_name))
-            # Invalidate page name cache
-            del WikiSystem(self.env).pages
+            # Update page name cache
+            WikiSystem(self.env)._update_pages(added=[new_name],
+                                               removed=[old_name])
             # Reparent attachments
             from trac.attachment import Attachment
             Attachment.reparent_all(self.env, self.realm, old_name,
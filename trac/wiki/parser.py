@@ -19,14 +19,25 @@
 #         Christian Boos <cboos@edgewall.org>
 
 import re
+from collections import OrderedDict
 
+from trac.config import IntOption
 from trac.core import *
 from trac.notification import EMAIL_LOOKALIKE_PATTERN
+from trac.util.concurrency import threading
 
 
 class WikiParser(Component):
     """Wiki text parser."""
 
+    tokens_cache_size = IntOption('wiki', 'tokens_cache_size', 5000,
+        """Maximum number of lines of wiki text whose tokens, the
+        plain text and the wiki markup found by the wiki syntax rules,
+        are kept in memory by each process. The tokens of a line are
+        shared by all the renderings of this line. Use `0` to disable
+        the cache. (''since 1.3.4'')
+        """)
+
     # Some constants used for clarifying the Wiki regexps:
 
     BOLDITALIC_TOKEN = "'''''"
@@ -172,6 +183,8 @@ class WikiParser(Component):
         self._link_resolvers = None
         self._helper_patterns = None
         self._external_handlers = None
+        self._tokens_cache = OrderedDict()
+        self._tokens_lock = threading.Lock()
 
     @property
     def rules(self):
@@ -206,7 +219,7 @@ class WikiParser(Component):
                 helpers += helper_re.findall(rule)[1:]
             rules = re.compile('(?:' + '|'.join(syntax) + ')', re.UNICODE)
             self._external_handlers = handlers
-            self._helper_patterns = helpers
+            self._helper_patterns = frozenset(helpers)
             self._compiled_rules = rules
 
     @property
@@ -220,6 +233,45 @@ class WikiParser(Component):
             self._link_resolvers = resolvers
         return self._link_resolvers
 
+    def tokenize(self, text):
+        """Split `text` into the sequence of its plain text parts and
+        of the matches of the wiki syntax `rules`.
+
+        The tokens are returned as a tuple of strings and of match
+        objects, in the order in which they appear in `text`. The
+        rule which matched is the `lastgroup` of the match object.
+        The tokens of the most recently used texts are cached.
+
+        :since: 1.3.4
+        """
+        size = self.tokens_cache_size
+        if size <= 0:
+            return self._tokenize(text)
+        with self._tokens_lock:
+            tokens = self._tokens_cache.pop(text, None)
+            if tokens is not None:
+                self._tokens_cache[text] = tokens
+                return tokens
+        tokens = self._tokenize(text)
+        with self._tokens_lock:
+            self._tokens_cache[text] = tokens
+            while len(self._tokens_cache) > size:
+                self._tokens_cache.popitem(last=False)
+        return tokens
+
+    def _tokenize(self, text):
+        tokens = []
+        pos = 0
+        for match in self.rules.finditer(text):
+            start, end = match.span()
+            if start > pos:
+                tokens.append(text[pos:start])
+            tokens.append(match)
+            pos = end
+        if pos < len(text):
+            tokens.append(text[pos:])
+        return tuple(tokens)
+
     def parse(self, wikitext):
         """Parse `wikitext` and produce a WikiDOM tree."""
         # obviously still some work to do here ;)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import hashlib
+from collections import OrderedDict
+
+from trac.attachment import IAttachmentChangeListener
+from trac.cache import cached_mapping
+from trac.config import IntOption
+from trac.core import *
+from trac.perm import DefaultPermissionPolicy, PermissionSystem
+from trac.ticket.api import ITicketChangeListener
+from trac.util import fq_class_name
+from trac.util.concurrency import threading
+from trac.util.text import to_utf8
+from trac.wiki.api import IWikiChangeListener
+from trac.wiki.formatter import RenderDependencies
+
+__all__ = ['WikiRenderCache']
+
+
+class WikiRenderCache(Component):
+    """Cache of the HTML rendered by `format_to_html` and
+    `format_to_oneliner`.
+
+    The rendered HTML is looked up by a hash of the wiki text, the
+    flavor and options of the rendering and the rendering context
+    (resource, user, locale, time zone and hints). It is only cached
+    when all the link resolvers, wiki syntax handlers and macros used
+    declared what their output depends on, with
+    `Formatter.depends_on`, and it is discarded when one of these
+    dependencies changes, in all the processes serving the environment.
+
+    :since: 1.3.4
+    """
+
+    implements(IAttachmentChangeListener, ITicketChangeListener,
+               IWikiChangeListener)
+
+    size = IntOption('wiki', 'render_cache_size', 500,
+        """Maximum number of rendered wiki texts (pages, ticket
+        descriptions and comments, ...) kept in memory by each process.
+        The wiki text is only rendered again when it changes or when
+        something its rendering depends on, like the existence of a
+        linked page or the status of a linked ticket, changes. The
+        rendered texts are not cached when permission policies other
+        than the default ones are enabled. Use `0` to disable the cache.
+        (''since 1.3.4'')
+        """)
+
+    # The permission policies whose decisions only change when the
+    # permission store or the resources change
+    cacheable_policies = frozenset([
+        'trac.attachment.LegacyAttachmentPolicy',
+        'trac.perm.DefaultPermissionPolicy',
+        'trac.ticket.web_ui.DefaultTicketPolicy',
+        'trac.wiki.web_ui.DefaultWikiPolicy',
+    ])
+
+    # Types of the hint values which can be part of the cache key
+    _hint_types = (basestring, bool, int, long, float, type(None))
+
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, context, flavor, text, option, generate):
+        """Return the HTML rendered for `text` in `context`, calling
+        `generate` to render it when it is not cached.
+        """
+        size = self.size
+        if size <= 0:
+            return generate()
+        enclosing = RenderDependencies.current()
+        key = self._get_key(context, flavor, text, option)
+        if key is not None:
+            # Retrieve the permission token first, so that the cache
+            # metadata of the request predates the rendering
+            permissions = self._permissions_token()
+            with self._lock:
+                entry = self._cache.pop(key, None)
+                if entry is not None:
+                    self._cache[key] = entry
+            if entry is not None:
+                html, names, tokens = entry
+                if all(token is current for token, current
+                       in zip(tokens, self._get_tokens(names, permissions))):
+                    if enclosing is not None:
+                        enclosing.add(names)
+                    return html
+        with RenderDependencies() as dependencies:
+            html = generate()
+        if key is not None and dependencies.cacheable:
+            names = frozenset(dependencies.names)
+            entry = html, names, self._get_tokens(names, permissions)
+            with self._lock:
+                self._cache.pop(key, None)
+                self._cache[key] = entry
+                while len(self._cache) > size:
+                    self._cache.popitem(last=False)
+        return html
+
+    def invalidate(self, *names):
+        """Discard the rendered texts depending on any of `names`, in
+        all the processes.
+        """
+        if self.size > 0:
+            for name in names:
+                del self._generations[name]
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        self.invalidate('attachment')
+
+    def attachment_deleted(self, attachment):
+        self.invalidate('attachment')
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        self.invalidate('attachment')
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.invalidate('ticket')
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate('ticket')
+
+    def ticket_deleted(self, ticket):
+        self.invalidate('ticket')
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        pass
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self.invalidate('ticket')
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self.invalidate('wiki')
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self.invalidate('wiki')
+
+    def wiki_page_deleted(self, page):
+        self.invalidate('wiki')
+
+    def wiki_page_version_deleted(self, page):
+        self.invalidate('wiki')
+
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate('wiki')
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    @cached_mapping
+    def _generations(self, name):
+        # A new object is created each time the dependency is
+        # invalidated
+        return object()
+
+    def _get_tokens(self, names, permissions):
+        return (permissions,) + tuple(self._generations[name]
+                                      for name in sorted(names))
+
+    def _permissions_token(self):
+        policy = self.env[DefaultPermissionPolicy]
+        return policy.permission_cache if policy is not None else None
+
+    def _get_key(self, context, flavor, text, option):
+        if not all(fq_class_name(policy) in self.cacheable_policies
+                   for policy in PermissionSystem(self.env).policies):
+            return None
+        hints = self._get_hints(context)
+        if hints is None:
+            return None
+        resources = []
+        ctx = context
+        while ctx:
+            resource = ctx.resource
+            while resource:
+                resources.append((resource.realm, resource.id,
+                                  resource.version))
+                resource = resource.parent
+            resources.append(None)
+            ctx = ctx.parent
+        href = context.href
+        req = getattr(context, 'req', None)
+        if req is not None:
+            tz = getattr(req, 'tz', None)
+            user = (unicode(getattr(req, 'locale', None)),
+                    getattr(tz, 'zone', unicode(tz)),
+                    getattr(req, 'lc_time', None))
+        else:
+            user = None
+        return (flavor, option, hashlib.sha1(to_utf8(text)).digest(),
+                tuple(resources), href.base if href else None,
+                getattr(context.perm, 'username', None), user, hints)
+
+    def _get_hints(self, context):
+        ctx = context
+        while ctx and ctx._hints is None:
+            ctx = ctx.parent
+        if not ctx:
+            return ()
+        items = sorted(ctx._hints.iteritems())
+        if all(isinstance(value, self._hint_types) for name, value in items):
+            return tuple(items)
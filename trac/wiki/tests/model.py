@@ -20,7 +20,7 @@ from trac.core import *
 from trac.resource import Resource
 from trac.test import EnvironmentStub, mkdtemp
 from trac.util.datefmt import utc, to_utimestamp
-from trac.wiki import WikiPage, IWikiChangeListener
+from trac.wiki import WikiPage, WikiSystem, IWikiChangeListener
 
 
 class TestWikiChangeListener(Component):
@@ -269,6 +269,27 @@ class WikiPageTestCase(unittest.TestCase):
         listener = TestWikiChangeListener(self.env)
         self.assertEqual((page, 'TestPage'), listener.renamed[0])
 
+    def test_page_names_updated(self):
+        wiki = WikiSystem(self.env)
+        self.assertEqual([], list(wiki.get_pages()))
+        for name in ('Page/Sub', 'Page', 'Other', 'Page/Sub/Deep'):
+            page = WikiPage(self.env, name)
+            page.text = 'Bla bla'
+            page.save('joe', 'Testing')
+        pages = wiki.pages
+        WikiPage(self.env, 'Other').rename('Page/Other')
+        WikiPage(self.env, 'Page/Sub').delete()
+        self.assertIsNot(pages, wiki.pages)
+        self.assertEqual(['Page', 'Page/Other', 'Page/Sub/Deep'],
+                         list(wiki.get_pages()))
+        self.assertEqual(['Page/Other'], list(wiki.get_pages('Page/', 0)))
+        self.assertTrue(wiki.has_page('Page/Other'))
+        self.assertFalse(wiki.has_page('Other'))
+
+        del wiki.pages
+        self.assertEqual(['Page', 'Page/Other', 'Page/Sub/Deep'],
+                         list(wiki.get_pages()))
+
     def test_edit_comment_of_page_version(self):
         self.env.db_transaction.executemany(
             "INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import io
+import os
+import re
+import unittest
+
+from trac.test import EnvironmentStub
+from trac.wiki.parser import WikiParser
+
+
+def wikisyntax_inputs(filename):
+    """Return the input wiki texts of the `filename` wiki syntax tests,
+    in `trac/wiki/tests`.
+    """
+    path = os.path.join(os.path.dirname(__file__), filename)
+    with io.open(path, encoding='utf-8') as f:
+        data = f.read()
+    tests = re.compile('^(%s.*)$' % ('=' * 30), re.MULTILINE).split(data)
+    return [test.split('-' * 30 + '\n')[0] for test in tests[2::2]
+            if test and test != '\n']
+
+
+class WikiParserTokenizeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.parser = WikiParser(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _rule_of(self, match):
+        for itype, group in match.groupdict().iteritems():
+            if group and itype not in self.parser.helper_patterns:
+                return itype
+
+    def _assert_conform(self, filename):
+        lines = 0
+        for text in wikisyntax_inputs(filename):
+            for line in text.splitlines():
+                tokens = self.parser.tokenize(line)
+                self.assertEqual(line, u''.join(
+                    token if isinstance(token, basestring) else token.group(0)
+                    for token in tokens))
+                for token in tokens:
+                    if not isinstance(token, basestring):
+                        self.assertEqual(self._rule_of(token),
+                                         token.lastgroup, line)
+                lines += 1
+        self.assertGreater(lines, 100)
+
+    def test_wiki_tests_conformance(self):
+        self._assert_conform('wiki-tests.txt')
+
+    def test_wikicreole_tests_conformance(self):
+        self._assert_conform('wikicreole-tests.txt')
+
+    def test_tokens(self):
+        tokens = self.parser.tokenize(u"Some '''bold''' wiki:WikiStart")
+        self.assertEqual(u'Some ', tokens[0])
+        self.assertEqual(['bold', 'bold', 'shref'],
+                         [token.lastgroup for token in tokens
+                          if not isinstance(token, basestring)])
+        self.assertEqual(u'bold', tokens[2])
+        self.assertEqual((), self.parser.tokenize(u''))
+
+    def test_tokens_cache(self):
+        line = u"Some ''text''"
+        self.assertIs(self.parser.tokenize(line),
+                      self.parser.tokenize(line))
+        self.env.config.set('wiki', 'tokens_cache_size', 0)
+        self.assertIsNot(self.parser.tokenize(line),
+                         self.parser.tokenize(line))
+        self.assertEqual(self.parser.tokenize(line)[0],
+                         self.parser.tokenize(line)[0])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiParserTokenizeTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.core import Component, ComponentMeta, implements
+from trac.mimeview.api import IHTMLPreviewRenderer
+from trac.perm import PermissionSystem
+from trac.test import EnvironmentStub, MockRequest
+from trac.ticket.model import Ticket
+from trac.util.html import tag
+from trac.web.chrome import add_stylesheet, web_context
+from trac.wiki.api import IWikiMacroProvider, IWikiSyntaxProvider
+from trac.wiki.formatter import format_to_html, format_to_oneliner
+from trac.wiki.model import WikiPage
+
+
+class WikiRenderCacheTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class CountingExtension(Component):
+            implements(IWikiMacroProvider, IWikiSyntaxProvider)
+            calls = []
+
+            def get_macros(self):
+                yield 'Declared'
+                yield 'Undeclared'
+                yield 'Nested'
+
+            def get_macro_description(self, name):
+                return ''
+
+            def expand_macro(self, formatter, name, content):
+                self.calls.append(name)
+                if name == 'Declared':
+                    formatter.depends_on()
+                elif name == 'Nested':
+                    formatter.depends_on()
+                    return format_to_html(self.env, formatter.context,
+                                          content)
+                return tag.span(name)
+
+            def get_wiki_syntax(self):
+                return []
+
+            def get_link_resolvers(self):
+                def resolver(formatter, ns, target, label):
+                    self.calls.append(ns)
+                    return tag.a(label)
+                yield ('undeclared', resolver)
+
+        class StylingRenderer(Component):
+            implements(IHTMLPreviewRenderer)
+
+            def get_quality_ratio(self, mimetype):
+                return 9 if mimetype == 'text/x-styled' else 0
+
+            def render(self, context, mimetype, content, filename=None,
+                       url=None):
+                add_stylesheet(context.req, 'styled.css')
+                return tag.pre(content)
+
+        cls.extension = CountingExtension
+        cls.renderer = StylingRenderer
+
+    @classmethod
+    def tearDownClass(cls):
+        ComponentMeta.deregister(cls.extension)
+        ComponentMeta.deregister(cls.renderer)
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.req = MockRequest(self.env, authname='joe')
+        self.context = web_context(self.req, 'wiki', 'WikiStart')
+        self.calls = self.extension.calls
+        del self.calls[:]
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _render(self, text, context=None):
+        return format_to_html(self.env, context or self.context, text)
+
+    def test_cached(self):
+        html = self._render("Some ''text'' [[Declared]]")
+        self.assertIs(html, self._render("Some ''text'' [[Declared]]"))
+        self.assertEqual(['Declared'], self.calls)
+        self.assertIsNot(html, format_to_oneliner(self.env, self.context,
+                                                  "Some ''text'' "
+                                                  "[[Declared]]"))
+
+    def test_context_in_key(self):
+        other = web_context(self.req, 'wiki', 'SandBox')
+        self.assertIsNot(self._render('[[Declared]]'),
+                         self._render('[[Declared]]', other))
+        self.assertEqual(['Declared', 'Declared'], self.calls)
+
+    def test_undeclared_not_cached(self):
+        self.assertIsNot(self._render('[[Undeclared]]'),
+                         self._render('[[Undeclared]]'))
+        self.assertIsNot(self._render('undeclared:target'),
+                         self._render('undeclared:target'))
+        text = '{{{#!Nested\n[[Undeclared]]\n}}}'
+        self.assertIsNot(self._render(text), self._render(text))
+        self.assertEqual(['Undeclared', 'Undeclared', 'undeclared',
+                          'undeclared', 'Nested', 'Undeclared', 'Nested',
+                          'Undeclared'], self.calls)
+
+    def test_mimeview_processor_not_cached(self):
+        """The stylesheets added by the renderers are added to each
+        request rendering the text."""
+        text = '{{{#!text/x-styled\nSome text\n}}}'
+        for idx in xrange(2):
+            req = MockRequest(self.env, authname='joe')
+            self._render(text, web_context(req, 'wiki', 'WikiStart'))
+            self.assertIn('/trac.cgi/chrome/styled.css',
+                          [link['href'] for link
+                           in req.chrome['links']['stylesheet']])
+
+    def test_disabled(self):
+        self.env.config.set('wiki', 'render_cache_size', 0)
+        self.assertIsNot(self._render('[[Declared]]'),
+                         self._render('[[Declared]]'))
+
+    def test_wiki_dependency(self):
+        html = self._render('SandBox')
+        self.assertIn('missing wiki', html)
+        self.assertIs(html, self._render('SandBox'))
+
+        page = WikiPage(self.env, 'SandBox')
+        page.text = 'Some text'
+        page.save('joe', 'Comment')
+        html = self._render('SandBox')
+        self.assertNotIn('missing wiki', html)
+        self.assertIs(html, self._render('SandBox'))
+
+    def test_ticket_dependency(self):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Summary'
+        ticket['status'] = 'new'
+        ticket.insert()
+        html = self._render('[[Nested(#1)]]')
+        self.assertIn('class="new ticket"', html)
+        self.assertIs(html, self._render('[[Nested(#1)]]'))
+
+        ticket['status'] = 'closed'
+        ticket.save_changes('joe')
+        html = self._render('[[Nested(#1)]]')
+        self.assertIn('class="closed ticket"', html)
+        self.assertIs(html, self._render('[[Nested(#1)]]'))
+
+    def test_permission_dependency(self):
+        permsys = PermissionSystem(self.env)
+        permsys.revoke_permission('anonymous', 'WIKI_VIEW')
+        html = self._render('SandBox')
+        self.assertIn('forbidden wiki', html)
+
+        permsys.grant_permission('joe', 'WIKI_VIEW')
+        self.req = MockRequest(self.env, authname='joe')
+        self.context = web_context(self.req, 'wiki', 'WikiStart')
+        self.assertIn('missing wiki', self._render('SandBox'))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiRenderCacheTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -11,10 +11,12 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from datetime import datetime, timedelta
 import unittest
 
 from trac.perm import DefaultPermissionStore, PermissionCache
 from trac.test import EnvironmentStub, MockRequest
+from trac.util.datefmt import utc
 from trac.web.api import HTTPBadRequest
 from trac.wiki.model import WikiPage
 from trac.wiki.web_ui import DefaultWikiPolicy, WikiModule
@@ -147,6 +149,24 @@ class WikiModuleTestCase(unittest.TestCase):
         self.assertNotIn('version', resp[1])
         self.assertEqual('NewPage', resp[1]['page'].name)
 
+    def test_sorted_timeline_events_same_time(self):
+        """Events with the same time are neither repeated nor skipped
+        between the batches of `limit` rows."""
+        t = datetime(2019, 1, 1, tzinfo=utc)
+        for name in ('PageA', 'PageB', 'PageC'):
+            for version in (1, 2):
+                page = WikiPage(self.env, name)
+                page.text = 'Version %d' % version
+                page.save('joe', 'Comment', t)
+        req = MockRequest(self.env)
+
+        events = WikiModule(self.env).get_sorted_timeline_events(
+            req, t - timedelta(days=1), t + timedelta(days=1), ['wiki'], 4)
+
+        self.assertEqual([('PageC', 2), ('PageC', 1), ('PageB', 2),
+                          ('PageB', 1), ('PageA', 2), ('PageA', 1)],
+                         [(e[3][0].id, e[3][0].version) for e in events])
+
 
 def test_suite():
     suite = unittest.TestSuite()
@@ -25,8 +25,9 @@ from trac.core import *
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.perm import IPermissionPolicy, IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.timeline.api import ITimelineEventProvider
+from trac.search import ISearchIndexSource, ISearchSource, SearchDocument, \
+                        search_to_sql, shorten_result
+from trac.timeline.api import ITimelineEventProvider, merge_timeline_events
 from trac.util import as_int, get_reporter_id
 from trac.util.datefmt import from_utimestamp, to_utimestamp
 from trac.util.html import tag
@@ -47,7 +48,7 @@ class WikiModule(Component):
 
     implements(IContentConverter, INavigationContributor,
                IPermissionRequestor, IRequestHandler, ITimelineEventProvider,
-               ISearchSource, ITemplateProvider)
+               ISearchIndexSource, ISearchSource, ITemplateProvider)
 
     page_manipulators = ExtensionPoint(IWikiPageManipulator)
 
@@ -754,22 +755,18 @@ class WikiModule(Component):
             yield ('wiki', _('Wiki changes'))
 
     def get_timeline_events(self, req, start, stop, filters):
+        return self.get_sorted_timeline_events(req, start, stop, filters,
+                                               None)
+
+    def get_sorted_timeline_events(self, req, start, stop, filters, limit):
         if 'wiki' in filters:
             wiki_realm = Resource(self.realm)
-            for ts, name, comment, author, version in self.env.db_query("""
-                    SELECT time, name, comment, author, version FROM wiki
-                    WHERE time>=%s AND time<=%s
-                    """, (to_utimestamp(start), to_utimestamp(stop))):
-                wiki_page = wiki_realm(id=name, version=version)
-                if 'WIKI_VIEW' not in req.perm(wiki_page):
-                    continue
-                yield ('wiki', from_utimestamp(ts), author,
-                       (wiki_page, comment))
-
-            # Attachments
-            for event in AttachmentModule(self.env).get_timeline_events(
-                    req, wiki_realm, start, stop):
-                yield event
+            return merge_timeline_events([
+                self._get_page_timeline_events(req, start, stop, limit),
+                # Attachments
+                AttachmentModule(self.env).get_timeline_events(
+                    req, wiki_realm, start, stop, limit)])
+        return []
 
     def render_timeline_event(self, context, field, event):
         wiki_page, comment = event[3]
@@ -791,6 +788,33 @@ class WikiModule(Component):
                              " (", tag.a(_("diff"), href=diff_href), ")")
             return markup
 
+    def _get_page_timeline_events(self, req, start, stop, limit):
+        """Generate the events for the wiki page versions, newest first,
+        retrieving them `limit` at a time if `limit` is specified.
+        """
+        wiki_realm = Resource(self.realm)
+        sql = """
+            SELECT time, name, comment, author, version FROM wiki
+            WHERE time>=%s AND time<=%s
+            ORDER BY time DESC, name DESC, version DESC
+            """
+        args = (to_utimestamp(start), to_utimestamp(stop))
+        if limit:
+            sql += " LIMIT %s OFFSET %s"
+        offset = 0
+        while True:
+            rows = self.env.db_query(sql, args + (limit, offset)
+                                          if limit else args)
+            for ts, name, comment, author, version in rows:
+                wiki_page = wiki_realm(id=name, version=version)
+                if 'WIKI_VIEW' not in req.perm(wiki_page):
+                    continue
+                yield ('wiki', from_utimestamp(ts), author,
+                       (wiki_page, comment))
+            if not limit or len(rows) < limit:
+                break
+            offset += limit
+
     # ISearchSource methods
 
     def get_search_filters(self, req):
@@ -822,6 +846,45 @@ class WikiModule(Component):
                 req, wiki_realm, terms):
             yield result
 
+    # ISearchIndexSource methods
+
+    def get_search_index_documents(self):
+        wiki_realm = Resource(self.realm)
+        for name, ts, author, text in self.env.db_query("""
+                SELECT w1.name, w1.time, w1.author, w1.text
+                FROM wiki w1,(SELECT name, max(version) AS ver
+                              FROM wiki GROUP BY name) w2
+                WHERE w1.version = w2.ver AND w1.name = w2.name
+                """):
+            yield self._search_index_document(wiki_realm(id=name),
+                                              from_utimestamp(ts), author,
+                                              text)
+        for doc in AttachmentModule(self.env).get_search_index_documents(
+                wiki_realm, 'wiki'):
+            yield doc
+
+    def get_search_index_document(self, resource):
+        if resource.realm == 'attachment' and resource.parent and \
+                resource.parent.realm == self.realm:
+            return AttachmentModule(self.env).get_search_index_document(
+                resource, 'wiki')
+        if resource.realm == self.realm:
+            page = WikiPage(self.env, resource.id)
+            if page.exists:
+                return self._search_index_document(
+                    Resource(self.realm, page.name), page.time, page.author,
+                    page.text)
+
+    def get_search_index_action(self, resource):
+        if resource.realm == 'attachment':
+            return 'ATTACHMENT_VIEW'
+        return 'WIKI_VIEW'
+
+    def _search_index_document(self, page, time, author, text):
+        return SearchDocument('wiki', page, time, author,
+                              '%s: %s' % (page.id, shorten_line(text)),
+                              '%s\n%s' % (text, page.id))
+
 
 class DefaultWikiPolicy(Component):
     """Default permission policy for the wiki system.
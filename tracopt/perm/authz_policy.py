@@ -15,7 +15,8 @@
 # Author: Alec Thomas <alec@swapoff.org>
 
 import os
-from fnmatch import fnmatchcase
+import re
+from fnmatch import translate
 from itertools import groupby
 
 from trac.config import ConfigurationError, ParsingError, PathOption, \
@@ -137,33 +138,77 @@ class AuthzPolicy(Component):
         self.authz = None
         self.authz_mtime = None
         self.groups_by_user = {}
+        self.sections = []
+        self._expanded_actions = {}
 
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
-        if not self.authz_mtime or \
-                os.path.getmtime(self.authz_file) != self.authz_mtime:
-            self.parse_authz()
+        self._check_authz_file()
         resource_key = self.normalise_resource(resource)
         self.log.debug('Checking %s on %s', action, resource_key)
         permissions = self.authz_permissions(resource_key, username)
+        return self._check_action(action, permissions)
+
+    def check_permissions(self, action, username, resources, perm):
+        self._check_authz_file()
+        sections = list(self._get_user_sections(username))
+        decisions = []
+        for resource in resources:
+            resource_key = self.normalise_resource(resource)
+            for resource_glob, match, permissions in sections:
+                if match(resource_key):
+                    break
+            else:
+                permissions = None
+            decisions.append(self._check_action(action, permissions))
+        return decisions
+
+    # Internal methods
+
+    def _check_authz_file(self):
+        if not self.authz_mtime or \
+                os.path.getmtime(self.authz_file) != self.authz_mtime:
+            self.parse_authz()
+
+    def _check_action(self, action, permissions):
         if permissions is None:
             return None                 # no match, can't decide
         elif permissions == []:
             return False                # all actions are denied
 
-        # FIXME: expand all permissions once for all
-        ps = PermissionSystem(self.env)
         for deny, perms in groupby(permissions,
                                    key=lambda p: p.startswith('!')):
-            if deny and action in ps.expand_actions(p[1:] for p in perms):
+            if deny and action in self._expand_actions(p[1:] for p in perms):
                 return False            # action is explicitly denied
-            elif action in ps.expand_actions(perms):
+            elif action in self._expand_actions(perms):
                 return True             # action is explicitly granted
 
         return None                     # no match for action, can't decide
 
-    # Internal methods
+    def _expand_actions(self, actions):
+        actions = tuple(actions)
+        expanded = self._expanded_actions.get(actions)
+        if expanded is None:
+            expanded = set(PermissionSystem(self.env).expand_actions(actions))
+            self._expanded_actions[actions] = expanded
+        return expanded
+
+    def _get_user_sections(self, username):
+        """Return the `(resource_glob, match, permissions)` tuples of the
+        resource sections having an entry for `username`, in the order in
+        which they are looked up.
+        """
+        if username and username != 'anonymous':
+            valid_users = ['*', 'authenticated', 'anonymous', username]
+        else:
+            valid_users = ['*', 'anonymous']
+        groups = self.groups_by_user.get(username, ())
+        for resource_glob, match, entries in self.sections:
+            for who, permissions in entries:
+                if who in valid_users or who in groups:
+                    yield resource_glob, match, permissions
+                    break
 
     def parse_authz(self):
         self.log.debug("Parsing authz security policy %s",
@@ -187,6 +232,19 @@ class AuthzPolicy(Component):
             self.log.error("Error parsing authz permission policy file: %s",
                            exception_to_unicode(e))
             raise ConfigurationError()
+        self._expanded_actions = {}
+        self.sections = []
+        for section in self.authz.sections():
+            if section == 'groups':
+                continue
+            resource_glob = section
+            if '@' not in resource_glob:
+                resource_glob += '@*'
+            self.sections.append((resource_glob,
+                                  re.compile(translate(resource_glob)).match,
+                                  [(who, to_list(permissions))
+                                   for who, permissions
+                                   in self.authz.items(section)]))
         groups = {}
         if self.authz.has_section('groups'):
             for group, users in self.authz.items('groups'):
@@ -247,25 +305,10 @@ class AuthzPolicy(Component):
     def authz_permissions(self, resource_key, username):
         # TODO: Handle permission negation in sections. eg. "if in this
         # ticket, remove TICKET_MODIFY"
-        if username and username != 'anonymous':
-            valid_users = ['*', 'authenticated', 'anonymous', username]
-        else:
-            valid_users = ['*', 'anonymous']
-        for resource_section in [a for a in self.authz.sections()
-                                   if a != 'groups']:
-            resource_glob = resource_section
-            if '@' not in resource_glob:
-                resource_glob += '@*'
-
-            if fnmatchcase(resource_key, resource_glob):
-                for who, permissions in self.authz.items(resource_section):
-                    permissions = to_list(permissions)
-                    if who in valid_users or \
-                            who in self.groups_by_user.get(username, []):
-                        self.log.debug("%s matched section %s for user %s",
-                                       resource_key, resource_glob, username)
-                        if isinstance(permissions, basestring):
-                            return [permissions]
-                        else:
-                            return permissions
+        for resource_glob, match, permissions \
+                in self._get_user_sections(username):
+            if match(resource_key):
+                self.log.debug("%s matched section %s for user %s",
+                               resource_key, resource_glob, username)
+                return permissions
         return None
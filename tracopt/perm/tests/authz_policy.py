@@ -219,6 +219,30 @@ class AuthzPolicyTestCase(unittest.TestCase):
         self.assertIn('MILESTONE_VIEW', self.get_perm('authenticated',
                                                       resource))
 
+    def test_check_permissions(self):
+        """check_permissions returns the same decisions as
+        check_permission called for each resource.
+        """
+        authz_policy = AuthzPolicy(self.env)
+        resources = [Resource('wiki', 'WikiStart'),
+                     Resource('wiki', u'résumé'),
+                     Resource('ticket', 42), Resource('ticket', 43),
+                     Resource('milestone', 'milestone1'),
+                     Resource('WIKI', 'wikistart'),
+                     Resource('repository', '').child('source', 'trunk'),
+                     Resource('repository', u'bláh').child('source', 'trunk')]
+        for action in ('WIKI_VIEW', 'TICKET_VIEW', 'MILESTONE_VIEW',
+                       'FILE_VIEW'):
+            for user in ('anonymous', 'authenticated', u'änon', u'éat',
+                         'John'):
+                perm = self.get_perm(user)
+                self.assertEqual(
+                    [authz_policy.check_permission(action, user, resource,
+                                                   perm)
+                     for resource in resources],
+                    authz_policy.check_permissions(action, user, resources,
+                                                   perm))
+
     def test_undefined_action_is_logged(self):
         """Undefined action is logged at warning level."""
         create_file(self.authz_file, textwrap.dedent("""\
@@ -15,21 +15,28 @@
 import codecs
 import contextlib
 import io
+import mmap
 import os
 import re
+import struct
+import sys
 import weakref
-from collections import deque
+import zlib
+from array import array
+from binascii import hexlify, unhexlify
+from collections import OrderedDict, deque
 from functools import partial
 from subprocess import PIPE
 from threading import Lock
 
 from trac.core import TracBaseError
-from trac.util import terminate
+from trac.util import AtomicFile, terminate
 from trac.util.compat import Popen, close_fds
 from trac.util.datefmt import time_now
-from trac.util.text import to_unicode
+from trac.util.text import exception_to_unicode, to_unicode
 
-__all__ = ['GitError', 'GitErrorSha', 'Storage', 'StorageFactory']
+__all__ = ['CatFile', 'CatFilePool', 'CommitGraph', 'GitError',
+           'GitErrorSha', 'ObjectStore', 'Storage', 'StorageFactory']
 
 
 class GitError(TracBaseError):
@@ -69,6 +76,31 @@ def parse_commit(raw):
     return '\n'.join(lines), props
 
 
+def _parse_tree(raw, prefix=''):
+    """Parse the raw content of a tree object.
+
+    Return a list of `(mode, type, sha, name)` tuples, with `prefix`
+    prepended to the names.
+    """
+    entries = []
+    start = 0
+    length = len(raw)
+    while start < length:
+        space = raw.index(' ', start)
+        nul = raw.index('\0', space)
+        mode = int(raw[start:space], 8)
+        sha = hexlify(raw[nul + 1:nul + 21])
+        if mode & 0170000 == 0040000:
+            type_ = 'tree'
+        elif mode & 0170000 == 0160000:
+            type_ = 'commit'
+        else:
+            type_ = 'blob'
+        entries.append((mode, type_, sha, prefix + raw[space + 1:nul]))
+        start = nul + 21
+    return entries
+
+
 _unquote_re = re.compile(r'\\(?:[abtnvfr"\\]|[0-7]{3})')
 _unquote_chars = {'a': '\a', 'b': '\b', 't': '\t', 'n': '\n', 'v': '\v',
                   'f': '\f', 'r': '\r', '"': '"', '\\': '\\'}
@@ -131,13 +163,16 @@ class GitCore(object):
         return Popen(self.__build_git_cmd(git_cmd, *cmd_args),
                      close_fds=close_fds, **kw)
 
-    def __execute(self, git_cmd, *cmd_args):
-        """execute git command and return file-like object of stdout"""
+    def __execute(self, git_cmd, *cmd_args, **kw):
+        """execute git command and return file-like object of stdout
+
+        The `input` keyword argument is written to the standard input.
+        """
 
         #print("DEBUG:", git_cmd, cmd_args, file=sys.stderr)
 
         with self.__pipe(git_cmd, *cmd_args) as p:
-            stdout_data, stderr_data = p.communicate()
+            stdout_data, stderr_data = p.communicate(kw.get('input'))
         if self.__log and (p.returncode != 0 or stderr_data):
             self.__log.debug('%s exits with %d, dir: %r, args: %s %r, '
                              'stderr: %r', self.__git_bin, p.returncode,
@@ -148,11 +183,15 @@ class GitCore(object):
     def cat_file_batch(self):
         return self.__pipe('cat-file', '--batch')
 
+    def cat_file_batch_check(self):
+        return self.__pipe('cat-file', '--batch-check')
+
     def log_pipe(self, *cmd_args):
         return self.__pipe('log', *cmd_args)
 
     def __getattr__(self, name):
-        if name[0] == '_' or name in ['cat_file_batch', 'log_pipe']:
+        if name[0] == '_' or name in ['cat_file_batch',
+                                      'cat_file_batch_check', 'log_pipe']:
             raise AttributeError(name)
         return partial(self.__execute, name.replace('_','-'))
 
@@ -200,6 +239,850 @@ class SizedDict(dict):
         raise NotImplementedError("SizedDict has no setdefault() method")
 
 
+class CatFile(object):
+    """Long-lived `git cat-file --batch` or `--batch-check` process.
+
+    :since: 1.3.4
+    """
+
+    # Number of objects requested before reading the responses, small
+    # enough for the responses of `--batch-check` to fit in the pipe
+    chunk_size = 64
+
+    def __init__(self, proc, contents):
+        self.proc = proc
+        self.contents = contents
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        proc = self.proc
+        for f in (proc.stdin, proc.stdout, proc.stderr):
+            if f:
+                f.close()
+        terminate(proc)
+        proc.wait()
+
+    def get(self, name):
+        """Return the `(sha, type, size, content)` tuple of the object
+        `name`, or `None` if the object doesn't exist. The content is
+        `None` for a `--batch-check` process.
+        """
+        return self.get_many([name])[0]
+
+    def get_many(self, names):
+        """Return the `(sha, type, size, content)` tuples of the objects
+        `names`, using the same pipe round-trip for several objects.
+        """
+        results = []
+        stdin = self.proc.stdin
+        stdout = self.proc.stdout
+        for idx in xrange(0, len(names), self.chunk_size):
+            chunk = names[idx:idx + self.chunk_size]
+            stdin.write(''.join(name + '\n' for name in chunk))
+            stdin.flush()
+            for name in chunk:
+                line = stdout.readline()
+                if not line:
+                    raise GitError("cat-file process exited unexpectedly")
+                items = line.split()
+                if len(items) != 3:
+                    # '<name> missing' or '<name> ambiguous'
+                    results.append(None)
+                    continue
+                sha, type_, size = items
+                size = int(size)
+                content = None
+                if self.contents:
+                    content = stdout.read(size + 1)[:size]
+                results.append((sha, type_, size, content))
+        return results
+
+
+class CatFilePool(object):
+    """Pool of `CatFile` processes.
+
+    A process is checked out by a thread for the duration of a request,
+    and returned to the pool afterwards if it is still healthy.
+
+    :since: 1.3.4
+    """
+
+    def __init__(self, factory, contents, max_idle=4):
+        self._factory = factory
+        self._contents = contents
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = Lock()
+
+    @contextlib.contextmanager
+    def checkout(self):
+        cat_file = None
+        with self._lock:
+            while self._idle:
+                cat_file = self._idle.pop()
+                if cat_file.is_alive():
+                    break
+                cat_file.close()
+                cat_file = None
+        if cat_file is None:
+            cat_file = CatFile(self._factory(), self._contents)
+        try:
+            yield cat_file
+        except:
+            # The pipes may be in an inconsistent state, e.g. with the
+            # content of a previous object not read
+            cat_file.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self._max_idle and cat_file.is_alive():
+                self._idle.append(cat_file)
+                cat_file = None
+        if cat_file is not None:
+            cat_file.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for cat_file in idle:
+            cat_file.close()
+
+
+class ObjectStore(object):
+    """Reader of the loose objects and packfiles of a repository, which
+    doesn't run git processes.
+
+    The objects are read with the same interface as `CatFile`, and the
+    store is used in place of the pools of `CatFile` processes by
+    `Storage`. The object names can be a sha, `<rev>^{tree}` or
+    `<rev>:<path>`; other revisions are resolved by the `resolve`
+    callable.
+
+    The base objects of the deltas are kept in an LRU cache of at most
+    `cache_size` bytes.
+
+    :since: 1.3.4
+    """
+
+    _type_names = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+    _ofs_delta = 6
+    _ref_delta = 7
+
+    def __init__(self, objects_dir, resolve=None,
+                 cache_size=16 * 1024 * 1024):
+        self.objects_dir = objects_dir
+        self._resolve = resolve
+        self._pack_dir = os.path.join(objects_dir, 'pack')
+        self._packs = {}
+        self._packs_mtime = None
+        self._alternates = None
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_size = cache_size
+        self._lock = Lock()
+
+    @contextlib.contextmanager
+    def checkout(self):
+        yield self
+
+    def close(self):
+        with self._lock:
+            packs, self._packs = self._packs, {}
+            self._packs_mtime = None
+            self._cache.clear()
+            self._cache_bytes = 0
+        for pack in packs.itervalues():
+            pack.close()
+        for store in self._alternates or ():
+            store.close()
+
+    def get(self, name):
+        """Return the `(sha, type, size, content)` tuple of the object
+        `name`, or `None` if the object doesn't exist.
+        """
+        if name.endswith('^{tree}'):
+            return self._peel(self._get_rev(name[:-7]), 'tree')
+        if ':' in name:
+            rev, path = name.split(':', 1)
+            obj = self._peel(self._get_rev(rev), 'tree')
+            for part in path.split('/'):
+                if not part:
+                    continue
+                if obj is None or obj[1] != 'tree':
+                    return None
+                for mode, type_, sha, entry_name in _parse_tree(obj[3]):
+                    if entry_name == part:
+                        obj = self.read(sha)
+                        break
+                else:
+                    return None
+            return obj
+        return self._get_rev(name)
+
+    def get_many(self, names):
+        return [self.get(name) for name in names]
+
+    def read(self, sha):
+        """Return the `(sha, type, size, content)` tuple of the object
+        `sha`, or `None` if the object doesn't exist.
+        """
+        sha = sha.lower()
+        try:
+            binsha = unhexlify(sha)
+        except (TypeError, ValueError):
+            return None
+        if len(binsha) != 20:
+            return None
+        obj = self._read_packed(binsha) or self._read_loose(sha)
+        if obj is None and self._refresh_packs():
+            # The object may have been moved to a new pack
+            obj = self._read_packed(binsha)
+        if obj is None:
+            for store in self._get_alternates():
+                result = store.read(sha)
+                if result is not None:
+                    return result
+            return None
+        type_, content = obj
+        return sha, type_, len(content), content
+
+    # Internal methods
+
+    def _get_rev(self, rev):
+        if len(rev) != 40 or not GitCore.is_sha(rev):
+            rev = self._resolve(rev) if self._resolve else None
+            if not rev:
+                return None
+        return self.read(rev)
+
+    def _peel(self, obj, type_):
+        while obj is not None and obj[1] != type_:
+            content = obj[3]
+            if obj[1] == 'commit' and type_ == 'tree' and \
+                    content.startswith('tree '):
+                obj = self.read(content[5:45])
+            elif obj[1] == 'tag' and content.startswith('object '):
+                obj = self.read(content[7:47])
+            else:
+                return None
+        return obj
+
+    def _read_loose(self, sha):
+        path = os.path.join(self.objects_dir, sha[:2], sha[2:])
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except EnvironmentError:
+            return None
+        try:
+            raw = zlib.decompress(raw)
+            header, content = raw.split('\0', 1)
+            type_, size = header.split(' ')
+        except (zlib.error, ValueError):
+            raise GitError("Corrupt loose object '%s'" % path)
+        if int(size) != len(content):
+            raise GitError("Corrupt loose object '%s'" % path)
+        return type_, content
+
+    def _read_packed(self, binsha):
+        if self._packs_mtime is None:
+            self._refresh_packs()
+        for pack in self._packs.values():
+            offset = pack.find(binsha)
+            if offset is not None:
+                return self._read_pack_object(pack, offset)
+        return None
+
+    def _read_pack_object(self, pack, offset):
+        # Follow the chain of deltas down to a base object
+        chain = []
+        while True:
+            base = self._cache_get((pack.path, offset))
+            if base is not None:
+                break
+            type_, data_offset, size, base_ref = pack.read_header(offset)
+            if type_ == self._ofs_delta:
+                chain.append((pack, offset, data_offset, size))
+                offset = base_ref
+            elif type_ == self._ref_delta:
+                chain.append((pack, offset, data_offset, size))
+                base = self.read(hexlify(base_ref))
+                if base is None:
+                    raise GitError("Missing delta base '%s' in '%s'"
+                                   % (hexlify(base_ref), pack.path))
+                base = base[1], base[3]
+                break
+            else:
+                type_name = self._type_names.get(type_)
+                if type_name is None:
+                    raise GitError("Invalid object type %d in '%s'"
+                                   % (type_, pack.path))
+                base = type_name, pack.inflate(data_offset, size)
+                if chain:
+                    self._cache_put((pack.path, offset), base)
+                break
+
+        type_name, data = base
+        while chain:
+            pack, offset, data_offset, size = chain.pop()
+            data = _apply_delta(data, pack.inflate(data_offset, size))
+            if chain:
+                self._cache_put((pack.path, offset), (type_name, data))
+        return type_name, data
+
+    def _cache_get(self, key):
+        with self._lock:
+            value = self._cache.pop(key, None)
+            if value is not None:
+                self._cache[key] = value
+            return value
+
+    def _cache_put(self, key, value):
+        size = len(value[1])
+        if size > self._cache_size:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = value
+            self._cache_bytes += size
+            while self._cache_bytes > self._cache_size:
+                key, value = self._cache.popitem(last=False)
+                self._cache_bytes -= len(value[1])
+
+    def _refresh_packs(self):
+        """Open the new packs and forget the removed ones, if the pack
+        directory has changed.
+        """
+        try:
+            mtime = os.stat(self._pack_dir).st_mtime
+            names = os.listdir(self._pack_dir)
+        except EnvironmentError:
+            mtime, names = 0, []
+        with self._lock:
+            if mtime == self._packs_mtime:
+                return False
+            self._packs_mtime = mtime
+            paths = {os.path.join(self._pack_dir, name[:-4])
+                     for name in names if name.endswith('.idx')}
+            packs = {}
+            for path in paths:
+                pack = self._packs.get(path)
+                if pack is None and os.path.exists(path + '.pack'):
+                    pack = _Pack(path)
+                if pack is not None:
+                    packs[path] = pack
+            self._packs = packs
+            return True
+
+    def _get_alternates(self):
+        if self._alternates is None:
+            alternates = []
+            path = os.path.join(self.objects_dir, 'info', 'alternates')
+            try:
+                with open(path, 'rb') as f:
+                    lines = f.read().splitlines()
+            except EnvironmentError:
+                lines = []
+            for line in lines:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    alternates.append(ObjectStore(
+                        os.path.join(self.objects_dir, line),
+                        cache_size=self._cache_size))
+            self._alternates = alternates
+        return self._alternates
+
+
+class _Pack(object):
+    """Packfile and its version 1 or 2 index."""
+
+    _uint = struct.Struct('>I')
+    _ulonglong = struct.Struct('>Q')
+
+    def __init__(self, path):
+        self.path = path
+        self._index = self._mmap(path + '.idx')
+        self._data = None
+        self._data_lock = Lock()
+        if self._index[:4] == '\377tOc':
+            version = self._get_uint(4)
+            if version != 2:
+                raise GitError("Unsupported pack index version %d in '%s'"
+                               % (version, path))
+            self._fanout_offset = 8
+            self._version = 2
+        else:
+            self._fanout_offset = 0
+            self._version = 1
+        self._count = self._get_uint(self._fanout_offset + 4 * 255)
+        self._entries_offset = self._fanout_offset + 4 * 256
+
+    def close(self):
+        self._index.close()
+        if self._data is not None:
+            self._data.close()
+
+    def find(self, binsha):
+        """Return the offset of the object `binsha` in the packfile, or
+        `None` if it is not in the pack.
+        """
+        byte = ord(binsha[0])
+        low = self._get_uint(self._fanout_offset + 4 * (byte - 1)) \
+              if byte else 0
+        high = self._get_uint(self._fanout_offset + 4 * byte)
+        while low < high:
+            mid = (low + high) // 2
+            sha = self._get_sha(mid)
+            if sha < binsha:
+                low = mid + 1
+            elif sha > binsha:
+                high = mid
+            else:
+                return self._get_offset(mid)
+        return None
+
+    def read_header(self, offset):
+        """Return the `(type, data_offset, size, base)` tuple of the
+        object at `offset`, where `base` is the offset of the base of
+        an offset delta or the binary id of the base of a reference
+        delta.
+        """
+        data = self._get_data()
+        c = ord(data[offset])
+        type_ = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        pos = offset + 1
+        while c & 0x80:
+            c = ord(data[pos])
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        base = None
+        if type_ == ObjectStore._ofs_delta:
+            c = ord(data[pos])
+            pos += 1
+            delta = c & 0x7f
+            while c & 0x80:
+                c = ord(data[pos])
+                pos += 1
+                delta = ((delta + 1) << 7) | (c & 0x7f)
+            base = offset - delta
+        elif type_ == ObjectStore._ref_delta:
+            base = data[pos:pos + 20]
+            pos += 20
+        return type_, pos, size, base
+
+    def inflate(self, offset, size):
+        """Return the `size` bytes of zlib-compressed data at `offset`."""
+        data = self._get_data()
+        d = zlib.decompressobj()
+        step = max(4096, size + 256)
+        chunks = []
+        while True:
+            chunk = data[offset:offset + step]
+            offset += step
+            chunks.append(d.decompress(chunk))
+            if d.unused_data or not chunk:
+                break
+        chunks.append(d.flush())
+        result = ''.join(chunks)
+        if len(result) != size:
+            raise GitError("Corrupt object in '%s'" % self.path)
+        return result
+
+    # Internal methods
+
+    @staticmethod
+    def _mmap(path):
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _get_data(self):
+        if self._data is None:
+            with self._data_lock:
+                if self._data is None:
+                    self._data = self._mmap(self.path + '.pack')
+        return self._data
+
+    def _get_uint(self, offset):
+        return self._uint.unpack_from(self._index, offset)[0]
+
+    def _get_sha(self, idx):
+        if self._version == 2:
+            offset = self._entries_offset + 20 * idx
+        else:
+            offset = self._entries_offset + 24 * idx + 4
+        return self._index[offset:offset + 20]
+
+    def _get_offset(self, idx):
+        if self._version == 1:
+            return self._get_uint(self._entries_offset + 24 * idx)
+        offset = self._get_uint(self._entries_offset + 24 * self._count +
+                                4 * idx)
+        if offset & 0x80000000:
+            # index into the table of 64-bit offsets
+            idx = offset & 0x7fffffff
+            offset = self._ulonglong.unpack_from(
+                self._index, self._entries_offset + 28 * self._count + 8 * idx
+            )[0]
+        return offset
+
+
+def _apply_delta(base, delta):
+    """Apply a packfile `delta` to the `base` data."""
+
+    def read_size(pos):
+        size = shift = 0
+        while True:
+            c = ord(delta[pos])
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+            if not c & 0x80:
+                return size, pos
+
+    base_size, pos = read_size(0)
+    if base_size != len(base):
+        raise GitError("Invalid delta base size")
+    target_size, pos = read_size(pos)
+    chunks = []
+    length = len(delta)
+    while pos < length:
+        c = ord(delta[pos])
+        pos += 1
+        if c & 0x80:
+            # copy from the base
+            offset = size = 0
+            for i in xrange(4):
+                if c & (1 << i):
+                    offset |= ord(delta[pos]) << (8 * i)
+                    pos += 1
+            for i in xrange(3):
+                if c & (0x10 << i):
+                    size |= ord(delta[pos]) << (8 * i)
+                    pos += 1
+            chunks.append(base[offset:offset + (size or 0x10000)])
+        elif c:
+            # insert from the delta
+            chunks.append(delta[pos:pos + c])
+            pos += c
+        else:
+            raise GitError("Invalid delta instruction")
+    result = ''.join(chunks)
+    if len(result) != target_size:
+        raise GitError("Invalid delta target size")
+    return result
+
+
+def _array_to_bytes(values):
+    if sys.byteorder != 'little':
+        values = array('I', values)
+        values.byteswap()
+    return values.tostring()
+
+
+class CommitGraph(object):
+    """Commit graph of a repository, stored in a file which is
+    memory-mapped, so that it can be shared by the processes.
+
+    The commits are identified by their position in a topological
+    order, parents first, so the commits added to the repository are
+    appended to the graph when it is updated. The file contains, after
+    a header giving the number of commits:
+
+     - a fan-out table and the sorted binary ids of the commits with
+       their position, for looking up a commit id or prefix,
+     - the binary ids of the commits by position,
+     - the positions of the parents and of the children of each
+       commit, as offsets into flat lists of positions.
+
+    All the integers are 32-bit unsigned little-endian values.
+
+    :since: 1.3.4
+    """
+
+    magic = 'TRACCGRF'
+    version = 1
+
+    _header = struct.Struct('<8sII')
+    _uint = struct.Struct('<I')
+    _uint_pair = struct.Struct('<II')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._stat = self._get_stat(os.fstat(f.fileno()))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count = self._header.unpack_from(self._map)
+        except struct.error:
+            magic = version = count = None
+        if magic != self.magic or version != self.version:
+            raise GitError("Invalid commit graph file '%s'" % path)
+        self._count = count
+        offset = self._header.size
+        self._fanout_offset = offset
+        offset += 4 * 256
+        self._sorted_ids_offset = offset
+        offset += 20 * count
+        self._sorted_pos_offset = offset
+        offset += 4 * count
+        self._ids_offset = offset
+        offset += 20 * count
+        self._parent_offsets_offset = offset
+        offset += 4 * (count + 1)
+        self._parents_offset = offset
+        self._num_edges = self._get_uint(offset - 4)
+        offset += 4 * self._num_edges
+        self._child_offsets_offset = offset
+        offset += 4 * (count + 1)
+        self._children_offset = offset
+        offset += 4 * self._num_edges
+        if offset != len(self._map):
+            raise GitError("Invalid commit graph file '%s'" % path)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, rev):
+        return self.get_pos(rev) is not None
+
+    def __iter__(self):
+        for pos in xrange(self._count):
+            yield self.get_rev(pos)
+
+    iterkeys = __iter__
+
+    def close(self):
+        self._map.close()
+
+    def is_stale(self):
+        """Return whether the file has been replaced since it was
+        opened, usually by another process.
+        """
+        try:
+            return self._get_stat(os.stat(self.path)) != self._stat
+        except OSError:
+            return True
+
+    def get_rev(self, pos):
+        """Return the id of the commit at position `pos`."""
+        offset = self._ids_offset + 20 * pos
+        return hexlify(self._map[offset:offset + 20])
+
+    def get_pos(self, rev):
+        """Return the position of commit `rev`, or `None` if it is not
+        in the graph.
+        """
+        try:
+            key = unhexlify(rev)
+        except (TypeError, ValueError):
+            return None
+        if len(key) != 20:
+            return None
+        idx = self._bisect(key)
+        if idx < self._count and self._get_sorted_id(idx) == key:
+            return self._get_uint(self._sorted_pos_offset + 4 * idx)
+
+    def get_revs_by_prefix(self, prefix):
+        """Return the ids of the commits starting with the hexadecimal
+        `prefix`, in sorted order.
+        """
+        prefix = prefix.lower()
+        try:
+            key = unhexlify((prefix + '0' * 40)[:40])
+        except (TypeError, ValueError):
+            return []
+        revs = []
+        for idx in xrange(self._bisect(key), self._count):
+            rev = hexlify(self._get_sorted_id(idx))
+            if not rev.startswith(prefix):
+                break
+            revs.append(rev)
+        return revs
+
+    def get_parents(self, pos):
+        """Return the positions of the parents of the commit at `pos`."""
+        return self._get_list(self._parent_offsets_offset,
+                              self._parents_offset, pos)
+
+    def get_children(self, pos):
+        """Return the positions of the children of the commit at `pos`."""
+        return self._get_list(self._child_offsets_offset,
+                              self._children_offset, pos)
+
+    def get_heads(self):
+        """Return the positions of the commits without children."""
+        offsets = self._get_array(self._child_offsets_offset,
+                                  self._count + 1)
+        return [pos for pos in xrange(self._count)
+                    if offsets[pos] == offsets[pos + 1]]
+
+    def is_ancestor(self, pos1, pos2):
+        """Return whether the commit at `pos1` is an ancestor of the
+        commit at `pos2`.
+
+        As the parents are before their children, the commits before
+        `pos1` don't need to be visited.
+        """
+        if pos1 >= pos2:
+            return False
+        seen = set()
+        stack = [pos2]
+        while stack:
+            for pos in self.get_parents(stack.pop()):
+                if pos == pos1:
+                    return True
+                if pos > pos1 and pos not in seen:
+                    seen.add(pos)
+                    stack.append(pos)
+        return False
+
+    @classmethod
+    def write(cls, path, rev_list, graph=None):
+        """Write a commit graph containing the commits of `graph`, if
+        given, followed by the commits of `rev_list` and return it.
+
+        `rev_list` is a list of `[rev, parent...]` lists, as given by
+        `git rev-list --parents --topo-order --reverse`. The parents
+        must be in `graph` or before their children in `rev_list`.
+        """
+        base_count = len(graph) if graph is not None else 0
+        count = base_count + len(rev_list)
+        new_pos = {revs[0]: base_count + idx
+                   for idx, revs in enumerate(rev_list)}
+        new_ids = [unhexlify(revs[0]) for revs in rev_list]
+
+        def get_pos(rev):
+            pos = new_pos.get(rev)
+            if pos is None and graph is not None:
+                pos = graph.get_pos(rev)
+            return pos
+
+        # Parents
+        if graph is not None:
+            parent_offsets = graph._get_array(graph._parent_offsets_offset,
+                                              base_count + 1)
+            parents = graph._get_array(graph._parents_offset,
+                                       graph._num_edges)
+        else:
+            parent_offsets = array('I', [0])
+            parents = array('I')
+        for revs in rev_list:
+            # Parents missing from a shallow clone are skipped
+            parents.extend(pos for pos in map(get_pos, revs[1:])
+                               if pos is not None)
+            parent_offsets.append(len(parents))
+
+        # Children, sorted by position
+        child_offsets = array('I', [0]) * (count + 1)
+        for pos in parents:
+            child_offsets[pos + 1] += 1
+        for pos in xrange(count):
+            child_offsets[pos + 1] += child_offsets[pos]
+        children = array('I', [0]) * len(parents)
+        next_child = array('I', child_offsets)
+        for pos in xrange(count):
+            for parent in parents[parent_offsets[pos]:
+                                  parent_offsets[pos + 1]]:
+                children[next_child[parent]] = pos
+                next_child[parent] += 1
+
+        # Sorted ids, merging the new ids into the sorted ids of `graph`
+        if graph is not None:
+            old_ids = graph._map[graph._sorted_ids_offset:
+                                 graph._sorted_ids_offset + 20 * base_count]
+            old_pos = graph._get_array(graph._sorted_pos_offset, base_count)
+        else:
+            old_ids = ''
+            old_pos = array('I')
+        sorted_ids = []
+        sorted_pos = array('I')
+        start = 0
+        for key, pos in sorted((key, base_count + idx)
+                               for idx, key in enumerate(new_ids)):
+            end = graph._bisect(key) if graph is not None else 0
+            sorted_ids.append(old_ids[20 * start:20 * end])
+            sorted_ids.append(key)
+            sorted_pos.extend(old_pos[start:end])
+            sorted_pos.append(pos)
+            start = end
+        sorted_ids.append(old_ids[20 * start:])
+        sorted_pos.extend(old_pos[start:])
+        sorted_ids = ''.join(sorted_ids)
+
+        first_bytes = sorted_ids[::20]
+        fanout = array('I')
+        total = 0
+        for byte in xrange(256):
+            total += first_bytes.count(chr(byte))
+            fanout.append(total)
+
+        if graph is not None:
+            ids = graph._map[graph._ids_offset:
+                             graph._ids_offset + 20 * base_count]
+        else:
+            ids = ''
+
+        with AtomicFile(path, 'wb') as f:
+            f.write(cls._header.pack(cls.magic, cls.version, count))
+            f.write(_array_to_bytes(fanout))
+            f.write(sorted_ids)
+            f.write(_array_to_bytes(sorted_pos))
+            f.write(ids)
+            f.write(''.join(new_ids))
+            f.write(_array_to_bytes(parent_offsets))
+            f.write(_array_to_bytes(parents))
+            f.write(_array_to_bytes(child_offsets))
+            f.write(_array_to_bytes(children))
+        return cls(path)
+
+    # Internal methods
+
+    @staticmethod
+    def _get_stat(st):
+        return st.st_ino, st.st_mtime, st.st_size
+
+    def _get_uint(self, offset):
+        return self._uint.unpack_from(self._map, offset)[0]
+
+    def _get_array(self, offset, count):
+        values = array('I')
+        values.fromstring(self._map[offset:offset + 4 * count])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def _get_list(self, offsets_offset, values_offset, pos):
+        start, end = self._uint_pair.unpack_from(self._map,
+                                                 offsets_offset + 4 * pos)
+        return struct.unpack_from('<%dI' % (end - start), self._map,
+                                  values_offset + 4 * start)
+
+    def _get_sorted_id(self, idx):
+        offset = self._sorted_ids_offset + 20 * idx
+        return self._map[offset:offset + 20]
+
+    def _bisect(self, key):
+        """Return the index of the first sorted id not lower than
+        `key`.
+        """
+        byte = ord(key[0])
+        low = self._get_uint(self._fanout_offset + 4 * (byte - 1)) \
+              if byte else 0
+        high = self._get_uint(self._fanout_offset + 4 * byte)
+        while low < high:
+            mid = (low + high) // 2
+            if self._get_sorted_id(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+
 class StorageFactory(object):
     __dict = weakref.WeakValueDictionary()
     __dict_nonweak = {}
@@ -207,7 +1090,8 @@ class StorageFactory(object):
     __dict_lock = Lock()
 
     def __init__(self, repo, log, weak=True, git_bin='git',
-                 git_fs_encoding=None):
+                 git_fs_encoding=None, commit_graph_path=None,
+                 backend='git'):
         self.logger = log
 
         with self.__dict_lock:
@@ -222,7 +1106,8 @@ class StorageFactory(object):
                 i = self.__dict[repo]
             except KeyError:
                 rev_cache = self.__dict_rev_cache.get(repo)
-                i = Storage(repo, log, git_bin, git_fs_encoding, rev_cache)
+                i = Storage(repo, log, git_bin, git_fs_encoding, rev_cache,
+                            commit_graph_path, backend)
                 self.__dict[repo] = i
 
             # create additional reference depending on 'weak' argument
@@ -298,6 +1183,154 @@ class Storage(object):
                 if refname.startswith('refs/tags/'):
                     yield refname[10:], rev
 
+        def __contains__(self, rev):
+            return rev in self.rev_dict
+
+        def __len__(self):
+            return len(self.rev_dict)
+
+        def iter_revs(self):
+            return self.rev_dict.iterkeys()
+
+        def get_children(self, rev):
+            try:
+                return sorted(self.rev_dict[rev][0])
+            except KeyError:
+                return []
+
+        def get_parents(self, rev):
+            try:
+                return list(self.rev_dict[rev][1])
+            except KeyError:
+                return []
+
+        def get_ordinal(self, rev):
+            """Return the position of `rev` in the history, starting
+            from 1 for the youngest revision.
+            """
+            return self.rev_dict[rev][2]
+
+        def get_rev(self, ordinal):
+            for rev, entry in self.rev_dict.iteritems():
+                if entry[2] == ordinal:
+                    return rev
+
+        def get_rheads(self, rev):
+            """Return the branch heads from which `rev` is reachable."""
+            try:
+                return self.rev_dict[rev][3]
+            except KeyError:
+                return frozenset()
+
+        def get_srevs(self, rev):
+            """Return the revisions having the same 4 first characters
+            as `rev`.
+            """
+            try:
+                return self.srev_dict[int(rev[:4], 16)]
+            except (KeyError, IndexError):
+                return ()
+
+        def iter_descendants(self, rev):
+            """Traverse the descendants of `rev` in breadth-first
+            order.
+            """
+            return self._iter_descendants(lambda rev: self.rev_dict[rev][0],
+                                          rev)
+
+        def is_ancestor(self, rev1, rev2):
+            return rev2 in self and rev2 in self.iter_descendants(rev1)
+
+        @staticmethod
+        def _iter_descendants(get_children, rev):
+            work_list = deque()
+            seen = set()
+
+            _children = get_children(rev)
+            seen.update(_children)
+            work_list.extend(_children)
+
+            while work_list:
+                p = work_list.popleft()
+                yield p
+
+                _children = set(get_children(p)) - seen
+                seen.update(_children)
+                work_list.extend(_children)
+
+    class GraphRevCache(RevCache):
+        """Revision cache backed by a `CommitGraph`.
+
+        :since: 1.3.4
+        """
+
+        __slots__ = ('graph', 'rheads_cache')
+
+        def __init__(self, refs_dict, graph):
+            count = len(graph)
+            super(Storage.GraphRevCache, self).__init__(
+                graph.get_rev(count - 1), graph.get_rev(0), graph,
+                refs_dict, graph)
+            self.graph = graph
+            self.rheads_cache = SizedDict(1000)
+
+        def __contains__(self, rev):
+            return self.graph.get_pos(rev) is not None
+
+        def iter_revs(self):
+            return iter(self.graph)
+
+        def get_children(self, rev):
+            return self._get_revs(self.graph.get_children, rev)
+
+        def get_parents(self, rev):
+            return self._get_revs(self.graph.get_parents, rev)
+
+        def get_ordinal(self, rev):
+            pos = self.graph.get_pos(rev)
+            if pos is None:
+                raise KeyError(rev)
+            return len(self.graph) - pos
+
+        def get_rev(self, ordinal):
+            if 1 <= ordinal <= len(self.graph):
+                return self.graph.get_rev(len(self.graph) - ordinal)
+
+        def get_rheads(self, rev):
+            try:
+                return self.rheads_cache[rev]
+            except KeyError:
+                pass
+            graph = self.graph
+            pos = graph.get_pos(rev)
+            if pos is None:
+                return frozenset()
+            rheads = frozenset(head for name, head, is_head
+                                    in self.iter_branches()
+                                    if head == rev or graph.is_ancestor(
+                                        pos, graph.get_pos(head)))
+            self.rheads_cache[rev] = rheads
+            return rheads
+
+        def get_srevs(self, rev):
+            return self.graph.get_revs_by_prefix(rev[:4])
+
+        def iter_descendants(self, rev):
+            return self._iter_descendants(self.get_children, rev)
+
+        def is_ancestor(self, rev1, rev2):
+            graph = self.graph
+            pos1 = graph.get_pos(rev1)
+            pos2 = graph.get_pos(rev2)
+            return pos1 is not None and pos2 is not None and \
+                   graph.is_ancestor(pos1, pos2)
+
+        def _get_revs(self, fn, rev):
+            pos = self.graph.get_pos(rev)
+            if pos is None:
+                return []
+            return sorted(self.graph.get_rev(p) for p in fn(pos))
+
     @staticmethod
     def __rev_key(rev):
         assert len(rev) >= 4
@@ -341,7 +1374,7 @@ class Storage(object):
                            % (git_bin, repr(e)))
 
     def __init__(self, git_dir, log, git_bin='git', git_fs_encoding=None,
-                 rev_cache=None):
+                 rev_cache=None, commit_graph_path=None, backend='git'):
         """Initialize PyGit.Storage instance
 
         `git_dir`: path to .git folder;
@@ -356,6 +1389,12 @@ class Storage(object):
                 if `None`, no implicit decoding/encoding to/from
                 unicode objects is performed, and bytestrings are
                 returned instead
+
+        `commit_graph_path`: path to the file storing the commit graph;
+                if `None`, the commit graph is built in memory
+
+        `backend`: `'git'` for reading the objects with `git cat-file`
+                processes, `'python'` for reading them with `ObjectStore`
         """
 
         self.logger = log
@@ -366,14 +1405,13 @@ class Storage(object):
         self.__rev_cache = rev_cache or self.RevCache.empty()
         self.__rev_cache_refresh = True
         self.__rev_cache_lock = Lock()
+        self.__commit_graph = None
+        self.__commit_graph_path = commit_graph_path
 
         # cache the last 200 commit messages
         self.__commit_msg_cache = SizedDict(200)
         self.__commit_msg_lock = Lock()
 
-        self.__cat_file_pipe = None
-        self.__cat_file_pipe_lock = Lock()
-
         if git_fs_encoding is not None:
             # validate encoding name
             codecs.lookup(git_fs_encoding)
@@ -416,6 +1454,25 @@ class Storage(object):
         self.repo = GitCore(git_dir, git_bin, log, git_fs_encoding)
         self.repo_path = git_dir
 
+        if backend == 'python':
+            # a weak reference avoids a cycle, as Storage has __del__
+            storage_ref = weakref.ref(self)
+            def resolve(rev):
+                storage = storage_ref()
+                if storage is not None:
+                    return storage.verifyrev(storage._fs_to_unicode(rev))
+            self.__cat_file_pool = self.__cat_file_check_pool = \
+                ObjectStore(os.path.join(git_dir, 'objects'), resolve)
+        elif backend == 'git':
+            # persistent `cat-file` processes, for reading the objects
+            # without forking a git process for each of them
+            self.__cat_file_pool = CatFilePool(self.repo.cat_file_batch,
+                                               True)
+            self.__cat_file_check_pool = \
+                CatFilePool(self.repo.cat_file_batch_check, False)
+        else:
+            raise GitError("Unknown backend '%s'" % backend)
+
         self.logger.debug("PyGIT.Storage instance for '%s' is constructed",
                           git_dir)
 
@@ -428,8 +1485,12 @@ class Storage(object):
             proc.wait()
 
     def __del__(self):
-        with self.__cat_file_pipe_lock:
-            self._cleanup_proc(self.__cat_file_pipe)
+        # the pools are not created if the constructor failed
+        for name in ('_Storage__cat_file_pool',
+                     '_Storage__cat_file_check_pool'):
+            pool = getattr(self, name, None)
+            if pool is not None:
+                pool.close()
 
     #
     # cache handling
@@ -469,6 +1530,9 @@ class Storage(object):
         return refreshed
 
     def _build_rev_cache(self, refs):
+        if self.__commit_graph_path:
+            return self._build_graph_rev_cache(refs)
+
         self.logger.debug("triggered rebuild of commit tree db for '%s'",
                           self.repo_path)
         ts0 = time_now()
@@ -560,6 +1624,60 @@ class Storage(object):
                           1000 * (time_now() - ts0))
         return rev_cache
 
+    def _build_graph_rev_cache(self, refs):
+        if not refs:
+            return self.RevCache.empty()
+        ts0 = time_now()
+        path = self.__commit_graph_path
+        graph = self.__commit_graph
+        if graph is None or graph.is_stale():
+            # The file may have been updated by another process
+            try:
+                graph = CommitGraph(path)
+            except (EnvironmentError, ValueError, GitError) as e:
+                if os.path.exists(path):
+                    self.logger.warning("Rebuilding commit graph '%s': %s",
+                                        path, to_unicode(e))
+                graph = None
+
+        heads = None
+        if graph is not None:
+            head_revs = [graph.get_rev(pos) for pos in graph.get_heads()]
+            heads = ''.join(rev + '\n' for rev in head_revs)
+            # Rebuild the graph when commits no longer exist or are no
+            # longer reachable, e.g. after deleting a branch or
+            # rewriting the history. `rev-list` fails and outputs
+            # nothing when one of the heads doesn't exist.
+            with self.__cat_file_check_pool.checkout() as cat_file:
+                missing = None in cat_file.get_many(head_revs)
+            if missing or \
+                    self.repo.rev_list('--max-count=1', '--stdin', '--not',
+                                       '--all', input=heads):
+                self.logger.debug("commits removed from '%s', rebuilding "
+                                  "commit graph", self.repo_path)
+                graph = heads = None
+
+        if graph is not None:
+            # Only the commits not reachable from the heads of the
+            # graph are retrieved
+            input = ''.join('^' + line for line in heads.splitlines(True))
+            rev_list = self.repo.rev_list('--parents', '--topo-order',
+                                          '--reverse', '--all', '--stdin',
+                                          input=input)
+        else:
+            rev_list = self.repo.rev_list('--parents', '--topo-order',
+                                          '--reverse', '--all')
+        rev_list = [line.split() for line in rev_list.splitlines()]
+        if rev_list or graph is None:
+            graph = CommitGraph.write(path, rev_list, graph)
+        self.__commit_graph = graph
+
+        self.logger.debug("updated commit graph for '%s' with %d new "
+                          "entries, %d entries (took %.1f ms)",
+                          self.repo_path, len(rev_list), len(graph),
+                          1000 * (time_now() - ts0))
+        return self.GraphRevCache(refs, graph)
+
     def _get_refs(self):
         refs = {}
         tags = {}
@@ -616,9 +1734,8 @@ class Storage(object):
 
         _rev_cache = self.rev_cache
 
-        try:
-            rheads = _rev_cache.rev_dict[sha][3]
-        except KeyError:
+        rheads = _rev_cache.get_rheads(sha)
+        if not rheads:
             return []
 
         if resolve:
@@ -629,22 +1746,22 @@ class Storage(object):
             return list(rheads)
 
     def history_relative_rev(self, sha, rel_pos):
-        db = self.get_commits()
+        _rev_cache = self.rev_cache
 
-        if sha not in db:
+        if sha not in _rev_cache:
             raise GitErrorSha()
 
         if rel_pos == 0:
             return sha
 
-        lin_rev = db[sha][2] + rel_pos
+        lin_rev = _rev_cache.get_ordinal(sha) + rel_pos
 
-        if lin_rev < 1 or lin_rev > len(db):
+        if lin_rev < 1 or lin_rev > len(_rev_cache):
             return None
 
-        for k, v in db.iteritems():
-            if v[2] == lin_rev:
-                return k
+        rev = _rev_cache.get_rev(lin_rev)
+        if rev is not None:
+            return rev
 
         # should never be reached if db is consistent
         raise GitError("internal inconsistency detected")
@@ -668,36 +1785,25 @@ class Storage(object):
         return self.verifyrev('HEAD')
 
     def cat_file(self, kind, sha):
-        with self.__cat_file_pipe_lock:
-            if self.__cat_file_pipe is None:
-                self.__cat_file_pipe = self.repo.cat_file_batch()
+        try:
+            with self.__cat_file_pool.checkout() as cat_file:
+                result = cat_file.get(sha)
+        except (EnvironmentError, GitError) as e:
+            # The process has been closed by the pool, so that the next
+            # call doesn't get the payload of this one
+            self.logger.debug("closed cat_file pipe: %s",
+                              exception_to_unicode(e))
+            return None
 
-            try:
-                self.__cat_file_pipe.stdin.write(sha + '\n')
-                self.__cat_file_pipe.stdin.flush()
-
-                split_stdout_line = self.__cat_file_pipe.stdout.readline() \
-                                                               .split()
-                if len(split_stdout_line) != 3:
-                    raise GitError("internal error (could not split line "
-                                   "'%s')" % (split_stdout_line,))
-
-                _sha, _type, _size = split_stdout_line
-
-                if _type != kind:
-                    raise GitError("internal error (got unexpected object "
-                                   "kind '%s', expected '%s')"
-                                   % (_type, kind))
-
-                size = int(_size)
-                return self.__cat_file_pipe.stdout.read(size + 1)[:size]
-            except:
-                # There was an error, we should close the pipe to get to a
-                # consistent state (Otherwise it happens that next time we
-                # call cat_file we get payload from previous call)
-                self.logger.debug("closing cat_file pipe")
-                self._cleanup_proc(self.__cat_file_pipe)
-                self.__cat_file_pipe = None
+        if result is None:
+            self.logger.debug("cat_file: object '%s' not found", sha)
+            return None
+        _sha, _type, size, content = result
+        if _type != kind:
+            self.logger.debug("cat_file: got unexpected object kind '%s', "
+                              "expected '%s'", _type, kind)
+            return None
+        return content
 
     def verifyrev(self, rev):
         """verify/lookup given revision object and return a sha id or None
@@ -729,7 +1835,7 @@ class Storage(object):
         rc = self.repo.rev_parse('--verify', rev).strip()
         if not rc:
             return None
-        if rc in _rev_cache.rev_dict:
+        if rc in _rev_cache:
             return rc
 
         return None
@@ -745,11 +1851,11 @@ class Storage(object):
 
         _rev_cache = self.rev_cache
 
-        if rev not in _rev_cache.rev_dict:
+        if rev not in _rev_cache:
             return None
 
         srev = rev[:min_len]
-        srevs = set(_rev_cache.srev_dict[self.__rev_key(rev)])
+        srevs = set(_rev_cache.get_srevs(rev))
 
         if len(srevs) == 1:
             return srev # we already got a unique id
@@ -772,17 +1878,13 @@ class Storage(object):
         _rev_cache = self.rev_cache
 
         # short-cut
-        if len(srev) == 40 and srev in _rev_cache.rev_dict:
+        if len(srev) == 40 and srev in _rev_cache:
             return srev
 
         if not GitCore.is_sha(srev):
             return None
 
-        try:
-            srevs = _rev_cache.srev_dict[self.__rev_key(srev)]
-        except KeyError:
-            return None
-
+        srevs = _rev_cache.get_srevs(srev)
         srevs = filter(lambda s: s.startswith(srev), srevs)
         if len(srevs) == 1:
             return srevs[0]
@@ -797,6 +1899,10 @@ class Storage(object):
     def ls_tree(self, rev, path='', recursive=False):
         rev = rev and str(rev) or 'HEAD' # paranoia
         path = self._fs_from_unicode(path).lstrip('/') or '.'
+        if '\n' not in rev and '\n' not in path:
+            return self._read_tree(rev, path, recursive)
+
+        # `cat-file --batch` can't read names containing a newline
         tree = self.repo.ls_tree('-zlr' if recursive else '-zl',
                                  rev, '--', path).split('\0')
 
@@ -811,6 +1917,58 @@ class Storage(object):
 
         return [ split_ls_tree_line(e) for e in tree if e ]
 
+    def _read_tree(self, rev, path, recursive):
+        """Return the same entries as `git ls-tree -l` for `rev` and
+        `path`, reading and parsing the tree objects in-process.
+        """
+        if path == '.':
+            dirname, basename = '', None
+        elif path.endswith('/'):
+            dirname, basename = path.rstrip('/'), None
+        elif '/' in path:
+            dirname, basename = path.rsplit('/', 1)
+        else:
+            dirname, basename = '', path
+
+        with self.__cat_file_pool.checkout() as cat_file:
+            result = cat_file.get('%s:%s' % (rev, dirname) if dirname
+                                  else rev + '^{tree}')
+            if result is None or result[1] != 'tree':
+                return []
+            prefix = dirname + '/' if dirname else ''
+            entries = [entry for entry in _parse_tree(result[3], prefix)
+                             if basename is None or
+                                entry[3] == prefix + basename]
+            if recursive:
+                entries = self._expand_trees(cat_file, entries)
+
+        blobs = [entry[2] for entry in entries if entry[1] == 'blob']
+        with self.__cat_file_check_pool.checkout() as cat_file:
+            sizes = {result[0]: result[2]
+                     for result in cat_file.get_many(blobs) if result}
+        return [(mode, type_, sha, sizes.get(sha) if type_ == 'blob'
+                                   else None, self._fs_to_unicode(name))
+                for mode, type_, sha, name in entries]
+
+    def _expand_trees(self, cat_file, entries):
+        """Recursively replace the trees in `entries` by their entries,
+        in the order of `git ls-tree -r`.
+        """
+        trees = [entry[2] for entry in entries if entry[1] == 'tree']
+        if not trees:
+            return entries
+        contents = {result[0]: result[3]
+                    for result in cat_file.get_many(trees) if result}
+        expanded = []
+        for entry in entries:
+            mode, type_, sha, name = entry
+            if type_ != 'tree':
+                expanded.append(entry)
+            elif sha in contents:
+                expanded.extend(self._expand_trees(
+                    cat_file, _parse_tree(contents[sha], name + '/')))
+        return expanded
+
     def read_commit(self, commit_id):
         if not commit_id:
             raise GitError("read_commit called with empty commit_id")
@@ -844,54 +2002,29 @@ class Storage(object):
     def get_obj_size(self, sha):
         sha = str(sha)
 
-        try:
-            obj_size = int(self.repo.cat_file('-s', sha).strip())
-        except ValueError:
+        with self.__cat_file_check_pool.checkout() as cat_file:
+            result = cat_file.get(sha)
+        if result is None:
             raise GitErrorSha("object '%s' not found" % sha)
 
-        return obj_size
+        return result[2]
 
     def children(self, sha):
-        db = self.get_commits()
-
-        try:
-            return sorted(db[sha][0])
-        except KeyError:
-            return []
+        return self.rev_cache.get_children(sha)
 
     def children_recursive(self, sha, rev_dict=None):
         """Recursively traverse children in breadth-first order"""
 
         if rev_dict is None:
-            rev_dict = self.get_commits()
-
-        work_list = deque()
-        seen = set()
-
-        _children = rev_dict[sha][0]
-        seen.update(_children)
-        work_list.extend(_children)
-
-        while work_list:
-            p = work_list.popleft()
-            yield p
-
-            _children = rev_dict[p][0] - seen
-            seen.update(_children)
-            work_list.extend(_children)
-
-        assert len(work_list) == 0
+            return self.rev_cache.iter_descendants(sha)
+        return self.RevCache._iter_descendants(
+            lambda rev: rev_dict[rev][0], sha)
 
     def parents(self, sha):
-        db = self.get_commits()
-
-        try:
-            return list(db[sha][1])
-        except KeyError:
-            return []
+        return self.rev_cache.get_parents(sha)
 
     def all_revs(self):
-        return self.get_commits().iterkeys()
+        return self.rev_cache.iter_revs()
 
     def sync(self):
         with self.__rev_cache_lock:
@@ -902,6 +2035,7 @@ class Storage(object):
         p = []
         change = {}
         next_path = []
+        state = {'done': False, 'closed': False}
         base_path = self._fs_from_unicode(base_path) or '.'
 
         def name_status_gen():
@@ -929,21 +2063,28 @@ class Storage(object):
             if p:
                 self._cleanup_proc(p[0])
             p[:] = []
+            state['done'] = True
             while True:
                 yield None
         gen = name_status_gen()
 
-        def historian(path):
-            path = self._fs_from_unicode(path)
+        def historian(upath):
+            path = self._fs_from_unicode(upath)
             try:
                 return change[path]
             except KeyError:
+                if state['closed'] and not state['done']:
+                    # the `git log` has been interrupted, e.g. nodes
+                    # lazily retrieving their `created_rev`
+                    with self.get_historian(sha, upath) as historian_:
+                        return historian_(upath)
                 next_path[:] = [path]
                 return next(gen)
 
         try:
             yield historian
         finally:
+            state['closed'] = True
             if p:
                 self._cleanup_proc(p[0])
 
@@ -975,9 +2116,7 @@ class Storage(object):
     def rev_is_anchestor_of(self, rev1, rev2):
         """return True if rev2 is successor of rev1"""
 
-        rev_dict = self.get_commits()
-        return (rev2 in rev_dict and
-                rev2 in self.children_recursive(rev1, rev_dict))
+        return self.rev_cache.is_ancestor(rev1, rev2)
 
     def blame(self, commit_sha, path):
         in_metadata = False
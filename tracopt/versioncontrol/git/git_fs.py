@@ -12,18 +12,21 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from contextlib import closing
 from datetime import datetime
+from hashlib import sha1
 import itertools
 import os
 
 from trac.api import ISystemInfoProvider
 from trac.cache import cached
-from trac.config import BoolOption, IntOption, ListOption, PathOption, Option
+from trac.config import BoolOption, ChoiceOption, IntOption, ListOption, \
+                        PathOption, Option
 from trac.core import Component, TracError, implements
 from trac.util import shorten_line
 from trac.util.datefmt import FixedOffset, to_timestamp, format_datetime
 from trac.util.html import Markup, tag
-from trac.util.text import to_unicode, exception_to_unicode
+from trac.util.text import exception_to_unicode, to_unicode, to_utf8
 from trac.util.translation import _
 from trac.versioncontrol.api import Changeset, Node, Repository, \
                                     IRepositoryConnector, InvalidRepository,\
@@ -134,6 +137,26 @@ class GitCachedRepository(CachedRepository):
                     revs[idx:idx] = traverse(rev, seen)
             return revs
 
+        def insert_changesets(changesets):
+            try:
+                self._insert_changeset_rows(changesets)
+            except self.env.db_exc.IntegrityError as e:
+                if len(changesets) == 1:
+                    self.log.info('Revision %s already cached: %r',
+                                  changesets[0][0], e)
+                    return []
+                # Retry one by one to skip the revisions already cached
+                return [changeset for changeset in changesets
+                                  if insert_changesets([changeset])]
+            return changesets
+
+        def batches(revs):
+            # sync revisions from older revision to newer revision
+            batch_size = max(1, RepositoryManager(self.env).sync_batch_size)
+            while revs:
+                yield [revs.pop() for idx in xrange(min(batch_size,
+                                                        len(revs)))]
+
         def sync_revs():
             updated = False
             seen = set()
@@ -142,19 +165,22 @@ class GitCachedRepository(CachedRepository):
                 if repos.child_revs(rev):
                     continue
                 revs = traverse(rev, seen)  # topology ordered
-                while revs:
-                    # sync revision from older revision to newer revision
-                    rev = revs.pop()
-                    self.log.info("Trying to sync revision [%s]", rev)
-                    cset = repos.get_changeset(rev)
-                    try:
-                        self.insert_changeset(rev, cset)
-                        updated = True
-                    except self.env.db_exc.IntegrityError as e:
-                        self.log.info('Revision %s already cached: %r', rev, e)
-                        continue
-                    if feedback:
-                        feedback(rev)
+                with closing(self._fetch_changesets(batches(revs))) \
+                        as fetched:
+                    for changesets in fetched:
+                        if len(changesets) == 1:
+                            self.log.info("Trying to sync revision [%s]",
+                                          changesets[0][0])
+                        else:
+                            self.log.info("Trying to sync revisions [%s:%s]",
+                                          changesets[0][0],
+                                          changesets[-1][0])
+                        changesets = insert_changesets(changesets)
+                        if changesets:
+                            updated = True
+                        if feedback:
+                            for rev, revision, changes in changesets:
+                                feedback(rev)
 
             return updated
 
@@ -306,6 +332,16 @@ class GitConnector(Component):
     cached_repository = BoolOption('git', 'cached_repository', 'false',
         """Wrap `GitRepository` in `CachedRepository`.""")
 
+    commit_graph_dir = PathOption('git', 'commit_graph_dir', '',
+        """Directory where the commit graph of each repository is
+        stored. When set, the commit graph is read from a file shared by
+        the processes and only the new commits are retrieved from the
+        repository, instead of building the whole graph in memory in
+        each process. Relative paths are resolved relative to the
+        environment directory, e.g. `files/git`.
+        (''since 1.3.4'')
+        """)
+
     shortrev_len = IntOption('git', 'shortrev_len', 7,
         """The length at which a sha1 is abbreviated (must be >= 4
         and <= 40).
@@ -341,6 +377,15 @@ class GitConnector(Component):
     git_bin = Option('git', 'git_bin', 'git',
         """Path to the git executable.""")
 
+    backend = ChoiceOption('git', 'backend', ('git', 'python'),
+        """How the objects of the repositories are read. With `git`,
+        they are read through long-lived `git cat-file` processes. With
+        `python`, the loose objects and packfiles are read directly,
+        without running git processes. The history, blame and diff are
+        always computed by the git executable.
+        (''since 1.3.4'')
+        """)
+
 
     def get_supported_types(self):
         yield ('git', 8)
@@ -391,6 +436,15 @@ class GitConnector(Component):
             def rlookup_uid(_):
                 return None
 
+        if self.commit_graph_dir:
+            if not os.path.isdir(self.commit_graph_dir):
+                os.makedirs(self.commit_graph_dir)
+            key = sha1(to_utf8(os.path.realpath(dir))).hexdigest()
+            commit_graph_path = os.path.join(self.commit_graph_dir,
+                                             key + '.graph')
+        else:
+            commit_graph_path = None
+
         repos = GitRepository(self.env, dir, params, self.log,
                               persistent_cache=self.persistent_cache,
                               git_bin=self.git_bin,
@@ -399,6 +453,8 @@ class GitConnector(Component):
                               rlookup_uid=rlookup_uid,
                               use_committer_id=self.use_committer_id,
                               use_committer_time=self.use_committer_time,
+                              commit_graph_path=commit_graph_path,
+                              backend=self.backend,
                               )
 
         if self.cached_repository:
@@ -500,6 +556,8 @@ class CsetPropertyRenderer(Component):
 class GitRepository(Repository):
     """Git repository"""
 
+    has_thread_safe_changesets = True
+
     def __init__(self, env, path, params, log,
                  persistent_cache=False,
                  git_bin='git',
@@ -508,6 +566,8 @@ class GitRepository(Repository):
                  rlookup_uid=lambda _: None,
                  use_committer_id=False,
                  use_committer_time=False,
+                 commit_graph_path=None,
+                 backend='git',
                  ):
 
         self.env = env
@@ -523,7 +583,9 @@ class GitRepository(Repository):
         try:
             factory = PyGIT.StorageFactory(path, log, not persistent_cache,
                                            git_bin=git_bin,
-                                           git_fs_encoding=git_fs_encoding)
+                                           git_fs_encoding=git_fs_encoding,
+                                           commit_graph_path=commit_graph_path,
+                                           backend=backend)
             self._git = factory.getInstance()
         except PyGIT.GitError as e:
             log.error(exception_to_unicode(e))
@@ -582,6 +644,22 @@ class GitRepository(Repository):
     def _get_node(self, path, rev, ls_tree_info=None, historian=None):
         return GitNode(self, path, rev, self.log, ls_tree_info, historian)
 
+    def get_created_revs(self, nodes):
+        # A single `git log` for the nodes of each directory
+        nodes_by_dir = {}
+        for node in nodes:
+            path = node.path.strip('/')
+            key = node.rev, path.rpartition('/')[0]
+            nodes_by_dir.setdefault(key, []).append((node, path))
+        revs = {}
+        for (rev, dir), dir_nodes in nodes_by_dir.iteritems():
+            with self.git.get_historian(rev, dir) as historian:
+                for node, path in dir_nodes:
+                    revs[node.path] = \
+                        self.git.last_change(rev, path, historian) \
+                        if path else rev
+        return revs
+
     def get_quickjump_entries(self, rev):
         for bname, bsha in self.git.get_branches():
             yield 'branches', bname, '/', bsha
@@ -700,6 +778,8 @@ class GitNode(Node):
             rev = repos.youngest_rev
         created_rev = rev
 
+        self._historian = historian
+
         kind = Node.DIRECTORY
         p = path.strip('/')
         if p:  # ie. not the root-tree
@@ -714,8 +794,9 @@ class GitNode(Node):
             self.fs_perm, self.fs_type, self.fs_sha, self.fs_size, fname = \
                 ls_tree_info
 
-            # fix-up to the last commit-rev that touched this node
-            created_rev = repos.git.last_change(rev, p, historian)
+            # fix-up to the last commit-rev that touched this node,
+            # retrieved on first access of `created_rev`
+            created_rev = None
 
             if self.fs_type == 'tree':
                 kind = Node.DIRECTORY
@@ -735,6 +816,18 @@ class GitNode(Node):
 
         Node.__init__(self, repos, path, rev, kind)
 
+    @property
+    def created_rev(self):
+        if self._created_rev is None and self.path.strip('/'):
+            self._created_rev = self.repos.git.last_change(
+                self.rev, self.path.strip('/'), self._historian)
+            self._historian = None
+        return self._created_rev
+
+    @created_rev.setter
+    def created_rev(self, rev):
+        self._created_rev = rev
+
     def __git_path(self):
         """return path as expected by PyGIT"""
         p = self.path.strip('/')
@@ -20,8 +20,10 @@ from trac.test import EnvironmentStub, mkdtemp, rmtree
 from trac.util import create_file
 from trac.versioncontrol.api import Changeset, DbRepositoryProvider, \
                                     RepositoryManager
-from tracopt.versioncontrol.git.PyGIT import GitCore, GitError, Storage, \
-                                             SizedDict, StorageFactory, \
+from tracopt.versioncontrol.git.PyGIT import CatFilePool, CommitGraph, \
+                                             GitCore, GitError, GitErrorSha, \
+                                             ObjectStore, SizedDict, \
+                                             Storage, StorageFactory, \
                                              parse_commit
 from tracopt.versioncontrol.git.tests.git_fs import GitCommandMixin
 
@@ -272,6 +274,76 @@ class NormalTestCase(unittest.TestCase, GitCommandMixin):
                          sorted(b[0] for b in storage.get_branches()))
         self.assertFalse(storage.sync())
 
+    def _git_ls_tree(self, storage, rev, path, recursive=False):
+        output = storage.repo.ls_tree('-zlr' if recursive else '-zl', rev,
+                                      '--', path or '.')
+        entries = []
+        for line in output.split('\0'):
+            if line:
+                meta, fname = line.split('\t', 1)
+                mode, type_, sha, size = meta.split()
+                entries.append((int(mode, 8), type_, sha,
+                                None if size == '-' else int(size),
+                                fname.decode('utf-8')))
+        return entries
+
+    def test_ls_tree(self):
+        for path in ('dir/sub/file.txt', 'dir/file.txt', 'dir/empty.txt',
+                     'file.txt', 'dir-/file.txt'):
+            dirname = os.path.dirname(os.path.join(self.repos_path, path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            create_file(os.path.join(self.repos_path, path),
+                        '' if 'empty' in path else path * 10)
+        self._git('add', '.')
+        self._git_commit('-m', 'ls-tree', date=datetime(2019, 3, 1, 9, 0, 0))
+
+        storage = self._storage()
+        rev = storage.head()
+        for path in ('', '.', '/', 'dir', 'dir/', 'dir/sub', 'dir/sub/',
+                     'dir/file.txt', 'file.txt', 'dir-', 'dir/file.txt/',
+                     'missing', 'dir/missing', 'missing/file.txt'):
+            for recursive in (False, True):
+                self.assertEqual(
+                    self._git_ls_tree(storage, rev, path.lstrip('/'),
+                                      recursive),
+                    storage.ls_tree(rev, path, recursive),
+                    'path %r, recursive %r' % (path, recursive))
+        self.assertEqual([], storage.ls_tree('0' * 40, 'dir'))
+        self.assertEqual(self._git_ls_tree(storage, rev, 'dir'),
+                         storage.ls_tree('master', 'dir'))
+
+    def test_cat_file_pool(self):
+        storage = self._storage()
+        rev = storage.head()
+        blob = storage.ls_tree(rev, '.gitignore')[0][2]
+        self.assertEqual('', storage.get_file(blob).read())
+        self.assertEqual(0, storage.get_obj_size(blob))
+        self.assertIsNone(storage.cat_file('blob', '0' * 40))
+        self.assertIsNone(storage.cat_file('commit', blob))
+        self.assertRaises(GitErrorSha, storage.get_obj_size, '0' * 40)
+        # the processes are still usable after the errors
+        self.assertEqual('test', storage.read_commit(rev)[0])
+        self.assertEqual(0, storage.get_obj_size(blob))
+
+    def test_cat_file_pool_discards_exited_processes(self):
+        pool = CatFilePool(self._storage().repo.cat_file_batch_check, False)
+        with pool.checkout() as cat_file:
+            pass
+        cat_file.proc.stdin.close()
+        cat_file.proc.wait()
+        with pool.checkout() as cat_file2:
+            self.assertIsNot(cat_file, cat_file2)
+            self.assertIsNone(cat_file2.get('0' * 40))
+        self.assertRaises(ValueError, self._checkout_and_fail, pool)
+        with pool.checkout() as cat_file3:
+            self.assertIsNot(cat_file2, cat_file3)
+        pool.close()
+
+    def _checkout_and_fail(self, pool):
+        with pool.checkout():
+            raise ValueError
+
     def test_turn_off_persistent_cache(self):
         # persistent_cache is enabled
         parent_rev = self._factory(False).getInstance().youngest_rev()
@@ -286,6 +358,272 @@ class NormalTestCase(unittest.TestCase, GitCommandMixin):
         self.assertNotEqual(rev, parent_rev)
 
 
+class CommitGraphTestCase(unittest.TestCase, GitCommandMixin):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.repos_path = mkdtemp()
+        self.graph_dir = mkdtemp()
+        self.graph_path = os.path.join(self.graph_dir, 'repos.graph')
+        self._git('init')
+        self._git('config', 'user.name', "Joe")
+        self._git('config', 'user.email', "joe@example.com")
+        self._commit('initial', datetime(2019, 1, 1, 9, 0, 0))
+
+    def tearDown(self):
+        StorageFactory._clean()
+        self.env.reset_db()
+        for path in (self.repos_path, self.graph_dir):
+            if os.path.isdir(path):
+                rmtree(path)
+
+    def _commit(self, name, date):
+        create_file(os.path.join(self.repos_path, name + '.txt'), name)
+        self._git('add', name + '.txt')
+        self._git_commit('-m', name, date=date)
+
+    def _create_branches(self):
+        self._git('checkout', '-b', 'b1', 'master')
+        self._commit('b1-1', datetime(2019, 1, 2, 9, 0, 0))
+        self._commit('b1-2', datetime(2019, 1, 3, 9, 0, 0))
+        self._git('checkout', 'master')
+        self._commit('master-1', datetime(2019, 1, 4, 9, 0, 0))
+        self._git_commit('--allow-empty', '-m', 'tag',
+                         date=datetime(2019, 1, 5, 9, 0, 0))
+        self._git('tag', 'v1')
+        self._git('merge', '--no-ff', '-m', 'merge b1', 'b1')
+        self._git('checkout', '-b', 'b2', 'b1')
+        self._commit('b2-1', datetime(2019, 1, 6, 9, 0, 0))
+        self._git('checkout', 'master')
+
+    def _storages(self):
+        path = os.path.join(self.repos_path, '.git')
+        return (Storage(path, self.env.log, self.git_bin, 'utf-8'),
+                Storage(path, self.env.log, self.git_bin, 'utf-8',
+                        commit_graph_path=self.graph_path))
+
+    def _assert_same_history(self, expected, actual):
+        revs = sorted(expected.all_revs())
+        self.assertEqual(revs, sorted(actual.all_revs()))
+        self.assertEqual(len(revs), len(actual.get_commits()))
+        for rev in revs:
+            self.assertEqual(expected.children(rev), actual.children(rev))
+            self.assertEqual(sorted(expected.parents(rev)),
+                             sorted(actual.parents(rev)))
+            self.assertEqual(sorted(expected.get_branch_contains(rev)),
+                             sorted(actual.get_branch_contains(rev)))
+            self.assertEqual(
+                sorted(expected.get_branch_contains(rev, resolve=True)),
+                sorted(actual.get_branch_contains(rev, resolve=True)))
+            self.assertEqual(sorted(expected.children_recursive(rev)),
+                             sorted(actual.children_recursive(rev)))
+            self.assertEqual(expected.shortrev(rev, 4),
+                             actual.shortrev(rev, 4))
+            self.assertEqual(rev, actual.fullrev(rev[:7]))
+            for rev2 in revs:
+                self.assertEqual(expected.rev_is_anchestor_of(rev, rev2),
+                                 actual.rev_is_anchestor_of(rev, rev2))
+        for rev in revs:
+            prev = actual.hist_prev_revision(rev)
+            if prev is not None:
+                self.assertEqual(rev, actual.hist_next_revision(prev))
+                self.assertFalse(actual.rev_is_anchestor_of(rev, prev))
+        self.assertIsNone(actual.hist_next_revision(actual.youngest_rev()))
+        self.assertIsNone(actual.hist_prev_revision(actual.oldest_rev()))
+        self.assertEqual(expected.oldest_rev(), actual.oldest_rev())
+        self.assertIn(actual.youngest_rev(), revs)
+        self.assertIsNone(actual.fullrev('0' * 40))
+        self.assertIsNone(actual.shortrev('0' * 40))
+        self.assertEqual([], actual.children('0' * 40))
+        self.assertEqual([], actual.get_branch_contains('0' * 40))
+
+    def test_build(self):
+        self._create_branches()
+        expected, actual = self._storages()
+        self._assert_same_history(expected, actual)
+        self.assertTrue(os.path.isfile(self.graph_path))
+        graph = CommitGraph(self.graph_path)
+        self.assertEqual(len(list(expected.all_revs())), len(graph))
+        for pos, rev in enumerate(graph):
+            self.assertEqual(pos, graph.get_pos(rev))
+            for parent in graph.get_parents(pos):
+                self.assertLess(parent, pos)
+        # b1 has been merged into master
+        self.assertEqual(sorted([expected.verifyrev('master'),
+                                 expected.verifyrev('b2')]),
+                         sorted(graph.get_rev(pos)
+                                for pos in graph.get_heads()))
+
+    def test_incremental_update(self):
+        expected, actual = self._storages()
+        self.assertEqual(1, len(actual.get_commits()))
+        self._create_branches()
+        expected.sync()
+        self.assertTrue(actual.sync())
+        self._assert_same_history(expected, actual)
+        self.assertFalse(actual.sync())
+
+        # another instance reuses the file
+        mtime = os.path.getmtime(self.graph_path)
+        expected, actual = self._storages()
+        self._assert_same_history(expected, actual)
+        self.assertEqual(mtime, os.path.getmtime(self.graph_path))
+
+    def test_rebuild_after_removing_branch(self):
+        self._create_branches()
+        expected, actual = self._storages()
+        self.assertEqual(sorted(expected.all_revs()),
+                         sorted(actual.all_revs()))
+        self._git('branch', '-D', 'b2')
+        expected.sync()
+        self.assertTrue(actual.sync())
+        self._assert_same_history(expected, actual)
+
+    def test_rebuild_after_pruning_branch(self):
+        """The graph is rebuilt when one of its heads no longer exists
+        in the repository."""
+        self._create_branches()
+        expected, actual = self._storages()
+        self.assertEqual(sorted(expected.all_revs()),
+                         sorted(actual.all_revs()))
+        self._git('branch', '-D', 'b2')
+        self._git('reflog', 'expire', '--expire=now', '--all')
+        self._git('gc', '--prune=now', '--quiet')
+        self._commit('master-2', datetime(2019, 1, 7, 9, 0, 0))
+        expected.sync()
+        self.assertTrue(actual.sync())
+        self._assert_same_history(expected, actual)
+        self.assertEqual(expected.verifyrev('master'), actual.youngest_rev())
+
+    def test_invalid_file(self):
+        create_file(self.graph_path, 'invalid')
+        self._create_branches()
+        expected, actual = self._storages()
+        self._assert_same_history(expected, actual)
+        self.assertEqual(len(list(expected.all_revs())),
+                         len(CommitGraph(self.graph_path)))
+
+
+class ObjectStoreTestCase(unittest.TestCase, GitCommandMixin):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.repos_path = mkdtemp()
+        self._git('init')
+        self._git('config', 'user.name', "Joe")
+        self._git('config', 'user.email', "joe@example.com")
+        os.mkdir(os.path.join(self.repos_path, 'dir'))
+        lines = ['line %d\n' % idx for idx in xrange(2000)]
+        for idx in xrange(5):
+            lines[idx * 100] = 'changed %d\n' % idx
+            create_file(os.path.join(self.repos_path, 'dir', 'file.txt'),
+                        ''.join(lines))
+            create_file(os.path.join(self.repos_path, 'file%d.txt' % idx),
+                        'file %d' % idx)
+            self._git('add', '.')
+            self._git_commit('-m', 'commit %d' % idx,
+                             date=datetime(2019, 2, 1 + idx, 9, 0, 0))
+        self._git('tag', '-a', '-m', 'tag', 'v1')
+        self.objects_dir = os.path.join(self.repos_path, '.git', 'objects')
+
+    def tearDown(self):
+        StorageFactory._clean()
+        self.env.reset_db()
+        if os.path.isdir(self.repos_path):
+            rmtree(self.repos_path)
+
+    def _storage(self, backend):
+        return Storage(os.path.join(self.repos_path, '.git'), self.env.log,
+                       self.git_bin, 'utf-8', backend=backend)
+
+    def _assert_same_objects(self, store):
+        repo = self._storage('git').repo
+        output = repo.cat_file('--batch-all-objects', '--batch-check')
+        shas = [line.split()[0] for line in output.splitlines()]
+        # 5 commits, 10 trees, 10 blobs and a tag
+        self.assertEqual(26, len(shas))
+        pool = CatFilePool(repo.cat_file_batch, True)
+        with pool.checkout() as cat_file:
+            self.assertEqual(cat_file.get_many(shas), store.get_many(shas))
+        pool.close()
+
+    def _has_deltas(self):
+        repo = self._storage('git').repo
+        pack_dir = os.path.join(self.objects_dir, 'pack')
+        for name in os.listdir(pack_dir):
+            if name.endswith('.idx'):
+                output = repo.verify_pack('-v', os.path.join(pack_dir, name))
+                for line in output.splitlines():
+                    if len(line.split()) == 7:
+                        return True
+        return False
+
+    def test_loose_objects(self):
+        store = ObjectStore(self.objects_dir)
+        self._assert_same_objects(store)
+
+    def test_offset_deltas(self):
+        self._git('gc', '--quiet')
+        self.assertTrue(self._has_deltas())
+        store = ObjectStore(self.objects_dir)
+        self._assert_same_objects(store)
+
+    def test_reference_deltas(self):
+        self._git('-c', 'repack.useDeltaBaseOffset=false', 'repack', '-adfq')
+        self.assertTrue(self._has_deltas())
+        # the delta bases don't fit in the cache
+        store = ObjectStore(self.objects_dir, cache_size=1024)
+        self._assert_same_objects(store)
+
+    def test_new_pack(self):
+        store = ObjectStore(self.objects_dir)
+        self._assert_same_objects(store)
+        self._git('gc', '--quiet')
+        self._assert_same_objects(store)
+
+    def test_alternates(self):
+        clone_path = os.path.join(self.repos_path, 'clone')
+        self._git('clone', '--quiet', '--shared', self.repos_path,
+                  clone_path)
+        store = ObjectStore(os.path.join(clone_path, '.git', 'objects'))
+        self._assert_same_objects(store)
+
+    def test_names(self):
+        git_storage = self._storage('git')
+        storage = self._storage('python')
+        rev = git_storage.head()
+        for name in (rev, rev + '^{tree}', rev + ':dir', rev + ':dir/',
+                     rev + ':dir/file.txt', rev + ':file1.txt',
+                     rev + ':missing', rev + ':file1.txt/file.txt',
+                     'v1^{tree}', 'v1:dir', 'master:dir/file.txt',
+                     '0' * 40, '0' * 40 + '^{tree}', 'missing^{tree}'):
+            with git_storage._Storage__cat_file_pool.checkout() as cat_file:
+                expected = cat_file.get(name)
+            with storage._Storage__cat_file_pool.checkout() as store:
+                self.assertEqual(expected, store.get(name), name)
+
+    def test_storage(self):
+        git_storage = self._storage('git')
+        storage = self._storage('python')
+        for rev in git_storage.all_revs():
+            self.assertEqual(git_storage.read_commit(rev),
+                             storage.read_commit(rev))
+            for path in ('', 'dir', 'dir/', 'file1.txt'):
+                for recursive in (False, True):
+                    entries = git_storage.ls_tree(rev, path, recursive)
+                    self.assertEqual(entries,
+                                     storage.ls_tree(rev, path, recursive))
+                    for entry in entries:
+                        if entry[1] == 'blob':
+                            self.assertEqual(
+                                git_storage.get_file(entry[2]).read(),
+                                storage.get_file(entry[2]).read())
+                            self.assertEqual(
+                                entry[3], storage.get_obj_size(entry[2]))
+        self.assertRaises(GitErrorSha, storage.get_obj_size, '0' * 40)
+        self.assertRaises(GitError, self._storage, 'unknown')
+
+
 class UnicodeNameTestCase(unittest.TestCase, GitCommandMixin):
 
     def setUp(self):
@@ -573,6 +911,8 @@ def test_suite():
         suite.addTest(unittest.makeSuite(GitTestCase))
         suite.addTest(unittest.makeSuite(TestParseCommit))
         suite.addTest(unittest.makeSuite(NormalTestCase))
+        suite.addTest(unittest.makeSuite(CommitGraphTestCase))
+        suite.addTest(unittest.makeSuite(ObjectStoreTestCase))
         if os.name != 'nt':
             # Popen doesn't accept unicode path and arguments on Windows
             suite.addTest(unittest.makeSuite(UnicodeNameTestCase))
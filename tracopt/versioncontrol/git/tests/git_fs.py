@@ -24,11 +24,12 @@ from trac.util import create_file
 from trac.util.compat import Popen, close_fds
 from trac.util.datefmt import to_timestamp, utc
 from trac.util.text import to_utf8
+from trac.web.chrome import web_context
 from trac.versioncontrol.api import Changeset, DbRepositoryProvider, \
                                     InvalidRepository, Node, \
                                     NoSuchChangeset, NoSuchNode, \
                                     RepositoryManager
-from trac.versioncontrol.web_ui.browser import BrowserModule
+from trac.versioncontrol.web_ui.browser import BlameAnnotator, BrowserModule
 from trac.versioncontrol.web_ui.log import LogModule
 from tracopt.versioncontrol.git.PyGIT import StorageFactory
 from tracopt.versioncontrol.git.git_fs import GitCachedRepository, \
@@ -600,6 +601,43 @@ from :6
         self.assertEqual(expected,
                          repos.get_node('test.txt').get_annotations())
 
+    def test_blame_annotator_cache(self):
+        self._git_init(data=False)
+        self._git_fast_import(self._data_annotations)
+        self._add_repository('gitrepos')
+        repos = self._repomgr.get_repository('gitrepos')
+        repos.sync()
+        req = MockRequest(self.env)
+
+        def annotate(rev):
+            resource = repos.resource.child('source', 'test.txt', rev)
+            return BlameAnnotator(self.env, web_context(req, resource))
+
+        rev1 = 'a7efe353630d02139f255220d71b76fa68eb7132'  # root commit
+        rev2 = 'f928d1b36b8bedf64bcf08667428fdcccf36b21b'
+        rev3 = '279a097f111c7cb1ef0b9da39735188051fd4f69'  # HEAD
+        expected = [rev1, rev1, rev3, rev2, rev2, rev3, rev2, rev2, rev3, rev2]
+        self.assertEqual([rev1] * 3, annotate(rev1).annotations)
+        self.assertEqual([rev1] * 3 + [rev2] * 7,
+                         annotate(rev2).annotations)
+        self.assertEqual(expected, annotate(rev3).annotations)
+        self.assertEqual([
+            (rev1, '[["%s",3]]' % rev1),
+            (rev2, '[["%s",3],["%s",7]]' % (rev1, rev2)),
+            (rev3, '[["%s",2],["%s",1],["%s",2],["%s",1],["%s",2],'
+                   '["%s",1],["%s",1]]'
+                   % (rev1, rev3, rev2, rev3, rev2, rev3, rev2))],
+            sorted(self.env.db_query("""
+                SELECT rev, annotations FROM node_annotation
+                WHERE repos=%s AND path='test.txt'""", (repos.id,)),
+                   key=lambda row: [rev1, rev2, rev3].index(row[0])))
+
+        # cached annotations are used
+        self.env.db_transaction("""
+            UPDATE node_annotation SET annotations=%s WHERE rev=%s
+            """, ('[["%s",10]]' % rev1, rev3))
+        self.assertEqual([rev1] * 10, annotate(rev3).annotations)
+
     # *   79dff4ccf842f8e2d2da2ee3e7a2149df63b099b Merge branch 'A'
     # |\
     # | *   86387120095e9e43573bce61b9da70a8c5d1c1b9 Merge branch 'B' into A
@@ -786,6 +824,22 @@ from :17
             (root_commit, 'B/b2.txt'),
             ], [(node.created_rev, node.path) for node in nodes])
 
+    def test_get_created_revs(self):
+        self._git_init(data=False)
+        self._git_fast_import(self._data_iter_nodes)
+        self._add_repository('gitrepos')
+        repos = self._repomgr.get_repository('gitrepos')
+        repos.sync()
+        mod = BrowserModule(self.env)
+
+        for rev in ('79dff4ccf842f8e2d2da2ee3e7a2149df63b099b',
+                    '86387120095e9e43573bce61b9da70a8c5d1c1b9',
+                    'c5b01c74e125aa034a1d4ae31dc16f1897a73779'):
+            nodes = list(mod._iter_nodes(repos.get_node('', rev)))
+            self.assertEqual(dict((node.path, node.created_rev)
+                                  for node in nodes),
+                             repos.get_created_revs(nodes))
+
     def test_colon_character_in_filename(self):
         self._git_init(data=False)
         self._git_fast_import(self._data_colon_character_in_filename)
@@ -969,6 +1023,8 @@ class GitCachedRepositoryTestCase(GitRepositoryTestCase):
         self.assertEqual(revs, revs2)
         self.assertEqual(4, len(revs2))
 
+        # Interrupt the sync after each revision is committed
+        self.env.config.set('versioncontrol', 'sync_batch_size', 1)
         revs2 = []
         def feedback_1(rev):
             revs2.append(rev)
@@ -1032,6 +1088,8 @@ from :2
         self.assertEqual(youngest_rev, revs[-1])
         self.assertEqual(oldest_rev, revs[0])
 
+        # Interrupt the sync after each revision is committed
+        self.env.config.set('versioncontrol', 'sync_batch_size', 1)
         revs2 = []
         def feedback_1(rev):
             revs2.append(rev)
@@ -1046,6 +1104,34 @@ from :2
             repos.sync(feedback=feedback_2)  # restart sync
         self.assertEqual(revs, revs2)
 
+    def test_sync_in_batches(self):
+        self._git_init()
+        self._create_merge_commit()
+        self._add_repository('gitrepos')
+        repos = self._repomgr.get_repository('gitrepos')
+
+        self.env.config.set('versioncontrol', 'sync_batch_size', 1)
+        revs = []
+        repos.sync(feedback=revs.append)
+        self.assertEqual(6, len(revs))
+
+        self.env.config.set('versioncontrol', 'sync_batch_size', 4)
+        revs2 = []
+        repos.sync(feedback=revs2.append, clean=True)
+        self.assertEqual(revs, revs2)
+        rows = self.env.db_query("SELECT COUNT(*) FROM revision "
+                                 "WHERE repos=%s", (repos.id,))
+        self.assertEqual(6, rows[0][0])
+
+        self.env.config.set('versioncontrol', 'sync_batch_size', 2)
+        self.env.config.set('versioncontrol', 'sync_workers', 3)
+        revs3 = []
+        repos.sync(feedback=revs3.append, clean=True)
+        self.assertEqual(revs, revs3)
+        rows = self.env.db_query("SELECT COUNT(*) FROM node_change "
+                                 "WHERE repos=%s", (repos.id,))
+        self.assertNotEqual(0, rows[0][0])
+
     def test_sync_too_many_merges(self):
         data = self._generate_data_many_merges(100)
         self._git_init(data=False, bare=True)